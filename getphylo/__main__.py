@@ -1,6 +1,7 @@
 '''Main entry point for getphylo.'''
 
 import logging
+import sys
 from datetime import datetime
 from getphylo import main
 from getphylo.utils.errors import GetphyloError
@@ -8,6 +9,14 @@ from getphylo.utils.errors import GetphyloError
 def entrypoint():
     '''Entry point for getphylo'''
     main.initialize_logging()
+    commands = {'worker': main.worker, 'serve': main.serve}
+    if sys.argv[1:2] and sys.argv[1] in commands:
+        try:
+            commands[sys.argv[1]](sys.argv[2:])
+        except GetphyloError as error:
+            logging.error(error)
+            exit(1)
+        return
     try:
         start_time = datetime.now()
         main.main()
@@ -17,3 +26,6 @@ def entrypoint():
     except GetphyloError as error:
         logging.error(error)
         exit(1)
+
+if __name__ == '__main__':
+    entrypoint()
@@ -2,11 +2,13 @@ import os
 import unittest
 from unittest.mock import patch
 from io import StringIO
-#from tempfile import TemporaryDirectory
+from tempfile import TemporaryDirectory
 
+from getphylo.ext import aligners
 from getphylo.utils import io as gp_io
 from getphylo import screen
 from getphylo.align import (
+    format_partition_data,
     get_locus_length,
     make_fasta_for_alignments,
     get_locus_from_tsv
@@ -48,6 +50,64 @@ class TestAlignmentLength(unittest.TestCase):
 
         ###THINK OF TESTS!
 
+    def test_format_partition_data(self):
+        partition_data = [['aligned_fasta/locus1.fasta', 50], ['locus2', 60]]
+        assert format_partition_data(partition_data) == [
+            'WAG, locus1 = 1-50', 'WAG, locus2 = 51-110'
+            ]
+        assert format_partition_data(partition_data, {'locus2': 'LG+G4'}) == [
+            'WAG, locus1 = 1-50', 'LG+G4, locus2 = 51-110'
+            ]
+
+class TestChooseAligner(unittest.TestCase):
+    def test_choose_aligner(self):
+        available = ['muscle', 'mafft', 'famsa', 'clustalo']
+        assert aligners.choose_aligner(10, 300, 'muscle', [], 2, False) == (
+            'muscle', {'maxiters': 2, 'super5': False}, None, None
+            )
+        assert aligners.choose_aligner(10, 300, 'auto', available)[0] == 'muscle'
+        assert aligners.choose_aligner(1000, 300, 'auto', available)[0] == 'mafft'
+        # long sequences move a locus to the next size class
+        assert aligners.choose_aligner(1000, 3000, 'auto', available)[0] == 'famsa'
+        assert aligners.choose_aligner(1000, 300, 'auto', ['muscle'])[1] == aligners.FAST_MUSCLE
+        # the largest loci are aligned from a sample
+        aligner, _, subsample, profile_aligner = aligners.choose_aligner(
+            50000, 300, 'auto', ['muscle', 'clustalo']
+            )
+        assert (aligner, subsample, profile_aligner) == (
+            'muscle', aligners.SUBSAMPLE_SIZE, 'clustalo'
+            )
+        assert aligners.choose_aligner(50000, 300, 'auto', ['famsa'])[2] is None
+
+ALIGNED_COUNTS = []
+
+def pad_alignment(filename, outname, aligner, location, settings):
+    '''Align sequences by padding them with gaps, in reverse order like a reordering aligner'''
+    sequences = gp_io.read_fasta(filename)
+    ALIGNED_COUNTS.append(len(sequences))
+    length = max(len(sequence) for sequence in sequences.values())
+    gp_io.write_fasta(
+        outname, {name: sequences[name].ljust(length, '-') for name in reversed(sequences)}
+        )
+
+class TestAlignLocus(unittest.TestCase):
+    def test_duplicates_aligned_once(self):
+        sequences = {'a': 'MKV', 'b': 'MKVLA', 'c': 'MKV', 'd': 'MKVLA', 'e': 'MA'}
+        assert aligners.group_duplicates(sequences) == {
+            'a': ['a', 'c'], 'b': ['b', 'd'], 'e': ['e']
+            }
+        with TemporaryDirectory() as folder:
+            filename = os.path.join(folder, 'locus.fasta')
+            outname = os.path.join(folder, 'aligned.fasta')
+            gp_io.write_fasta(filename, sequences)
+            with patch.object(aligners, 'run_aligner', side_effect=pad_alignment):
+                aligners.align_locus(filename, outname, 'muscle', {'muscle': 'muscle'}, {})
+            assert ALIGNED_COUNTS == [3]
+            assert gp_io.read_fasta(outname) == {
+                'e': 'MA---', 'b': 'MKVLA', 'd': 'MKVLA', 'a': 'MKV--', 'c': 'MKV--'
+                }
+            assert list(gp_io.read_fasta(outname)) == ['e', 'b', 'd', 'a', 'c']
+
 #def test_do_alignments(self):
     
 #def test_get_locus_alignment(self):
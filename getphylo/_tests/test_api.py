@@ -0,0 +1,126 @@
+import os
+import threading
+import unittest
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from getphylo.api import Pipeline
+from getphylo.ext import diamond, muscle
+from getphylo.utils import cache, executor, io
+from getphylo.utils.errors import InsufficientLociError
+
+class TestPipeline(unittest.TestCase):
+    def test_threshold(self):
+        hits = {
+            'a': [['locus1', 'a1'], ['locus2', 'a2'], ['locus3', 'a3']],
+            'b': [['locus1', 'b1'], ['locus2', 'b2'], ['locus2', 'b3']],
+            'c': [['locus1', 'c1'], ['locus3', 'c3']],
+        }
+        result = Pipeline.threshold(['locus1', 'locus2', 'locus3'], hits, 100, 1, 10)
+        assert result.loci == ['locus1']
+        assert result.orthologs['locus1'] == {'a': 'a1', 'b': 'b1', 'c': 'c1'}
+        assert result.unique['locus2'] is False
+        assert round(result.presence['locus3']) == 67
+        result = Pipeline.threshold(['locus1', 'locus2', 'locus3'], hits, 60, 1, 10)
+        assert result.loci == ['locus1', 'locus3']
+        result = Pipeline.threshold(['locus1', 'locus2', 'locus3'], hits, 60, 1, 1)
+        assert result.loci == ['locus1']
+        with self.assertRaises(InsufficientLociError):
+            Pipeline.threshold(['locus2'], hits, 100, 1, 10)
+
+    def test_concatenate(self):
+        alignments = {
+            'locus1': {'a': 'AC-', 'b': 'ACD'},
+            'locus2': {'a': 'MM', 'c': 'M-'},
+        }
+        combined, partition = Pipeline.concatenate(alignments)
+        assert combined == {'a': 'AC-MM', 'b': 'ACD??', 'c': '???M-'}
+        assert partition == ['WAG, locus1 = 1-3', 'WAG, locus2 = 4-5']
+
+PROTEOMES = {
+    'a': '>a1\nMKVLAAGIT\n>a2\nMSTNPKPQR\n>a3\nMGGGGGGGG\n>a4\nMGGGGGGGG\n',
+    'b': '>b1\nMKVLAAGIT\n>b2\nMSTNPKPQR\n',
+    'c': '>c1\nMKVLAAGIT\n',
+    }
+
+def make_database(filename, dmnd_database, diamond_location):
+    '''Stand in for DIAMOND makedb by copying the proteins'''
+    io.write_fasta(dmnd_database, io.read_fasta(filename))
+
+def search(filename, dmnd_database, outname, *args):
+    '''Stand in for DIAMOND blastp by matching identical sequences'''
+    subjects = io.read_fasta(dmnd_database)
+    with open(outname, 'w') as _file:
+        for query, sequence in io.read_fasta(filename).items():
+            for subject, other in subjects.items():
+                if sequence == other:
+                    _file.write(f'{query}\t{subject}\t100.0\n')
+
+def align(filename, outname, *args):
+    '''Stand in for MUSCLE by copying the sequences'''
+    io.write_fasta(outname, io.read_fasta(filename))
+
+class TestPipelineStages(unittest.TestCase):
+    def test_extract_screen_align(self):
+        pipeline = Pipeline()
+        with TemporaryDirectory() as folder, \
+                patch.object(diamond, 'make_diamond_database', make_database), \
+                patch.object(diamond, 'run_diamond_search', search), \
+                patch.object(muscle, 'run_muscle', align):
+            paths = []
+            for taxon, text in PROTEOMES.items():
+                paths.append(os.path.join(folder, taxon + '.faa'))
+                with open(paths[-1], 'w') as _file:
+                    _file.write(text)
+            proteomes = pipeline.extract(paths)
+            assert proteomes['b'] == {'b1': 'MKVLAAGIT', 'b2': 'MSTNPKPQR'}
+            # a3 and a4 are not singletons and a2 is missing from c
+            result = pipeline.screen(proteomes, seed='a', minlength=1, presence=60)
+            assert sorted(result.loci) == ['a1', 'a2']
+            assert result.orthologs['a2'] == {'a': 'a2', 'b': 'b2'}
+            result = pipeline.screen(proteomes, seed='a', minlength=1)
+            assert result.loci == ['a1']
+            alignments = pipeline.align(proteomes, result)
+            assert alignments == {'a1': {taxon: 'MKVLAAGIT' for taxon in 'abc'}}
+
+    def test_concurrent_pipelines(self):
+        # both searches wait for each other, so the pipelines run at the same time
+        barrier = threading.Barrier(2, timeout=30)
+        seen = {}
+        def record_search(filename, dmnd_database, outname, *args):
+            barrier.wait()
+            tool_cache = cache.get_cache()
+            seen[threading.current_thread().name] = (executor.get_timeout(), tool_cache.folder)
+            search(filename, dmnd_database, outname, *args)
+        results, errors = {}, []
+        def run(name, pipeline, proteomes):
+            try:
+                with pipeline:
+                    results[name] = pipeline.screen(proteomes, seed='a', minlength=1).loci
+            except Exception as error:
+                errors.append(error)
+        with TemporaryDirectory() as folder, \
+                patch.object(diamond, 'make_diamond_database', make_database), \
+                patch.object(diamond, 'run_diamond_search', record_search):
+            proteomes = {}
+            for taxon, text in PROTEOMES.items():
+                lines = text.splitlines()
+                proteomes[taxon] = dict(zip([line[1:] for line in lines[::2]], lines[1::2]))
+            threads = [
+                threading.Thread(target=run, name=name, args=(name, Pipeline(
+                    task_timeout=timeout, cache_folder=os.path.join(folder, name)
+                    ), proteomes))
+                for name, timeout in [('first', 10.0), ('second', 20.0)]
+                ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert not errors
+            assert results == {'first': ['a1'], 'second': ['a1']}
+            assert seen == {
+                'first': (10.0, os.path.join(folder, 'first')),
+                'second': (20.0, os.path.join(folder, 'second'))
+                }
+            assert executor.get_timeout() is None
+            assert cache.get_cache() is None
@@ -4,7 +4,37 @@ import unittest
 from unittest.mock import patch
 from io import StringIO
 
-#from getphylo.extract import 
+from tempfile import TemporaryDirectory
+
+from getphylo.extract import get_cds_lines
+from getphylo.utils.errors import BadAnnotationError, BadRecordError
+
+GFF = '''##gff-version 3
+contig_1\t.\tgene\t1\t30\t.\t+\t.\tID=gene1
+contig_1\t.\tCDS\t1\t9\t.\t+\t0\tID=cds1;Parent=gene1;locus_tag=A_1
+contig_1\t.\tCDS\t16\t27\t.\t+\t0\tID=cds1;Parent=gene1;locus_tag=A_1
+contig_1\t.\tCDS\t31\t39\t.\t-\t0\tID=cds2;locus_tag=A_2
+contig_1\t.\tCDS\t40\t45\t.\t+\t0\tID=cds3
+##FASTA
+>contig_1
+ATGAAACCCnnnnnnGGGTTTNAATAAcccTTAGGGCATATGTTT
+'''
+
+GENBANK = '''LOCUS       contig_1                  33 bp    DNA              UNK 01-JAN-1980
+DEFINITION  .
+FEATURES             Location/Qualifiers
+     CDS             1..21
+                     /locus_tag="A_1"
+     CDS             join(1..9,
+                     13..21)
+                     /locus_tag="A_2"
+     CDS             22..33
+                     /locus_tag="A_3"
+                     /pseudo
+ORIGIN
+        1 atgaaaccca aagggtttta aatgtaaggg tga
+//
+'''
 
 #test (main) checkpoint is correct
 
@@ -17,7 +47,49 @@ from io import StringIO
 
 #check diamond builds to the correct location
 
+class TestInputFormats(unittest.TestCase):
+    def write(self, folder, name, text):
+        filename = os.path.join(folder, name)
+        with open(filename, 'w') as _file:
+            _file.write(text)
+        return filename
 
+    def test_gff(self):
+        with TemporaryDirectory() as folder:
+            filename = self.write(folder, 'genome.gff', GFF)
+            # the CDS without a locus tag is a bad annotation
+            with self.assertRaises(BadAnnotationError):
+                get_cds_lines(filename, 'locus_tag', False, False)
+            assert get_cds_lines(filename, 'locus_tag', True, False) == [
+                '>contig_1_A_1', 'MKPGFX', '>contig_1_A_2', 'MP'
+                ]
+            # the sequence can also be read from a fasta file of the same name
+            gff, fasta = GFF.split('##FASTA\n')
+            filename = self.write(folder, 'split.gff3', gff)
+            with self.assertRaises(BadRecordError):
+                get_cds_lines(filename, 'ID', False, False)
+            self.write(folder, 'split.fna', fasta)
+            assert get_cds_lines(filename, 'ID', False, False)[-2:] == ['>contig_1_cds3', 'MF']
 
+    def test_genbank_translate(self):
+        with TemporaryDirectory() as folder:
+            filename = self.write(folder, 'genome.gbk', GENBANK)
+            with self.assertRaises(BadAnnotationError):
+                get_cds_lines(filename, 'locus_tag', False, False)
+            # the pseudogene is skipped instead of being translated through its stop
+            assert get_cds_lines(filename, 'locus_tag', False, False, True) == [
+                '>contig_1_A_1', 'MKPKGF', '>contig_1_A_2', 'MKPGF'
+                ]
 
-
+    def test_protein_fasta(self):
+        with TemporaryDirectory() as folder:
+            filename = self.write(
+                folder, 'genome.faa', '>WP_1.1 a protein\nMKP\nGF*\n>WP_2.1\nMAA\n'
+                )
+            assert get_cds_lines(filename, 'locus_tag', False, False) == [
+                '>WP_1_1', 'MKPGF', '>WP_2_1', 'MAA'
+                ]
+            filename = self.write(folder, 'duplicate.faa', '>WP_1.1\nMKP\n>WP_1.1\nMAA\n')
+            with self.assertRaises(BadAnnotationError):
+                get_cds_lines(filename, 'locus_tag', False, False)
+            assert not get_cds_lines(filename, 'locus_tag', True, True)
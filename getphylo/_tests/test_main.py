@@ -1,12 +1,18 @@
-import glob
+import json
 import os
+import subprocess
+import sys
 import unittest
-from unittest.mock import patch
+from contextlib import redirect_stdout
 from io import StringIO
+from tempfile import TemporaryDirectory
 
-from getphylo.main import check_seed
+from getphylo.main import check_seed, get_manifest, run_stage
+from getphylo.utils import profiler, timeline
+from getphylo.utils._tests.environ import EnvironTestCase
 from getphylo.utils.checkpoint import Checkpoint
-from getphylo.utils.errors import BadSeedError
+from getphylo.utils.errors import BadInputError, BadSeedError
+from getphylo.utils.presets import PresetSchedule
 
 class TestCheckSeed(unittest.TestCase):
     def test_check_seed(self):
@@ -15,10 +21,8 @@ class TestCheckSeed(unittest.TestCase):
             Returns: None
         '''
         checkpoint1 = 0
-        search_string1 = 'dummy'
-        glob1 = ['one.gbk','two.gbk','three.gbk']
-        with patch.object(glob, 'glob', return_value=glob1):
-            assert check_seed(checkpoint1, search_string1) == 'one.gbk'
+        gbks1 = ['one.gbk','two.gbk','three.gbk']
+        assert check_seed(checkpoint1, gbks1) == 'one.gbk'
         
     def test_check_seed_checkpoints(self):
         '''
@@ -32,34 +36,88 @@ class TestCheckSeed(unittest.TestCase):
         checkpoint4 = 500
         checkpoint5 = 'start'
         checkpoint6 = [Checkpoint.START, Checkpoint.SINGLETONS_THRESHOLDED]
-        search_string1 = 'dummy'
-        glob1 = ['one.gbk','two.gbk','three.gbk']
-        with patch.object(glob, 'glob', return_value=glob1):
-            assert check_seed(checkpoint1, search_string1) == 'one.gbk'
-        with patch.object(glob, 'glob', return_value=glob1):
-            assert check_seed(checkpoint2, search_string1) == 'one.gbk'
-        with patch.object(glob, 'glob', return_value=glob1):
-            with self.assertRaisesRegex(BadSeedError, 'checkpoint has been set'):
-                check_seed(checkpoint3, search_string1) == 'one.gbk'
-        with patch.object(glob, 'glob', return_value=glob1):
-            with self.assertRaisesRegex(BadSeedError, 'checkpoint has been set'):
-                check_seed(checkpoint4, search_string1) == 'one.gbk'
-        with patch.object(glob, 'glob', return_value=glob1):
-            with self.assertRaises(TypeError):
-                check_seed(checkpoint5, search_string1) == 'one.gbk'
-        with patch.object(glob, 'glob', return_value=glob1):
-            with self.assertRaises(TypeError):
-                check_seed(checkpoint6, search_string1) == 'one.gbk'
+        gbks1 = ['one.gbk','two.gbk','three.gbk']
+        assert check_seed(checkpoint1, gbks1) == 'one.gbk'
+        assert check_seed(checkpoint2, gbks1) == 'one.gbk'
+        with self.assertRaisesRegex(BadSeedError, 'checkpoint has been set'):
+            check_seed(checkpoint3, gbks1) == 'one.gbk'
+        with self.assertRaisesRegex(BadSeedError, 'checkpoint has been set'):
+            check_seed(checkpoint4, gbks1) == 'one.gbk'
+        with self.assertRaises(TypeError):
+            check_seed(checkpoint5, gbks1) == 'one.gbk'
+        with self.assertRaises(TypeError):
+            check_seed(checkpoint6, gbks1) == 'one.gbk'
 
     def test_check_seed_glob(self):
         '''
-        Test that an empty glob will trigger a BadSeedError
+        Test that an empty list of input files will trigger a BadSeedError
             Arguments: Self
             Returns: None
         '''
         checkpoint1 = 0
-        search_string1 = 'dummy'
-        glob2 = []
-        with patch.object(glob, 'glob', return_value=glob2):
-            with self.assertRaisesRegex(BadSeedError, 'No files found'):
-                check_seed(checkpoint1, search_string1) 
+        gbks2 = []
+        with self.assertRaisesRegex(BadSeedError, 'No files found'):
+            check_seed(checkpoint1, gbks2) 
+
+class TestGetManifest(unittest.TestCase):
+    def test_restart_without_manifest(self):
+        '''
+        Test that a restart after extraction without a manifest is refused
+            Arguments: Self
+            Returns: None
+        '''
+        with TemporaryDirectory() as output:
+            with self.assertRaisesRegex(BadInputError, 'without'):
+                get_manifest(Checkpoint.FASTA_EXTRACTED, '*.gbk', output, 1)
+
+class TestRunStage(EnvironTestCase):
+    def test_failing_stage(self):
+        '''
+        Check that a stage that raises still closes its span and writes its profile
+            Arguments: Self
+            Returns: None
+        '''
+        schedule = PresetSchedule()
+        with TemporaryDirectory() as output:
+            profiler.configure(os.path.join(output, profiler.PROFILE_FOLDER))
+            timeline.configure(os.path.join(output, timeline.TRACE_FOLDER))
+            with self.assertRaises(ValueError), redirect_stdout(StringIO()):
+                with run_stage(schedule, 'align'):
+                    raise ValueError
+            timeline.write_trace(os.path.join(output, timeline.TRACE_NAME))
+            with open(os.path.join(output, timeline.TRACE_NAME)) as _file:
+                events = json.load(_file)['traceEvents']
+            phases = [event['ph'] for event in events if event.get('cat') == 'stage']
+            assert phases == ['B', 'E']
+            assert os.path.exists(os.path.join(output, profiler.PROFILE_FOLDER, 'align.pstats'))
+        assert 'align' in schedule.stage_times
+
+class TestStartupImports(unittest.TestCase):
+    # modules that 'getphylo -h' must not import
+    HEAVY_MODULES = [
+        'Bio', 'numpy', 'getphylo.extract', 'getphylo.screen', 'getphylo.align',
+        'getphylo.trees'
+        ]
+
+    def test_help_imports(self):
+        '''
+        Check that 'getphylo -h' does not import heavy dependencies or the stage modules
+            Arguments: Self
+            Returns: None
+        '''
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-m', 'getphylo', '-h'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+            check=True
+            )
+        modules = [
+            line.split('|')[-1].strip() for line in result.stderr.splitlines()
+            if line.startswith('import time:') and 'cumulative' not in line
+            ]
+        assert 'getphylo.main' in modules
+        for module in self.HEAVY_MODULES:
+            imported = [
+                name for name in modules if name == module or name.startswith(module + '.')
+                ]
+            assert not imported, f'{", ".join(imported)} imported by getphylo -h'
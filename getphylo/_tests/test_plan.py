@@ -0,0 +1,75 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+from getphylo import plan
+from getphylo.plan import Proteome
+
+GENBANK = '''FEATURES             Location/Qualifiers
+     CDS             1..30
+                     /locus_tag="a"
+                     /translation="MKTAYIAKQR"
+     CDS             31..400
+                     /locus_tag="b"
+                     /translation="MKTAYIAKQRQISFVKSHFSRQLEERLGLIEVQAPILSRVGDGTQDNL
+                     SGAEKAVQVKVKALPDAQ"
+ORIGIN
+'''
+# without translations, one of them a pseudogene
+NUCLEOTIDE_GENBANK = '''FEATURES             Location/Qualifiers
+     CDS             join(1..30,
+                     61..120)
+                     /locus_tag="a"
+                     /note="not a
+                     translation"
+     CDS             121..400
+                     /locus_tag="b"
+                     /pseudo
+     CDS             complement(<401..>430)
+                     /locus_tag="c"
+ORIGIN
+'''
+
+class TestPlan(unittest.TestCase):
+    def test_scan_genbank(self):
+        with TemporaryDirectory() as folder:
+            filename = os.path.join(folder, 'genome.gbk')
+            with open(filename, 'w') as _file:
+                _file.write(GENBANK)
+            assert plan.scan_genbank(filename) == [10, 66]
+            assert plan.scan_genbank(filename, translate=True) == [10, 66]
+            with open(filename, 'w') as _file:
+                _file.write(NUCLEOTIDE_GENBANK)
+            assert plan.scan_genbank(filename) == []
+            assert plan.scan_genbank(filename, translate=True) == [30, 10]
+
+    def test_estimate_stages(self):
+        proteomes = [Proteome(10**7, 4000, 1.2 * 10**6)] * 50
+        seed_lengths = [300] * 4000
+        thresholds = [-1, 200, 2000, 100, 1, 1000]
+        estimates = plan.estimate_stages(proteomes, seed_lengths, thresholds, 8)
+        assert [estimate.stage for estimate in estimates] == ['extract', 'screen', 'align', 'trees']
+        # one alignment for each expected locus
+        assert estimates[2].tasks == 720
+        # more cpus only shorten the stages that run in parallel
+        faster = plan.estimate_stages(proteomes, seed_lengths, thresholds, 16)
+        assert faster[2].seconds < estimates[2].seconds
+        assert faster[3].seconds == estimates[3].seconds
+
+    def test_calibrate(self):
+        proteomes = [Proteome(10**6, 400, 1.2 * 10**5)] * 5
+        thresholds = [-1, 200, 2000, 100, 1, 1000]
+        estimates = plan.estimate_stages(proteomes, [300] * 400, thresholds, 1, loci=50)
+        with TemporaryDirectory() as folder:
+            report = os.path.join(folder, 'run_report.json')
+            stage_times = {
+                estimate.stage: estimate.seconds * 2 - estimate.overhead for estimate in estimates
+                }
+            plan.write_run_report(report, estimates, stage_times, 1)
+            coefficients = plan.read_run_reports([report])
+        # the calibrated models predict the measured times
+        calibrated = plan.estimate_stages(
+            proteomes, [300] * 400, thresholds, 1, coefficients=coefficients, loci=50
+            )
+        for estimate in calibrated:
+            self.assertAlmostEqual(estimate.seconds, stage_times[estimate.stage], delta=0.01)
@@ -4,8 +4,12 @@ import unittest
 from unittest.mock import patch
 from io import StringIO
 
-from getphylo.screen import write_pa_table
-from getphylo.utils import io as gp_io
+from tempfile import TemporaryDirectory
+
+from getphylo import screen
+from getphylo.extract import QueuedDatabases
+from getphylo.screen import get_batch_size, passes_thresholds, write_pa_table
+from getphylo.utils import executor, io as gp_io
 
 
 class TestWritePATable(unittest.TestCase):
@@ -22,6 +26,88 @@ class TestWritePATable(unittest.TestCase):
             write_pa_table(pa_data, loci, output)
             patched_read.assert_called_once_with(expected_filename, expected_result)
 
+class TestBatchedScreening(unittest.TestCase):
+    def test_get_batch_size(self):
+        assert get_batch_size(0, 0, 1000) == 1500
+        # 3 in 5 candidates passed, so 100 more loci need about 167 candidates plus the margin
+        assert get_batch_size(1500, 900, 1000) == 250
+        assert get_batch_size(150, 0, 10) == 150
+        assert get_batch_size(0, 0, 1) == 100
+
+    def test_passes_thresholds(self):
+        assert passes_thresholds(4, True, 5, 80)
+        assert not passes_thresholds(3, True, 5, 80)
+        assert not passes_thresholds(5, False, 5, 80)
+
+    def test_get_prescreen_genomes(self):
+        # at 100% presence no genome may be missing, so only the margin is searched first
+        subset = screen.get_prescreen_genomes(200, 100, 1)
+        assert len(subset) == 20 and subset == sorted(set(subset))
+        assert subset == screen.get_prescreen_genomes(200, 100, 1)
+        # at 80% a locus may be missing from 40 genomes
+        assert len(screen.get_prescreen_genomes(200, 80, 1)) == 60
+        assert screen.get_prescreen_genomes(200, 10, 1) == []
+        assert screen.get_prescreen_genomes(10, 100, 1) == []
+
+def fake_self_search(query, database, outname, *args):
+    '''Hit every protein in the query, and p1 and p2 as paralogs'''
+    lines = []
+    for name in gp_io.read_fasta(query):
+        lines.append(f'{name}\t{name}')
+        if name in ('p1', 'p2'):
+            lines.append(f'{name}\tp{3 - int(name[1])}')
+    gp_io.write_to_file(outname, lines)
+
+class TestSeedSample(unittest.TestCase):
+    def test_search_seed_sample(self):
+        with TemporaryDirectory() as folder:
+            seed_fasta = os.path.join(folder, 'g0.fasta')
+            seed_tsv = os.path.join(folder, 'g0.tsv')
+            gp_io.write_fasta(seed_fasta, {f'p{i}': 'M' * (5 if i == 0 else 50) for i in range(8)})
+            with patch.object(screen.diamond, 'run_diamond_search', fake_self_search), \
+                    patch.object(screen, 'MIN_BATCH_SIZE', 1), \
+                    patch.object(screen, 'BATCH_MARGIN', 1):
+                candidates = screen.search_seed_sample(
+                    seed_fasta, 'g0.dmnd', seed_tsv, [5, 10, 100, 100, 1, 10], 1, ['diamond'] * 4
+                    )
+            # p0 is too short and p1 and p2 are paralogs, so finding 5 needs a second round
+            assert sorted(candidates) == ['p3', 'p4', 'p5', 'p6', 'p7']
+            assert {line[0] for line in gp_io.read_tsv(seed_tsv)} == {f'p{i}' for i in range(1, 8)}
+            assert set(os.listdir(folder)) == {'g0.fasta', 'g0.tsv'}
+
+def write_database(filename, dmnd_database):
+    '''Build a database unless the genome was skipped'''
+    if gp_io.file_exists(filename):
+        gp_io.write_to_file(dmnd_database, [filename])
+
+class TestQueuedSearches(unittest.TestCase):
+    def test_search_candidates(self):
+        with TemporaryDirectory() as folder, \
+                patch.object(screen.diamond, 'run_diamond_search', fake_self_search):
+            for name in ['fasta', 'dmnd', 'tsv']:
+                os.makedirs(os.path.join(folder, name))
+            gp_io.write_fasta(
+                os.path.join(folder, 'tsv', 'candidate_loci.fasta'), {'p1': 'MK', 'p3': 'MA'}
+                )
+            # g2 was skipped as a bad record
+            for key in ['g0', 'g1']:
+                gp_io.write_fasta(os.path.join(folder, 'fasta', key + '.fasta'), {'p': 'M'})
+            with executor.TaskGraph(1) as graph:
+                tasks = {key: graph.add(write_database, [
+                    os.path.join(folder, 'fasta', key + '.fasta'),
+                    os.path.join(folder, 'dmnd', key + '.dmnd')
+                    ]) for key in ['g0', 'g1', 'g2']}
+                databases = QueuedDatabases(graph, tasks, {'g0': 10, 'g1': 10, 'g2': 10})
+                screen.search_candidates(
+                    folder, ['g0', 'g1', 'g2'], 1, ['diamond'] * 4, presence_threshold=100,
+                    maximum_loci=1, databases=databases
+                    )
+                assert all(graph.is_finished(task) for task in tasks.values())
+            # the genome without a database is left out of the searches and the thresholds
+            assert sorted(os.listdir(os.path.join(folder, 'tsvs'))) == ['g0.tsv', 'g1.tsv']
+            assert [line[0] for line in gp_io.read_tsv(os.path.join(folder, 'tsvs', 'g0.tsv'))] \
+                == ['p1', 'p1', 'p3']
+
 #test (main) checkpoint is correct -> add to checkpoint check to io?
 
 # assert the presence of required files and suggest a different checkpoin
@@ -0,0 +1,96 @@
+import os
+import threading
+import time
+import unittest
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from getphylo._tests.test_api import PROTEOMES, align, make_database, search
+from getphylo.api import Pipeline
+from getphylo.ext import diamond, muscle
+from getphylo.server import JobManager, ReferenceCollection, resolve_inputs
+from getphylo.utils.errors import BadInputError
+
+def run_job(job_id, request):
+    if request.get('fail'):
+        raise ValueError('bad job')
+    return {'echo': request['value']}
+
+class TestJobManager(unittest.TestCase):
+    def test_jobs(self):
+        manager = JobManager(run_job, jobs=2)
+        good = manager.submit({'value': 1})
+        bad = manager.submit({'fail': True})
+        manager.shutdown()
+        assert manager.get(good)['state'] == 'done'
+        assert manager.get(good)['result'] == {'echo': 1}
+        assert manager.get(bad)['state'] == 'failed'
+        assert manager.get(bad)['error'] == 'bad job'
+        assert manager.get('missing') is None
+        assert len(manager.list()) == 2
+
+    def test_expire(self):
+        release = threading.Event()
+        def wait_job(job_id, request):
+            if request.get('wait'):
+                release.wait(30)
+            return {}
+        manager = JobManager(wait_job, jobs=2, keep=60)
+        old = manager.submit({})
+        waiting = manager.submit({'wait': True})
+        while manager.get(old)['state'] != 'done':
+            time.sleep(0.01)
+        with manager.lock:
+            manager.jobs[old]['finished'] -= 120
+        # jobs that have not finished are kept however long they take
+        assert [job['id'] for job in manager.list()] == [waiting]
+        assert manager.get(old) is None
+        release.set()
+        manager.shutdown()
+        assert manager.get(waiting)['state'] == 'done'
+
+class TestReferenceCollection(unittest.TestCase):
+    def test_resolve_inputs(self):
+        with TemporaryDirectory() as folder:
+            root = os.path.realpath(folder)
+            assert resolve_inputs(['a.gbk', os.path.join(root, 'b', 'c.gbk')], folder) == [
+                os.path.join(root, 'a.gbk'), os.path.join(root, 'b', 'c.gbk')
+                ]
+            for path in ['../a.gbk', '/etc/passwd', 'b/../../a.gbk']:
+                with self.assertRaises(BadInputError):
+                    resolve_inputs([path], folder)
+
+    def test_run_job(self):
+        with TemporaryDirectory() as folder, \
+                patch.object(diamond, 'make_diamond_database', make_database), \
+                patch.object(diamond, 'run_diamond_search', search), \
+                patch.object(muscle, 'run_muscle', align):
+            inputs = os.path.join(folder, 'inputs')
+            os.makedirs(inputs)
+            for taxon, text in PROTEOMES.items():
+                with open(os.path.join(inputs, taxon + '.faa'), 'w') as _file:
+                    _file.write(text)
+            reference = ReferenceCollection(
+                Pipeline(workdir=folder),
+                [os.path.join(inputs, 'a.faa'), os.path.join(inputs, 'b.faa')],
+                os.path.join(folder, 'reference')
+                )
+            jobs = os.path.join(folder, 'jobs')
+            os.makedirs(jobs)
+            request = {'gbks': ['c.faa'], 'options': {'minlength': 1}, 'method': 'nj'}
+            with patch.object(Pipeline, 'concatenate', wraps=Pipeline.concatenate) as concatenate:
+                result = reference.run_job('job1', request, jobs, inputs)
+            concatenate.assert_called_once()
+            assert result['loci'] == 1
+            assert result['output'] == os.path.join(jobs, 'job1')
+            with open(result['tree']) as _file:
+                tree = _file.read()
+            assert all(taxon + ':' in tree for taxon in 'abc')
+            for request in [
+                    {'gbks': [os.path.join(folder, 'reference', 'a.dmnd')]},
+                    {'gbks': ['missing.faa']},
+                    {'gbks': ['c.faa'], 'options': {'unknown': 1}},
+                    {'gbks': ['a.faa']},
+                    ]:
+                with self.assertRaises(BadInputError):
+                    reference.run_job('job2', request, jobs, inputs)
@@ -0,0 +1,126 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from getphylo import trees
+from getphylo.align import format_partition_data
+from getphylo.ext import iqtree
+from getphylo.utils import io
+from getphylo.utils.presets import PRESETS, DEFAULT_PRESET
+
+MODELS = {'locus1': 'LG+G4', 'locus2': 'JTT+I'}
+# the alignments ModelFinder was run on
+SELECTED = []
+
+def run_modelfinder(alignment_path, out_path, iqtree_location):
+    '''Stand in for ModelFinder by writing a report naming the model of the locus'''
+    SELECTED.append(alignment_path)
+    model = MODELS.get(os.path.basename(out_path))
+    if model is not None:
+        io.write_to_file(out_path + '.iqtree', [iqtree.BEST_MODEL_PREFIX + ' ' + model])
+
+def write_alignments(output, alignments):
+    '''Write the locus alignments and their partition file'''
+    os.makedirs(os.path.join(output, 'aligned_fasta'))
+    for locus, sequences in alignments.items():
+        io.write_fasta(os.path.join(output, 'aligned_fasta', locus + '.fasta'), sequences)
+    partition_data = [
+        [locus, len(next(iter(sequences.values())))] for locus, sequences in alignments.items()
+        ]
+    io.write_to_file(
+        os.path.join(output, 'partition.txt'), format_partition_data(partition_data)
+        )
+
+class TestModelCache(unittest.TestCase):
+    def test_get_alignment_hash(self):
+        with TemporaryDirectory() as folder:
+            first = os.path.join(folder, 'first.fasta')
+            second = os.path.join(folder, 'second.fasta')
+            other = os.path.join(folder, 'other.fasta')
+            io.write_fasta(first, {'g0': 'MK-T', 'g1': 'MKAT'})
+            # renumbered genomes in another order
+            io.write_fasta(second, {'g0': 'MKAT', 'g5': 'MK-T'})
+            io.write_fasta(other, {'g0': 'MKAT', 'g1': 'MKAT'})
+            assert trees.get_alignment_hash(first) == trees.get_alignment_hash(second)
+            assert trees.get_alignment_hash(first) != trees.get_alignment_hash(other)
+
+    def test_read_partitions(self):
+        with TemporaryDirectory() as folder:
+            partition = os.path.join(folder, 'partition.txt')
+            io.write_to_file(partition, format_partition_data(
+                [['locus1', 4], ['locus 2', 3]], {'locus1': 'LG+G4'}
+                ) + [''])
+            assert trees.read_partitions(partition) == [['locus1', 4], ['locus 2', 3]]
+
+    def test_read_model_cache(self):
+        with TemporaryDirectory() as folder:
+            model_cache = os.path.join(folder, trees.MODEL_CACHE_NAME)
+            assert trees.read_model_cache(model_cache) == {}
+            io.write_to_file(model_cache, ['abc\tLG+G4', 'malformed', 'def\tWAG'])
+            assert trees.read_model_cache(model_cache) == {'abc': 'LG+G4', 'def': 'WAG'}
+
+    def test_get_best_model(self):
+        with TemporaryDirectory() as folder:
+            report = os.path.join(folder, 'locus.iqtree')
+            assert iqtree.get_best_model(report) is None
+            io.write_to_file(report, ['ModelFinder', iqtree.BEST_MODEL_PREFIX + ' LG+F+G4'])
+            assert iqtree.get_best_model(report) == 'LG+F+G4'
+            io.remove_files([report])
+            io.write_to_file(report, [iqtree.BEST_MODEL_PREFIX])
+            assert iqtree.get_best_model(report) is None
+
+    def test_select_locus_models(self):
+        alignments = {
+            'locus1': {'g0': 'MKAT', 'g1': 'MK-T'},
+            'locus2': {'g0': 'MAA', 'g1': 'MAC'},
+            'locus3': {'g0': 'MW', 'g1': 'MW'},
+            }
+        SELECTED.clear()
+        with TemporaryDirectory() as folder, \
+                patch.object(iqtree, 'run_modelfinder', run_modelfinder):
+            first = os.path.join(folder, 'first')
+            write_alignments(first, alignments)
+            model_cache = os.path.join(folder, trees.MODEL_CACHE_NAME)
+            models = trees.select_locus_models(
+                first, os.path.join(first, 'partition.txt'), 1, 'iqtree', model_cache
+                )
+            # no model was selected for locus3, which keeps WAG
+            assert models == MODELS
+            assert io.read_file(os.path.join(first, 'partition.txt')) == [
+                'LG+G4, locus1 = 1-4\n', 'JTT+I, locus2 = 5-7\n', 'WAG, locus3 = 8-9\n'
+                ]
+            # a later run with other genome ids finds the models in the cache
+            second = os.path.join(folder, 'second')
+            write_alignments(second, {
+                locus: {'g' + str(index + 3): sequence for index, sequence in enumerate(
+                    reversed(list(sequences.values()))
+                    )}
+                for locus, sequences in alignments.items()
+                })
+            SELECTED.clear()
+            models = trees.select_locus_models(
+                second, os.path.join(second, 'partition.txt'), 1, 'iqtree', model_cache
+                )
+            assert models == MODELS
+            assert SELECTED == [os.path.join(second, 'aligned_fasta', 'locus3.fasta')]
+
+    def test_build_all_with_models(self):
+        preset = PRESETS[DEFAULT_PRESET]
+        with TemporaryDirectory() as folder, \
+                patch.object(io, 'run_in_parallel') as run_in_parallel:
+            write_alignments(folder, {
+                'locus1': {'g0': 'MKAT'}, 'locus3': {'g0': 'MW'},
+                'combined_alignment': {'g0': 'MKATMW'}
+                })
+            files = io.list_files(os.path.join(folder, 'aligned_fasta'), 'fasta')
+            trees.build_all_trees(
+                files, 1, 'iqtree', folder, folder, 'iqtree', preset, models=MODELS
+                )
+        args_list = {os.path.basename(args[1]): args for args in run_in_parallel.call_args[0][1]}
+        # each locus uses its own model, the combined alignment the models of the partition file
+        assert args_list['locus1'][2:5] == [None, 'iqtree', 'LG+G4']
+        assert args_list['locus3'][2:5] == [None, 'iqtree', preset.iqtree_model]
+        assert args_list['combined_alignment'][2:5] == [
+            os.path.join(folder, 'partition.txt'), 'iqtree', None
+            ]
@@ -3,21 +3,38 @@ Create alignments from a folder of fasta files.
 
 Functions:
     get_locus_from_tsv(locus: str, fasta_name: str) -> Tuple[str, str]
-    make_fasta_for_alignments(loci_list: List[str], output:str) -> None
-    do_alignments(output:str) -> None
+    make_fasta_for_alignments(
+        loci_list: List[str], output:str, genome_keys: List[str], locus_names: Dict[str, str],
+        on_gathered: Callable[[str], None] = None
+    ) -> None
+    queue_alignment(
+        graph: TaskGraph, output: str, locus: str, method: str, locations: Dict[str, str],
+        available: List[str], maxiters: int = None, super5: bool = False
+    ) -> Tuple[int, List]
+    do_alignments(
+        output: str, loci: List[str], cpus: int, muscle_location: str, maxiters: int = None,
+        super5: bool = False, memory_budget: int = None, method: str = 'muscle',
+        locations: Dict[str, str] = None
+    ) -> None
+    write_alignment_report(filename: str, report: List[List], seconds: List[float]) -> None
     get_locus_length(alignment: List[str]) -> int
-    get_locus_alignment(alignment, taxon_name) -> str
-    make_combined_alignment(gbks: List, output: str) -> None
-    make_alignments(checkpoint: Checkpoint, output: str, loci: List, gbks: List) -> None
+    make_combined_alignment(manifest: Manifest, loci: List[str], output: str) -> None
+    make_alignments(
+        checkpoint: Checkpoint, output: str, loci: List, manifest: Manifest,
+        locus_names: Dict[str, str], cpus: int, muscle_location: str, preset: Preset,
+        memory_budget: int = None, method: str = 'muscle', locations: Dict[str, str] = None
+    ) -> None
 '''
 import logging
 import os
-import glob
-from typing import List, Tuple
-from getphylo.ext import muscle
+from typing import Callable, Dict, List, Tuple
+from getphylo.ext import aligners
 from getphylo.utils import io
 from getphylo.utils.checkpoint import Checkpoint
-from getphylo.utils.errors import FileAlreadyExistsError, BadLocusError
+from getphylo.utils.executor import TaskGraph
+from getphylo.utils.manifest import Manifest
+from getphylo.utils.presets import DEFAULT_PRESET, PRESETS, Preset
+from getphylo.utils.errors import FileAlreadyExistsError, BadLocusError, NoFinalLociError
 
 def get_locus_from_tsv(locus: str, fasta_name: str) -> Tuple[str, str]:
     '''
@@ -41,46 +58,156 @@ def get_locus_from_tsv(locus: str, fasta_name: str) -> Tuple[str, str]:
             return sequence_name, sequence
     raise BadLocusError("Locus %s not found in file: %s" % (locus, tsv_name))
 
-def make_fasta_for_alignments(loci_list: List[str], output: str) -> None:
+def make_fasta_for_alignments(
+        loci_list: List[str], output: str, genome_keys: List[str], locus_names: Dict[str, str],
+        on_gathered: Callable[[str], None] = None
+    ) -> None:
     '''
     Builds a .fasta file from sequences where there is a hit in the diamond search results.
+    Each genome's results and proteins are read once and sequences are named by genome id.
+    The hits of every genome are read first, so that a locus is known to be complete as
+    soon as the last genome with a hit has been read.
     Arguments:
-        loci_list: a list of locus tags to extract hits
+        loci_list: a list of locus ids to extract hits
         output: the path of the output directory
+        genome_keys: the ids of the genomes with a fasta file
+        locus_names: the original names of the loci, used to name the files
+        on_gathered: optional function called with each locus once its file is complete
     Returns:
         None
     '''
     io.make_folder(os.path.join(output, 'unaligned_fasta'))
-    files = glob.glob(os.path.join(output, 'fasta/*.fasta'))
-    assert files
+    assert genome_keys
     logging.debug(loci_list)
-    for locus in loci_list:
-        write_lines = []
-        for filename in files:
-            try:
-                logging.debug('locus: %s; filename: %s' % (locus, filename))
-                write_lines.extend(get_locus_from_tsv(locus, filename))
-                logging.debug('write_lines %s', write_lines)
-            except BadLocusError as error:
-                logging.warning(error)
+    loci = set(loci_list)
+    genome_hits = []
+    last_genome = {}
+    for index, genome_key in enumerate(genome_keys):
+        tsv_name = os.path.join(output, 'tsvs', genome_key + '.tsv')
+        hits = {}
+        for line in io.read_tsv(tsv_name):
+            if line[0] in loci:
+                hits.setdefault(line[0], line[1])
+        for locus in loci_list:
+            if locus not in hits:
+                logging.warning('Locus %s not found in file: %s', locus_names[locus], tsv_name)
+            else:
+                last_genome[locus] = index
+        genome_hits.append(hits)
+    for index, (genome_key, hits) in enumerate(zip(genome_keys, genome_hits)):
+        sequences = io.read_fasta(os.path.join(output, 'fasta', genome_key + '.fasta'))
+        for locus in loci_list:
+            if locus not in hits:
+                continue
+            outfile = os.path.join(output, 'unaligned_fasta', locus_names[locus] + '.fasta')
+            io.write_to_file(outfile, ['>' + genome_key, sequences[hits[locus]]])
+        if on_gathered is not None:
+            for locus in loci_list:
+                if last_genome.get(locus) == index:
+                    on_gathered(locus)
 
-        outfile = os.path.join(output, 'unaligned_fasta', locus + '.fasta')
-        io.write_to_file(outfile, write_lines)
+def queue_alignment(
+        graph: TaskGraph, output: str, locus: str, method: str, locations: Dict[str, str],
+        available: List[str], maxiters: int = None, super5: bool = False
+    ) -> Tuple[int, List]:
+    '''
+    Choose the aligner for a locus from its unaligned sequences and add the alignment to a
+    task graph. Identical sequences are only aligned once (see aligners.align_locus).
+        Arguments:
+            graph: the task graph the alignment is added to
+            output: the path of the output directory
+            locus: the name of the locus
+            method: the name of an aligner, or 'auto' to choose one by the size of the locus
+            locations: the paths to the executables of the aligners
+            available: the aligners that can be chosen automatically
+            maxiters: maximum number of MUSCLE 3 iterations
+            super5: use the MUSCLE 5 Super5 algorithm
+        Returns:
+            task: the index of the alignment in the task graph
+            report: the row of the alignment report for the locus
+    '''
+    filename = os.path.join(output, 'unaligned_fasta', locus + '.fasta')
+    outfile = os.path.join(output, 'aligned_fasta', locus + '.fasta')
+    sequences = io.read_fasta(filename)
+    unique = len(set(sequences.values()))
+    max_length = max((len(sequence) for sequence in sequences.values()), default=0)
+    aligner, settings, subsample, profile_aligner = aligners.choose_aligner(
+        unique, max_length, method, available, maxiters, super5
+        )
+    task = graph.add(
+        aligners.align_locus,
+        [filename, outfile, aligner, locations, settings, subsample, profile_aligner],
+        estimate=aligners.estimate_alignment_memory(
+            min(unique, subsample or unique), max_length, aligner
+            ),
+        reduce_memory=aligners.reduce_alignment_memory, tolerate_failure=True
+        )
+    return task, [locus, len(sequences), unique, max_length, aligner, subsample, profile_aligner]
 
-def do_alignments(output: str, cpus: int, muscle_location: str) -> None:
+def do_alignments(
+        output: str, loci: List[str], cpus: int, muscle_location: str, maxiters: int = None,
+        super5: bool = False, memory_budget: int = None, method: str = 'muscle',
+        locations: Dict[str, str] = None
+    ) -> None:
     '''
-    Runs the pre-aligned fasta file through the muscle module.
+    Runs the pre-aligned fasta files through the aligner chosen for each locus.
+    Loci that fail to align are left out of the combined alignment. The aligner and run
+    time of each locus are written to alignment_report.tsv.
         Arguments:
             output: the path of the outut directory
+            loci: the names of the loci to align
+            maxiters: maximum number of MUSCLE 3 iterations
+            super5: use the MUSCLE 5 Super5 algorithm
+            memory_budget: optional memory available to the aligners in bytes
+            method: the name of an aligner, or 'auto' to choose one by the size of each locus
+            locations: the paths to the executables of the other aligners
         Returns:
             None
     '''
     io.make_folder(os.path.join(output, 'aligned_fasta'))
-    args_list = []
-    for filename in glob.glob(os.path.join(output, 'unaligned_fasta/*.fasta')):
-        outfile = os.path.join(output, 'aligned_fasta', os.path.basename(filename))
-        args_list.append([filename, outfile, muscle_location])
-    io.run_in_parallel(muscle.run_muscle, args_list, cpus) #add cpu arg
+    locations = {**(locations or {}), 'muscle': muscle_location}
+    available = aligners.get_available_aligners(locations) if method == aligners.AUTO else []
+    with io.make_task_graph(cpus, memory_budget) as graph:
+        tasks, report = zip(*[
+            queue_alignment(
+                graph, output, locus, method, locations, available, maxiters, super5
+                )
+            for locus in loci
+            ]) if loci else ([], [])
+        seconds = graph.wait(tasks)
+    write_alignment_report(os.path.join(output, 'alignment_report.tsv'), report, seconds)
+
+def write_alignment_report(filename: str, report: List[List], seconds: List[float]) -> None:
+    '''
+    Write the aligner and run time of each locus, and log the total time of each aligner.
+        Arguments:
+            filename: path to the report
+            report:
+                [locus, sequences, unique, max_length, aligner, subsample, profile_aligner] lists
+            seconds: the time taken to align each locus, or None if it failed
+        Returns:
+            None
+    '''
+    lines = [
+        'locus\tsequences\tunique\tmax_length\taligner\tsubsample\tprofile_aligner\tseconds'
+        ]
+    totals = {}
+    for (
+            locus, sequences, unique, max_length, aligner, subsample, profile_aligner
+        ), time_taken in zip(report, seconds):
+        if subsample is not None:
+            aligner = f'{aligner}+{profile_aligner}'
+        lines.append('\t'.join([
+            locus, str(sequences), str(unique), str(max_length), aligner, str(subsample or ''),
+            profile_aligner or '', 'failed' if time_taken is None else f'{time_taken:.3f}'
+            ]))
+        if time_taken is not None:
+            count, total = totals.get(aligner, (0, 0.0))
+            totals[aligner] = (count + 1, total + time_taken)
+    for aligner, (count, total) in totals.items():
+        logging.info('%s aligned %s loci in %.1f seconds.', aligner, count, total)
+    io.remove_files([filename])
+    io.write_to_file(filename, lines)
 
 def get_locus_length(alignment: List[str]) -> int:
     '''
@@ -100,53 +227,35 @@ def get_locus_length(alignment: List[str]) -> int:
             break
     return alignment_length
 
-def get_locus_alignment(alignment, taxon_name) -> str:
-    '''
-    Extract an alignment for a loci for a taxa.
-        Arguments:
-            alignment: List of lines representing the alignment fasta
-            taxon_name: the name of the taxon to extract lines for
-        Returns:
-            extracted_alignment_string:
-                the alignment of the specific loci and taxa combined as a string
-    '''
-    seq_flag = False
-    extracted_alignment = []
-    for line in alignment:
-        if line[0] == '>':
-            seq_flag = False
-        if '>' in line and taxon_name in line:
-            seq_flag = True
-        if seq_flag and taxon_name not in line:
-            extracted_alignment.extend(line[:-1])
-    extracted_alignment_string = ''.join(extracted_alignment)
-    return extracted_alignment_string
-
-def format_partition_data(partition_data: List) -> List:
+def format_partition_data(partition_data: List, models: Dict[str, str] = None) -> List:
     '''
     Takes the partition data [locus, locus_length] and reformats it as a partition file 
     (e.g. p1 = 1-50, p2 = 51-110)
         Arguments:
             partition_data: a list of [locus, locus_length] lists
+            models: optional substitution model of each locus, WAG for loci without one
         Returns:
             partition_lines: list of lines in the partition format
     '''
-    model = 'WAG'
+    if models is None:
+        models = {}
     partition_lines = []
     partition_start = 1
     for partition in partition_data:
         locus, length = partition[0], partition[1]
         locus = os.path.splitext(os.path.basename(locus))[0]
         partition_end = partition_start + length - 1
+        model = models.get(locus, 'WAG')
         partition_lines.append('%s, %s = %s-%s' % (model, locus, partition_start, partition_end))
         partition_start += length
     return partition_lines
 
-def make_combined_alignment(gbks: List, output: str) -> None:
+def make_combined_alignment(manifest: Manifest, loci: List[str], output: str) -> None:
     '''
     Create a combined alignment from single locus alignments
         Arguments:
-            gbks: a list of genbank files
+            manifest: the manifest of the input genomes
+            loci: the names of the aligned loci
             output: path  to output directory
         Returns:
             None
@@ -160,19 +269,26 @@ def make_combined_alignment(gbks: List, output: str) -> None:
         raise FileAlreadyExistsError('%s alread exists.' % combined_alignment_path)
     combined_alignment = []
     partition_data = []
-    taxa = glob.glob(gbks)
-    assert taxa, gbks
-    loci = glob.glob(os.path.join(output, 'aligned_fasta/*.fasta'))
-    first_taxa = True
-    for taxon in taxa:
-        taxon_name = os.path.splitext(os.path.basename(taxon))[0]
+    assert manifest.genomes
+    # each alignment is read once and joined on the genome ids in the sequence names
+    alignments = []
+    for locus in loci:
+        alignment_path = os.path.join(output, 'aligned_fasta', locus + '.fasta')
+        if not io.file_exists(alignment_path):
+            logging.warning('No alignment for locus %s. It has been dropped.', locus)
+            continue
+        alignment = io.read_fasta(alignment_path)
+        if not alignment:
+            raise ValueError('An alignment cannot be empty.')
+        locus_length = len(next(iter(alignment.values())))
+        partition_data.append([locus, locus_length])
+        alignments.append((alignment, locus_length))
+    if not alignments:
+        raise NoFinalLociError('None of the final loci could be aligned.')
+    for genome in manifest.genomes:
         sequence_data = []
-        for locus in loci:
-            alignment = io.read_file(locus)
-            locus_length = get_locus_length(alignment)
-            if first_taxa is True:
-                partition_data.append([locus, locus_length])
-            locus_alignment = get_locus_alignment(alignment, taxon_name)
+        for alignment, locus_length in alignments:
+            locus_alignment = alignment.get(genome.key, '')
             if len(locus_alignment) == locus_length:
                 sequence_data.append(locus_alignment)
             else:
@@ -180,38 +296,69 @@ def make_combined_alignment(gbks: List, output: str) -> None:
         sequence_string = ''.join(sequence_data)
         assert sequence_data
         if sequence_string.count('?') == len(sequence_string):
-            logging.error('[ALERT]: %s has no sequence data and has been removed.', taxon_name)
+            logging.error('[ALERT]: %s has no sequence data and has been removed.', genome.name)
         else:
-            combined_alignment.append(f'>{taxon_name}')
+            combined_alignment.append(f'>{genome.name}')
             combined_alignment.append(sequence_string)
-        first_taxa = False
     partition_data = format_partition_data(partition_data)
     io.write_to_file(combined_alignment_path, combined_alignment)
     io.write_to_file(partition_path, partition_data)
 
 def make_alignments(
-    checkpoint: Checkpoint, output: str, loci: List, gbks: List, cpus: int, muscle_location: str
+    checkpoint: Checkpoint, output: str, loci: List, manifest: Manifest,
+    locus_names: Dict[str, str], cpus: int, muscle_location: str,
+    preset: Preset = PRESETS[DEFAULT_PRESET], memory_budget: int = None,
+    method: str = 'muscle', locations: Dict[str, str] = None
     ) -> None:
     '''
     Main routine for align.
         Arguments:
             checkpoint: checkpoint defined by the user
             output: path to the output directory
-            loci: list of loci to align
-            gbks: list of the input genbank filesx
+            loci: list of loci ids to align
+            manifest: the manifest of the input genomes
+            locus_names: the original names of the loci in the seed genome
             muscle_location: the path to muscle executable
+            preset: the speed preset for MUSCLE
+            memory_budget: optional memory available to the aligners in bytes
+            method: the name of an aligner, or 'auto' to choose one by the size of each locus
+            locations: the paths to the executables of the other aligners
         Returns:
             None
     '''
-    if checkpoint < Checkpoint.SINGLETONS_EXTRACTED:
-        logging.info("Extracting sequences for alignment...")
-        make_fasta_for_alignments(loci, output)
-    logging.info("CHECKPOINT: SINGLETONS_EXTRACTED")
-    if checkpoint < Checkpoint.SINGLETONS_ALIGNED:
-        logging.info("Aligning sequences...")
-        do_alignments(output, cpus, muscle_location)
+    if checkpoint >= Checkpoint.SINGLETONS_EXTRACTED:
+        logging.info("CHECKPOINT: SINGLETONS_EXTRACTED")
+        if checkpoint < Checkpoint.SINGLETONS_ALIGNED:
+            logging.info("Aligning sequences...")
+            do_alignments(
+                output, [locus_names[locus] for locus in loci], cpus, muscle_location,
+                preset.muscle_maxiters, preset.muscle_super5, memory_budget, method, locations
+                )
+    else:
+        # each locus is aligned as soon as its last ortholog has been gathered
+        io.make_folder(os.path.join(output, 'aligned_fasta'))
+        locations = {**(locations or {}), 'muscle': muscle_location}
+        available = aligners.get_available_aligners(locations) if method == aligners.AUTO else []
+        queued = {}
+        with io.make_task_graph(cpus, memory_budget) as graph:
+            logging.info("Extracting sequences for alignment...")
+            make_fasta_for_alignments(
+                loci, output, manifest.get_extracted_keys(output), locus_names,
+                lambda locus: queued.setdefault(locus, queue_alignment(
+                    graph, output, locus_names[locus], method, locations, available,
+                    preset.muscle_maxiters, preset.muscle_super5
+                    ))
+                )
+            logging.info("CHECKPOINT: SINGLETONS_EXTRACTED")
+            logging.info("Aligning sequences...")
+            gathered = [locus for locus in loci if locus in queued]
+            seconds = graph.wait([queued[locus][0] for locus in gathered])
+        write_alignment_report(
+            os.path.join(output, 'alignment_report.tsv'),
+            [queued[locus][1] for locus in gathered], seconds
+            )
     logging.info("CHECKPOINT: SINGLETONS_ALIGNED")
     if checkpoint < Checkpoint.ALIGNMENTS_COMBINED:
         logging.info("Making combined alingnment...")
-        make_combined_alignment(gbks, output)
+        make_combined_alignment(manifest, [locus_names[locus] for locus in loci], output)
     logging.info("CHECKPOINT: ALIGNMENTS_COMBINED")
@@ -0,0 +1,459 @@
+'''
+In-memory Python API for getphylo.
+
+Data is passed between stages as python objects. Files are only written to
+temporary folders for the external tools and removed straight afterwards.
+Each pipeline has its own executor and cache settings, which its calls apply to the
+calling thread only (see utils.settings), and its own pool of processes, so several
+pipelines can be called at the same time from threads of one process. A shared cpu
+pool or jobserver of the process still limits the cpus of all of them.
+
+Example:
+    from getphylo.api import Pipeline
+    with Pipeline(cpus=4) as pipeline:
+        proteomes = pipeline.extract(glob.glob('genomes/*.gbk'))
+        screen_result = pipeline.screen(proteomes)
+        alignments = pipeline.align(proteomes, screen_result)
+        newick = pipeline.build_tree(alignments)
+
+Classes:
+    ScreenResult
+    Pipeline
+'''
+import functools
+import multiprocessing.pool
+import os
+import tempfile
+import threading
+from collections import Counter
+from typing import Callable, Dict, List, NamedTuple, Tuple
+
+from getphylo import align, extract, screen, trees
+from getphylo.ext import aligners, diamond, fasttree, iqtree
+from getphylo.utils import cache, cpupool, executor, io, memory, settings, store
+from getphylo.utils.errors import BadInputError, BadMethodError, InsufficientLociError
+from getphylo.utils.presets import DEFAULT_PRESET, get_preset
+
+# {taxon: {protein: sequence}}
+Proteomes = Dict[str, Dict[str, str]]
+# {locus: {taxon: aligned sequence}}
+Alignments = Dict[str, Dict[str, str]]
+
+class ScreenResult(NamedTuple):
+    '''The loci selected by screening and their orthologs in each taxon'''
+    loci: List[str]
+    orthologs: Dict[str, Dict[str, str]]
+    presence: Dict[str, float]
+    unique: Dict[str, bool]
+
+def with_settings(method: Callable) -> Callable:
+    '''Apply the settings of the pipeline to the calls made by a method in this thread'''
+    @functools.wraps(method)
+    def wrapper(self: 'Pipeline', *args, **kwargs):
+        with settings.override(self.environment):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+class Pipeline:
+    '''
+    Run the getphylo stages on in-memory data. The pool of processes is started by the
+    first parallel call and kept until the pipeline is closed.
+    '''
+    def __init__(
+            self, cpus: int = 1, preset: str = DEFAULT_PRESET, tag_label: str = 'locus_tag',
+            ignore_bad_annotations: bool = False, ignore_bad_records: bool = False,
+            identity: float = None, query_coverage: float = None, subject_coverage: float = None,
+            diamond_location: str = 'diamond', muscle_location: str = 'muscle',
+            fasttree_location: str = 'fasttree', iqtree_location: str = 'iqtree',
+            memory_budget: int = None, workdir: str = None, translate: bool = False,
+            aligner: str = 'muscle', mafft_location: str = 'mafft',
+            famsa_location: str = 'famsa', clustalo_location: str = 'clustalo',
+            task_timeout: float = None, retries: int = executor.DEFAULT_RETRIES,
+            failure_report: str = None, cache_folder: str = None,
+            cache_size: float = cache.DEFAULT_CACHE_SIZE
+        ):
+        '''
+        Arguments:
+            cpus: the number of cpus for parallelisation
+            preset: the speed preset for the external tools
+            tag_label: the string defining the tag label (e.g. 'locus_tag')
+            ignore_bad_annotations: ignore features with missing annotations
+            ignore_bad_records: skip files with bad records
+            identity: minimum identity score for blastp
+            query_coverage: minimum query coverage for blastp
+            subject_coverage: minimum subject coverage for blastp
+            *_location: paths to the external tools
+            memory_budget: optional memory available to the external tools in bytes
+            workdir: folder for temporary files, the system default if None
+            translate: translate CDS features without a translation from the sequence
+            aligner: the name of an aligner, or 'auto' to choose one by the size of each locus
+            task_timeout: the longest an external tool may run in seconds, or None for no limit
+            retries: the number of times a failed task is run again
+            failure_report: optional path to the file that failures are appended to
+            cache_folder: optional path to a cache of the outputs of the external tools
+            cache_size: the size limit of the cache in GB
+        '''
+        self.cpus = cpus
+        self.preset = get_preset(preset)
+        self.tag_label = tag_label
+        self.ignore_bad_annotations = ignore_bad_annotations
+        self.ignore_bad_records = ignore_bad_records
+        self.diamond_args = (diamond_location, identity, query_coverage, subject_coverage)
+        self.fasttree_location = fasttree_location
+        self.iqtree_location = iqtree_location
+        self.memory_budget = memory_budget
+        self.workdir = workdir
+        self.translate = translate
+        self.aligner = aligner
+        self.locations = {
+            'muscle': muscle_location, 'mafft': mafft_location, 'famsa': famsa_location,
+            'clustalo': clustalo_location
+            }
+        # intermediate files are kept in temporary folders rather than an artifact store
+        self.environment = {
+            **executor.get_environment(task_timeout, retries, failure_report),
+            **cache.get_environment(cache_folder, cache_size),
+            **store.get_environment()
+            }
+        self.pool = None
+        self.lock = threading.Lock()
+        with settings.override(self.environment):
+            self.tool_cache = cache.get_cache()
+        if self.tool_cache is not None:
+            self.tool_cache.evict()
+
+    def __enter__(self) -> 'Pipeline':
+        return self
+
+    def __exit__(self, error_type, error, traceback) -> None:
+        self.close()
+
+    def get_pool(self) -> multiprocessing.pool.Pool:
+        '''Return the pool of processes, starting it on first use, or None for one cpu'''
+        if self.cpus <= 1:
+            return None
+        with self.lock:
+            if self.pool is None:
+                self.pool = executor.make_pool(self.cpus, self.environment)
+            return self.pool
+
+    def close(self) -> None:
+        '''Stop the pool of processes and log the hits and misses of the cache'''
+        with self.lock:
+            if self.pool is not None:
+                self.pool.terminate()
+                self.pool.join()
+                self.pool = None
+        if self.tool_cache is not None:
+            self.tool_cache.report()
+
+    @with_settings
+    def run_in_parallel(
+            self, function: Callable, args_list: List[List], estimates: List[int] = None,
+            reduce_memory: Callable = None
+        ) -> List:
+        '''
+        Run a function on each list of arguments in the pool of the pipeline.
+            Arguments:
+                function: the function to be called
+                args_list: list of lists containing the arguments for each call of the function
+                estimates: optional estimated memory of each call in bytes
+                reduce_memory: takes the arguments of a failed call and returns lower memory ones
+            Returns:
+                return_value: a list of return values for each call of the function
+        '''
+        return executor.run_tasks(
+            function, args_list, self.cpus, estimates, self.memory_budget, reduce_memory,
+            pool=self.get_pool()
+            )
+
+    def temporary_folder(self) -> tempfile.TemporaryDirectory:
+        '''Return a new temporary folder for the files of one call'''
+        return tempfile.TemporaryDirectory(prefix='getphylo_', dir=self.workdir)
+
+    @with_settings
+    def extract(self, gbks: List[str]) -> Proteomes:
+        '''
+        Extract the CDS translations from genbank files.
+            Arguments:
+                gbks: list of paths to genbank files
+            Returns:
+                proteomes: {taxon: {protein: sequence}} named as in the command line tool
+        '''
+        args_list = [
+            [
+                filename, self.tag_label, self.ignore_bad_annotations, self.ignore_bad_records,
+                self.translate
+                ]
+            for filename in gbks
+            ]
+        results = self.run_in_parallel(extract.get_cds_lines, args_list)
+        proteomes = {}
+        for filename, lines in zip(gbks, results):
+            if not lines:
+                continue
+            taxon = os.path.splitext(os.path.basename(filename))[0]
+            proteomes[taxon] = dict(zip([line[1:] for line in lines[::2]], lines[1::2]))
+        return proteomes
+
+    @with_settings
+    def build_databases(self, proteomes: Proteomes, prefixes: Dict[str, str]) -> None:
+        '''
+        Build a DIAMOND database for each proteome that does not have one yet.
+            Arguments:
+                proteomes: {taxon: {protein: sequence}}
+                prefixes: {taxon: path prefix} for the fasta and database of each taxon
+            Returns:
+                None
+        '''
+        make_args = []
+        for taxon, proteome in proteomes.items():
+            prefix = prefixes[taxon]
+            if not os.path.exists(prefix + '.dmnd'):
+                # left over from an interrupted build
+                if os.path.exists(prefix + '.fasta'):
+                    os.remove(prefix + '.fasta')
+                io.write_fasta(prefix + '.fasta', proteome)
+                make_args.append([prefix + '.fasta', prefix + '.dmnd', self.diamond_args[0]])
+        self.run_in_parallel(diamond.make_diamond_database, make_args)
+
+    @with_settings
+    def search(
+            self, name: str, query: Dict[str, str], proteomes: Proteomes, prefixes: Dict[str, str]
+        ) -> Dict[str, List[List[str]]]:
+        '''
+        Search query sequences against each proteome with DIAMOND.
+            Arguments:
+                name: path prefix for the query and result files
+                query: {name: sequence} of the query sequences
+                proteomes: {taxon: {protein: sequence}} to search against
+                prefixes: {taxon: path prefix} for the fasta and database of each taxon
+            Returns:
+                hits: {taxon: rows of the DIAMOND result table}
+        '''
+        query_path = name + '.fasta'
+        io.write_fasta(query_path, query)
+        self.build_databases(proteomes, prefixes)
+        search_args, estimates, tsvs = [], [], {}
+        for taxon in proteomes:
+            prefix = prefixes[taxon]
+            tsvs[taxon] = f'{name}_{os.path.basename(prefix)}.tsv'
+            search_args.append([
+                query_path, prefix + '.dmnd', tsvs[taxon], self.diamond_args,
+                self.preset.diamond_sensitivity, None, None
+                ])
+        for args in search_args:
+            estimates.append(diamond.estimate_search_memory(args[0], args[1]))
+        self.run_in_parallel(
+            diamond.run_diamond_search, search_args, estimates, diamond.reduce_search_memory
+            )
+        return {taxon: io.read_tsv(tsv) for taxon, tsv in tsvs.items()}
+
+    @with_settings
+    def screen(
+            self, proteomes: Proteomes, seed: str = None, find: int = -1,
+            minlength: int = 200, maxlength: int = 2000, presence: float = 100,
+            minloci: int = 1, maxloci: int = 1000, random_seed_number: int = None,
+            databases: Dict[str, str] = None, seed_hits: List[List[str]] = None
+        ) -> ScreenResult:
+        '''
+        Select singletons from the seed proteome that are present and unique in the others.
+            Arguments:
+                proteomes: {taxon: {protein: sequence}} from extract
+                seed: the taxon to use as seed, the first taxon if None
+                others: thresholds as in the command line tool
+                databases: optional {taxon: path prefix} of DIAMOND databases built earlier
+                seed_hits: optional result of the seed self-search from an earlier call
+            Returns:
+                screen_result: the selected loci and their orthologs in each taxon
+        '''
+        if seed is None:
+            seed = next(iter(proteomes))
+        if seed not in proteomes:
+            raise BadInputError(f'The seed {seed} is not one of the proteomes.')
+        thresholds = [find, minlength, maxlength, presence, minloci, maxloci]
+        with self.temporary_folder() as folder:
+            prefixes = {
+                taxon: os.path.join(folder, f'taxon_{index}')
+                for index, taxon in enumerate(proteomes)
+                }
+            prefixes.update(databases or {})
+            if seed_hits is None:
+                seed_hits = self.search(
+                    os.path.join(folder, 'seed'), proteomes[seed], {seed: proteomes[seed]},
+                    prefixes
+                    )[seed]
+            seed_lines = []
+            for name, sequence in proteomes[seed].items():
+                seed_lines.extend(['>' + name, sequence])
+            candidate_loci, _ = screen.select_candidates(
+                screen.get_unique_hits(seed_hits), seed_lines, thresholds, random_seed_number
+                )
+            query = {locus: proteomes[seed][locus] for locus in candidate_loci}
+            hits = self.search(
+                os.path.join(folder, 'candidates'), query, proteomes, prefixes
+                )
+        return self.threshold(candidate_loci, hits, presence, minloci, maxloci)
+
+    @staticmethod
+    def threshold(
+            candidate_loci: List[str], hits: Dict[str, List[List[str]]],
+            presence_threshold: float, minimum_loci: int, maximum_loci: int
+        ) -> ScreenResult:
+        '''
+        Score the presence and uniqueness of each candidate in the hit tables.
+            Arguments:
+                candidate_loci: loci in the order they should be considered
+                hits: {taxon: rows of the DIAMOND result table}
+                presence_threshold: percentage of taxa each locus must be present in
+                minimum_loci: the minimum number of loci required
+                maximum_loci: the maximum number of loci to select
+            Returns:
+                screen_result: the selected loci and their orthologs in each taxon
+        '''
+        counts = {taxon: Counter(row[0] for row in rows) for taxon, rows in hits.items()}
+        first_hits = {}
+        for taxon, rows in hits.items():
+            for row in rows:
+                first_hits.setdefault((row[0], taxon), row[1])
+        loci, orthologs, presence, unique = [], {}, {}, {}
+        for locus in candidate_loci:
+            found = [taxon for taxon in counts if counts[taxon][locus] > 0]
+            presence[locus] = len(found) / len(counts) * 100
+            unique[locus] = all(counts[taxon][locus] <= 1 for taxon in counts)
+            orthologs[locus] = {taxon: first_hits[(locus, taxon)] for taxon in found}
+            if presence[locus] >= presence_threshold and unique[locus]:
+                loci.append(locus)
+            if len(loci) >= maximum_loci:
+                break
+        if len(loci) < minimum_loci:
+            raise InsufficientLociError(
+                'The number of loci selected are below the defined threshold.'
+                )
+        return ScreenResult(loci, orthologs, presence, unique)
+
+    @with_settings
+    def align(self, proteomes: Proteomes, screen_result: ScreenResult) -> Alignments:
+        '''
+        Align the orthologs of each selected locus with the aligner chosen for it, as in the
+        command line tool. Loci that fail to align are left out.
+            Arguments:
+                proteomes: {taxon: {protein: sequence}} from extract
+                screen_result: the result of screen
+            Returns:
+                alignments: {locus: {taxon: aligned sequence}}
+        '''
+        available = (
+            aligners.get_available_aligners(self.locations)
+            if self.aligner == aligners.AUTO else []
+            )
+        with self.temporary_folder() as folder:
+            io.make_folder(os.path.join(folder, 'unaligned_fasta'))
+            io.make_folder(os.path.join(folder, 'aligned_fasta'))
+            names = [f'locus_{index}' for index in range(len(screen_result.loci))]
+            for name, locus in zip(names, screen_result.loci):
+                io.write_fasta(os.path.join(folder, 'unaligned_fasta', name + '.fasta'), {
+                    taxon: proteomes[taxon][protein]
+                    for taxon, protein in screen_result.orthologs[locus].items()
+                    })
+            with executor.TaskGraph(self.cpus, self.memory_budget, pool=self.get_pool()) as graph:
+                tasks = [
+                    align.queue_alignment(
+                        graph, folder, name, self.aligner, self.locations, available,
+                        self.preset.muscle_maxiters, self.preset.muscle_super5
+                        )[0]
+                    for name in names
+                    ]
+                seconds = graph.wait(tasks)
+            return {
+                locus: io.read_fasta(os.path.join(folder, 'aligned_fasta', name + '.fasta'))
+                for locus, name, time_taken in zip(screen_result.loci, names, seconds)
+                if time_taken is not None
+                }
+
+    @staticmethod
+    def concatenate(alignments: Alignments) -> Tuple[Dict[str, str], List[str]]:
+        '''
+        Combine the locus alignments into a supermatrix, filling missing taxa with '?'.
+            Arguments:
+                alignments: {locus: {taxon: aligned sequence}}
+            Returns:
+                combined: {taxon: concatenated sequence}
+                partition_lines: the partition file for IQ-TREE
+        '''
+        taxa = []
+        for sequences in alignments.values():
+            taxa.extend(taxon for taxon in sequences if taxon not in taxa)
+        combined = {taxon: [] for taxon in taxa}
+        partition_data = []
+        for locus, sequences in alignments.items():
+            length = len(next(iter(sequences.values()), ''))
+            partition_data.append([locus, length])
+            for taxon in taxa:
+                combined[taxon].append(sequences.get(taxon, '?' * length))
+        partition_lines = align.format_partition_data(partition_data)
+        return {taxon: ''.join(parts) for taxon, parts in combined.items()}, partition_lines
+
+    @with_settings
+    def build_tree(
+            self, alignments: Alignments, method: str = 'fasttree',
+            concatenation: Tuple[Dict[str, str], List[str]] = None
+        ) -> str:
+        '''
+        Build a tree from the combined alignment of all loci.
+            Arguments:
+                alignments: {locus: {taxon: aligned sequence}}
+                method: 'fasttree', 'iqtree' or 'nj'
+                concatenation: optional result of concatenate(alignments), to reuse it
+            Returns:
+                newick: the tree in newick format
+        '''
+        if concatenation is None:
+            concatenation = self.concatenate(alignments)
+        combined, partition_lines = concatenation
+        with self.temporary_folder() as folder:
+            alignment_path = os.path.join(folder, 'combined_alignment.fasta')
+            io.write_fasta(alignment_path, combined)
+            if method not in ['nj', 'fasttree', 'iqtree']:
+                raise BadMethodError(method + ' is not a phylogenetic tool.')
+            with cpupool.take_tokens(self.cpus) as threads:
+                if method == 'nj':
+                    tree_path = os.path.join(folder, 'combined_alignment.tree')
+                    trees.build_nj_tree(alignment_path, tree_path, cpus=threads)
+                elif method == 'fasttree':
+                    tree_path = os.path.join(folder, 'combined_alignment.tree')
+                    fasttree.run_fasttree(
+                        alignment_path, tree_path, self.fasttree_location,
+                        self.preset.fasttree_options, threads=threads
+                        )
+                else:
+                    partition_path = os.path.join(folder, 'partition.txt')
+                    io.write_to_file(partition_path, partition_lines)
+                    prefix = os.path.join(folder, 'combined_alignment')
+                    memory.call_with_retries(
+                        iqtree.run_iqtree,
+                        [
+                            alignment_path, prefix, partition_path, self.iqtree_location,
+                            self.preset.iqtree_model, self.preset.iqtree_bootstrap, None,
+                            None, None, threads
+                        ],
+                        iqtree.reduce_iqtree_memory
+                        )
+                    tree_path = prefix + '.treefile'
+            with open(tree_path) as _file:
+                return _file.read().strip()
+
+    def run(self, gbks: List[str], method: str = 'fasttree', **thresholds) -> str:
+        '''
+        Run all stages from genbank files to a tree.
+            Arguments:
+                gbks: list of paths to genbank files
+                method: 'fasttree', 'iqtree' or 'nj'
+                thresholds: keyword arguments passed to screen
+            Returns:
+                newick: the tree in newick format
+        '''
+        proteomes = self.extract(gbks)
+        screen_result = self.screen(proteomes, **thresholds)
+        alignments = self.align(proteomes, screen_result)
+        return self.build_tree(alignments, method)
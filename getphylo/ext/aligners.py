@@ -0,0 +1,334 @@
+'''
+Choose and run an aligner for each locus.
+
+MUSCLE, MAFFT, FAMSA and Clustal Omega are run through the same function, so that loci
+of very different sizes can be aligned by different tools in one parallel stage. With the
+'auto' method a locus is given the most accurate installed aligner that scales to its
+number of sequences, and for the largest loci a random sample of the sequences is aligned
+first and the rest are added to it by profile alignment. Identical sequences, common among
+closely related genomes, are only aligned once.
+
+Functions:
+    get_available_aligners(locations: Dict[str, str]) -> List[str]
+    get_size_class(sequences: int, max_length: int) -> str
+    get_settings(
+        aligner: str, size_class: str, maxiters: int = None, super5: bool = False
+        ) -> Dict
+    choose_aligner(
+        sequences: int, max_length: int, method: str, available: List[str],
+        maxiters: int = None, super5: bool = False
+        ) -> Tuple[str, Dict, Optional[int], Optional[str]]
+    estimate_alignment_memory(sequences: int, max_length: int, aligner: str) -> int
+    run_aligner(filename: str, outname: str, aligner: str, location: str, settings: Dict) -> None
+    align_subsample(
+        filename: str, outname: str, aligner: str, locations: Dict[str, str], settings: Dict,
+        subsample: int, profile_aligner: str
+        ) -> None
+    group_duplicates(sequences: Dict[str, str]) -> Dict[str, List[str]]
+    run_alignment(
+        filename: str, outname: str, aligner: str, locations: Dict[str, str], settings: Dict,
+        subsample: int = None, profile_aligner: str = None
+        ) -> None
+    align_locus(
+        filename: str, outname: str, aligner: str, locations: Dict[str, str], settings: Dict,
+        subsample: int = None, profile_aligner: str = None
+        ) -> float
+    reduce_alignment_memory(args: List) -> List
+'''
+import os
+import random
+import shutil
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+from getphylo.ext import clustalo, famsa, mafft, muscle
+from getphylo.utils import io
+
+AUTO = 'auto'
+ALIGNERS = ['muscle', 'mafft', 'famsa', 'clustalo']
+# upper limits on the number of sequences of each size class
+SMALL_LOCUS = 500
+MEDIUM_LOCUS = 3000
+# loci with longer sequences are treated as the next size class
+LONG_SEQUENCE = 2000
+# larger loci are aligned from a sample, to which the other sequences are added
+SUBSAMPLE_LOCUS = 10000
+SUBSAMPLE_SIZE = 2000
+# installed aligners are preferred in this order, most accurate first
+PREFERENCES = {
+    'small': ['muscle', 'mafft', 'clustalo', 'famsa'],
+    'medium': ['mafft', 'famsa', 'muscle', 'clustalo'],
+    'large': ['famsa', 'mafft', 'clustalo', 'muscle'],
+}
+# aligners that can add sequences to an existing alignment
+PROFILE_ALIGNERS = ['mafft', 'clustalo']
+# MAFFT strategies: L-INS-i for small loci (--auto), FFT-NS-2 and FFT-NS-1 for larger ones
+MAFFT_OPTIONS = {
+    'small': ['--auto'],
+    'medium': ['--retree', '2', '--maxiterate', '0'],
+    'large': ['--retree', '1', '--maxiterate', '0'],
+}
+FAST_MUSCLE = {'maxiters': 2, 'super5': True}
+BASE_MEMORY = 2**27
+
+def get_available_aligners(locations: Dict[str, str]) -> List[str]:
+    '''
+    Find the aligners that are installed.
+        Arguments:
+            locations: the path to the executable of each aligner
+        Returns:
+            available: the names of the aligners that can be run
+    '''
+    return [
+        aligner for aligner in ALIGNERS
+        if aligner in locations and shutil.which(locations[aligner]) is not None
+        ]
+
+def get_size_class(sequences: int, max_length: int) -> str:
+    '''
+    Classify a locus by the work of aligning it.
+        Arguments:
+            sequences: the number of sequences
+            max_length: the length of the longest sequence
+        Returns:
+            size_class: 'small', 'medium' or 'large'
+    '''
+    classes = list(PREFERENCES)
+    if sequences <= SMALL_LOCUS:
+        index = 0
+    elif sequences <= MEDIUM_LOCUS:
+        index = 1
+    else:
+        index = 2
+    if max_length > LONG_SEQUENCE:
+        index = min(index + 1, len(classes) - 1)
+    return classes[index]
+
+def get_settings(
+        aligner: str, size_class: str, maxiters: int = None, super5: bool = False
+    ) -> Dict:
+    '''
+    Get the options of an aligner for a size class of locus.
+        Arguments:
+            aligner: the name of the aligner
+            size_class: 'small', 'medium' or 'large'
+            maxiters: maximum number of MUSCLE 3 iterations for small loci
+            super5: use the MUSCLE 5 Super5 algorithm for small loci
+        Returns:
+            settings: the keyword arguments of the aligner
+    '''
+    if aligner == 'muscle':
+        if size_class == 'small':
+            return {'maxiters': maxiters, 'super5': super5}
+        return dict(FAST_MUSCLE)
+    if aligner == 'mafft':
+        return {'options': MAFFT_OPTIONS[size_class]}
+    return {'options': []}
+
+def choose_aligner(
+        sequences: int, max_length: int, method: str, available: List[str],
+        maxiters: int = None, super5: bool = False
+    ) -> Tuple[str, Dict, Optional[int], Optional[str]]:
+    '''
+    Choose the aligner and its options for a locus.
+        Arguments:
+            sequences: the number of sequences
+            max_length: the length of the longest sequence
+            method: the name of an aligner, or 'auto' to choose by the size of the locus
+            available: the installed aligners
+            maxiters: maximum number of MUSCLE 3 iterations
+            super5: use the MUSCLE 5 Super5 algorithm
+        Returns:
+            aligner: the name of the aligner
+            settings: the keyword arguments of the aligner
+            subsample: the number of sequences aligned first, or None to align all at once
+            profile_aligner: the aligner adding the other sequences, or None
+    '''
+    if method != AUTO:
+        if method == 'muscle':
+            return method, {'maxiters': maxiters, 'super5': super5}, None, None
+        return method, get_settings(method, 'small'), None, None
+    subsample = None
+    profile_aligner = None
+    profile_aligners = [aligner for aligner in PROFILE_ALIGNERS if aligner in available]
+    if sequences > SUBSAMPLE_LOCUS and profile_aligners:
+        subsample = SUBSAMPLE_SIZE
+        profile_aligner = profile_aligners[0]
+        sequences = subsample
+    size_class = get_size_class(sequences, max_length)
+    # without any installed aligner MUSCLE reports the missing executable as before
+    candidates = [aligner for aligner in PREFERENCES[size_class] if aligner in available]
+    aligner = candidates[0] if candidates else 'muscle'
+    return (
+        aligner, get_settings(aligner, size_class, maxiters, super5), subsample, profile_aligner
+        )
+
+def estimate_alignment_memory(sequences: int, max_length: int, aligner: str) -> int:
+    '''
+    Estimate the memory used to align a locus.
+        Arguments:
+            sequences: the number of sequences
+            max_length: the length of the longest sequence
+            aligner: the name of the aligner
+        Returns:
+            estimate: the estimated memory in bytes
+    '''
+    # FAMSA avoids the quadratic distance matrix of the other aligners
+    if aligner == 'famsa':
+        return BASE_MEMORY + 64 * sequences * max_length
+    return muscle.get_muscle_memory(sequences, max_length)
+
+def run_aligner(filename: str, outname: str, aligner: str, location: str, settings: Dict) -> None:
+    '''
+    Align a fasta file with one of the aligners.
+        Arguments:
+            filename: path to unaligned sequences
+            outname: path for the alignment
+            aligner: the name of the aligner
+            location: path to the executable of the aligner
+            settings: the keyword arguments of the aligner
+        Returns:
+            None
+    '''
+    if aligner == 'muscle':
+        muscle.run_muscle(filename, outname, location, settings['maxiters'], settings['super5'])
+    elif aligner == 'mafft':
+        mafft.run_mafft(filename, outname, location, settings['options'])
+    elif aligner == 'famsa':
+        famsa.run_famsa(filename, outname, location, settings['options'])
+    elif aligner == 'clustalo':
+        clustalo.run_clustalo(filename, outname, location, settings['options'])
+    else:
+        raise ValueError(aligner + ' is not a supported aligner.')
+
+def align_subsample(
+        filename: str, outname: str, aligner: str, locations: Dict[str, str], settings: Dict,
+        subsample: int, profile_aligner: str
+    ) -> None:
+    '''
+    Align a random sample of the sequences and add the others to it by profile alignment.
+        Arguments:
+            filename: path to unaligned sequences
+            outname: path for the alignment
+            aligner: the name of the aligner of the sample
+            locations: the path to the executable of each aligner
+            settings: the keyword arguments of the aligner of the sample
+            subsample: the number of sequences in the sample
+            profile_aligner: the aligner adding the other sequences, 'mafft' or 'clustalo'
+        Returns:
+            None
+    '''
+    sequences = io.read_fasta(filename)
+    names = list(sequences)
+    # the same locus is always sampled in the same way
+    sample = set(random.Random(len(names)).sample(names, min(subsample, len(names))))
+    temporary = tempfile.mkdtemp(prefix='getphylo-')
+    try:
+        sample_path = os.path.join(temporary, 'sample.fasta')
+        sample_alignment = os.path.join(temporary, 'sample_aligned.fasta')
+        rest_path = os.path.join(temporary, 'rest.fasta')
+        io.write_fasta(sample_path, {name: sequences[name] for name in names if name in sample})
+        io.write_fasta(rest_path, {name: sequences[name] for name in names if name not in sample})
+        run_aligner(sample_path, sample_alignment, aligner, locations[aligner], settings)
+        if profile_aligner == 'mafft':
+            mafft.run_mafft(
+                sample_alignment, outname, locations['mafft'], MAFFT_OPTIONS['large'],
+                add=rest_path
+                )
+        else:
+            clustalo.run_clustalo(
+                rest_path, outname, locations['clustalo'], profile=sample_alignment
+                )
+    finally:
+        shutil.rmtree(temporary, ignore_errors=True)
+
+def group_duplicates(sequences: Dict[str, str]) -> Dict[str, List[str]]:
+    '''
+    Group the names of identical sequences.
+        Arguments:
+            sequences: dictionary of sequences keyed by name
+        Returns:
+            groups: the names sharing each unique sequence, keyed by the first of them
+    '''
+    first_names = {}
+    groups = {}
+    for name, sequence in sequences.items():
+        first_name = first_names.setdefault(sequence, name)
+        groups.setdefault(first_name, []).append(name)
+    return groups
+
+def run_alignment(
+        filename: str, outname: str, aligner: str, locations: Dict[str, str], settings: Dict,
+        subsample: int = None, profile_aligner: str = None
+    ) -> None:
+    '''Align a fasta file at once or from a sample (see align_locus)'''
+    if subsample is None:
+        run_aligner(filename, outname, aligner, locations[aligner], settings)
+    else:
+        align_subsample(
+            filename, outname, aligner, locations, settings, subsample, profile_aligner
+            )
+
+def align_locus(
+        filename: str, outname: str, aligner: str, locations: Dict[str, str], settings: Dict,
+        subsample: int = None, profile_aligner: str = None
+    ) -> float:
+    '''
+    Align a locus with the aligner chosen for it. Only one copy of identical sequences is
+    aligned, and its aligned row is given to each of them afterwards.
+        Arguments:
+            filename: path to unaligned sequences
+            outname: path for the alignment
+            aligner: the name of the aligner
+            locations: the path to the executable of each aligner
+            settings: the keyword arguments of the aligner
+            subsample: optional number of sequences aligned before the others are added
+            profile_aligner: the aligner adding the other sequences to the sample
+        Returns:
+            seconds: the time taken to align the locus
+    '''
+    start = time.monotonic()
+    sequences = io.read_fasta(filename)
+    groups = group_duplicates(sequences)
+    if len(groups) == len(sequences):
+        run_alignment(filename, outname, aligner, locations, settings, subsample, profile_aligner)
+        return time.monotonic() - start
+    if len(groups) == 1:
+        # identical sequences are already aligned
+        aligned = {name: sequences[name] for name in groups}
+    else:
+        temporary = tempfile.mkdtemp(prefix='getphylo-')
+        try:
+            unique_path = os.path.join(temporary, 'unique.fasta')
+            unique_alignment = os.path.join(temporary, 'unique_aligned.fasta')
+            io.write_fasta(unique_path, {name: sequences[name] for name in groups})
+            run_alignment(
+                unique_path, unique_alignment, aligner, locations, settings, subsample,
+                profile_aligner
+                )
+            aligned = io.read_fasta(unique_alignment)
+        finally:
+            shutil.rmtree(temporary, ignore_errors=True)
+    # duplicates follow their first copy in the order chosen by the aligner
+    io.remove_files([outname])
+    io.write_fasta(
+        outname, {name: row for first_name, row in aligned.items() for name in groups[first_name]}
+        )
+    return time.monotonic() - start
+
+def reduce_alignment_memory(args: List) -> List:
+    '''
+    Take the arguments of align_locus and return arguments using less memory.
+        Arguments:
+            args: the arguments of a call that ran out of memory
+        Returns:
+            args: arguments using the fastest options of the aligner
+    '''
+    args = list(args)
+    aligner = args[2]
+    if aligner == 'muscle':
+        args[4] = {'maxiters': 1, 'super5': True}
+    elif aligner == 'mafft':
+        args[4] = {'options': ['--memsave', *MAFFT_OPTIONS['large']]}
+    return args
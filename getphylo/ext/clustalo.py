@@ -0,0 +1,36 @@
+'''
+Run Clustal Omega.
+
+Functions:
+    run_clustalo(
+        filename: str, outname: str, clustalo_location: str = 'clustalo',
+        options: List[str] = (), profile: str = None
+        ) -> None
+'''
+from typing import List
+from getphylo.utils import io
+
+def run_clustalo(
+    filename: str, outname: str, clustalo_location: str = 'clustalo',
+    options: List[str] = (), profile: str = None
+    ) -> None:
+    '''
+    Run Clustal Omega on protein fasta file.
+        Arguments:
+            filename: path to unaligned sequences
+            outname: path for the alignment
+            clustalo_location: path to the Clustal Omega executable
+            options: additional options for Clustal Omega
+            profile: optional existing alignment that the sequences are added to (--profile1)
+        Returns:
+            None
+    '''
+    # Clustal Omega uses every core by default; getphylo runs one job per cpu
+    command = [
+        clustalo_location, '-i', filename, '-o', outname, '--force', '--threads', '1', *options
+        ]
+    inputs = [filename]
+    if profile is not None:
+        command.extend(['--profile1', profile])
+        inputs.append(profile)
+    io.run_in_command_line(command, inputs=inputs, outputs=[outname])
@@ -2,20 +2,41 @@
 Make DIAMOND databases and run searches using DIAMOND
 
 Functions:
-    make_diamond_database(filename: str, dmnd_database=None) -> None
+    make_diamond_database(
+    filename: str, dmnd_database=None, diamond_location='diamond', threads: int = None
+    ) -> None
     run_diamond_search(
-    filename: str, dmnd_database=None, outname=None, diamond_args=['diamond',None,None,None]
+    filename: str, dmnd_database=None, outname=None, diamond_args=['diamond',None,None,None],
+    sensitivity=None, block_size=None, index_chunks=None, threads: int = None
+    ) -> None
+    run_diamond_cluster(
+    filename: str, outname: str, diamond_args=['diamond',None,None,None], threads: int = None
     ) -> None
+    estimate_search_memory(
+    filename: str, dmnd_database: str, block_size=None, index_chunks=None
+    ) -> int
+    get_search_memory(letters: int, block_size=None, index_chunks=None) -> int
+    reduce_search_memory(args: List) -> List
+    add_threads(command: List[str], threads: int = None) -> None
 '''
 import logging
-from getphylo.utils import io
+from typing import List
+from getphylo.utils import cpupool, io
+
+# DIAMOND blastp defaults
+DEFAULT_BLOCK_SIZE = 2.0
+DEFAULT_INDEX_CHUNKS = 4
+BASE_MEMORY = 2**28
 
-def make_diamond_database(infile: str, dmnd_database=None, diamond_location='diamond') -> None:
+def make_diamond_database(
+    infile: str, dmnd_database=None, diamond_location='diamond', threads: int = None
+    ) -> None:
     '''
     Create a DIAMOND database from a fasta file.
         Arguments:
             filename: path to the input file
             dmnd_database: path to output directory
+            threads: the number of threads DIAMOND may use, or None for a parallel task
         Returns:
             None
     '''
@@ -28,11 +49,13 @@ def make_diamond_database(infile: str, dmnd_database=None, diamond_location='dia
         "--db", database_name, 
         "--in", infile
         ]
+    add_threads(command, threads)
     logging.debug(command)
-    io.run_in_command_line(command)
+    io.run_in_command_line(command, inputs=[infile], outputs=[database_name])
 
 def run_diamond_search(
-    filename: str, dmnd_database=None, outname=None, diamond_args=['diamond',None,None,None]
+    filename: str, dmnd_database=None, outname=None, diamond_args=['diamond',None,None,None],
+    sensitivity=None, block_size=None, index_chunks=None, threads: int = None
     ) -> None:
     '''
     Run BLASTP through DIAMOND.
@@ -41,6 +64,10 @@ def run_diamond_search(
             dmnd_database: name of a database file to read
             outname: name of the output file
             diamond_args: list of arguments for diamond
+            sensitivity: optional sensitivity flag (e.g. '--fast')
+            block_size: optional block size in billions of letters (lower uses less memory)
+            index_chunks: optional number of index chunks (higher uses less memory)
+            threads: the number of threads DIAMOND may use, or None for a parallel task
         Returns:
             None
     '''
@@ -59,6 +86,7 @@ def run_diamond_search(
         "--out", output,
         "--outfmt", "6", "qseqid", "sseqid", "pident"
         ]
+    add_threads(command, threads)
     #there must be a nicer way of doing this but it works for now!
     if diamond_args[1] is not None:
         command.append("--id")
@@ -69,5 +97,99 @@ def run_diamond_search(
     if diamond_args[3] is not None:
         command.append("--subject-cover")
         command.append(str(diamond_args[3]))
+    if sensitivity is not None:
+        command.append(sensitivity)
+    if block_size is not None:
+        command.extend(["--block-size", str(block_size)])
+    if index_chunks is not None:
+        command.extend(["--index-chunks", str(index_chunks)])
     logging.debug(command)
-    io.run_in_command_line(command)
+    io.run_in_command_line(command, inputs=[filename, database], outputs=[output])
+
+def run_diamond_cluster(
+    filename: str, outname: str, diamond_args=['diamond',None,None,None], threads: int = None
+    ) -> None:
+    '''
+    Cluster the proteins of a fasta file with DIAMOND.
+        Arguments:
+            filename: path to the input fasta file
+            outname: name of the output file of representative and member pairs
+            diamond_args: list of arguments for diamond
+            threads: the number of threads DIAMOND may use, or None for a parallel task
+        Returns:
+            None
+    '''
+    command = [
+        diamond_args[0], "cluster",
+        "--db", filename,
+        "--out", outname
+        ]
+    add_threads(command, threads)
+    if diamond_args[1] is not None:
+        command.append("--approx-id")
+        command.append(str(diamond_args[1]))
+    if diamond_args[2] is not None:
+        command.append("--member-cover")
+        command.append(str(diamond_args[2]))
+    logging.debug(command)
+    io.run_in_command_line(command, inputs=[filename], outputs=[outname])
+
+def estimate_search_memory(
+    filename: str, dmnd_database: str, block_size=None, index_chunks=None
+    ) -> int:
+    '''
+    Estimate the memory used by run_diamond_search.
+    DIAMOND uses roughly six times the block size in GB, but small inputs never fill a block.
+        Arguments:
+            filename: path to the input fasta file
+            dmnd_database: path to the database file
+            block_size: block size in billions of letters
+            index_chunks: number of index chunks
+        Returns:
+            estimate: the estimated memory in bytes
+    '''
+    letters = io.get_file_size(filename) + io.get_file_size(dmnd_database)
+    return get_search_memory(letters, block_size, index_chunks)
+
+def get_search_memory(letters: int, block_size=None, index_chunks=None) -> int:
+    '''
+    Estimate the memory used by a DIAMOND search of a number of letters.
+        Arguments:
+            letters: the letters in the query and the database
+            block_size: block size in billions of letters
+            index_chunks: number of index chunks
+        Returns:
+            estimate: the estimated memory in bytes
+    '''
+    block_size = DEFAULT_BLOCK_SIZE if block_size is None else block_size
+    index_chunks = DEFAULT_INDEX_CHUNKS if index_chunks is None else index_chunks
+    letters = min(letters, block_size * 1e9)
+    return int(BASE_MEMORY + 6 * letters * DEFAULT_INDEX_CHUNKS / index_chunks)
+
+def reduce_search_memory(args: List) -> List:
+    '''
+    Take the arguments of run_diamond_search and return arguments using less memory.
+        Arguments:
+            args: the arguments of a call that ran out of memory
+        Returns:
+            args: arguments with half the block size and twice the index chunks
+    '''
+    args = list(args)
+    block_size, index_chunks = args[5:7]
+    block_size = DEFAULT_BLOCK_SIZE if block_size is None else block_size
+    index_chunks = DEFAULT_INDEX_CHUNKS if index_chunks is None else index_chunks
+    args[5:7] = [block_size / 2, index_chunks * 2]
+    return args
+
+def add_threads(command: List[str], threads: int = None) -> None:
+    '''
+    Limit the threads of a DIAMOND command when the cpus are shared through a pool.
+        Arguments:
+            command: the DIAMOND command
+            threads: the number of threads DIAMOND may use, or None for a parallel task
+        Returns:
+            None
+    '''
+    threads = cpupool.get_tool_threads(threads)
+    if threads is not None:
+        command.extend(["--threads", str(threads)])
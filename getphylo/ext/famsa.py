@@ -0,0 +1,27 @@
+'''
+Run FAMSA.
+
+Functions:
+    run_famsa(
+        filename: str, outname: str, famsa_location: str = 'famsa', options: List[str] = ()
+        ) -> None
+'''
+from typing import List
+from getphylo.utils import io
+
+def run_famsa(
+    filename: str, outname: str, famsa_location: str = 'famsa', options: List[str] = ()
+    ) -> None:
+    '''
+    Run FAMSA on protein fasta file.
+        Arguments:
+            filename: path to unaligned sequences
+            outname: path for the alignment
+            famsa_location: path to the FAMSA executable
+            options: additional options for FAMSA
+        Returns:
+            None
+    '''
+    # FAMSA uses every core by default; getphylo runs one job per cpu
+    command = [famsa_location, '-t', '1', *options, filename, outname]
+    io.run_in_command_line(command, inputs=[filename], outputs=[outname])
@@ -2,17 +2,27 @@
 Run fasttree.
 
 Functions:
-    run_fasttree(filename, outfile=None, fasttree_location='fasttree') -> None
+    run_fasttree(
+        filename, outfile=None, fasttree_location='fasttree', options=(), intree=None,
+        threads=None
+        ) -> None
 
 '''
-from getphylo.utils import io
+from getphylo.utils import cpupool, io
 
-def run_fasttree(filename, outfile=None, fasttree_location='fasttree') -> None:
+def run_fasttree(
+    filename, outfile=None, fasttree_location='fasttree', options=(), intree=None, threads=None
+    ) -> None:
     '''
     Run fasttree on a protein alignment.
         Arguments:
             filename: path to the alignment
             outfile: path to the output file
+            fasttree_location: path to the fasttree executable
+            options: additional options for fasttree (e.g. ['-fastest'])
+            intree: optional starting tree containing every sequence in the alignment
+            threads: the number of threads used by the multithreaded build of FastTree,
+                or None for a parallel task
         Returns:
             None
     '''
@@ -23,7 +33,16 @@ def run_fasttree(filename, outfile=None, fasttree_location='fasttree') -> None:
         out = outfile
     command = [
         fasttree_location,
+        *options,
         "-out", out,
-        filename
     ]
-    io.run_in_command_line(command)
+    inputs = [filename]
+    if intree is not None:
+        command.extend(["-intree", intree])
+        inputs.append(intree)
+    command.append(filename)
+    threads = cpupool.get_tool_threads(threads)
+    io.run_in_command_line(
+        command, inputs=inputs, outputs=[out],
+        env=None if threads is None else {'OMP_NUM_THREADS': str(threads)}
+        )
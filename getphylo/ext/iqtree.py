@@ -2,13 +2,38 @@
 Run iqtree.
 
 Functions:
-    run_iqtree(alignment_path: str, partition_path: str, out_path: str) -> None
+    run_iqtree(
+        alignment_path: str, out_path: str, partition_path: str=None,
+        iqtree_location: str='iqtree', model: str='MFP', bootstrap: int=1000, memory: int=None,
+        starting_tree: str=None, constraint_tree: str=None, threads: int=None
+        ) -> None
+    estimate_iqtree_memory(alignment_path: str) -> int
+    get_iqtree_memory(taxa: int, sites: int) -> int
+    reduce_iqtree_memory(args: List) -> List
+    run_modelfinder(
+        alignment_path: str, out_path: str, iqtree_location: str='iqtree', threads: int=None
+        ) -> None
+    get_best_model(report_path: str) -> Optional[str]
 
 '''
-from getphylo.utils import io
+from typing import List, Optional
+from getphylo.utils import cpupool, io
+from getphylo.utils.memory import get_fasta_dimensions
+
+FIXED_MODEL = 'WAG'
+# the files written with the -pre prefix that are kept in the tool cache
+OUTPUT_EXTENSIONS = ['.treefile', '.iqtree', '.log', '.contree']
+# ModelFinder only writes a report and a log
+MODELFINDER_EXTENSIONS = ['.iqtree', '.log']
+BEST_MODEL_PREFIX = 'Best-fit model according to BIC:'
+BASE_MEMORY = 2**28
+# amino acid states, rate categories and bytes per double
+LIKELIHOOD_BYTES = 20 * 4 * 8
 
 def run_iqtree(
-    alignment_path: str, out_path: str, partition_path: str=None, iqtree_location: str='iqtree'
+    alignment_path: str, out_path: str, partition_path: str=None, iqtree_location: str='iqtree',
+    model: str='MFP', bootstrap: int=1000, memory: int=None, starting_tree: str=None,
+    constraint_tree: str=None, threads: int=None
     ) -> None:
     '''
     Run fasttree on a protein alignment.
@@ -16,17 +41,117 @@ def run_iqtree(
             alignment_path: path to the alignment
             partition_path: path to the partition file
             out_path: path to the output file
+            model: the substitution model, or None to use the models in the partition file
+            bootstrap: number of ultrafast bootstrap replicates, or None to skip
+            memory: optional maximum memory in bytes, IQ-TREE will use memory saving techniques
+            starting_tree: optional tree to start the search from (-t)
+            constraint_tree: optional tree whose splits every candidate tree must contain (-g)
+            threads: the number of threads IQ-TREE may use, or None for a parallel task
         Returns:
             None
     '''
+    # without a partition file there are no fixed models to fall back on
+    if model is None and partition_path is None:
+        model = FIXED_MODEL
     command = [
             iqtree_location,
             '-s', alignment_path,
-            '-pre', out_path, 
-            '-m', 'MFP',
-            '-bb', '1000'
+            '-pre', out_path
             ]
+    threads = cpupool.get_tool_threads(threads)
+    if threads is not None:
+        command.extend(['-nt', str(threads)])
+    if model is not None:
+        command.extend(['-m', model])
+    if bootstrap is not None:
+        command.extend(['-bb', str(bootstrap)])
+    if memory is not None:
+        command.extend(['-mem', f'{max(memory // 2**20, 1)}M'])
+    inputs = [alignment_path]
     if partition_path is not None:
         command.append('-spp')
         command.append(partition_path)
-    io.run_in_command_line(command)
+        inputs.append(partition_path)
+    if starting_tree is not None:
+        command.extend(['-t', starting_tree])
+        inputs.append(starting_tree)
+    if constraint_tree is not None:
+        command.extend(['-g', constraint_tree])
+        inputs.append(constraint_tree)
+    outputs = [out_path + extension for extension in OUTPUT_EXTENSIONS]
+    io.run_in_command_line(command, inputs=inputs, outputs=outputs)
+
+def estimate_iqtree_memory(alignment_path: str) -> int:
+    '''
+    Estimate the memory used by run_iqtree in the same way as IQ-TREE,
+    from the partial likelihood vectors stored for each branch of the tree.
+        Arguments:
+            alignment_path: path to the alignment
+        Returns:
+            estimate: the estimated memory in bytes
+    '''
+    taxa, sites = get_fasta_dimensions(alignment_path)
+    return get_iqtree_memory(taxa, sites)
+
+def get_iqtree_memory(taxa: int, sites: int) -> int:
+    '''
+    Estimate the memory used by IQ-TREE for an alignment of a given size.
+        Arguments:
+            taxa: the number of sequences
+            sites: the length of the alignment
+        Returns:
+            estimate: the estimated memory in bytes
+    '''
+    return BASE_MEMORY + 3 * taxa * sites * LIKELIHOOD_BYTES
+
+def reduce_iqtree_memory(args: List) -> List:
+    '''
+    Take the arguments of run_iqtree and return arguments using less memory.
+        Arguments:
+            args: the arguments of a call that ran out of memory
+        Returns:
+            args: arguments limiting IQ-TREE to half the previous memory
+    '''
+    args = list(args)
+    memory = args[6]
+    if memory is None:
+        memory = estimate_iqtree_memory(args[0])
+    args[6] = memory // 2
+    return args
+
+def run_modelfinder(
+    alignment_path: str, out_path: str, iqtree_location: str='iqtree', threads: int=None
+    ) -> None:
+    '''
+    Select the best substitution model of an alignment with ModelFinder, without building a tree.
+        Arguments:
+            alignment_path: path to the alignment
+            out_path: prefix of the output files
+            iqtree_location: path to the iqtree executable
+            threads: the number of threads IQ-TREE may use, or None for a parallel task
+        Returns:
+            None
+    '''
+    command = [iqtree_location, '-s', alignment_path, '-m', 'MF', '-pre', out_path]
+    threads = cpupool.get_tool_threads(threads)
+    if threads is not None:
+        command.extend(['-nt', str(threads)])
+    outputs = [out_path + extension for extension in MODELFINDER_EXTENSIONS]
+    io.run_in_command_line(command, inputs=[alignment_path], outputs=outputs)
+
+def get_best_model(report_path: str) -> Optional[str]:
+    '''
+    Read the model selected by ModelFinder from an IQ-TREE report.
+        Arguments:
+            report_path: path to the .iqtree report
+        Returns:
+            model: the best-fit model, or None if the report does not name one
+    '''
+    try:
+        lines = io.read_file(report_path)
+    except FileNotFoundError:
+        return None
+    for line in lines:
+        if line.startswith(BEST_MODEL_PREFIX):
+            return line[len(BEST_MODEL_PREFIX):].strip() or None
+    return None
@@ -0,0 +1,35 @@
+'''
+Run MAFFT.
+
+Functions:
+    run_mafft(
+        filename: str, outname: str, mafft_location: str = 'mafft', options: List[str] = (),
+        add: str = None
+        ) -> None
+'''
+from typing import List
+from getphylo.utils import io
+
+def run_mafft(
+    filename: str, outname: str, mafft_location: str = 'mafft', options: List[str] = (),
+    add: str = None
+    ) -> None:
+    '''
+    Run MAFFT on protein fasta file.
+        Arguments:
+            filename: path to unaligned sequences, or the existing alignment if add is given
+            outname: path for the alignment
+            mafft_location: path to the MAFFT executable
+            options: additional options for MAFFT (e.g. ['--auto'])
+            add: optional path to sequences added to the existing alignment (--add)
+        Returns:
+            None
+    '''
+    command = [mafft_location, '--quiet', '--anysymbol', *options]
+    inputs = [filename]
+    if add is not None:
+        command.extend(['--add', add])
+        inputs.append(add)
+    command.append(filename)
+    # MAFFT writes the alignment to the standard output
+    io.run_in_command_line(command, inputs=inputs, outputs=[outname], stdout=outname)
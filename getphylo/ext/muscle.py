@@ -2,13 +2,22 @@
 Runs MUSCLE on a provided fasta file.
 
 Functions:
-    run_muscle(filename, outname=None) -> None
+    run_muscle(
+        filename, outname=None, muscle_location='muscle', maxiters=None, super5=False
+        ) -> None
     get_muscle_version() -> float
+    estimate_muscle_memory(filename: str) -> int
+    get_muscle_memory(sequences: int, max_length: int) -> int
+    reduce_muscle_memory(args: List) -> List
 '''
 import re
 import subprocess
 import logging
-from getphylo.utils import io
+from typing import List
+from getphylo.utils import cpupool, io, profiler, timeline
+from getphylo.utils.memory import get_fasta_dimensions
+
+BASE_MEMORY = 2**27
 
 def get_muscle_version(muscle_location: str = 'muscle') -> float:
     '''
@@ -19,10 +28,10 @@ def get_muscle_version(muscle_location: str = 'muscle') -> float:
             version_number:
                 a float reprisenting the first two parts of the MUSCLE version number
     '''
-    with subprocess.Popen(
-        [muscle_location, "-version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE
-        ) as process:
-        out, _ = process.communicate()
+    command = [muscle_location, "-version"]
+    with timeline.tool_span(command), profiler.pause_for_tool(muscle_location):
+        with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as process:
+            out, _ = process.communicate()
     # only the first line matters
     version = out.decode().splitlines()[0]
     # the second chunk is all that's relevant
@@ -38,12 +47,18 @@ def get_muscle_version(muscle_location: str = 'muscle') -> float:
         raise RuntimeError("cannot determine version of MUSCLE") from error
 
 
-def run_muscle(filename: str, outname=None, muscle_location: str = 'muscle') -> None:
+def run_muscle(
+    filename: str, outname=None, muscle_location: str = 'muscle',
+    maxiters: int = None, super5: bool = False
+    ) -> None:
     '''
     Run MUSCLE aligner on protein fasta file.
         Arguments:
             filename: path to unaligned sequences
             outname: path for the alignment
+            muscle_location: path to the MUSCLE executable
+            maxiters: maximum number of iterations (MUSCLE 3 only)
+            super5: use the Super5 algorithm (MUSCLE 5 only)
         Returns:
             None
     '''
@@ -58,13 +73,52 @@ def run_muscle(filename: str, outname=None, muscle_location: str = 'muscle') ->
         )
         command = [
             muscle_location,
-            "-align", filename, 
+            "-super5" if super5 else "-align", filename,
             "-output", outname
         ]
+        # loci are aligned in parallel, one token each
+        if cpupool.get_tool_threads() is not None:
+            command.extend(["-threads", "1"])
     else:
         command = [
             muscle_location,
             "-in", filename, 
             "-out", outname
         ]
-    io.run_in_command_line(command)
+        if maxiters is not None:
+            command.extend(["-maxiters", str(maxiters)])
+    io.run_in_command_line(command, inputs=[filename], outputs=[outname])
+
+def estimate_muscle_memory(filename: str) -> int:
+    '''
+    Estimate the memory used by run_muscle from the number and length of sequences.
+    MUSCLE holds a pairwise distance matrix and a profile for every sequence.
+        Arguments:
+            filename: path to unaligned sequences
+        Returns:
+            estimate: the estimated memory in bytes
+    '''
+    sequences, max_length = get_fasta_dimensions(filename)
+    return get_muscle_memory(sequences, max_length)
+
+def get_muscle_memory(sequences: int, max_length: int) -> int:
+    '''
+    Estimate the memory used by MUSCLE to align a number of sequences.
+        Arguments:
+            sequences: the number of sequences
+            max_length: the length of the longest sequence
+        Returns:
+            estimate: the estimated memory in bytes
+    '''
+    return BASE_MEMORY + 8 * sequences ** 2 + 64 * sequences * max_length
+
+def reduce_muscle_memory(args: List) -> List:
+    '''
+    Take the arguments of run_muscle and return arguments using less memory.
+        Arguments:
+            args: the arguments of a call that ran out of memory
+        Returns:
+            args: arguments using a single iteration (MUSCLE 3) or Super5 (MUSCLE 5)
+    '''
+    filename, outname, muscle_location, _, _ = args
+    return [filename, outname, muscle_location, 1, True]
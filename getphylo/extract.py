@@ -1,159 +1,277 @@
 '''
-Build fasta and diamond databases from genbank files
+Build fasta and diamond databases from genbank, GFF3 or protein fasta files
+
+Classes:
+QueuedDatabases
 
 Functions:
-build_diamond_databases(output:str) -> None
-extract_cdses(
-    gbks: str, output: str, tag_label: str, ignore_bad_annotations: bool, ignore_bad_records: bool
-    ) -> None
+build_diamond_database(filename: str, dmnd_database: str, diamond_location: str) -> None
+get_genbank_cdses(
+    filename: str, tag_label: str, translate: bool = False
+    ) -> Iterator[Tuple[str, Optional[str], str]]
+get_protein_cdses(filename: str) -> Iterator[Tuple[Optional[str], Optional[str], str]]
+get_cds_lines(
+    filename: str, tag_label: str, ignore_bad_annotations: bool, ignore_bad_records: bool,
+    translate: bool = False
+    ) -> List[str]
 get_cds_from_genbank(
     filename: str, output: str, tag_label: str, ignore_bad_annotations: bool,
-    ignore_bad_records: bool) -> None
+    ignore_bad_records: bool, genome_key: str, translate: bool = False) -> None
 extract_data(
-    checkpoint: Checkpoint, output: str, gbks: str, tag_label: str,
-    ignore_bad_annotations: bool, ignore_bad_records: bool
-    ) -> None
+    checkpoint: Checkpoint, output: str, manifest: Manifest, tag_label: str,
+    ignore_bad_annotations: bool, ignore_bad_records: bool, diamond_location: str,
+    graph: TaskGraph, translate: bool = False, first: str = None
+    ) -> QueuedDatabases
 '''
 import logging
 import os
-import glob
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
 from getphylo.ext import diamond
-from getphylo.utils import io
+from getphylo.utils import gff, io
 from getphylo.utils.checkpoint import Checkpoint
+from getphylo.utils.manifest import Manifest
 from getphylo.utils.errors import BadAnnotationError, BadRecordError
+from getphylo.utils.executor import TaskGraph
+from getphylo.utils.translate import translate_features
 
-def build_diamond_databases(output: str, cpus: int, diamond_location: str) -> None:
+def build_diamond_database(filename: str, dmnd_database: str, diamond_location: str) -> None:
     '''
-    Create diamond databases from from all the fasta files in .output/fasta/*.fasta
+    Create the diamond database of a genome unless it was skipped as a bad record
         Arguments:
-            output: path to the output folder
-            cpus: number of cpus available
+            filename: path to the fasta file of the genome
+            dmnd_database: path to the database
+            diamond_location: path to diamond install
         Returns:
             None
     '''
-    dmnd_folder = os.path.join(output, 'dmnd')
-    io.make_folder(dmnd_folder)
-    fasta_files_path = os.path.join(output, 'fasta/*.fasta')
-    args_list = []
-    for filename in glob.glob(fasta_files_path):
-        dmnd_database = os.path.basename(io.change_extension(filename, "dmnd"))
-        dmnd_database = os.path.join(dmnd_folder, dmnd_database)
-        args = [filename, dmnd_database, diamond_location]
-        args_list.append(args)
-    io.run_in_parallel(diamond.make_diamond_database, args_list, cpus)
+    if io.file_exists(filename):
+        diamond.make_diamond_database(filename, dmnd_database, diamond_location)
+
+class QueuedDatabases(NamedTuple):
+    '''The diamond databases queued on a task graph, which searches can wait for'''
+    graph: TaskGraph
+    # the build task of each genome
+    tasks: Dict[str, int]
+    # the size of the input file of each genome, which its proteome does not exceed
+    sizes: Dict[str, int]
 
-def extract_cdses(
-        gbks: str, output: str, tag_label: str,
-        ignore_bad_annotations: bool, ignore_bad_records: bool, cpus: int
-    ) -> None:
+def get_genbank_cdses(
+        filename: str, tag_label: str, translate: bool = False
+    ) -> Iterator[Tuple[str, Optional[str], str]]:
     '''
-    Produce a fasta file from each genbank provided
+    Read the CDS features of a genbank file
         Arguments:
-            gbks: search string for genbank files
-            output: path to the output directory
-            tag_args:
-            cpus: number of cpus available
+            filename: the name of the genbank file being read
+            tag_label: the string defining the tag label (e.g. 'locus_tag')
+            translate:
+                bool flagging whether to translate CDS features without a translation,
+                skipping those marked /pseudo or /pseudogene
         Returns:
-            None
+            cdses: (record id, tag or None if missing, translation) for each CDS feature
     '''
-    io.make_folder(os.path.join(output, 'fasta'))
-    filenames = glob.glob(gbks)
-    args_list = [[
-        filename, output, tag_label, ignore_bad_annotations, ignore_bad_records
-        ] for filename in filenames]
-    io.run_in_parallel(get_cds_from_genbank, args_list, cpus)
+    for record in io.get_records_from_genbank(filename):
+        features = [feature for feature in record.features if feature.type == "CDS"]
+        if translate:
+            # pseudogenes have no protein, translating them would read through their stops
+            features = [
+                feature for feature in features if "translation" in feature.qualifiers
+                or not {"pseudo", "pseudogene"} & set(feature.qualifiers)
+                ]
+        translations = [
+            str(feature.qualifiers.get("translation", [""])[0]) for feature in features
+            ]
+        # features without a translation are translated together once the record is read
+        untranslated = [
+            position for position, translation in enumerate(translations) if translation == ""
+            ]
+        if translate and untranslated:
+            for position, translation in zip(untranslated, translate_features(
+                    record, [features[position] for position in untranslated]
+                )):
+                translations[position] = translation
+        for feature, translation in zip(features, translations):
+            yield record.id, feature.qualifiers.get(tag_label, [None])[0], translation
 
-def get_cds_from_genbank(
-    filename: str, output: str, tag_label: str, ignore_bad_annotations: bool,
-    ignore_bad_records: bool) -> None:
+def get_protein_cdses(filename: str) -> Iterator[Tuple[Optional[str], Optional[str], str]]:
     '''
-    Extract CDS translations from genbank files into ./fasta/*.fasta
+    Read the proteins of a protein fasta file
         Arguments:
-            filename: the name of the genbank file being read
-            output: path to the output folder
+            filename: the name of the fasta file being read
+        Returns:
+            cdses: (None, name or None if missing, sequence) for each protein, named by the
+            first word of its header
+    '''
+    name = None
+    sequence: List[str] = []
+    with open(filename) as _file:
+        for line in _file:
+            line = line.strip()
+            if line.startswith('>'):
+                if name is not None:
+                    yield None, name[0] if name else None, ''.join(sequence).rstrip('*')
+                name = line[1:].split()
+                sequence = []
+            elif name is None and line:
+                raise ValueError(f'{filename} is not a fasta file.')
+            else:
+                sequence.append(line)
+    if name is not None:
+        yield None, name[0] if name else None, ''.join(sequence).rstrip('*')
+
+def get_cds_lines(
+    filename: str, tag_label: str, ignore_bad_annotations: bool, ignore_bad_records: bool,
+    translate: bool = False
+    ) -> List[str]:
+    '''
+    Extract CDS translations from an input genome as fasta lines. Genbank files are read
+    by default, protein fasta (.faa) and GFF3 files (.gff, .gff3) by their extension.
+        Arguments:
+            filename: the name of the input file being read
             tag_label: the string defining the tag label (e.g. 'locus_tag')
             ignore_bad_annotations:
                 bool flagging whether to ignore features with missing annotations
-        Returns: None
+            ignore_bad_records:
+                bool flagging whether to skip files with bad records
+            translate:
+                bool flagging whether to translate CDS features without a translation
+        Returns:
+            lines: the fasta lines, or an empty list if the file was skipped
     '''
     logging.debug('Extracting CDS annotations from %s', filename)
+    input_format = io.get_input_format(filename)
+    if input_format == 'protein':
+        cdses = get_protein_cdses(filename)
+    elif input_format == 'gff':
+        cdses = gff.get_cds_translations(filename, tag_label)
+    else:
+        cdses = get_genbank_cdses(filename, tag_label, translate)
     lines = []
     seen = set()
     warning_flag = False
     try:
-        records = io.get_records_from_genbank(filename)
-        for record in records:
-            for feature in record.features:
-                if feature.type != "CDS":
-                    continue
+        for record_id, name, translation in cdses:
+            if not name:
+                logging.warning(
+                    'Missing %s in %s.', tag_label, record_id or filename
+                    )
+                if not ignore_bad_annotations:
+                    raise BadAnnotationError(
+                        f'Some features are missing the {tag_label} annotations.'
+                        'Ensure the genbank file is correctly annotated or use'
+                        '--ignore-bad-annotations flag.'
+                    )
+                continue
 
-                if not feature.qualifiers.get(tag_label):
-                    logging.warning(
-                        'Missing %s in %s.', tag_label, record.id
-                        )
-                    if not ignore_bad_annotations:
-                        raise BadAnnotationError(
-                            f'Some features are missing the {tag_label} annotations.'
-                            'Ensure the genbank file is correctly annotated or use'
-                            '--ignore-bad-annotations flag.'
-                        )
+            # proteins are already named, CDS features are named within their record
+            locus_tag = name if record_id is None else f'{record_id}_{name}'
+            if locus_tag in seen:
+                warning_flag = True
+                if ignore_bad_annotations:
                     continue
+                raise BadAnnotationError(f'{filename} contains duplicate: {locus_tag}')
+            seen.add(locus_tag)
 
-                locus_tag = f'{record.id}_{feature.qualifiers[tag_label][0]}'
-                if locus_tag in seen:
-                    warning_flag = True
-                    if ignore_bad_annotations:
-                        continue
-                    raise BadAnnotationError(f'{filename} contains duplicate: {locus_tag}')
-                seen.add(locus_tag)
-
-                translation = str(feature.qualifiers.get("translation", [""])[0])
-                if translation == "":
-                    warning_flag = True
-                    if ignore_bad_annotations:
-                        continue
-                    raise BadAnnotationError(
-                        f'{locus_tag} in {filename} contains an empty translation!'
-                        )
-                lines.append(">" + locus_tag.replace(".", "_"))
-                lines.append(translation)
+            if translation == "":
+                warning_flag = True
+                if ignore_bad_annotations:
+                    continue
+                raise BadAnnotationError(
+                    f'{locus_tag} in {filename} contains an empty translation!'
+                    )
+            lines.append(">" + locus_tag.replace(".", "_"))
+            lines.append(translation)
     except ValueError as error:
         if not ignore_bad_records:
             raise BadRecordError(error)
-        return
+        return []
     if not lines:
         if not ignore_bad_records:
             raise BadRecordError(f'No CDS Features in {filename}')
-        return
+        return []
     if warning_flag is True:
-        logging.warning('%s has bad annotations!', record.id)
+        logging.warning('%s has bad annotations!', filename)
         if ignore_bad_records is True:
-            return
-    filename = io.change_extension(os.path.basename(filename), "fasta")
-    filename = os.path.join(output, 'fasta', filename)
-    io.write_to_file(filename, lines)
+            return []
+    return lines
+
+def get_cds_from_genbank(
+    filename: str, output: str, tag_label: str, ignore_bad_annotations: bool,
+    ignore_bad_records: bool, genome_key: str, translate: bool = False) -> None:
+    '''
+    Extract CDS translations from an input genome into ./fasta/<genome_key>.fasta
+    The proteins are renamed <genome_key>_0, <genome_key>_1, ... and the original
+    names are written to ./fasta/<genome_key>.names
+        Arguments:
+            filename: the name of the input file being read
+            output: path to the output folder
+            tag_label: the string defining the tag label (e.g. 'locus_tag')
+            ignore_bad_annotations:
+                bool flagging whether to ignore features with missing annotations
+            genome_key: the id of the genome in the manifest
+            translate:
+                bool flagging whether to translate CDS features without a translation
+        Returns: None
+    '''
+    lines = get_cds_lines(
+        filename, tag_label, ignore_bad_annotations, ignore_bad_records, translate
+        )
+    if not lines:
+        return
+    fasta_lines = []
+    name_lines = []
+    for index, (name, sequence) in enumerate(zip(lines[::2], lines[1::2])):
+        protein_id = f'{genome_key}_{index}'
+        fasta_lines.extend(['>' + protein_id, sequence])
+        name_lines.append(f'{protein_id}\t{name[1:]}')
+    prefix = os.path.join(output, 'fasta', genome_key)
+    io.write_to_file(prefix + '.fasta', fasta_lines)
+    io.write_to_file(prefix + '.names', name_lines)
 
 def extract_data(
-        checkpoint: Checkpoint, output: str, gbks: str, tag_label: str,
-        ignore_bad_annotations: bool, ignore_bad_records: bool, cpus: int,
-        diamond_location: str
-    ) -> None:
+        checkpoint: Checkpoint, output: str, manifest: Manifest, tag_label: str,
+        ignore_bad_annotations: bool, ignore_bad_records: bool, diamond_location: str,
+        graph: TaskGraph, translate: bool = False, first: str = None
+    ) -> QueuedDatabases:
     '''
-    Called from main to build fasta and diamond databases from the provided genbankfiles
+    Called from main to queue the extraction of a fasta file and the diamond database of
+    each genome, and wait for the database of the first genome. The database of a genome
+    is queued right after its extraction, so that it is built before later genomes are
+    extracted. The screen waits for the others and logs the checkpoints of this stage.
         Arguments:
             checkpoint: Checkpoint to begin the analysis
             output: path to the output folder
-            gbks: search string for the genbank files
+            manifest: the manifest of the input genomes
             tag_label: the string defining the tag label (e.g. 'locus_tag')
             ignore_bad_annotations:
                 bool flagging whether to ignore features with missing annotations
-        Returns: None
+            ignore_bad_records:
+                bool flagging whether to skip files with bad records
+            diamond_location: path to diamond install
+            graph: the task graph the tasks are added to
+            translate:
+                bool flagging whether to translate CDS features without a translation
+            first: optional id of the genome to queue before the others (e.g. the seed)
+        Returns:
+            databases: the build task of each genome
     '''
     if checkpoint < Checkpoint.FASTA_EXTRACTED:
         logging.info("Extracting CDS in fasta format...")
-        extract_cdses(gbks, output, tag_label, ignore_bad_annotations, ignore_bad_records, cpus)
-    logging.info("CHECKPOINT:FASTA_EXTRACTED")
-    if checkpoint < Checkpoint.DIAMOND_BUILT:
-        logging.info("Building diamond databases...")
-        build_diamond_databases(output, cpus, diamond_location)
-    logging.info("CHECKPOINT:DIAMOND_BUILT")
+        io.make_folder(os.path.join(output, 'fasta'))
+    logging.info("Building diamond databases...")
+    io.make_folder(os.path.join(output, 'dmnd'))
+    genomes = sorted(manifest.genomes, key=lambda genome: genome.key != first)
+    tasks = {}
+    for genome in genomes:
+        after = []
+        if checkpoint < Checkpoint.FASTA_EXTRACTED:
+            # the manifest holds absolute paths so that workers on other nodes can find the files
+            after.append(graph.add(get_cds_from_genbank, [
+                genome.path, output, tag_label, ignore_bad_annotations, ignore_bad_records,
+                genome.key, translate
+                ]))
+        tasks[genome.key] = graph.add(build_diamond_database, [
+            os.path.join(output, 'fasta', genome.key + '.fasta'),
+            os.path.join(output, 'dmnd', genome.key + '.dmnd'), diamond_location
+            ], after)
+    graph.wait([tasks[genomes[0].key]])
+    return QueuedDatabases(graph, tasks, {genome.key: genome.size for genome in genomes})
@@ -3,15 +3,26 @@ Main routine for getphylo
 
 Functions:
     initialize_logging() -> None
-    check_seed(checkpoint: Checkpoint, gbk_search_string: str) -> str
-    check_gbks(gbks: str) -> None
+    check_seed(checkpoint: Checkpoint, gbks: List[str]) -> str
+    check_gbks(gbks: List[str]) -> None
+    get_manifest(checkpoint: Checkpoint, gbks: str, output: str, cpus: int) -> Manifest
+    get_timeout(minutes: float = None) -> float
+    run_stage(schedule: PresetSchedule, stage: str) -> Iterator[Preset]
+    worker(argv: List[str]) -> None
+    serve(argv: List[str]) -> None
     main()
 '''
-import glob
+import atexit
+import contextlib
 import logging
+import multiprocessing
 import os
-from getphylo import align, extract, parser, screen, trees
-from getphylo.utils import io
+import signal
+from typing import Iterator, List
+from getphylo import parser
+from getphylo.utils import (
+    cache, cpupool, executor, io, memory, profiler, store, timeline, workqueue
+    )
 from getphylo.utils.errors import (
     BadInputError,
     BadMethodError,
@@ -20,6 +31,8 @@ from getphylo.utils.errors import (
     NoFinalLociError
     )
 from getphylo.utils.checkpoint import Checkpoint
+from getphylo.utils.manifest import Manifest
+from getphylo.utils.presets import Preset, PresetSchedule
 
 def initialize_logging() -> None:
     '''Set up and configure logging.
@@ -33,36 +46,35 @@ def initialize_logging() -> None:
         datefmt='%H:%M:%S')
     logging.info("Running getphylo version 1.0.1.")
 
-def check_seed(checkpoint: Checkpoint, gbk_search_string: str) -> str:
+def check_seed(checkpoint: Checkpoint, gbks: List[str]) -> str:
     '''
     Set a seed for a new analysis and raise an error if continuing an old analysis.
         Arguments:
             checkpoint: the checkpoint supplied by the user
-            gbk_search_string: the string used to filter the glob (e.g. '*.gbk')
+            gbks: the paths of the input files in manifest order
         Returns:
             seed: the filename of the selected seed genome
     '''
     if checkpoint > 0:
         raise BadSeedError('A checkpoint has been set! Please ensure the seed is defined.')
-    gbks = glob.glob(gbk_search_string)
     if not gbks:
-        raise BadSeedError(f'No files found in {gbk_search_string}.')
+        raise BadSeedError('No files found in the input search string.')
     seed = gbks[0]
     logging.warning(
-        'No seed defined. Using first file in glob (%s) as seed.', seed
+        'No seed defined. Using first input file (%s) as seed.', seed
         )
     return seed
 
-def check_gbks(gbks: str) -> None:
+def check_gbks(gbks: List[str]) -> None:
     '''
     check at least three files are  found by the provided search string
     otherwise, raise BadInputError
         arguments:
-            gbks: search string from the parser
+            gbks: the paths of the input files in manifest order
         returns:
             None
     '''
-    gbk_count = len(glob.glob(gbks))
+    gbk_count = len(gbks)
     if gbk_count < 3:
         raise BadInputError(
             'getphylo requires at least 3 input sequences. '
@@ -70,30 +82,165 @@ def check_gbks(gbks: str) -> None:
             'Please, check input search sting parameter (-g) and try again.'
             )
 
+def get_manifest(checkpoint: Checkpoint, gbks: str, output: str, cpus: int) -> Manifest:
+    '''
+    Read the manifest of a previous run when restarting after extraction, otherwise build it.
+    A restart after extraction without a manifest is refused, as the genome ids of a new
+    manifest may not match the files already in the output folder.
+        Arguments:
+            checkpoint: the checkpoint supplied by the user
+            gbks: search string from the parser
+            output: path to the output folder
+            cpus: number of cpus used to hash the input files
+        Returns:
+            manifest: the manifest of the input genomes
+    '''
+    manifest_path = os.path.join(output, 'manifest.tsv')
+    if checkpoint >= Checkpoint.FASTA_EXTRACTED:
+        if not os.path.exists(manifest_path):
+            raise BadInputError(
+                f'Cannot restart from {checkpoint.name} without {manifest_path}. '
+                'Restart from START instead.'
+                )
+        logging.info('Reading %s', manifest_path)
+        manifest = Manifest.read(manifest_path)
+        manifest.check_unchanged()
+        return manifest
+    return Manifest.build(gbks, cpus)
+
+def get_timeout(minutes: float = None) -> float:
+    '''
+    Convert the task timeout from the command line into seconds.
+        Arguments:
+            minutes: the timeout in minutes, or None for no limit
+        Returns:
+            seconds: the timeout in seconds, or None for no limit
+    '''
+    if minutes is None:
+        return None
+    return minutes * 60
+
+@contextlib.contextmanager
+def run_stage(schedule: PresetSchedule, stage: str) -> Iterator[Preset]:
+    '''
+    Time, profile and trace a stage, closing its profile and span also if it fails.
+        Arguments:
+            schedule: the preset schedule of the run
+            stage: the name of the stage
+        Returns:
+            preset: the preset to use for this stage
+    '''
+    preset = schedule.start_stage(stage)
+    profiler.start_stage(stage)
+    timeline.begin_stage(stage)
+    try:
+        yield preset
+    finally:
+        timeline.end_stage(stage)
+        profiler.end_stage(stage)
+        schedule.end_stage(stage)
+
+def worker(argv: List[str]) -> None:
+    '''
+    Process tasks from the work queue of a distributed run.
+        Arguments:
+            argv: the command line arguments after 'worker'
+        Returns:
+            None
+    '''
+    args = parser.parse_worker_args(argv)
+    logging.getLogger().setLevel(args.logging)
+    queue_dir = os.path.join(os.path.abspath(args.output), 'queue')
+    worker_args = (queue_dir, args.poll, args.timeout, args.idle_exit)
+    tool_cache = None
+    if args.cache is not None:
+        tool_cache = cache.configure(args.cache, args.cache_size)
+    store_path = os.path.join(os.path.abspath(args.output), store.STORE_NAME)
+    if os.path.exists(store_path):
+        store.configure(store_path, os.path.abspath(args.output))
+    executor.configure(get_timeout(args.task_timeout), args.retries)
+    signal.signal(signal.SIGTERM, executor.exit_on_signal)
+    if args.cpus <= 1:
+        workqueue.run_worker(*worker_args)
+    else:
+        processes = [
+            multiprocessing.Process(target=workqueue.run_worker, args=worker_args)
+            for _ in range(args.cpus)
+            ]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        finally:
+            # each worker stops its running tool when it is terminated
+            for process in processes:
+                process.terminate()
+    if tool_cache is not None:
+        tool_cache.report()
+
+def serve(argv: List[str]) -> None:
+    '''
+    Run getphylo as a service.
+        Arguments:
+            argv: the command line arguments after 'serve'
+        Returns:
+            None
+    '''
+    args = parser.parse_serve_args(argv)
+    logging.getLogger().setLevel(args.logging)
+    # imported here so the command line tool does not pay for the http server
+    from getphylo import server
+    server.serve(args)
+
 def main():
     '''main routine for getphylo
         Arguments: None
         Returns: None'''
     args = parser.parse_args()
     logging.getLogger().setLevel(args.logging)
+    # terminate through the normal cleanup path so that running tools are stopped
+    signal.signal(signal.SIGTERM, executor.exit_on_signal)
 
     gbks = args.gbks
-    check_gbks(gbks)
     checkpoint = Checkpoint[args.checkpoint.upper()]
     seed = args.seed
     output = os.path.abspath(args.output)
     diamond_args = (args.diamond, args.identity, args.query_coverage, args.subject_coverage)
+    schedule = PresetSchedule(args.preset, args.deadline)
+    memory_budget = memory.get_memory_budget(args.memory)
+    logging.info('Memory budget is %.1f GB.', memory_budget / 2**30)
+    thresholds = [
+        args.find, args.minlength, args.maxlength, args.presence, args.minloci, args.maxloci,
+        ]
 
     if os.path.isdir(gbks):
         raise BadInputError(
             gbks + ' is a directory. Please provide a search string (e.g. \'my_dir/*.gbk\').'
             )
+    if args.plan:
+        from getphylo import plan
+        paths = Manifest.find_paths(gbks)
+        check_gbks(paths)
+        seed = check_seed(checkpoint, paths) if seed is None else os.path.abspath(seed)
+        plan.make_plan(
+            paths, seed, thresholds, args.cpus, args.method, args.build_all, memory_budget,
+            args.calibrate, args.random_seed_number, args.translate
+            )
+        return
+    if args.previous_tree is not None and not os.path.isfile(args.previous_tree):
+        raise BadInputError(f'The previous tree {args.previous_tree} does not exist.')
+    if args.cpu_pool is not None:
+        cpupool.configure(args.cpu_pool, args.cpu_pool_size)
+        logging.info('Sharing cpus with other runs through %s', args.cpu_pool)
+    manifest = get_manifest(checkpoint, gbks, output, args.cpus)
+    check_gbks(manifest.paths)
     if seed is None:
-        seed = check_seed(checkpoint, gbks)
+        seed = check_seed(checkpoint, manifest.paths)
+    seed_key = manifest.get_genome(seed).key
     logging.info('The seed genome is %s!', seed)
 
     ### Begin main workflow
-    ### extract.py
     if checkpoint < Checkpoint.DIAMOND_BUILT:
         try:
             io.make_folder(output)
@@ -101,20 +248,63 @@ def main():
             logging.warning(
                 'ALERT: %s already exists. Continuing analysis in that directory.', output
                 )
-        extract.extract_data(
-            checkpoint, output, gbks, args.tag, args.ignore_bad_annotations,
-            args.ignore_bad_records, args.cpus, args.diamond
-            )
-    ### screen.py
-    final_loci = None
-    if checkpoint < Checkpoint.SINGLETONS_THRESHOLDED:
-        thresholds = [
-            args.find, args.minlength, args.maxlength, args.presence, args.minloci, args.maxloci,
-            ]
-        final_loci = screen.get_target_proteins(
-            checkpoint, output, seed, thresholds, args.cpus, args.random_seed_number, diamond_args
+    manifest.write(os.path.join(output, 'manifest.tsv'))
+    executor.configure(
+        get_timeout(args.task_timeout), args.retries, os.path.join(output, 'failures.jsonl')
+        )
+    store_path = os.path.join(output, store.STORE_NAME)
+    if args.store or os.path.exists(store_path):
+        logging.info('Keeping intermediate files in %s', store_path)
+        store.configure(store_path, output)
+    if args.distributed:
+        work_queue = workqueue.WorkQueue(
+            os.path.join(output, 'queue'), worker_timeout=args.worker_timeout * 60
             )
+        # tasks and the shutdown marker of an earlier run in this folder are dropped
+        work_queue.reset()
+        io.set_work_queue(work_queue)
+        atexit.register(work_queue.shutdown)
+    if args.profile:
+        profiler.configure(os.path.join(output, profiler.PROFILE_FOLDER), args.profile_top)
+        logging.info('Profiling each stage into %s', profiler.get_folder())
+    if args.trace:
+        timeline.configure(os.path.join(output, timeline.TRACE_FOLDER))
+        # written when the run ends, also if it fails, to show where it was held up
+        atexit.register(timeline.write_trace, os.path.join(output, timeline.TRACE_NAME))
+    tool_cache = None
+    if args.cache is not None:
+        tool_cache = cache.configure(args.cache, args.cache_size)
+    # stage modules are imported as they are needed to keep startup fast
+    # extraction and screening share a task graph, so that each genome is searched as soon
+    # as its database is built
+    with io.make_task_graph(args.cpus, memory_budget) as graph:
+        ### extract.py
+        databases = None
+        if checkpoint < Checkpoint.DIAMOND_BUILT:
+            from getphylo import extract
+            with run_stage(schedule, 'extract'):
+                # the stage ends once the seed database is built, the screen waits for the
+                # others
+                databases = extract.extract_data(
+                    checkpoint, output, manifest, args.tag, args.ignore_bad_annotations,
+                    args.ignore_bad_records, args.diamond, graph, args.translate, seed_key
+                    )
+        else:
+            schedule.skip_stage('extract')
+        ### screen.py
+        from getphylo import screen
+        final_loci = None
+        if checkpoint < Checkpoint.SINGLETONS_THRESHOLDED:
+            with run_stage(schedule, 'screen') as preset:
+                final_loci = screen.get_target_proteins(
+                    checkpoint, output, seed, manifest, thresholds, args.cpus,
+                    args.random_seed_number, diamond_args, preset, memory_budget,
+                    args.seed_search, args.prescreen, databases
+                    )
+        else:
+            schedule.skip_stage('screen')
     ### before continuing check final loci is defined, otherwise read from file
+    locus_names = manifest.read_protein_names(output, seed_key)
     try:
         assert final_loci
     except AssertionError:
@@ -124,7 +314,12 @@ def main():
         try:
             final_loci_path = os.path.join(output, 'final_loci.txt')
             logging.info('Attempting to read %s', final_loci_path)
-            final_loci = screen.get_loci_from_file(final_loci_path)
+            # final_loci.txt holds the original names of the loci
+            locus_ids = {name: locus for locus, name in locus_names.items()}
+            final_loci = [
+                locus_ids.get(locus, locus)
+                for locus in screen.get_loci_from_file(final_loci_path)
+                ]
         except:
             raise NoFinalLociError(
                 'Final loci could not be read from final_loci.txt.'
@@ -134,19 +329,54 @@ def main():
 
     ### align.py
     if checkpoint < Checkpoint.ALIGNMENTS_COMBINED:
-        align.make_alignments(checkpoint, output, final_loci, gbks, args.cpus, args.muscle)
+        from getphylo import align
+        with run_stage(schedule, 'align') as preset:
+            align.make_alignments(
+                checkpoint, output, final_loci, manifest, locus_names, args.cpus, args.muscle,
+                preset, memory_budget, args.aligner,
+                {'mafft': args.mafft, 'famsa': args.famsa, 'clustalo': args.clustalo}
+                )
+    else:
+        schedule.skip_stage('align')
 
     ### trees.py
     if checkpoint < Checkpoint.TREES_BUILT:
+        from getphylo import trees
         build_all = args.build_all
         if args.method == 'fasttree':
             tree_builder = args.fasttree
         elif args.method == 'iqtree':
             tree_builder = args.iqtree
+        elif args.method == 'nj':
+            tree_builder = None
         else:
             raise BadMethodError(
-                'Neither fasttree or iqtree was selected.'
+                'Neither fasttree, iqtree or nj was selected.'
                 'It should not be possible for you to generate this error - please report!')
-        trees.make_trees(output, build_all, args.method, args.cpus, tree_builder)
+        model_cache = None
+        if args.locus_models and args.method != 'iqtree':
+            logging.warning('--locus-models is only used with --method iqtree.')
+        elif args.locus_models:
+            model_cache = os.path.join(
+                output if args.cache is None else args.cache, trees.MODEL_CACHE_NAME
+                )
+        with run_stage(schedule, 'trees') as preset:
+            trees.make_trees(
+                output, build_all, args.method, args.cpus, tree_builder, preset,
+                memory_budget, manifest, args.previous_tree, args.constrain,
+                args.distance_correction, model_cache
+                )
     logging.info("CHECKPOINT: DONE")
+    if schedule.stage_times:
+        from getphylo import plan
+        plan.write_run_report(
+            os.path.join(output, 'run_report.json'),
+            plan.measure_run(
+                output, manifest, seed_key, thresholds, args.cpus, args.method, args.build_all,
+                len(final_loci)
+                ),
+            schedule.stage_times, args.cpus
+            )
+    if tool_cache is not None:
+        tool_cache.report()
     logging.info("Analysis complete. Thank you for using getphylo!")
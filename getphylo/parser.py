@@ -10,15 +10,28 @@ Create an argument parser using argparse
         get_seed_parser(arg_parser) -> ArgumentParser
         get_io_parser(arg_parser) -> ArgumentParser
         get_exe_parser(arg_parser) -> ArgumentParser
+        get_performance_parser(arg_parser) -> ArgumentParser
         get_arguments(arg_parser) -> ArgumentParser
         def parse_args() -> ArgumentParser
+        get_worker_parser() -> ArgumentParser
+        parse_worker_args(argv: List[str]) -> ArgumentParser
+        get_serve_parser() -> ArgumentParser
+        parse_serve_args(argv: List[str]) -> ArgumentParser
 '''
 
 import argparse
 from argparse import RawTextHelpFormatter
 
 import logging
+from typing import List
+from getphylo.ext.aligners import ALIGNERS, AUTO
+from getphylo.utils.cache import DEFAULT_CACHE_SIZE
+from getphylo.utils.executor import DEFAULT_RETRIES
+from getphylo.utils.profiler import DEFAULT_TOP
+from getphylo.utils.workqueue import DEFAULT_WORKER_TIMEOUT
 from getphylo.utils.checkpoint import Checkpoint
+from getphylo.utils.phylo import DISTANCE_CORRECTIONS
+from getphylo.utils.presets import DEFAULT_PRESET, PRESET_ORDER
 
 def get_parser():
     ''''Create a parser object specific to getphylo'''
@@ -153,19 +166,81 @@ def get_phylo_parser(arg_parser):
         '(default: %(default)s)'
     )
     )
+    phylo_parser.add_argument(
+        '-al',
+        '--aligner',
+        default='muscle',
+        choices=[AUTO, *ALIGNERS],
+        help=(
+            'choose the aligner\n'
+            'auto = choose an installed aligner for each locus by its size:\n'
+            '       MUSCLE for small loci, MAFFT or FAMSA for large ones, and for the largest\n'
+            '       a sample is aligned first and the rest added by MAFFT or Clustal Omega\n'
+            'the aligner and run time of each locus are written to alignment_report.tsv\n'
+            '(default: %(default)s)'
+        )
+    )
     phylo_parser.add_argument(
         '-m',
         '--method',
         default='fasttree',
-        choices=['fasttree', 'iqtree'],
+        choices=['fasttree', 'iqtree', 'nj'],
         help=(
             'choose the phylogenetic method\n'
             'NOTE: Using iqtree will test individual gene models\n'
             'but will exponentially increase the run time\n'
+            'NOTE: nj builds a neighbour joining tree without an external tool, for quick triage\n'
             'NOTE: Not recommended to use in combination with --build-all\n'
             '(default: %(default)s)'
         )
     )
+    phylo_parser.add_argument(
+        '-dc',
+        '--distance-correction',
+        default='kimura',
+        choices=DISTANCE_CORRECTIONS,
+        help=(
+            'correction of the protein distances used by --method nj\n'
+            'none = p-distances, poisson = -ln(1 - p), kimura = -ln(1 - p - 0.2p^2)\n'
+            '(default: %(default)s)'
+        )
+    )
+    phylo_parser.add_argument(
+        '-lm',
+        '--locus-models',
+        action='store_true',
+        help=(
+            'select the substitution model of each locus with ModelFinder and write\n'
+            'the models into partition.txt, so that iqtree does not test models\n'
+            'on the concatenated alignment\n'
+            'models are cached in locus_models.tsv by alignment (in the --cache folder if set)\n'
+            'NOTE: only used with --method iqtree\n'
+            '(default: %(default)s)'
+        )
+    )
+    phylo_parser.add_argument(
+        '-pt',
+        '--previous-tree',
+        default=None,
+        type=str,
+        help=(
+            'a tree from an earlier analysis of a subset of the genomes\n'
+            'new taxa are placed onto it and it is used as the starting tree\n'
+            'the topological difference from it is written to trees/tree_update.txt\n'
+            'NOTE: only used for the concatenated alignment\n'
+            '(default: %(default)s)'
+        )
+    )
+    phylo_parser.add_argument(
+        '-con',
+        '--constrain',
+        action='store_true',
+        help=(
+            'use the previous tree as a constraint for iqtree (-g) instead of a starting tree\n'
+            'only the placement of new taxa is searched\n'
+            '(default: %(default)s)'
+        )
+    )
     return arg_parser
 
 def get_records_parser(arg_parser):
@@ -196,6 +271,16 @@ def get_records_parser(arg_parser):
             'NOTE: This will only work if -ia is also set'
         )
         )
+    record_parser.add_argument(
+        '-tr',
+        '--translate',
+        action='store_true',
+        help=(
+            'translate CDS features without a /translation from the record sequence\n'
+            'using their /codon_start and /transl_table, skipping /pseudo features\n'
+            '(default: %(default)s)'
+        )
+        )
     return arg_parser
 
 def get_search_parser(arg_parser):
@@ -270,6 +355,18 @@ def get_search_parser(arg_parser):
             '(default: %(default)s)'
         )
         )
+    search_parser.add_argument(
+        '-pre',
+        '--prescreen',
+        action='store_true',
+        help=(
+            'search candidates against a random subset of the genomes first and only search\n'
+            'those that can still meet --presence and uniqueness against the other genomes\n'
+            'the subset holds the genomes a locus may be missing from plus 10%% (at least 10)\n'
+            'candidates that fail are listed in tsv/prescreen_failed.txt\n'
+            '(default: %(default)s)'
+        )
+        )
     return arg_parser
 
 def get_seed_parser(arg_parser):
@@ -306,6 +403,19 @@ def get_seed_parser(arg_parser):
         'NOTE: this will only effect the results if -p is used\n'
         '(default: %(default)s)'
         )
+    seed_parser.add_argument(
+        '-ss',
+        '--seed-search',
+        default='blastp',
+        choices=['blastp', 'cluster'],
+        help=(
+            'how singletons are found in the seed genome\n'
+            'blastp = search a sample of the proteins within the length thresholds\n'
+            '         against the whole seed proteome, large enough to satisfy -f\n'
+            'cluster = cluster the whole seed proteome with DIAMOND, faster for large proteomes\n'
+            '(default: %(default)s)'
+        )
+        )
     return arg_parser
 
 def get_io_parser(arg_parser):
@@ -326,6 +436,8 @@ def get_io_parser(arg_parser):
         default="*.gbk",
         type=str,
         help='string indicating the genbank files to use in the phylogeny\n'
+        'protein fasta (.faa) and GFF3 files (.gff, .gff3) with a ##FASTA section\n'
+        'or a genome fasta of the same name (.fna, .fasta, .fa, .fas) are also read\n'
         '(default: %(default)s)'
         )
     io_parser.add_argument(
@@ -380,6 +492,36 @@ def get_exe_parser(arg_parser):
         '(default: %(default)s)'
         )
     )
+    exe_parser.add_argument(
+        '-ma',
+        '--mafft',
+        default="mafft",
+        type=str,
+        help=(
+        'path to MAFFT executable \n'
+        '(default: %(default)s)'
+        )
+    )
+    exe_parser.add_argument(
+        '-fa',
+        '--famsa',
+        default="famsa",
+        type=str,
+        help=(
+        'path to FAMSA executable \n'
+        '(default: %(default)s)'
+        )
+    )
+    exe_parser.add_argument(
+        '-clo',
+        '--clustalo',
+        default="clustalo",
+        type=str,
+        help=(
+        'path to Clustal Omega executable \n'
+        '(default: %(default)s)'
+        )
+    )
     exe_parser.add_argument(
         '-ft',
         '--fasttree',
@@ -402,6 +544,210 @@ def get_exe_parser(arg_parser):
     )
     return arg_parser
 
+def get_performance_parser(arg_parser):
+    '''
+    Create an argument group for trading accuracy for speed
+        Arguments:
+            arg_parser: the basic argument parser
+        Returns:
+            arg_parser: the argument parser with arguments added
+    '''
+    performance_parser = arg_parser.add_argument_group(
+            'performance',
+            'control the speed and resource use of the analysis'
+            )
+    performance_parser.add_argument(
+        '-ps',
+        '--preset',
+        default=DEFAULT_PRESET,
+        choices=PRESET_ORDER,
+        help=(
+            'speed preset applied to DIAMOND, MUSCLE, FastTree and IQ-TREE:\n'
+            'fast = DIAMOND --fast, MUSCLE -maxiters 2/-super5, FastTree -fastest -nosupport,\n'
+            '       IQ-TREE with fixed models and no bootstrap\n'
+            'balanced = the default settings of each tool\n'
+            'thorough = DIAMOND --sensitive and a more exhaustive FastTree search\n'
+            '(default: %(default)s)'
+        )
+        )
+    performance_parser.add_argument(
+        '-dl',
+        '--deadline',
+        default=None,
+        type=float,
+        help=(
+            'wall-clock budget for the analysis in hours\n'
+            'presets are downgraded stage by stage if the deadline is at risk\n'
+            '(default: %(default)s)'
+        )
+        )
+    performance_parser.add_argument(
+        '-mem',
+        '--memory',
+        default=None,
+        type=float,
+        help=(
+            'memory budget in GB for parallel DIAMOND, MUSCLE and IQ-TREE jobs\n'
+            'jobs are only started while their estimated memory fits in the budget\n'
+            'uses the cgroup limit or the physical memory if left as None\n'
+            '(default: %(default)s)'
+        )
+        )
+    performance_parser.add_argument(
+        '-dist',
+        '--distributed',
+        action='store_true',
+        help=(
+            'send parallel jobs to a work queue in the output folder instead of a local pool\n'
+            'start workers on any node sharing the filesystem with: getphylo worker -o OUTPUT\n'
+            '(default: %(default)s)'
+        )
+        )
+    performance_parser.add_argument(
+        '-wt',
+        '--worker-timeout',
+        default=DEFAULT_WORKER_TIMEOUT / 60,
+        type=float,
+        help=(
+            'minutes --distributed waits for jobs while no worker is attached before failing\n'
+            '(default: %(default)s)'
+        )
+        )
+    performance_parser.add_argument(
+        '-cache',
+        '--cache',
+        default=None,
+        type=str,
+        help=(
+            'folder for a cache of DIAMOND, MUSCLE, FastTree and IQ-TREE results\n'
+            'identical commands on identical inputs are restored instead of rerun\n'
+            'the folder can be shared between runs\n'
+            '(default: %(default)s)'
+        )
+        )
+    performance_parser.add_argument(
+        '-cs',
+        '--cache-size',
+        default=DEFAULT_CACHE_SIZE,
+        type=float,
+        help=(
+            'size limit of the cache in GB, least recently used results are removed first\n'
+            '(default: %(default)s)'
+        )
+        )
+    performance_parser.add_argument(
+        '-tt',
+        '--task-timeout',
+        default=None,
+        type=float,
+        help=(
+            'minutes a single DIAMOND, MUSCLE, FastTree or IQ-TREE job may run before it\n'
+            'is stopped\n'
+            '(default: %(default)s)'
+        )
+        )
+    performance_parser.add_argument(
+        '-rt',
+        '--retries',
+        default=DEFAULT_RETRIES,
+        type=int,
+        help=(
+            'times a failed or stopped job is run again, waiting longer before each attempt\n'
+            'loci that still fail to align are dropped and reported in failures.jsonl\n'
+            '(default: %(default)s)'
+        )
+        )
+    performance_parser.add_argument(
+        '-pool',
+        '--cpu-pool',
+        default=None,
+        type=str,
+        help=(
+            'folder of a machine-wide pool of cpu tokens shared by concurrent runs\n'
+            'each parallel job beside the first waits for a free token, so runs on the same\n'
+            'server do not oversubscribe it even if each uses --cpus for all cores\n'
+            'NOTE: a GNU make jobserver (make -j, workflow managers) is used without this option\n'
+            '(default: %(default)s)'
+        )
+        )
+    performance_parser.add_argument(
+        '-poolsize',
+        '--cpu-pool-size',
+        default=None,
+        type=int,
+        help=(
+            'number of cpu tokens in the --cpu-pool\n'
+            'uses all cpus of the machine if left as None\n'
+            '(default: %(default)s)'
+        )
+        )
+    performance_parser.add_argument(
+        '-st',
+        '--store',
+        action='store_true',
+        help=(
+            'keep proteomes, DIAMOND databases, hit tables and per locus sequences in\n'
+            'artifacts.sqlite in the output folder instead of thousands of small files\n'
+            'files are only written while an external tool reads them\n'
+            'NOTE: always used when restarting in a folder that has an artifacts.sqlite\n'
+            '(default: %(default)s)'
+        )
+        )
+    performance_parser.add_argument(
+        '-plan',
+        '--plan',
+        action='store_true',
+        help=(
+            'scan the inputs and print the projected work, time, memory and disk of each stage\n'
+            'then exit without running any tools\n'
+            '(default: %(default)s)'
+        )
+        )
+    performance_parser.add_argument(
+        '-cal',
+        '--calibrate',
+        default=None,
+        nargs='+',
+        type=str,
+        help=(
+            'run_report.json files of previous runs used to calibrate the --plan run times\n'
+            '(default: %(default)s)'
+        )
+        )
+    performance_parser.add_argument(
+        '-prof',
+        '--profile',
+        action='store_true',
+        help=(
+            'profile the Python code of each stage, including the parallel jobs, and write\n'
+            'profile/<stage>.pstats to the output folder with the run time of each external\n'
+            'tool in profile/<stage>.tools.json, printing the slowest functions of each stage\n'
+            '(default: %(default)s)'
+        )
+        )
+    performance_parser.add_argument(
+        '-proftop',
+        '--profile-top',
+        default=DEFAULT_TOP,
+        type=int,
+        help=(
+            'number of functions printed for each stage by --profile\n'
+            '(default: %(default)s)'
+        )
+        )
+    performance_parser.add_argument(
+        '-trace',
+        '--trace',
+        action='store_true',
+        help=(
+            'write trace.json to the output folder with a timeline of every stage, parallel\n'
+            'job and external tool, and of the running jobs and the load of the machine\n'
+            'open it in ui.perfetto.dev or chrome://tracing to see where cpus sat idle\n'
+            '(default: %(default)s)'
+        )
+        )
+    return arg_parser
+
 def get_arguments(arg_parser):
     '''
     Add arguments and argument groups to the parser
@@ -418,6 +764,7 @@ def get_arguments(arg_parser):
     arg_parser = get_seed_parser(arg_parser)
     arg_parser = get_records_parser(arg_parser)
     arg_parser = get_exe_parser(arg_parser)
+    arg_parser = get_performance_parser(arg_parser)
     return arg_parser
 
 def parse_args():
@@ -428,3 +775,269 @@ def parse_args():
     arg_parser = get_arguments(arg_parser)
     args = arg_parser.parse_args()
     return args
+
+def get_worker_parser():
+    '''
+    Create a parser for the worker command
+        Arguments:
+            None
+        Returns:
+            arg_parser: the worker argument parser
+    '''
+    arg_parser = argparse.ArgumentParser(
+        "getphylo worker",
+        description=(
+            'process tasks from the work queue of a getphylo run started with --distributed\n'
+            'example usage: getphylo worker -o output -c 8'
+            ),
+        formatter_class=RawTextHelpFormatter
+        )
+    arg_parser.add_argument(
+        '-o',
+        '--output',
+        default='output',
+        type=str,
+        help=(
+            'the output folder of the getphylo run\n'
+            '(default: %(default)s)'
+        )
+    )
+    arg_parser.add_argument(
+        '-c',
+        '--cpus',
+        default=1,
+        type=int,
+        help=(
+            'the number of tasks to process at the same time\n'
+            '(default: %(default)s)'
+        )
+        )
+    arg_parser.add_argument(
+        '--poll',
+        default=1.0,
+        type=float,
+        help=(
+            'seconds between checks of the queue\n'
+            '(default: %(default)s)'
+        )
+        )
+    arg_parser.add_argument(
+        '--timeout',
+        default=120.0,
+        type=float,
+        help=(
+            'seconds without a heartbeat before a task is given to another worker\n'
+            '(default: %(default)s)'
+        )
+        )
+    arg_parser.add_argument(
+        '--idle-exit',
+        default=None,
+        type=float,
+        help=(
+            'exit after this many seconds without a task\n'
+            '(default: %(default)s)'
+        )
+        )
+    arg_parser.add_argument(
+        '--cache',
+        default=None,
+        type=str,
+        help=(
+            'folder for a cache of external tool results (see getphylo --cache)\n'
+            '(default: %(default)s)'
+        )
+        )
+    arg_parser.add_argument(
+        '--cache-size',
+        default=DEFAULT_CACHE_SIZE,
+        type=float,
+        help=(
+            'size limit of the cache in GB\n'
+            '(default: %(default)s)'
+        )
+        )
+    arg_parser.add_argument(
+        '--task-timeout',
+        default=None,
+        type=float,
+        help=(
+            'minutes a single external tool may run before it is stopped\n'
+            '(default: %(default)s)'
+        )
+        )
+    arg_parser.add_argument(
+        '--retries',
+        default=DEFAULT_RETRIES,
+        type=int,
+        help=(
+            'times a failed task is run again before it is reported as failed\n'
+            '(default: %(default)s)'
+        )
+        )
+    arg_parser.add_argument(
+        '-l',
+        '--logging',
+        default='INFO',
+        choices=[
+            logging.getLevelName(level) for level in [logging.DEBUG, logging.INFO, logging.WARNING]
+            ],
+        help='set the logging level\n'
+        '(default: %(default)s)'
+    )
+    return arg_parser
+
+def parse_worker_args(argv: List[str]):
+    '''
+    get the arguments for the worker command
+        Arguments:
+            argv: the command line arguments after 'worker'
+        Returns:
+            args: the parsed arguments
+    '''
+    arg_parser = get_worker_parser()
+    args = arg_parser.parse_args(argv)
+    return args
+
+def get_serve_parser():
+    '''
+    Create a parser for the serve command
+        Arguments:
+            None
+        Returns:
+            arg_parser: the serve argument parser
+    '''
+    arg_parser = argparse.ArgumentParser(
+        "getphylo serve",
+        description=(
+            'run getphylo as a service that keeps a reference collection warm\n'
+            'example usage: getphylo serve -g \'reference/*.gbk\' -c 8 -j 2 --port 8250'
+            ),
+        formatter_class=RawTextHelpFormatter
+        )
+    arg_parser.add_argument(
+        '-g',
+        '--gbks',
+        default="*.gbk",
+        type=str,
+        help='string indicating the genbank files of the reference collection\n'
+        '(default: %(default)s)'
+        )
+    arg_parser.add_argument(
+        '-o',
+        '--output',
+        default='serve',
+        type=str,
+        help=(
+            'folder for the reference databases and the output of each job\n'
+            '(default: %(default)s)'
+        )
+    )
+    arg_parser.add_argument(
+        '-t',
+        '--tag',
+        default="locus_tag",
+        type=str,
+        help='string indicating the GenBank annotations to extract\n'
+        '(default: %(default)s)'
+        )
+    arg_parser.add_argument(
+        '-c',
+        '--cpus',
+        default=1,
+        type=int,
+        help=(
+            'the number of cpus shared by all jobs\n'
+            '(default: %(default)s)'
+        )
+        )
+    arg_parser.add_argument(
+        '-j',
+        '--jobs',
+        default=1,
+        type=int,
+        help=(
+            'the number of jobs to run at the same time\n'
+            '(default: %(default)s)'
+        )
+        )
+    arg_parser.add_argument(
+        '--keep-jobs',
+        default=3600.0,
+        type=float,
+        help=(
+            'seconds the status of a finished job is kept\n'
+            '(default: %(default)s)'
+        )
+        )
+    arg_parser.add_argument(
+        '--host',
+        default='127.0.0.1',
+        type=str,
+        help=(
+            'the address to listen on\n'
+            '(default: %(default)s)'
+        )
+        )
+    arg_parser.add_argument(
+        '--port',
+        default=8250,
+        type=int,
+        help=(
+            'the port to listen on\n'
+            '(default: %(default)s)'
+        )
+        )
+    arg_parser.add_argument(
+        '--socket',
+        default=None,
+        type=str,
+        help=(
+            'listen on a unix socket at this path instead of a port\n'
+            '(default: %(default)s)'
+        )
+        )
+    arg_parser.add_argument(
+        '--input-root',
+        default='.',
+        type=str,
+        help=(
+            'folder the genbank files of submitted jobs must be in; relative paths\n'
+            'in a job are read from this folder\n'
+            '(default: %(default)s)'
+        )
+        )
+    arg_parser.add_argument(
+        '-ps',
+        '--preset',
+        default=DEFAULT_PRESET,
+        choices=PRESET_ORDER,
+        help=(
+            'speed preset applied to the external tools\n'
+            '(default: %(default)s)'
+        )
+        )
+    arg_parser.add_argument(
+        '-l',
+        '--logging',
+        default='INFO',
+        choices=[
+            logging.getLevelName(level) for level in [logging.DEBUG, logging.INFO, logging.WARNING]
+            ],
+        help='set the logging level\n'
+        '(default: %(default)s)'
+    )
+    arg_parser = get_exe_parser(arg_parser)
+    return arg_parser
+
+def parse_serve_args(argv: List[str]):
+    '''
+    get the arguments for the serve command
+        Arguments:
+            argv: the command line arguments after 'serve'
+        Returns:
+            args: the parsed arguments
+    '''
+    arg_parser = get_serve_parser()
+    args = arg_parser.parse_args(argv)
+    return args
@@ -0,0 +1,575 @@
+'''
+Plan an analysis without running any external tools.
+
+The input files are scanned for the lengths of their translations without BioPython:
+GenBank files for their /translation qualifiers, protein fasta files for their sequences
+and GFF3 files for the lengths of their CDS rows. For large collections only a sample of
+the files is scanned and the proteomes of the others are extrapolated from their file size.
+The work of each stage is projected from these proteomes and the run time is estimated
+with one coefficient per cost model, in cpu seconds per unit of work. Each completed run
+writes run_report.json with the projected work and the measured time of each stage, from
+which the coefficients can be calibrated for later plans.
+
+Classes:
+    Proteome
+    StageEstimate
+
+Functions:
+    scan_genbank(filename: str, translate: bool = False) -> List[int]
+    scan_fasta(filename: str) -> List[int]
+    scan_gff(filename: str) -> List[int]
+    scan_input(filename: str, translate: bool = False) -> List[int]
+    scan_inputs(
+        paths: List[str], seed: str, cpus: int, random_seed_number: int = None,
+        translate: bool = False
+        ) -> Tuple[List[Proteome], List[int], int]
+    get_estimate(
+        stage: str, model: str, tasks: int, work: float, unit: str, serial_work: float,
+        task_memory: int, disk: int, cpus: int, memory_budget: int, coefficients: Dict[str, float]
+        ) -> StageEstimate
+    estimate_stages(
+        proteomes: List[Proteome], seed_lengths: List[int], thresholds: List, cpus: int,
+        method: str = 'fasttree', build_all: bool = False, memory_budget: int = None,
+        coefficients: Dict[str, float] = None, loci: int = None
+        ) -> List[StageEstimate]
+    read_run_reports(filenames: List[str]) -> Dict[str, float]
+    measure_run(
+        output: str, manifest: Manifest, seed_key: str, thresholds: List, cpus: int,
+        method: str, build_all: bool, loci: int
+        ) -> List[StageEstimate]
+    write_run_report(
+        filename: str, estimates: List[StageEstimate], stage_times: Dict[str, float], cpus: int
+        ) -> None
+    format_size(size: float) -> str
+    format_time(seconds: float) -> str
+    format_table(estimates: List[StageEstimate]) -> List[str]
+    make_plan(
+        paths: List[str], seed: str, thresholds: List, cpus: int, method: str, build_all: bool,
+        memory_budget: int, reports: List[str] = None, random_seed_number: int = None,
+        translate: bool = False
+        ) -> None
+'''
+import json
+import logging
+import math
+import os
+import random
+import re
+import statistics
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Tuple
+
+from getphylo.ext import diamond, iqtree, muscle
+from getphylo.screen import BATCH_MARGIN, MIN_BATCH_SIZE
+from getphylo.utils import gff, io, phylo, store
+from getphylo.utils.errors import BadInputError
+from getphylo.utils.manifest import Manifest
+
+# the most genbank files scanned for a plan, the others are extrapolated
+MAX_SCANNED = 100
+# the columns of the feature keys and of the qualifiers of a genbank feature table
+FEATURE_INDENT = ' ' * 5
+QUALIFIER_INDENT = ' ' * 21
+# a range of bases in a location, e.g. <1..>300 or the parts of join(1..30,40..90)
+LOCATION_RANGE = re.compile(r'<?(\d+)\.\.>?(\d+)')
+# cpu seconds per unit of work for each cost model, calibrated with --calibrate
+DEFAULT_COEFFICIENTS = {
+    'extract': 0.5,
+    'screen': 1.0,
+    'align': 100.0,
+    'fasttree': 0.5,
+    'iqtree': 20.0,
+    'nj': 0.05,
+}
+# seconds of start up and file handling for each task
+TASK_OVERHEAD = 0.5
+# share of the seed proteins within the length thresholds that are singletons
+SINGLETON_FRACTION = 0.6
+# share of the singletons that pass the presence threshold
+PASS_FRACTION = 0.3
+# hits to itself and its closest paralogues for each seed protein
+SEED_HITS = 2
+# bytes written for each DIAMOND hit
+HIT_BYTES = 40
+# bytes of the fasta header and original name of each protein
+PROTEIN_NAME_BYTES = 48
+# size of a DIAMOND database relative to its letters
+DATABASE_FACTOR = 1.2
+# memory used by BioPython relative to the size of the genbank file
+EXTRACT_MEMORY_FACTOR = 4
+# length of an aligned locus relative to its unaligned sequences
+GAP_FACTOR = 1.2
+FASTTREE_BASE_MEMORY = 2**26
+# bytes of the FastTree profiles for each site of each taxon
+FASTTREE_BYTES = 20 * 4
+# bytes of each tree file for each taxon
+TREE_BYTES = 40
+
+class Proteome(NamedTuple):
+    '''The size and protein content of an input genome'''
+    size: int
+    proteins: int
+    letters: int
+
+class StageEstimate(NamedTuple):
+    '''The projected workload and resource use of a stage'''
+    stage: str
+    model: str
+    tasks: int
+    work: float
+    unit: str
+    # the work on the longest path through the stage once it is spread over the cpus
+    span: float
+    # seconds of task overhead on the longest path
+    overhead: float
+    seconds: float
+    task_memory: int
+    memory: int
+    disk: int
+
+def scan_genbank(filename: str, translate: bool = False) -> List[int]:
+    '''
+    Read the lengths of the CDS translations of a genbank file without parsing it.
+        Arguments:
+            filename: path to the genbank file
+            translate: estimate the translations of CDS features without a /translation from
+            the length of their location, skipping pseudogenes as extraction does
+        Returns:
+            lengths: the length of each translation
+    '''
+    lengths = []
+    length = None
+    # the location of the CDS feature being read until it turns out to have a translation
+    location = None
+    qualifiers = False
+    with open(filename) as _file:
+        for line in _file:
+            if length is not None:
+                line = line.strip()
+                if line.endswith('"'):
+                    lengths.append(length + len(line) - 1)
+                    length = None
+                else:
+                    length += len(line)
+                continue
+            if not line.startswith(QUALIFIER_INDENT):
+                # the next feature or the end of the features
+                if translate and location is not None:
+                    lengths.append(sum(
+                        int(end) - int(start) + 1
+                        for start, end in LOCATION_RANGE.findall(''.join(location))
+                        ) // 3)
+                location = None
+                if line.startswith(FEATURE_INDENT + 'CDS '):
+                    location = [line[len(QUALIFIER_INDENT):].strip()]
+                qualifiers = False
+                continue
+            line = line.strip()
+            if line.startswith('/'):
+                qualifiers = True
+            if line.startswith('/translation="'):
+                location = None
+                line = line[len('/translation="'):]
+                if line.endswith('"'):
+                    lengths.append(len(line) - 1)
+                else:
+                    length = len(line)
+            elif line.split('=')[0] in ['/pseudo', '/pseudogene']:
+                location = None
+            elif location is not None and not qualifiers:
+                location.append(line)
+    return lengths
+
+def scan_fasta(filename: str) -> List[int]:
+    '''
+    Read the lengths of the sequences in a fasta file.
+        Arguments:
+            filename: path to the fasta file
+        Returns:
+            lengths: the length of each sequence
+    '''
+    lengths = []
+    with store.open_file(filename) as _file:
+        for line in _file:
+            if line.startswith('>'):
+                lengths.append(0)
+            elif lengths:
+                lengths[-1] += len(line.strip())
+    return lengths
+
+def scan_gff(filename: str) -> List[int]:
+    '''
+    Estimate the lengths of the translations of the CDS rows of a GFF3 file.
+        Arguments:
+            filename: path to the GFF3 file
+        Returns:
+            lengths: the length of each translation
+    '''
+    lengths: Dict[Tuple[str, str], int] = {}
+    with open(filename) as _file:
+        for index, row in enumerate(gff.read_cds_rows(_file)):
+            key = (row.seqid, row.attributes.get('ID', f'#{index}'))
+            lengths[key] = lengths.get(key, 0) + row.end - row.start
+    return [length // 3 for length in lengths.values()]
+
+def scan_input(filename: str, translate: bool = False) -> List[int]:
+    '''
+    Read the lengths of the translations of an input file in any supported format.
+        Arguments:
+            filename: path to the input file
+            translate: count genbank CDS features without a /translation
+        Returns:
+            lengths: the length of each translation
+    '''
+    input_format = io.get_input_format(filename)
+    if input_format == 'protein':
+        return scan_fasta(filename)
+    if input_format == 'gff':
+        return scan_gff(filename)
+    return scan_genbank(filename, translate)
+
+def scan_inputs(
+        paths: List[str], seed: str, cpus: int, random_seed_number: int = None,
+        translate: bool = False
+    ) -> Tuple[List[Proteome], List[int], int]:
+    '''
+    Scan the seed and a sample of the other input files and extrapolate the rest.
+        Arguments:
+            paths: the paths of the input files
+            seed: path to the seed genome, which is always scanned
+            cpus: the number of cpus used to scan the files
+            random_seed_number: integer used as a seed for choosing the sample
+            translate: count genbank CDS features without a /translation
+        Returns:
+            proteomes: the proteome of each input file
+            seed_lengths: the length of each protein in the seed genome
+            scanned: the number of files that were scanned
+    '''
+    others = [path for path in paths if path != seed]
+    if len(others) > MAX_SCANNED:
+        others = random.Random(random_seed_number).sample(others, MAX_SCANNED)
+    sample = [seed] + others
+    scans = dict(zip(sample, io.run_in_parallel(
+        scan_input, [[path, translate] for path in sample], cpus
+        )))
+    scanned_size = sum(os.path.getsize(path) for path in sample)
+    scanned_proteins = sum(len(lengths) for lengths in scans.values())
+    scanned_letters = sum(sum(lengths) for lengths in scans.values())
+    proteomes = []
+    for path in paths:
+        size = os.path.getsize(path)
+        if path in scans:
+            proteomes.append(Proteome(size, len(scans[path]), sum(scans[path])))
+        else:
+            proteomes.append(Proteome(
+                size,
+                round(size * scanned_proteins / max(scanned_size, 1)),
+                round(size * scanned_letters / max(scanned_size, 1))
+                ))
+    return proteomes, scans[seed], len(sample)
+
+def get_estimate(
+        stage: str, model: str, tasks: int, work: float, unit: str, serial_work: float,
+        task_memory: int, disk: int, cpus: int, memory_budget: int,
+        coefficients: Dict[str, float]
+    ) -> StageEstimate:
+    '''
+    Estimate the run time and peak memory of a stage from its work.
+        Arguments:
+            stage: the name of the stage
+            model: the cost model of the stage
+            tasks: the number of tasks run by the stage
+            work: the total work of the stage
+            unit: the unit of the work
+            serial_work: work in a single task that cannot be spread over the cpus
+            task_memory: the memory of the largest task in bytes
+            disk: the bytes written by the stage
+            cpus: the number of cpus available
+            memory_budget: the memory available in bytes, or None for no limit
+            coefficients: cpu seconds per unit of work for each model
+        Returns:
+            estimate: the StageEstimate
+    '''
+    parallelism = max(1, min(cpus, tasks))
+    span = serial_work + (work - serial_work) / parallelism
+    overhead = TASK_OVERHEAD * tasks / parallelism
+    memory = task_memory * parallelism
+    if memory_budget:
+        # tasks wait for memory, but a task larger than the budget still runs on its own
+        memory = max(min(memory, memory_budget), task_memory)
+    return StageEstimate(
+        stage, model, tasks, work, unit, span, overhead, coefficients[model] * span + overhead,
+        int(task_memory), int(memory), int(disk)
+        )
+
+def estimate_stages(
+        proteomes: List[Proteome], seed_lengths: List[int], thresholds: List, cpus: int,
+        method: str = 'fasttree', build_all: bool = False, memory_budget: int = None,
+        coefficients: Dict[str, float] = None, loci: int = None
+    ) -> List[StageEstimate]:
+    '''
+    Project the workload and resource use of each stage.
+        Arguments:
+            proteomes: the proteome of each input genome
+            seed_lengths: the length of each protein in the seed genome
+            thresholds: find, minlength, maxlength, presence, minloci and maxloci
+            cpus: the number of cpus available
+            method: the tree building method
+            build_all: whether a tree is built for every locus
+            memory_budget: the memory available in bytes, or None for no limit
+            coefficients: calibrated cpu seconds per unit of work for each model
+            loci: the number of loci found, or None to project it
+        Returns:
+            estimates: a StageEstimate for extract, screen, align and trees
+    '''
+    loci_to_find, min_length, max_length, _, _, max_loci = thresholds
+    coefficients = {**DEFAULT_COEFFICIENTS, **(coefficients or {})}
+    genomes = len(proteomes)
+    candidates = [length for length in seed_lengths if max_length > length > min_length]
+    length = statistics.mean(candidates) if candidates else 0
+    longest = max(candidates, default=0)
+    proteins = sum(proteome.proteins for proteome in proteomes)
+    letters = sum(proteome.letters for proteome in proteomes)
+    largest = max(proteome.letters for proteome in proteomes)
+    # extract: every genbank file is parsed by BioPython
+    estimates = [get_estimate(
+        'extract', 'extract', genomes, sum(proteome.size for proteome in proteomes) / 2**20, 'MB',
+        0, EXTRACT_MEMORY_FACTOR * max(proteome.size for proteome in proteomes),
+        letters * (1 + DATABASE_FACTOR) + proteins * PROTEIN_NAME_BYTES,
+        cpus, memory_budget, coefficients
+        )]
+    # screen: a sample of the seed against itself, then batches of singletons against
+    # every genome until enough loci pass
+    singletons = len(candidates) * SINGLETON_FRACTION
+    seed_queries = len(candidates)
+    if loci_to_find > 0:
+        singletons = min(singletons, loci_to_find)
+        seed_queries = min(
+            seed_queries, math.ceil(loci_to_find / SINGLETON_FRACTION * BATCH_MARGIN)
+            )
+    searched = min(singletons, max(MIN_BATCH_SIZE, max_loci / PASS_FRACTION * BATCH_MARGIN))
+    seed_pairs = seed_queries * length * sum(seed_lengths)
+    estimates.append(get_estimate(
+        'screen', 'screen', 1 + genomes, (seed_pairs + searched * length * letters) / 1e9,
+        'G letter pairs', seed_pairs / 1e9,
+        diamond.get_search_memory(max(searched, seed_queries) * length + largest),
+        (seed_queries * SEED_HITS + searched * genomes) * HIT_BYTES,
+        cpus, memory_budget, coefficients
+        ))
+    if loci is None:
+        loci = round(min(max_loci, searched * PASS_FRACTION))
+    # align: one MUSCLE job for each locus with a sequence from every genome
+    aligned = length * GAP_FACTOR
+    sites = round(loci * aligned)
+    estimates.append(get_estimate(
+        'align', 'align', loci, loci * (genomes**2 * length + genomes * length**2) / 1e9,
+        'G cells', 0, muscle.get_muscle_memory(genomes, longest),
+        loci * genomes * (length + aligned + 2 * PROTEIN_NAME_BYTES)
+        + genomes * (sites + PROTEIN_NAME_BYTES),
+        cpus, memory_budget, coefficients
+        ))
+    # trees: the concatenated alignment and optionally every locus
+    tree_cells = genomes * sites * math.log2(genomes) / 1e6
+    tasks = 1
+    work = tree_cells
+    if build_all:
+        tasks += loci
+        work += tree_cells
+    if method == 'iqtree':
+        task_memory = iqtree.get_iqtree_memory(genomes, sites)
+    elif method == 'nj':
+        task_memory = phylo.get_distance_memory(genomes, sites)
+    else:
+        task_memory = FASTTREE_BASE_MEMORY + genomes * sites * FASTTREE_BYTES
+    estimates.append(get_estimate(
+        'trees', method, tasks, work, 'M cells', tree_cells, task_memory,
+        tasks * genomes * TREE_BYTES, cpus, memory_budget, coefficients
+        ))
+    return estimates
+
+def read_run_reports(filenames: List[str]) -> Dict[str, float]:
+    '''
+    Calibrate the cost models from the reports of previous runs.
+        Arguments:
+            filenames: paths to run_report.json files
+        Returns:
+            coefficients: the median cpu seconds per unit of work of each model in the reports
+    '''
+    ratios = defaultdict(list)
+    for filename in filenames:
+        try:
+            with open(filename) as _file:
+                stages = json.load(_file)['stages']
+        except (OSError, ValueError, KeyError) as error:
+            raise BadInputError(f'{filename} is not a getphylo run report: {error}') from error
+        for stage in stages:
+            if stage['span'] > 0:
+                ratios[stage['model']].append(
+                    max(stage['seconds'] - stage['overhead'], 0) / stage['span']
+                    )
+    return {model: statistics.median(values) for model, values in ratios.items()}
+
+def measure_run(
+        output: str, manifest: Manifest, seed_key: str, thresholds: List, cpus: int,
+        method: str, build_all: bool, loci: int
+    ) -> List[StageEstimate]:
+    '''
+    Project the work of a finished run from its extracted proteomes and final loci.
+        Arguments:
+            output: path to the output folder
+            manifest: the manifest of the input genomes
+            seed_key: the id of the seed genome
+            thresholds: find, minlength, maxlength, presence, minloci and maxloci
+            cpus: the number of cpus used
+            method: the tree building method
+            build_all: whether a tree was built for every locus
+            loci: the number of final loci
+        Returns:
+            estimates: a StageEstimate for each stage
+    '''
+    genomes = [
+        genome for genome in manifest.genomes
+        if io.file_exists(os.path.join(output, 'fasta', genome.key + '.fasta'))
+        ]
+    scans = io.run_in_parallel(
+        scan_fasta,
+        [[os.path.join(output, 'fasta', genome.key + '.fasta')] for genome in genomes],
+        cpus
+        )
+    proteomes = [
+        Proteome(genome.size, len(lengths), sum(lengths))
+        for genome, lengths in zip(genomes, scans)
+        ]
+    seed_lengths = scans[[genome.key for genome in genomes].index(seed_key)]
+    return estimate_stages(
+        proteomes, seed_lengths, thresholds, cpus, method, build_all, loci=loci
+        )
+
+def write_run_report(
+        filename: str, estimates: List[StageEstimate], stage_times: Dict[str, float], cpus: int
+    ) -> None:
+    '''
+    Write the projected work and the measured time of the stages that were run.
+        Arguments:
+            filename: path to the new report
+            estimates: the projected work of each stage
+            stage_times: the measured seconds of each stage that was run
+            cpus: the number of cpus used
+        Returns:
+            None
+    '''
+    stages = [
+        {
+            'stage': estimate.stage,
+            'model': estimate.model,
+            'tasks': estimate.tasks,
+            'work': round(estimate.work, 6),
+            'unit': estimate.unit,
+            'span': round(estimate.span, 6),
+            'overhead': round(estimate.overhead, 3),
+            'predicted': round(estimate.seconds, 3),
+            'seconds': round(stage_times[estimate.stage], 3)
+        }
+        for estimate in estimates if estimate.stage in stage_times
+        ]
+    with open(filename, 'w') as _file:
+        json.dump({'cpus': cpus, 'stages': stages}, _file, indent=1)
+    logging.info('Run report written to %s', filename)
+
+def format_size(size: float) -> str:
+    '''Format a number of bytes (e.g. 1.5 GB)'''
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024:
+            return f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.1f} TB'
+
+def format_time(seconds: float) -> str:
+    '''Format a duration (e.g. 2h 05m)'''
+    seconds = round(seconds)
+    if seconds < 60:
+        return f'{seconds}s'
+    if seconds < 3600:
+        return f'{seconds // 60}m {seconds % 60:02d}s'
+    if seconds < 86400:
+        return f'{seconds // 3600}h {seconds % 3600 // 60:02d}m'
+    return f'{seconds // 86400}d {seconds % 86400 // 3600:02d}h'
+
+def format_table(estimates: List[StageEstimate]) -> List[str]:
+    '''
+    Format the estimates as a table with a row for each stage and a total.
+        Arguments:
+            estimates: the estimate of each stage
+        Returns:
+            lines: the lines of the table
+    '''
+    row = '{:<8} {:>7} {:>24} {:>9} {:>11} {:>10}'
+    lines = [row.format('stage', 'tasks', 'work', 'time', 'peak memory', 'disk')]
+    for estimate in estimates:
+        lines.append(row.format(
+            estimate.stage, estimate.tasks, f'{estimate.work:.3g} {estimate.unit}',
+            format_time(estimate.seconds), format_size(estimate.memory),
+            format_size(estimate.disk)
+            ))
+    lines.append(row.format(
+        'total', '', '', format_time(sum(estimate.seconds for estimate in estimates)),
+        format_size(max(estimate.memory for estimate in estimates)),
+        format_size(sum(estimate.disk for estimate in estimates))
+        ))
+    return lines
+
+def make_plan(
+        paths: List[str], seed: str, thresholds: List, cpus: int, method: str, build_all: bool,
+        memory_budget: int, reports: List[str] = None, random_seed_number: int = None,
+        translate: bool = False
+    ) -> None:
+    '''
+    Print the projected workload and resource use of each stage of an analysis.
+        Arguments:
+            paths: the paths of the input files
+            seed: path to the seed genome
+            thresholds: find, minlength, maxlength, presence, minloci and maxloci
+            cpus: the number of cpus available
+            method: the tree building method
+            build_all: whether a tree is built for every locus
+            memory_budget: the memory available in bytes
+            reports: optional run reports to calibrate the cost models from
+            random_seed_number: integer used as a seed for choosing the scanned files
+            translate: count genbank CDS features without a /translation
+        Returns:
+            None
+    '''
+    coefficients = read_run_reports(reports) if reports else {}
+    proteomes, seed_lengths, scanned = scan_inputs(
+        paths, seed, cpus, random_seed_number, translate
+        )
+    estimates = estimate_stages(
+        proteomes, seed_lengths, thresholds, cpus, method, build_all, memory_budget, coefficients
+        )
+    _, min_length, max_length, _, min_loci, _ = thresholds
+    candidates = [length for length in seed_lengths if max_length > length > min_length]
+    loci = estimates[2].tasks
+    sites = round(loci * statistics.mean(candidates or [0]) * GAP_FACTOR)
+    lines = [
+        f'Plan for {len(paths)} genomes on {cpus} cpus '
+        f'({scanned} scanned, the rest extrapolated from their file size)',
+        f'Proteins: {sum(proteome.proteins for proteome in proteomes)} in total, '
+        f'{len(seed_lengths)} in the seed genome ({len(candidates)} within the length thresholds)',
+        f'Expected loci: {loci}, supermatrix of {len(paths)} taxa x {sites} sites',
+        'Cost models: ' + (
+            f'{", ".join(sorted(coefficients))} calibrated from {len(reports)} run report(s)'
+            if coefficients else 'defaults, use --calibrate with run_report.json files'
+            ),
+        ''
+        ]
+    lines.extend(format_table(estimates))
+    for estimate in estimates:
+        if memory_budget and estimate.task_memory > memory_budget:
+            lines.append(
+                f'WARNING: the largest {estimate.stage} task needs '
+                f'{format_size(estimate.task_memory)}, '
+                f'more than the memory budget of {format_size(memory_budget)}.'
+                )
+    if loci < min_loci:
+        lines.append(f'WARNING: fewer loci are expected than --minloci ({min_loci}).')
+    print('\n'.join(lines))
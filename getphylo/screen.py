@@ -2,53 +2,119 @@
 Screen fasta files and blast databases for singletons and extract sequences
 
 Functions:
+    get_unique_hits(hits: List[List[str]]) -> List
     get_unique_hits_from_tsv(file: str) -> List
+    shuffle_loci(loci: List, random_seed_number: int) -> List
+    select_candidates(
+        unique_loci: List, fasta_contents: List[str], thresholds: List, random_seed_number: int
+    ) -> Tuple[List, List]
     get_seed_paths(seed: str, output: str) -> Tuple[str, str, str]
+    append_file(filename: str, destination: str) -> None
+    search_seed_sample(
+        seed_fasta: str, seed_dmnd: str, seed_tsv: str, thresholds: List,
+        random_seed_number: int, diamond_args: Tuple[str,float,float,float],
+        sensitivity: str = None, threads: int = None
+    ) -> List[str]
+    cluster_seed(
+        seed_fasta: str, seed_tsv: str, diamond_args: Tuple[str,float,float,float],
+        threads: int = None
+    ) -> List[str]
     get_singletons_from_seed(
         seed, output, thresholds, random_seed_number,
-        diamond_args:Tuple[str,float,float,float]
+        diamond_args:Tuple[str,float,float,float], sensitivity=None, seed_search='blastp',
+        threads=None
     )
     get_loci_from_file(file: str) -> List
-    search_candidates(output: str, cpus: int, diamond_args: Tuple[str,float,float,float]) -> None
-    score_locus(locus: str, files: List) -> Tuple[int, bool, List]
-    process_final_loci(final_loci: List, minimum_loci: int, output: str) -> None
+    get_batch_size(searched: int, passed: int, maximum_loci: int) -> int
+    get_built_keys(output: str, genome_keys: List[str]) -> List[str]
+    search_database(
+        query: str, dmnd_database: str, tsv_name: str,
+        diamond_args: Tuple[str,float,float,float], sensitivity: str = None,
+        block_size: float = None, index_chunks: int = None
+    ) -> None
+    run_searches(
+        query: str, genome_keys: List[str], tsv_names: List[str], output: str, cpus: int,
+        diamond_args: Tuple[str,float,float,float], sensitivity: str = None,
+        memory_budget: int = None, databases: QueuedDatabases = None
+    ) -> None
+    get_prescreen_genomes(
+        number_of_genomes: int, presence_threshold: float, random_seed_number: int = None
+    ) -> List[int]
+    search_batch(
+        batch_loci: List[str], candidates: Dict[str, str], query: str, genome_keys: List[str],
+        tsv_names: List[str], output: str, cpus: int, diamond_args: Tuple[str,float,float,float],
+        sensitivity: str = None, memory_budget: int = None, presence_threshold: float = None,
+        subset: List[int] = (), databases: QueuedDatabases = None
+    ) -> List[str]
+    search_candidates(
+        output: str, genome_keys: List[str], cpus: int, diamond_args: Tuple[str,float,float,float],
+        sensitivity: str = None, memory_budget: int = None, presence_threshold: float = None,
+        maximum_loci: int = None, prescreen: bool = False, random_seed_number: int = None,
+        databases: QueuedDatabases = None
+    ) -> None
+    count_hits(files: List) -> List[Counter]
+    score_locus(locus: str, hit_counts: List[Counter]) -> Tuple[int, bool, List]
+    passes_thresholds(
+        presence: int, unique: bool, number_of_genomes: int, presence_threshold: float
+    ) -> bool
+    process_final_loci(
+        final_loci: List, minimum_loci: int, output: str, locus_names: Dict[str, str]
+    ) -> None
     do_thresholding(
-        target_loci: List, presence_threshold: float, maximum_loci: int, output: str
+        target_loci: List, presence_threshold: float, maximum_loci: int, output: str,
+        manifest: Manifest, locus_names: Dict[str, str]
+    ) -> List
+    threshold_loci(
+        target_loci: List, thresholds: List, output: str, manifest: Manifest,
+        locus_names: Dict[str, str]
     ) -> List
-    threshold_loci(target_loci: List, thresholds: List, output: str) -> List
     write_pa_table(pa_table: List, loci: List, output: str) -> None
     get_target_proteins(
-        checkpoint: Checkpoint, output: str, seed: str, thresholds: List,
-        cpus: int, random_seed_number: int, diamond_args: Tuple[str,float,float,float]
+        checkpoint: Checkpoint, output: str, seed: str, manifest: Manifest, thresholds: List,
+        cpus: int, random_seed_number: int, diamond_args: Tuple[str,float,float,float],
+        preset: Preset, memory_budget: int = None, seed_search: str = 'blastp',
+        prescreen: bool = False, databases: QueuedDatabases = None
     ) -> None
 '''
+import math
 import os
-import glob
 import logging
 from collections import Counter
 import random
-from typing import List, Tuple
+from typing import Dict, List, Tuple
 
 from getphylo.ext import diamond
-from getphylo.utils import io
+from getphylo.extract import QueuedDatabases
+from getphylo.utils import cpupool, io, memory
 from getphylo.utils.checkpoint import Checkpoint
+from getphylo.utils.manifest import Manifest
+from getphylo.utils.presets import DEFAULT_PRESET, PRESETS, Preset
 from getphylo.utils.errors import(
     FileAlreadyExistsError,
     InsufficientLociError,
     NoCandidateLociError
 )
 
-def get_unique_hits_from_tsv(file: str) -> List:
+# the first batch of candidates searched is this many times the maximum number of loci,
+# and later batches allow the same margin over the observed pass rate
+BATCH_MARGIN = 1.5
+MIN_BATCH_SIZE = 100
+# the prescreen searches the genomes a locus may be missing from plus this margin
+MIN_PRESCREEN_GENOMES = 10
+PRESCREEN_FRACTION = 0.1
+# candidates that failed the prescreen, left out of thresholding
+PRESCREEN_FAILED = 'prescreen_failed.txt'
+
+def get_unique_hits(lines: List[List[str]]) -> List:
     '''
-    Finds unique hits from the provided dmnd result file.
+    Finds unique hits from the rows of a dmnd result table.
         Arguments:
-            file: path to tsv file
+            lines: list of rows from the result table
         Returns:
             unique_hits: list of hits that are unique in the genome
     '''
     hits = []
     unique_hits = []
-    lines = io.read_tsv(file)
     for line in lines:
         hits.append(line[0])
     counter = Counter(hits)
@@ -57,11 +123,74 @@ def get_unique_hits_from_tsv(file: str) -> List:
             unique_hits.append(hit)
     return unique_hits
 
+def get_unique_hits_from_tsv(file: str) -> List:
+    '''
+    Finds unique hits from the provided dmnd result file.
+        Arguments:
+            file: path to tsv file
+        Returns:
+            unique_hits: list of hits that are unique in the genome
+    '''
+    return get_unique_hits(io.read_tsv(file))
+
+def shuffle_loci(loci: List, random_seed_number: int) -> List:
+    '''
+    Shuffle a list of loci.
+        Arguments:
+            loci: list of loci
+            random_seed_number: random seed for the locus order, random if None
+        Returns:
+            shuffled_loci: a shuffled copy of the list
+    '''
+    shuffled_loci = list(loci)
+    if random_seed_number is None: #random, random if no random seed set
+        random.shuffle(shuffled_loci)
+    else: #use the random seed provided
+        random.Random(random_seed_number).shuffle(shuffled_loci)
+    return shuffled_loci
+
+def select_candidates(
+        unique_loci: List, fasta_contents: List[str], thresholds: List, random_seed_number: int
+    ) -> Tuple[List, List]:
+    '''
+    Shuffle the singletons and select those within the length thresholds.
+        Arguments:
+            unique_loci: list of singletons in the seed genome
+            fasta_contents: lines of the seed fasta file
+            thresholds: list of thresholds from the parser
+                [args.find, args.minlength, args.maxlength,
+                args.presence, args.minloci, args.maxloci]
+            random_seed_number: random seed for the locus order, random if None
+        Returns:
+            candidate_loci: list of selected loci
+            loci_fasta: fasta lines of the selected loci
+    '''
+    unique_loci = shuffle_loci(unique_loci, random_seed_number)
+    loci = 0
+    loci_fasta = []
+    candidate_loci = []
+    loci_to_find, loci_min_length, loci_max_length, _, _, _ = thresholds
+    headers = {
+        line[1:].strip(): index for index, line in enumerate(fasta_contents)
+        if line.startswith('>')
+        }
+    for locus in unique_loci:
+        if loci_to_find < 0 or loci < loci_to_find:
+            sequence = fasta_contents[headers[locus] + 1]
+            if loci_max_length > len(sequence) > loci_min_length:
+                candidate_loci.append(locus)
+                loci_fasta.append(">" + locus)
+                loci_fasta.append(sequence)
+                loci += 1
+        else:
+            break
+    return candidate_loci, loci_fasta
+
 def get_seed_paths(seed: str, output: str) -> Tuple[str, str, str]:
     '''
-    Take the path to a genbank file and return files with .fasta, .dmnd and .tsv extensions.
+    Take the id of a genome and return files with .fasta, .dmnd and .tsv extensions.
     Arguments:
-        seed: path to the seed genome
+        seed: the id of the seed genome in the manifest
         output: path to the output directory
     Returns:
         seed_fasta, seed_dmnd, seed_tsv
@@ -75,15 +204,119 @@ def get_seed_paths(seed: str, output: str) -> Tuple[str, str, str]:
     seed_tsv = os.path.join(output, 'tsv', seed_tsv)
     return seed_fasta, seed_dmnd, seed_tsv
 
-def get_singletons_from_seed(seed, output, thresholds, random_seed_number, diamond_args):
+def append_file(filename: str, destination: str) -> None:
+    '''
+    Append the contents of a file to another and remove it.
+        Arguments:
+            filename: path to the file to be appended
+            destination: path to the file to append to
+        Returns:
+            None
+    '''
+    io.write_to_file(destination, [line.rstrip('\n') for line in io.read_file(filename)])
+    io.remove_files([filename])
+
+def search_seed_sample(
+        seed_fasta: str, seed_dmnd: str, seed_tsv: str, thresholds: List,
+        random_seed_number: int, diamond_args, sensitivity: str = None, threads: int = None
+    ) -> List[str]:
+    '''
+    Find singletons among the seed proteins within the length thresholds. Only a shuffled
+    sample large enough to satisfy --find is searched against the whole seed proteome,
+    with further rounds if the sample contains too few singletons.
+        Arguments:
+            seed_fasta: path to the proteome of the seed genome
+            seed_dmnd: path to the diamond database of the seed genome
+            seed_tsv: path to the results of the self-search
+            thresholds: list of thresholds from the parser
+                [args.find, args.minlength, args.maxlength,
+                args.presence, args.minloci, args.maxloci]
+            random_seed_number: random seed for the locus order, random if None
+            sensitivity: optional DIAMOND sensitivity flag (e.g. '--fast')
+            threads: the number of threads DIAMOND may use
+        Returns:
+            candidate_loci: the singletons in shuffled order
+    '''
+    loci_to_find, loci_min_length, loci_max_length, _, _, _ = thresholds
+    sequences = io.read_fasta(seed_fasta)
+    in_range = shuffle_loci(
+        [
+            locus for locus, sequence in sequences.items()
+            if loci_max_length > len(sequence) > loci_min_length
+        ],
+        random_seed_number
+        )
+    candidate_loci = []
+    searched = 0
+    sample = 0
+    while searched < len(in_range) and (loci_to_find < 0 or len(candidate_loci) < loci_to_find):
+        if loci_to_find < 0:
+            sample_size = len(in_range)
+        else:
+            sample_size = get_batch_size(searched, len(candidate_loci), loci_to_find)
+        sample_loci = in_range[searched:searched + sample_size]
+        sample_fasta = os.path.join(os.path.dirname(seed_tsv), f'seed_sample_{sample}.fasta')
+        sample_tsv = io.change_extension(seed_tsv, f'sample_{sample}.tsv')
+        io.write_fasta(sample_fasta, {locus: sequences[locus] for locus in sample_loci})
+        memory.call_with_retries(
+            diamond.run_diamond_search,
+            [sample_fasta, seed_dmnd, sample_tsv, diamond_args, sensitivity, None, None, threads],
+            diamond.reduce_search_memory
+            )
+        unique_loci = set(get_unique_hits_from_tsv(sample_tsv))
+        candidate_loci.extend(locus for locus in sample_loci if locus in unique_loci)
+        append_file(sample_tsv, seed_tsv)
+        io.remove_files([sample_fasta])
+        searched += len(sample_loci)
+        sample += 1
+        logging.info(
+            'Searched %s of %s seed proteins within the length thresholds; %s singletons found.',
+            searched, len(in_range), len(candidate_loci)
+            )
+    if loci_to_find >= 0:
+        candidate_loci = candidate_loci[:loci_to_find]
+    return candidate_loci
+
+def cluster_seed(seed_fasta: str, seed_tsv: str, diamond_args, threads: int = None) -> List[str]:
+    '''
+    Find singletons in the seed proteome with DIAMOND clustering instead of a self-search.
+    The clusters are also written as a self-search table, with a row for each pair of
+    proteins in the same cluster.
+        Arguments:
+            seed_fasta: path to the proteome of the seed genome
+            seed_tsv: path to the table of pairs
+            threads: the number of threads DIAMOND may use
+        Returns:
+            unique_loci: the proteins that are alone in their cluster
+    '''
+    clusters_path = io.change_extension(seed_tsv, 'clusters.tsv')
+    diamond.run_diamond_cluster(seed_fasta, clusters_path, diamond_args, threads)
+    clusters = {}
+    for representative, member, *_ in io.read_tsv(clusters_path):
+        clusters.setdefault(representative, set()).update([representative, member])
+    lines = []
+    for members in clusters.values():
+        for member in sorted(members):
+            lines.extend(f'{member}\t{other}' for other in sorted(members))
+    io.write_to_file(seed_tsv, lines)
+    return get_unique_hits_from_tsv(seed_tsv)
+
+def get_singletons_from_seed(
+        seed, output, thresholds, random_seed_number, diamond_args, sensitivity=None,
+        seed_search='blastp', threads=None
+    ):
     '''
     Use diamond to identify singletons in the seed genome.
         Arguments:
-            seed: path to the seed genbank file
+            seed: the id of the seed genome in the manifest
             output: path to the output directory
             thresholds: list of thresholds from the parser
                 [args.find, args.minlength, args.maxlength,
                 args.presence, args.minloci, args.maxloci]
+            sensitivity: optional DIAMOND sensitivity flag (e.g. '--fast')
+            seed_search: 'blastp' to search a sample of the seed against itself,
+                or 'cluster' to cluster the whole seed proteome
+            threads: the number of threads DIAMOND may use
         Returns:
             candidate_loci:
                 List of candidates selected from the seed genome
@@ -91,33 +324,24 @@ def get_singletons_from_seed(seed, output, thresholds, random_seed_number, diamo
     io.make_folder(os.path.join(output, 'tsv'))
     logging.info("Identifying singletons in seed genome...")
     seed_fasta, seed_dmnd, seed_tsv = get_seed_paths(seed, output)
-    seed_fasta_contents = io.read_file(seed_fasta)
-    diamond.run_diamond_search(seed_fasta, seed_dmnd, seed_tsv, diamond_args) ### add others here!
-    unique_loci = get_unique_hits_from_tsv(seed_tsv)
-    logging.info("Found %s loci in the seed genome!", str(len(unique_loci)))
-    if random_seed_number is None: #random, random if no random seed set
-        random.shuffle(unique_loci)
-    else: #use the random seed provided
-        random.Random(random_seed_number).shuffle(unique_loci)
-    loci = 0
-    loci_fasta = []
-    candidate_loci = []
-    loci_to_find, loci_min_length, loci_max_length, _, _, _ = thresholds
-    for locus in unique_loci:
-        if loci_to_find < 0 or loci < loci_to_find:
-            sequence = io.get_locus(seed_fasta_contents, locus)
-            if loci_max_length > len(sequence) > loci_min_length:
-                candidate_loci.append(locus)
-                loci_fasta.append(">" + locus)
-                loci_fasta.append(sequence)
-                loci += 1
-        else:
-            break
+    if seed_search == 'cluster':
+        unique_loci = cluster_seed(seed_fasta, seed_tsv, diamond_args, threads)
+        logging.info("Found %s loci in the seed genome!", str(len(unique_loci)))
+        candidate_loci, _ = select_candidates(
+            unique_loci, io.read_file(seed_fasta), thresholds, random_seed_number
+            )
+    else:
+        candidate_loci = search_seed_sample(
+            seed_fasta, seed_dmnd, seed_tsv, thresholds, random_seed_number, diamond_args,
+            sensitivity, threads
+            )
+    sequences = io.read_fasta(seed_fasta)
+    loci = len(candidate_loci)
     txt_path = os.path.join(output, 'tsv/candidate_loci.txt')
     fasta_path = os.path.join(output, 'tsv/candidate_loci.fasta')
     logging.info('%s singletons found in the seed genome!' % loci)
     io.write_to_file(txt_path, candidate_loci)
-    io.write_to_file(fasta_path, loci_fasta)
+    io.write_fasta(fasta_path, {locus: sequences[locus] for locus in candidate_loci})
     return candidate_loci
 
 def get_loci_from_file(file: str) -> List:
@@ -132,46 +356,332 @@ def get_loci_from_file(file: str) -> List:
     loci = [locus.strip() for locus in loci]
     return loci
 
-def search_candidates(output: str, cpus: int, diamond_args) -> None:
+def get_batch_size(searched: int, passed: int, maximum_loci: int) -> int:
+    '''
+    Choose how many more candidates to search to reach the maximum number of loci,
+    based on the proportion of the candidates searched so far that passed.
+        Arguments:
+            searched: the number of candidates searched so far
+            passed: the number of those candidates that passed the thresholds
+            maximum_loci: the number of loci wanted
+        Returns:
+            batch_size: the number of candidates in the next batch
+    '''
+    if searched == 0:
+        batch_size = maximum_loci * BATCH_MARGIN
+    elif passed == 0:
+        batch_size = searched
+    else:
+        batch_size = (maximum_loci - passed) * searched / passed * BATCH_MARGIN
+    return max(MIN_BATCH_SIZE, math.ceil(batch_size))
+
+def get_built_keys(output: str, genome_keys: List[str]) -> List[str]:
+    '''
+    Get the ids of the genomes with a diamond database (bad records may be skipped).
+        Arguments:
+            output: path to the output folder
+            genome_keys: the ids of the genomes
+        Returns:
+            keys: the ids of the genomes with a database
+    '''
+    return [
+        key for key in genome_keys
+        if io.file_exists(os.path.join(output, 'dmnd', key + '.dmnd'))
+        ]
+
+def search_database(
+        query: str, dmnd_database: str, tsv_name: str, diamond_args, sensitivity: str = None,
+        block_size: float = None, index_chunks: int = None
+    ) -> None:
+    '''
+    Search a fasta file against the diamond database of a genome, unless the genome was
+    skipped as a bad record and has no database.
+        Arguments:
+            query: path to the fasta file of candidates
+            dmnd_database: path to the database of the genome
+            tsv_name: path to the results
+            sensitivity: optional DIAMOND sensitivity flag (e.g. '--fast')
+            block_size: optional block size in billions of letters
+            index_chunks: optional number of index chunks
+        Returns:
+            None
+    '''
+    if io.file_exists(dmnd_database):
+        diamond.run_diamond_search(
+            query, dmnd_database, tsv_name, diamond_args, sensitivity, block_size, index_chunks
+            )
+
+def run_searches(
+        query: str, genome_keys: List[str], tsv_names: List[str], output: str, cpus: int,
+        diamond_args, sensitivity: str = None, memory_budget: int = None,
+        databases: QueuedDatabases = None
+    ) -> None:
+    '''
+    Search a fasta file against the diamond database of each genome.
+        Arguments:
+            query: path to the fasta file of candidates
+            genome_keys: the ids of the genomes with a diamond database
+            tsv_names: path to the results for each genome
+            output: path to the output folder
+            cpus: the number of cpus avaliable
+            sensitivity: optional DIAMOND sensitivity flag (e.g. '--fast')
+            memory_budget: optional memory available to the searches in bytes
+            databases: optional databases still being built, each search starts as soon
+                as the database of its genome is built
+        Returns:
+            None
+    '''
+    args_list = []
+    estimates = []
+    for genome_key, tsv_name in zip(genome_keys, tsv_names):
+        database = os.path.join(output, 'dmnd', genome_key + '.dmnd')
+        args_list.append([query, database, tsv_name, diamond_args, sensitivity, None, None])
+        if databases is None or (
+                databases.graph.is_finished(databases.tasks[genome_key])
+                and io.file_exists(database)
+            ):
+            estimates.append(diamond.estimate_search_memory(query, database))
+        else:
+            estimates.append(diamond.get_search_memory(
+                io.get_file_size(query) + databases.sizes[genome_key]
+                ))
+    if databases is None:
+        io.run_in_parallel(
+            search_database, args_list, cpus,
+            estimates, memory_budget, diamond.reduce_search_memory
+            )
+        return
+    graph = databases.graph
+    graph.wait([
+        graph.add(
+            search_database, args, [databases.tasks[genome_key]], estimate,
+            diamond.reduce_search_memory
+            )
+        for genome_key, args, estimate in zip(genome_keys, args_list, estimates)
+        ])
+
+def get_prescreen_genomes(
+        number_of_genomes: int, presence_threshold: float, random_seed_number: int = None
+    ) -> List[int]:
+    '''
+    Choose the genomes that candidates are searched against first. Candidates missing from
+    more genomes than --presence allows fail whatever their other hits, so the subset holds
+    that many genomes plus a margin in which to find them missing.
+        Arguments:
+            number_of_genomes: the number of genomes searched
+            presence_threshold: the percentage of genomes a locus needs to be present in
+            random_seed_number: random seed for the choice of genomes, random if None
+        Returns:
+            subset: the indices of the chosen genomes, or an empty list if a prescreen
+            would search every genome
+    '''
+    allowed_misses = 0
+    while allowed_misses < number_of_genomes and passes_thresholds(
+            number_of_genomes - allowed_misses - 1, True, number_of_genomes, presence_threshold
+        ):
+        allowed_misses += 1
+    size = allowed_misses + max(
+        MIN_PRESCREEN_GENOMES, math.ceil(PRESCREEN_FRACTION * number_of_genomes)
+        )
+    if size >= number_of_genomes:
+        return []
+    if random_seed_number is None:
+        return sorted(random.sample(range(number_of_genomes), size))
+    return sorted(random.Random(random_seed_number).sample(range(number_of_genomes), size))
+
+def search_batch(
+        batch_loci: List[str], candidates: Dict[str, str], query: str, genome_keys: List[str],
+        tsv_names: List[str], output: str, cpus: int, diamond_args, sensitivity: str = None,
+        memory_budget: int = None, presence_threshold: float = None, subset: List[int] = (),
+        databases: QueuedDatabases = None
+    ) -> List[str]:
+    '''
+    Search a batch of candidates against every genome. With a subset of genomes, the batch
+    is searched against the subset first, and only the candidates that could still pass the
+    thresholds are searched against the other genomes.
+        Arguments:
+            batch_loci: the candidates in the batch
+            candidates: the sequences of the candidates
+            query: path to write the fasta file of the batch to
+            genome_keys: the ids of the genomes with a diamond database
+            tsv_names: path to the results of the batch for each genome
+            output: path to the output folder
+            cpus: the number of cpus avaliable
+            sensitivity: optional DIAMOND sensitivity flag (e.g. '--fast')
+            memory_budget: optional memory available to the searches in bytes
+            presence_threshold: the percentage of genomes a locus needs to be present in
+            subset: optional indices of the genomes to search first
+            databases: optional databases still being built, without a subset
+        Returns:
+            searched_loci: the candidates that were searched against every genome
+    '''
+    io.write_fasta(query, {locus: candidates[locus] for locus in batch_loci})
+    if not subset:
+        run_searches(
+            query, genome_keys, tsv_names, output, cpus, diamond_args, sensitivity,
+            memory_budget, databases
+            )
+        io.remove_files([query])
+        return batch_loci
+    others = [index for index in range(len(genome_keys)) if index not in subset]
+    run_searches(
+        query, [genome_keys[index] for index in subset], [tsv_names[index] for index in subset],
+        output, cpus, diamond_args, sensitivity, memory_budget
+        )
+    io.remove_files([query])
+    hit_counts = count_hits([tsv_names[index] for index in subset])
+    searched_loci = []
+    for locus in batch_loci:
+        presence, unique, _ = score_locus(locus, hit_counts)
+        # at best the locus is present and unique in every genome not searched yet
+        if passes_thresholds(presence + len(others), unique, len(genome_keys), presence_threshold):
+            searched_loci.append(locus)
+    logging.info(
+        '%s of %s candidates passed the prescreen against %s genomes.',
+        len(searched_loci), len(batch_loci), len(subset)
+        )
+    if searched_loci:
+        io.write_fasta(query, {locus: candidates[locus] for locus in searched_loci})
+        run_searches(
+            query, [genome_keys[index] for index in others], [tsv_names[index] for index in others],
+            output, cpus, diamond_args, sensitivity, memory_budget
+            )
+        io.remove_files([query])
+    return searched_loci
+
+def search_candidates(
+        output: str, genome_keys: List[str], cpus: int, diamond_args, sensitivity: str = None,
+        memory_budget: int = None, presence_threshold: float = None, maximum_loci: int = None,
+        prescreen: bool = False, random_seed_number: int = None,
+        databases: QueuedDatabases = None
+    ) -> None:
     '''
     Uses diamond blastP to search for the candidates in all other genomes.
+    If a maximum number of loci is given, the candidates are searched in batches in their
+    shuffled order and the search stops once enough of them pass the thresholds. Thresholding
+    takes the first passing loci in the same order, so the result is the same as searching
+    every candidate. The search only stops between batches: a locus is scored once it has
+    been searched against every genome, so all the searches of a batch run to the end, even
+    when the batch holds more passing loci than are needed. With a prescreen, each batch is
+    first searched against a random subset of the genomes, and candidates that already fail
+    there are written to tsv/prescreen_failed.txt instead of being searched against the
+    other genomes. Databases that are still being built are searched as soon as they are
+    built, except with a prescreen, which is chosen among the genomes with a database.
         Arguments:
             output: path to the output folder
+            genome_keys: the ids of the genomes with a diamond database, or of every genome
+                if the databases are still being built
             cpus: the number of cpus avaliable
             diamond_location: path to diamond install
+            sensitivity: optional DIAMOND sensitivity flag (e.g. '--fast')
+            memory_budget: optional memory available to the searches in bytes
+            presence_threshold: the percentage of genomes a locus needs to be present in
+            maximum_loci: the number of passing loci after which to stop searching
+            prescreen: search a subset of the genomes first
+            random_seed_number: random seed for the choice of genomes, random if None
+            databases: optional databases still being built
         Returns:
             None
     '''
+    if databases is not None and prescreen and presence_threshold is not None:
+        databases.graph.wait(databases.tasks.values())
+        genome_keys = get_built_keys(output, genome_keys)
+        databases = None
     tsvs_folder = os.path.join(output, 'tsvs')
     io.make_folder(tsvs_folder)
-    diamond_databases = glob.glob(os.path.join(output, 'dmnd/*.dmnd'))
-    args_list = []
-    for database in diamond_databases:
-        tsv_name = io.change_extension(os.path.basename(database), 'tsv')
-        tsv_name = os.path.join(tsvs_folder, tsv_name)
-        candidate_loci_path = os.path.join(output, 'tsv/candidate_loci.fasta')
-        args_item = [candidate_loci_path, database, tsv_name, diamond_args]
-        args_list.append(args_item)
-    io.run_in_parallel(diamond.run_diamond_search, args_list, cpus)
+    candidate_loci_path = os.path.join(output, 'tsv/candidate_loci.fasta')
+    tsv_names = [os.path.join(tsvs_folder, genome_key + '.tsv') for genome_key in genome_keys]
+    subset = []
+    if prescreen and presence_threshold is not None:
+        subset = get_prescreen_genomes(len(genome_keys), presence_threshold, random_seed_number)
+        if not subset:
+            logging.info('The prescreen would search every genome and is skipped.')
+    if (maximum_loci is None or presence_threshold is None) and not subset:
+        run_searches(
+            candidate_loci_path, genome_keys, tsv_names, output, cpus, diamond_args,
+            sensitivity, memory_budget, databases
+            )
+        return
+    candidates = io.read_fasta(candidate_loci_path)
+    loci = list(candidates)
+    searched = 0
+    passed = 0
+    batch = 0
+    failed = []
+    while searched < len(loci) and (maximum_loci is None or passed < maximum_loci):
+        if maximum_loci is None:
+            batch_loci = loci
+        else:
+            batch_loci = loci[searched:searched + get_batch_size(searched, passed, maximum_loci)]
+        batch_path = os.path.join(output, 'tsv', f'candidate_batch_{batch}.fasta')
+        batch_tsvs = [io.change_extension(tsv_name, f'batch_{batch}.tsv') for tsv_name in tsv_names]
+        searched_loci = search_batch(
+            batch_loci, candidates, batch_path, genome_keys, batch_tsvs, output, cpus,
+            diamond_args, sensitivity, memory_budget, presence_threshold, subset, databases
+            )
+        if databases is not None:
+            # every database has been built once the first batch was searched
+            built = set(get_built_keys(output, genome_keys))
+            tsv_names, batch_tsvs = (
+                [name for key, name in zip(genome_keys, names) if key in built]
+                for names in [tsv_names, batch_tsvs]
+                )
+            genome_keys = [key for key in genome_keys if key in built]
+            databases = None
+        searched_set = set(searched_loci)
+        failed.extend(locus for locus in batch_loci if locus not in searched_set)
+        if searched_loci:
+            hit_counts = count_hits(batch_tsvs)
+        for locus in searched_loci:
+            presence, unique, _ = score_locus(locus, hit_counts)
+            if passes_thresholds(presence, unique, len(genome_keys), presence_threshold):
+                passed += 1
+        # the results of every batch are kept in one file per genome
+        for batch_tsv, tsv_name in zip(batch_tsvs, tsv_names):
+            if io.file_exists(batch_tsv):
+                append_file(batch_tsv, tsv_name)
+            else:
+                # genomes outside the prescreen are not searched when every candidate failed
+                io.write_to_file(tsv_name, [])
+        searched += len(batch_loci)
+        batch += 1
+        logging.info(
+            'Searched %s of %s candidates; %s passed the thresholds.',
+            searched, len(loci), passed
+            )
+    if searched < len(loci):
+        logging.info(
+            'Enough loci were found. Skipped searching the remaining %s candidates.',
+            len(loci) - searched
+            )
+    if subset:
+        io.write_to_file(os.path.join(output, 'tsv', PRESCREEN_FAILED), failed)
+
+def count_hits(files: List) -> List[Counter]:
+    '''
+    Counts the hits of each query in blastP results.
+        Arguments:
+            files:
+                list of paths to blastP results
+        Returns:
+            hit_counts: a Counter of query names for each file
+    '''
+    return [Counter(line[0] for line in io.read_tsv(file)) for file in files]
 
-def score_locus(locus: str, files: List) -> Tuple[int, bool, List]:
+def score_locus(locus: str, hit_counts: List[Counter]) -> Tuple[int, bool, List]:
     '''
     Scores the presence and uniqueness of a locus.
         Arguments:
             locus:
                 the name of the locus being screened
-            files:
-                list of paths to blastP results
+            hit_counts:
+                a Counter of query names for each genome from count_hits
     '''
     pa_data = []
     presence_counter = 0
     unique_flag = True
-    for file in files:
-        counter = 0
-        lines = io.read_file(file)
-        for line in lines:
-            if locus in line:
-                counter += 1
+    for hits in hit_counts:
+        counter = hits[locus]
         if counter > 0:
             presence_counter += 1
         if counter > 1:
@@ -179,15 +689,34 @@ def score_locus(locus: str, files: List) -> Tuple[int, bool, List]:
         pa_data.append(counter)
     return presence_counter, unique_flag, pa_data
 
-def process_final_loci(final_loci: List, minimum_loci: int, output: str) -> None:
+def passes_thresholds(
+        presence: int, unique: bool, number_of_genomes: int, presence_threshold: float
+    ) -> bool:
+    '''
+    Decide whether a scored locus can be used for the analysis.
+        Arguments:
+            presence: the number of genomes the locus was found in
+            unique: False if the locus had more than one hit in any genome
+            number_of_genomes: the number of genomes searched
+            presence_threshold: the percentage of genomes the locus needs to be present in
+        Returns:
+            True if the locus is present in enough genomes and unique in all of them
+    '''
+    presence_percent = (presence / number_of_genomes) * 100
+    return presence_percent >= presence_threshold and unique
+
+def process_final_loci(
+        final_loci: List, minimum_loci: int, output: str, locus_names: Dict[str, str]
+    ) -> None:
     '''
     Assess that the number of loci meets the user defined threshold to continue analysis
     and write the list of loci to file
         Arguments:
             output: path to the output directory
-            final_loci: list of loci names to be used for the alignment
+            final_loci: list of loci ids to be used for the alignment
             minimum_loci:
                 the minimum number of loci that need to be selected to continue the analysis
+            locus_names: the original names of the loci in the seed genome
         Returns:
             None
     '''
@@ -197,10 +726,11 @@ def process_final_loci(final_loci: List, minimum_loci: int, output: str) -> None
         logging.warning("The number of loci below defined threshold. Exiting...")
         raise InsufficientLociError('The number of loci selected are below the defined threshold.')
     filename = os.path.join(output, 'final_loci.txt')
-    io.write_to_file(filename, final_loci)
+    io.write_to_file(filename, [locus_names[locus] for locus in final_loci])
 
 def do_thresholding(
-        target_loci: List, presence_threshold: float, maximum_loci: int, output: str
+        target_loci: List, presence_threshold: float, maximum_loci: int, output: str,
+        manifest: Manifest, locus_names: Dict[str, str]
     ) -> List:
     '''
     Apply thresholding to finalise the loci to use for analysis.
@@ -209,13 +739,17 @@ def do_thresholding(
         target_loci: list of loci from the seed the genome to compare against other genomes
         presence_threshold:
             the percentage of genomes the loci needs to be present in to be selected for analysis
+        manifest: the manifest of the input genomes
+        locus_names: the original names of the loci in the seed genome
     Returns:
         None
     '''
     final_loci = []
     pa_table = []
-    files = glob.glob(os.path.join(output, 'tsvs/*.tsv'))
-    pa_table.append([os.path.splitext(os.path.basename(file))[0] for file in files])
+    genome_keys = manifest.get_extracted_keys(output)
+    files = [os.path.join(output, 'tsvs', genome_key + '.tsv') for genome_key in genome_keys]
+    hit_counts = count_hits(files)
+    pa_table.append([manifest.by_key[genome_key].name for genome_key in genome_keys])
     thresholding_data = ["locus;" + "presence;" + "unique"]
     if len(target_loci) < maximum_loci:
         maximum_loci = len(target_loci)
@@ -223,13 +757,13 @@ def do_thresholding(
         logging.debug(
             "final = %s, max = %s, targets = %s",
             len(final_loci), maximum_loci, len(target_loci))
-        presence, unique, pa_data = score_locus(locus, files)
+        presence, unique, pa_data = score_locus(locus, hit_counts)
         pa_table.append(pa_data)
         number_of_loci = len(files)
         presence_percent = (presence / number_of_loci) * 100
-        thresholding_string = str(locus) + ";" + str(presence_percent) + ";" + str(unique)
+        thresholding_string = locus_names[locus] + ";" + str(presence_percent) + ";" + str(unique)
         thresholding_data.append(thresholding_string)
-        if presence_percent >= presence_threshold and unique:
+        if passes_thresholds(presence, unique, number_of_loci, presence_threshold):
             final_loci.append(locus)
         if len(final_loci) >= maximum_loci:
             logging.info('The maximum number of loci was reached.')
@@ -238,11 +772,14 @@ def do_thresholding(
         logging.warning('Number of loci selected is lower than the maximum defined.')
     filename = os.path.join(output, 'thresholding_data')
     io.write_to_file(filename, thresholding_data)
-    write_pa_table(pa_table, target_loci, output)
+    write_pa_table(pa_table, [locus_names[locus] for locus in target_loci], output)
     return final_loci
 
 
-def threshold_loci(target_loci: List, thresholds: List, output: str) -> List:
+def threshold_loci(
+        target_loci: List, thresholds: List, output: str, manifest: Manifest,
+        locus_names: Dict[str, str]
+    ) -> List:
     '''
     Score loci for singleton status and presence in dataset
         Arguments:
@@ -251,6 +788,8 @@ def threshold_loci(target_loci: List, thresholds: List, output: str) -> List:
                 [args.find, args.minlength, args.maxlength,
                 args.presence, args.minloci, args.maxloci]
             output: path to the output directory
+            manifest: the manifest of the input genomes
+            locus_names: the original names of the loci in the seed genome
         Returns:
             final_loci: list of loci names to be used in the downstream analysis
     '''
@@ -261,8 +800,10 @@ def threshold_loci(target_loci: List, thresholds: List, output: str) -> List:
         raise FileAlreadyExistsError(
             'File already exists. Please remove and restart from checkpoint.', filename
             )
-    final_loci = do_thresholding(target_loci, presence_threshold, maximum_loci, output)
-    process_final_loci(final_loci, minimum_loci, output)
+    final_loci = do_thresholding(
+        target_loci, presence_threshold, maximum_loci, output, manifest, locus_names
+        )
+    process_final_loci(final_loci, minimum_loci, output, locus_names)
     return final_loci
 
 def write_pa_table(pa_table: List, loci: List, output: str) -> None:
@@ -288,32 +829,56 @@ def write_pa_table(pa_table: List, loci: List, output: str) -> None:
     io.write_to_file(filename, new_table)
 
 def get_target_proteins(
-        checkpoint: Checkpoint, output: str, seed: str, thresholds: List,
-        cpus: int, random_seed_number: int, diamond_args: Tuple[str,float,float,float]
+        checkpoint: Checkpoint, output: str, seed: str, manifest: Manifest, thresholds: List,
+        cpus: int, random_seed_number: int, diamond_args: Tuple[str,float,float,float],
+        preset: Preset = PRESETS[DEFAULT_PRESET], memory_budget: int = None,
+        seed_search: str = 'blastp', prescreen: bool = False,
+        databases: QueuedDatabases = None
     ) -> None:
     '''
-    The main routine for screen.py
+    The main routine for screen.py. When the databases are still being built, the seed is
+    searched once its own database is built and each genome as soon as its database is
+    built. The checkpoints of extraction are logged once every database has been built.
         Arguments:
             checkpoint: the checkpoint provided by the user
             output: path of the output directory
             seed: the name of the file corresponding to the seed genome
+            manifest: the manifest of the input genomes
             thresholds: list of arguments containing threholding information:
                 [args.find, args.minlength, args.maxlength,
                 args.presence, args.minloci, args.maxloci]
             cpus: number of cpus to run diamond
             random_seed_number: random seed from locus order
             diamond_location: location of the diamond install
+            preset: the speed preset for DIAMOND searches
+            memory_budget: optional memory available to DIAMOND in bytes
+            seed_search: how singletons are found in the seed, 'blastp' or 'cluster'
+            prescreen: search a subset of the genomes before the others
+            databases: optional databases queued by extract.extract_data
         Returns:
             None
     '''
     candidate_loci = None
     final_loci = None
     logging.debug('The output directory is: %s', output)
+    seed = manifest.get_genome(seed).key
     if checkpoint < Checkpoint.SINGLETONS_IDENTIFIED:
-        candidate_loci = get_singletons_from_seed(
-            seed, output, thresholds, random_seed_number, diamond_args
-            )
-    logging.info("CHECKPOINT: SINGLETONS_IDENTIFIED")
+        seed_args = [
+            seed, output, thresholds, random_seed_number, diamond_args,
+            preset.diamond_sensitivity, seed_search
+            ]
+        if databases is None:
+            # the self-search runs on its own, on as many cpus as the run can take
+            with cpupool.take_tokens(cpus) as threads:
+                candidate_loci = get_singletons_from_seed(*seed_args, threads)
+        else:
+            # the other genomes are extracted before and after it
+            graph = databases.graph
+            candidate_loci = graph.wait([graph.add(
+                get_singletons_from_seed, seed_args, [databases.tasks[seed]], exclusive=True
+                )])[0]
+    if databases is None:
+        logging.info("CHECKPOINT: SINGLETONS_IDENTIFIED")
     #candidate loci will not exist if restarted from a checkpoint
     if not candidate_loci:
         try:
@@ -327,10 +892,26 @@ def get_target_proteins(
     #continue sequential analysis
     if checkpoint < Checkpoint.SINGLETONS_SEARCHED:
         logging.info("Screening candidate loci against other genomes...")
-        search_candidates(output, cpus, diamond_args)
+        _, _, _, presence_threshold, _, maximum_loci = thresholds
+        search_candidates(
+            output, manifest.keys if databases else manifest.get_extracted_keys(output), cpus,
+            diamond_args, preset.diamond_sensitivity, memory_budget, presence_threshold,
+            maximum_loci, prescreen, random_seed_number, databases
+            )
+    if databases is not None:
+        # the searches waited for every database
+        databases.graph.wait(databases.tasks.values())
+        logging.info("CHECKPOINT:FASTA_EXTRACTED")
+        logging.info("CHECKPOINT:DIAMOND_BUILT")
+        logging.info("CHECKPOINT: SINGLETONS_IDENTIFIED")
     logging.info("CHECKPOINT: SINGLETONS_SEARCHED")
     if checkpoint < Checkpoint.SINGLETONS_THRESHOLDED:
         logging.info("Thresholding candidate loci...")
-        final_loci = threshold_loci(candidate_loci, thresholds, output)
+        failed_path = os.path.join(output, 'tsv', PRESCREEN_FAILED)
+        if io.file_exists(failed_path):
+            failed = set(get_loci_from_file(failed_path))
+            candidate_loci = [locus for locus in candidate_loci if locus not in failed]
+        locus_names = manifest.read_protein_names(output, seed)
+        final_loci = threshold_loci(candidate_loci, thresholds, output, manifest, locus_names)
     logging.info("CHECKPOINT: SINGLETONS_THRESHOLDED")
     return final_loci
@@ -0,0 +1,357 @@
+'''
+A long-running getphylo service that keeps a reference collection warm.
+
+The reference proteomes, their DIAMOND databases and the seed self-search are
+prepared once at startup. Jobs submitted over HTTP (on a TCP port or a unix
+socket) only extract and search their own genomes. A bounded number of jobs run at
+the same time, and their tasks share one pool of processes that is started with the
+server. Their genbank files must be in the input root of the server. Finished jobs
+are forgotten after a while.
+
+Endpoints:
+    POST /jobs       {"gbks": ["/path/a.gbk", ...], "options": {"presence": 90, ...}}
+    GET  /jobs       status of all jobs
+    GET  /jobs/<id>  status of one job
+    GET  /status     the reference collection and the number of jobs
+
+Classes:
+    JobManager
+    ReferenceCollection
+
+Functions:
+    resolve_inputs(gbks: List[str], input_root: str) -> List[str]
+    make_handler(manager: JobManager, reference: ReferenceCollection) -> type
+    serve(args) -> None
+'''
+import glob
+import json
+import logging
+import os
+import socketserver
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List
+
+from getphylo.api import Pipeline
+from getphylo.utils import io
+from getphylo.utils.errors import BadInputError
+
+# seconds a finished job is kept
+DEFAULT_KEEP = 3600.0
+SCREEN_OPTIONS = [
+    'seed', 'find', 'minlength', 'maxlength', 'presence', 'minloci', 'maxloci',
+    'random_seed_number',
+]
+TREE_METHODS = ['fasttree', 'iqtree', 'nj']
+
+class JobManager:
+    '''Run submitted jobs on a bounded pool and keep track of their status'''
+    def __init__(
+            self, run_job: Callable[[str, Dict], Dict], jobs: int = 1, keep: float = DEFAULT_KEEP
+        ):
+        '''
+        Arguments:
+            run_job: called with the job id and request, returns a dictionary of results
+            jobs: the number of jobs to run at the same time
+            keep: seconds the status of a finished job is kept
+        '''
+        self.run_job = run_job
+        self.keep = keep
+        self.pool = ThreadPoolExecutor(max_workers=jobs)
+        self.lock = threading.Lock()
+        self.jobs = {}
+
+    def expire(self) -> None:
+        '''Forget the jobs that finished longer ago than the time they are kept'''
+        cutoff = time.time() - self.keep
+        with self.lock:
+            for job_id, job in list(self.jobs.items()):
+                if job.get('finished', cutoff) < cutoff:
+                    del self.jobs[job_id]
+
+    def update(self, job_id: str, **fields) -> None:
+        '''Update the status of a job'''
+        with self.lock:
+            self.jobs[job_id].update(fields)
+
+    def submit(self, request: Dict) -> str:
+        '''
+        Queue a new job.
+            Arguments:
+                request: the job request
+            Returns:
+                job_id: the id of the new job
+        '''
+        self.expire()
+        job_id = uuid.uuid4().hex[:12]
+        with self.lock:
+            self.jobs[job_id] = {'id': job_id, 'state': 'queued', 'submitted': time.time()}
+        self.pool.submit(self.execute, job_id, request)
+        return job_id
+
+    def execute(self, job_id: str, request: Dict) -> None:
+        '''
+        Run a job and record the outcome.
+            Arguments:
+                job_id: the id of the job
+                request: the job request
+            Returns:
+                None
+        '''
+        self.update(job_id, state='running', started=time.time())
+        try:
+            result = self.run_job(job_id, request)
+        except Exception as error:
+            logging.error('Job %s failed: %s', job_id, error)
+            self.update(job_id, state='failed', finished=time.time(), error=str(error))
+            return
+        self.update(job_id, state='done', finished=time.time(), result=result)
+
+    def get(self, job_id: str) -> Dict:
+        '''Return a copy of the status of a job, or None if it does not exist'''
+        self.expire()
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return None if job is None else dict(job)
+
+    def list(self) -> List[Dict]:
+        '''Return a copy of the status of all jobs'''
+        self.expire()
+        with self.lock:
+            return [dict(job) for job in self.jobs.values()]
+
+    def shutdown(self) -> None:
+        '''Wait for running jobs and stop the pool'''
+        self.pool.shutdown(wait=True)
+
+class ReferenceCollection:
+    '''Reference proteomes and DIAMOND databases shared by all jobs'''
+    def __init__(self, pipeline: Pipeline, gbks: List[str], folder: str):
+        '''
+        Arguments:
+            pipeline: the pipeline used to run the jobs
+            gbks: list of paths to the reference genbank files
+            folder: folder to keep the reference databases in between restarts
+        '''
+        self.pipeline = pipeline
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+        logging.info('Extracting %s reference genomes...', len(gbks))
+        self.proteomes = pipeline.extract(gbks)
+        self.databases = {}
+        for filename in gbks:
+            taxon = os.path.splitext(os.path.basename(filename))[0]
+            if taxon not in self.proteomes:
+                continue
+            prefix = os.path.join(folder, taxon)
+            dmnd = prefix + '.dmnd'
+            if os.path.exists(dmnd) and os.path.getmtime(dmnd) < os.path.getmtime(filename):
+                os.remove(dmnd)
+            self.databases[taxon] = prefix
+        logging.info('Building reference databases...')
+        pipeline.build_databases(self.proteomes, self.databases)
+        self.seed_hits = {}
+        self.lock = threading.Lock()
+
+    def get_seed_hits(self, seed: str) -> List[List[str]]:
+        '''
+        Return the self-search of a reference seed, running it the first time it is used.
+            Arguments:
+                seed: the name of the reference taxon
+            Returns:
+                seed_hits: rows of the DIAMOND result table
+        '''
+        with self.lock:
+            if seed not in self.seed_hits:
+                with self.pipeline.temporary_folder() as folder:
+                    self.seed_hits[seed] = self.pipeline.search(
+                        os.path.join(folder, 'seed'), self.proteomes[seed],
+                        {seed: self.proteomes[seed]}, self.databases
+                        )[seed]
+            return self.seed_hits[seed]
+
+    def run_job(self, job_id: str, request: Dict, output: str, input_root: str) -> Dict:
+        '''
+        Place the genomes of a job in a tree with the reference collection.
+            Arguments:
+                job_id: the id of the job
+                request: the job request with 'gbks', and optionally 'options' and 'method'
+                output: folder for the output of all jobs
+                input_root: folder the genbank files of the job must be in
+            Returns:
+                result: paths to the outputs and the number of loci
+        '''
+        gbks = resolve_inputs(request.get('gbks', []), input_root)
+        options = request.get('options', {})
+        method = request.get('method', 'fasttree')
+        unknown = set(options) - set(SCREEN_OPTIONS)
+        if unknown:
+            raise BadInputError(f'Unknown options: {", ".join(sorted(unknown))}.')
+        if method not in TREE_METHODS:
+            raise BadInputError(f'{method} is not a phylogenetic tool.')
+        missing = [filename for filename in gbks if not os.path.isfile(filename)]
+        if missing:
+            raise BadInputError(f'Input files not found: {", ".join(missing)}.')
+        proteomes = self.pipeline.extract(gbks)
+        clashes = set(proteomes) & set(self.proteomes)
+        if clashes:
+            raise BadInputError(
+                f'Genomes share a name with the reference: {", ".join(sorted(clashes))}.'
+                )
+        proteomes.update(self.proteomes)
+        options = dict(options)
+        options.setdefault('seed', next(iter(self.proteomes)))
+        seed_hits = None
+        if options['seed'] in self.proteomes:
+            seed_hits = self.get_seed_hits(options['seed'])
+        screen_result = self.pipeline.screen(
+            proteomes, databases=self.databases, seed_hits=seed_hits, **options
+            )
+        alignments = self.pipeline.align(proteomes, screen_result)
+        combined, partition_lines = self.pipeline.concatenate(alignments)
+        newick = self.pipeline.build_tree(alignments, method, (combined, partition_lines))
+        job_folder = os.path.join(output, job_id)
+        io.make_folder(job_folder)
+        io.write_to_file(os.path.join(job_folder, 'final_loci.txt'), screen_result.loci)
+        io.write_to_file(os.path.join(job_folder, 'partition.txt'), partition_lines)
+        io.write_fasta(os.path.join(job_folder, 'combined_alignment.fasta'), combined)
+        tree_path = os.path.join(job_folder, 'combined_alignment.tree')
+        io.write_to_file(tree_path, [newick])
+        return {'output': job_folder, 'tree': tree_path, 'loci': len(screen_result.loci)}
+
+def resolve_inputs(gbks: List[str], input_root: str) -> List[str]:
+    '''
+    Resolve the genbank files of a job against the input root of the server.
+        Arguments:
+            gbks: paths to the genbank files, absolute or relative to the input root
+            input_root: folder the genbank files must be in
+        Returns:
+            paths: the absolute paths to the genbank files
+    '''
+    root = os.path.realpath(input_root)
+    paths = [os.path.realpath(os.path.join(root, filename)) for filename in gbks]
+    outside = [
+        filename for filename, path in zip(gbks, paths)
+        if os.path.commonpath([root, path]) != root
+        ]
+    if outside:
+        raise BadInputError(f'Input files outside the input root: {", ".join(outside)}.')
+    return paths
+
+def make_handler(manager: JobManager, reference: ReferenceCollection) -> type:
+    '''
+    Create a request handler class bound to a job manager.
+        Arguments:
+            manager: the job manager
+            reference: the reference collection
+        Returns:
+            Handler: the request handler class
+    '''
+    class Handler(BaseHTTPRequestHandler):
+        '''Handle job submissions and status requests'''
+        def send_json(self, status: int, data) -> None:
+            '''Send a json response'''
+            body = json.dumps(data).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            '''Return the status of the server or of jobs'''
+            parts = self.path.strip('/').split('/')
+            if parts == ['status']:
+                self.send_json(200, {
+                    'reference': sorted(reference.proteomes),
+                    'jobs': len(manager.list())
+                    })
+            elif parts == ['jobs']:
+                self.send_json(200, manager.list())
+            elif len(parts) == 2 and parts[0] == 'jobs' and manager.get(parts[1]):
+                self.send_json(200, manager.get(parts[1]))
+            else:
+                self.send_json(404, {'error': 'not found'})
+
+        def do_POST(self):
+            '''Submit a job'''
+            if self.path.strip('/') != 'jobs':
+                self.send_json(404, {'error': 'not found'})
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                request = json.loads(self.rfile.read(length) or b'{}')
+                if not isinstance(request.get('gbks'), list) or not request['gbks']:
+                    raise ValueError('a list of genbank files is required in "gbks"')
+            except ValueError as error:
+                self.send_json(400, {'error': str(error)})
+                return
+            self.send_json(202, {'id': manager.submit(request)})
+
+        def log_message(self, format, *args):
+            logging.debug(format, *args)
+
+    return Handler
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    '''HTTP server listening on a unix socket'''
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects a (host, port) client address
+        return request, ('unix', 0)
+
+def serve(args) -> None:
+    '''
+    Start the getphylo service.
+        Arguments:
+            args: the arguments from parser.parse_serve_args
+        Returns:
+            None
+    '''
+    gbks = sorted(glob.glob(args.gbks))
+    if not gbks:
+        raise BadInputError(f'No reference files found in {args.gbks}.')
+    input_root = os.path.abspath(args.input_root)
+    if not os.path.isdir(input_root):
+        raise BadInputError(f'The input root {args.input_root} is not a folder.')
+    output = os.path.abspath(args.output)
+    jobs_folder = os.path.join(output, 'jobs')
+    os.makedirs(jobs_folder, exist_ok=True)
+    # all jobs share the pool of the pipeline, which is started here before any other
+    # threads run, so its processes are forked once and stay warm
+    pipeline = Pipeline(
+        cpus=args.cpus, preset=args.preset, tag_label=args.tag,
+        diamond_location=args.diamond, muscle_location=args.muscle,
+        fasttree_location=args.fasttree, iqtree_location=args.iqtree,
+        workdir=output
+        )
+    pipeline.get_pool()
+    reference = ReferenceCollection(pipeline, gbks, os.path.join(output, 'reference'))
+    manager = JobManager(
+        lambda job_id, request: reference.run_job(job_id, request, jobs_folder, input_root),
+        args.jobs, args.keep_jobs
+        )
+    handler = make_handler(manager, reference)
+    if args.socket is not None:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = UnixHTTPServer(args.socket, handler)
+        logging.info('Listening on %s', args.socket)
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), handler)
+        logging.info('Listening on http://%s:%s', args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info('Shutting down...')
+    finally:
+        server.server_close()
+        manager.shutdown()
+        pipeline.close()
+        if args.socket is not None and os.path.exists(args.socket):
+            os.remove(args.socket)
@@ -2,53 +2,307 @@
 Build trees from a directory containing .fasta alignments
 
 Functions:
-    build_all_trees(files: List, cpus: int, method: str, output: str) -> None
-    make_trees(output: str, build_all: bool, method: str, cpus: int) -> None
+    build_nj_tree(filename: str, outfile: str, correction: str = 'kimura', cpus: int = 1) -> None
+    build_all_trees(
+        files: List, cpus: int, method: str, tree_directory: str, output: str,
+        tree_builder: str, preset: Preset, memory_budget: int = None,
+        correction: str = 'kimura', models: Dict[str, str] = None
+    ) -> None
+    prepare_previous_tree(
+        previous_tree: str, alignment_path: str, tree_directory: str, constrain: bool
+    ) -> str
+    report_tree_update(previous_tree: str, new_tree: str, report_path: str) -> None
+    get_alignment_hash(filename: str) -> str
+    read_model_cache(model_cache: str) -> Dict[str, str]
+    read_partitions(partition_path: str) -> List[List]
+    select_locus_models(
+        output: str, partition_path: str, cpus: int, iqtree_location: str, model_cache: str,
+        memory_budget: int = None
+    ) -> Dict[str, str]
+    make_trees(
+        output: str, build_all: bool, method: str, cpus: int, tree_builder: str, preset: Preset,
+        memory_budget: int = None, manifest: Manifest = None, previous_tree: str = None,
+        constrain: bool = False, correction: str = 'kimura', model_cache: str = None
+    ) -> None
 '''
+import hashlib
 import os
-import glob
 import logging
-from typing import List
+from typing import Dict, List
 
-from getphylo.utils import io
+from getphylo.align import format_partition_data
+from getphylo.utils import cpupool, io, memory, phylo
 from getphylo.ext import fasttree, iqtree
 from getphylo.utils.errors import GetphyloError
+from getphylo.utils.manifest import Manifest
+from getphylo.utils.presets import DEFAULT_PRESET, PRESETS, Preset
+
+MODEL_CACHE_NAME = 'locus_models.tsv'
+
+def build_nj_tree(
+    filename: str, outfile: str, correction: str = 'kimura', cpus: int = 1
+    ) -> None:
+    '''
+    Build a neighbour joining tree from an alignment without an external tool.
+        Arguments:
+            filename: path to the alignment
+            outfile: path to the new tree
+            correction: 'poisson', 'kimura' or 'none' for p-distances
+            cpus: number of threads used to calculate the distances
+        Returns:
+            None
+    '''
+    names, distances = phylo.get_distance_matrix(io.read_fasta(filename), correction, cpus)
+    phylo.write_tree(phylo.neighbour_joining(names, distances), outfile)
 
 def build_all_trees(
-    files: List, cpus: int, method: str, tree_directory: str, output: str, tree_builder:str
+    files: List, cpus: int, method: str, tree_directory: str, output: str, tree_builder:str,
+    preset: Preset = PRESETS[DEFAULT_PRESET], memory_budget: int = None,
+    correction: str = 'kimura', models: Dict[str, str] = None
     ) -> None:
     '''
     builds all trees in from a list of files
+    A locus whose tree cannot be built is skipped.
         Arguments:
             files: list of alignment files to be processed
             cpus: number of cpus for parallelisation
             method: pyhlogenetic method (e.g. fasttree)
+            preset: the speed preset for the tree builder
+            memory_budget: optional memory available to IQ-TREE in bytes
+            correction: the distance correction for neighbour joining
+            models: optional substitution model of each locus from select_locus_models;
+                IQ-TREE then uses the model of each locus and the models in the partition
+                file for the combined alignment
         Returns:
             None 
     '''
     args_list = []
-    if method == 'fasttree':
+    if method == 'nj':
         for filename in files:
             outfile = os.path.join(
                 tree_directory, os.path.basename(io.change_extension(filename, "tree"))
                 )
-            args_list.append([filename, outfile, tree_builder])
-        io.run_in_parallel(fasttree.run_fasttree, args_list, cpus)
-    elif method == 'iqtree':
-        partition = os.path.join(output, 'partition.txt')
+            args_list.append([filename, outfile, correction])
+        io.run_in_parallel(build_nj_tree, args_list, cpus, tolerate_failures=True)
+    elif method == 'fasttree':
         for filename in files:
             outfile = os.path.join(
-                tree_directory, os.path.basename(os.path.splitext(filename)[0])
+                tree_directory, os.path.basename(io.change_extension(filename, "tree"))
                 )
-            args_list.append([filename, outfile, partition, tree_builder])
-        io.run_in_parallel(iqtree.run_iqtree, args_list, cpus)
+            args_list.append([filename, outfile, tree_builder, preset.fasttree_options])
+        io.run_in_parallel(fasttree.run_fasttree, args_list, cpus, tolerate_failures=True)
+    elif method == 'iqtree':
+        partition = os.path.join(output, 'partition.txt')
+        estimates = []
+        for filename in files:
+            locus = os.path.basename(os.path.splitext(filename)[0])
+            outfile = os.path.join(tree_directory, locus)
+            if models is None:
+                args_list.append([
+                    filename, outfile, partition, tree_builder,
+                    preset.iqtree_model, preset.iqtree_bootstrap, None
+                    ])
+            elif locus == 'combined_alignment':
+                args_list.append([
+                    filename, outfile, partition, tree_builder, None,
+                    preset.iqtree_bootstrap, None
+                    ])
+            else:
+                args_list.append([
+                    filename, outfile, None, tree_builder,
+                    models.get(locus, preset.iqtree_model), preset.iqtree_bootstrap, None
+                    ])
+            estimates.append(iqtree.estimate_iqtree_memory(filename))
+        io.run_in_parallel(
+            iqtree.run_iqtree, args_list, cpus, estimates, memory_budget,
+            iqtree.reduce_iqtree_memory, tolerate_failures=True
+            )
     else:
         raise GetphyloError(method + ' is not a phylogenetic tool.')
 
-def make_trees(output: str, build_all: bool, method: str, cpus: int, tree_builder: str) -> None:
+def prepare_previous_tree(
+    previous_tree: str, alignment_path: str, tree_directory: str, constrain: bool
+    ) -> str:
+    '''
+    Fit a tree from an earlier analysis to the taxa of the current alignment.
+        Arguments:
+            previous_tree: path to the earlier tree
+            alignment_path: path to the combined alignment
+            tree_directory: folder for the new tree
+            constrain: if True, return a constraint tree without the new taxa,
+                otherwise a starting tree with the new taxa placed by sequence distance
+        Returns:
+            tree_path: path to the tree to pass to the tree builder
+    '''
+    tree = phylo.read_tree(previous_tree)
+    alignment = io.read_fasta(alignment_path)
+    removed = phylo.get_taxa(tree) - set(alignment)
+    if removed:
+        logging.warning('%s taxa in the previous tree are not in the alignment.', len(removed))
+        phylo.prune_tree(tree, set(alignment))
+    if len(phylo.get_taxa(tree)) < 3:
+        raise GetphyloError('The previous tree shares fewer than 3 taxa with the alignment.')
+    if constrain:
+        tree_path = os.path.join(tree_directory, 'constraint_tree.tree')
+    else:
+        new_taxa = phylo.place_taxa(tree, alignment)
+        logging.info('Placed %s new taxa onto the previous tree.', len(new_taxa))
+        tree_path = os.path.join(tree_directory, 'starting_tree.tree')
+    phylo.write_tree(tree, tree_path)
+    return tree_path
+
+def report_tree_update(previous_tree: str, new_tree: str, report_path: str) -> None:
+    '''
+    Write the topological difference between the previous and the new tree.
+        Arguments:
+            previous_tree: path to the earlier tree
+            new_tree: path to the new tree
+            report_path: path to the report
+        Returns:
+            None
+    '''
+    previous = phylo.read_tree(previous_tree)
+    new = phylo.read_tree(new_tree)
+    previous_taxa = phylo.get_taxa(previous)
+    new_taxa = phylo.get_taxa(new)
+    distance, maximum = phylo.robinson_foulds(previous, new)
+    normalised = distance / maximum if maximum else 0.0
+    lines = [
+        f'taxa added: {len(new_taxa - previous_taxa)}',
+        f'taxa removed: {len(previous_taxa - new_taxa)}',
+        f'shared taxa: {len(previous_taxa & new_taxa)}',
+        f'robinson-foulds distance: {distance}',
+        f'normalised robinson-foulds distance: {normalised:.4f}',
+    ]
+    logging.info(
+        'Robinson-Foulds distance from the previous tree on the shared taxa: %s (%.4f)',
+        distance, normalised
+        )
+    io.write_to_file(report_path, lines)
+
+def get_alignment_hash(filename: str) -> str:
+    '''
+    Calculate the sha1 hash of the sorted sequences of an alignment. The names and order of
+    the sequences are left out, as they change with the genomes of each run.
+        Arguments:
+            filename: path to the alignment
+        Returns:
+            digest: the hex digest of the alignment
+    '''
+    sequences = sorted(io.read_fasta(filename).values())
+    return hashlib.sha1('\n'.join(sequences).encode()).hexdigest()
+
+def read_model_cache(model_cache: str) -> Dict[str, str]:
+    '''
+    Read the substitution models selected in earlier runs.
+        Arguments:
+            model_cache: path to the tsv of alignment hashes and models
+        Returns:
+            models: the model selected for each alignment hash
+    '''
+    if not os.path.exists(model_cache):
+        return {}
+    models = {}
+    for line in io.read_file(model_cache):
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) == 2:
+            models[fields[0]] = fields[1]
+    return models
+
+def read_partitions(partition_path: str) -> List[List]:
+    '''
+    Read the loci of a partition file written by align.format_partition_data.
+        Arguments:
+            partition_path: path to the partition file
+        Returns:
+            partition_data: a list of [locus, locus_length] lists
+    '''
+    partition_data = []
+    for line in io.read_file(partition_path):
+        if not line.strip():
+            continue
+        definition = line.strip().split(', ', 1)[1]
+        locus, span = definition.rsplit(' = ', 1)
+        start, end = span.split('-')
+        partition_data.append([locus, int(end) - int(start) + 1])
+    return partition_data
+
+def select_locus_models(
+    output: str, partition_path: str, cpus: int, iqtree_location: str, model_cache: str,
+    memory_budget: int = None
+    ) -> Dict[str, str]:
+    '''
+    Select the substitution model of each locus with ModelFinder and write the models into the
+    partition file. Models are cached by the hash of the locus alignment, so that loci seen in
+    earlier runs are not selected again. Loci whose selection fails keep WAG.
+        Arguments:
+            output: path to the output directory
+            partition_path: path to the partition file
+            cpus: the number of cpus available
+            iqtree_location: path to the iqtree executable
+            model_cache: path to the tsv of alignment hashes and models
+            memory_budget: optional memory available to IQ-TREE in bytes
+        Returns:
+            models: the selected model of each locus that has one
+    '''
+    partition_data = read_partitions(partition_path)
+    alignments = {
+        locus: os.path.join(output, 'aligned_fasta', locus + '.fasta')
+        for locus, _ in partition_data
+        }
+    hashes = {locus: get_alignment_hash(alignment) for locus, alignment in alignments.items()}
+    cached = read_model_cache(model_cache)
+    missing = [locus for locus in alignments if hashes[locus] not in cached]
+    logging.info(
+        'Substitution models of %s of %s loci were found in %s.',
+        len(alignments) - len(missing), len(alignments), model_cache
+        )
+    if missing:
+        model_directory = os.path.join(output, 'models')
+        os.makedirs(model_directory, exist_ok=True)
+        args_list = [
+            [alignments[locus], os.path.join(model_directory, locus), iqtree_location]
+            for locus in missing
+            ]
+        estimates = [iqtree.estimate_iqtree_memory(alignments[locus]) for locus in missing]
+        io.run_in_parallel(
+            iqtree.run_modelfinder, args_list, cpus, estimates, memory_budget,
+            tolerate_failures=True
+            )
+        selected = {}
+        for locus in missing:
+            model = iqtree.get_best_model(os.path.join(model_directory, locus + '.iqtree'))
+            if model is None:
+                logging.warning('No model was selected for %s; using WAG.', locus)
+            else:
+                selected[hashes[locus]] = model
+        io.write_to_file(model_cache, [f'{key}\t{model}' for key, model in selected.items()])
+        cached.update(selected)
+    models = {
+        locus: cached[hashes[locus]] for locus in alignments if hashes[locus] in cached
+        }
+    io.remove_files([partition_path])
+    io.write_to_file(partition_path, format_partition_data(partition_data, models))
+    return models
+
+def make_trees(
+    output: str, build_all: bool, method: str, cpus: int, tree_builder: str,
+    preset: Preset = PRESETS[DEFAULT_PRESET], memory_budget: int = None,
+    manifest: Manifest = None, previous_tree: str = None, constrain: bool = False,
+    correction: str = 'kimura', model_cache: str = None
+    ) -> None:
     '''Main routine for trees.
         Arguments:
             output: path to the output directory
+            preset: the speed preset for the tree builder
+            memory_budget: optional memory available to IQ-TREE in bytes
+            manifest: the manifest used to name the taxa of single locus trees
+            previous_tree: optional tree from an earlier analysis to start from
+            constrain: use the previous tree as an IQ-TREE constraint instead of a starting tree
+            correction: the distance correction for neighbour joining
+            model_cache:
+                optional tsv of substitution models; IQ-TREE then uses a cached model
+                for each locus instead of ModelFinder
         Returns:
             None
     '''
@@ -56,17 +310,78 @@ def make_trees(output: str, build_all: bool, method: str, cpus: int, tree_builde
     io.make_folder(tree_directory)
     logging.info("Building trees...")
     if build_all is True:
-        files = glob.glob(os.path.join(output, 'aligned_fasta/*.fasta'))
-        build_all_trees(files, cpus, method, tree_directory, output, tree_builder)
+        if previous_tree is not None:
+            logging.warning('The previous tree is only used for the concatenated alignment.')
+        files = io.list_files(os.path.join(output, 'aligned_fasta'), 'fasta')
+        models = None
+        if method == 'iqtree' and model_cache is not None:
+            models = select_locus_models(
+                output, os.path.join(output, 'partition.txt'), cpus, tree_builder, model_cache,
+                memory_budget
+                )
+        build_all_trees(
+            files, cpus, method, tree_directory, output, tree_builder, preset, memory_budget,
+            correction, models
+            )
+        # single locus alignments name sequences by genome id
+        extension = '.treefile' if method == 'iqtree' else '.tree'
+        for filename in files:
+            locus = os.path.splitext(os.path.basename(filename))[0]
+            tree_path = os.path.join(tree_directory, locus + extension)
+            if not os.path.exists(tree_path):
+                logging.warning('No tree was built for %s.', locus)
+            elif manifest is not None and locus != 'combined_alignment':
+                manifest.rename_tree(tree_path)
     else:
         filename = os.path.join(output, 'aligned_fasta/combined_alignment.fasta')
-        if method == 'fasttree':
-            output = os.path.join(tree_directory, 'combined_alignment.tree')
-            fasttree.run_fasttree(filename, output, tree_builder)
+        if method == 'fasttree' and constrain:
+            logging.warning('FastTree does not use constraint trees; using a starting tree.')
+            constrain = False
+        start_tree = None
+        if method == 'nj' and previous_tree is not None:
+            logging.warning(
+                'Neighbour joining does not use a starting tree; '
+                'the previous tree is only compared.'
+                )
+        elif previous_tree is not None:
+            start_tree = prepare_previous_tree(previous_tree, filename, tree_directory, constrain)
+        if method == 'nj':
+            new_tree = os.path.join(tree_directory, 'combined_alignment.tree')
+            with cpupool.take_tokens(cpus) as threads:
+                build_nj_tree(filename, new_tree, correction, threads)
+        elif method == 'fasttree':
+            new_tree = os.path.join(tree_directory, 'combined_alignment.tree')
+            with cpupool.take_tokens(cpus) as threads:
+                fasttree.run_fasttree(
+                    filename, new_tree, tree_builder, preset.fasttree_options, start_tree,
+                    threads
+                    )
         elif method == 'iqtree':
             partition = os.path.join(output, 'partition.txt')
-            output = os.path.join(tree_directory, 'combined_alignment')
-            iqtree.run_iqtree(filename, output, partition, tree_builder)
+            prefix = os.path.join(tree_directory, 'combined_alignment')
+            model = preset.iqtree_model
+            if model_cache is not None:
+                select_locus_models(
+                    output, partition, cpus, tree_builder, model_cache, memory_budget
+                    )
+                # the partition file now holds the models
+                model = None
+            with cpupool.take_tokens(cpus) as threads:
+                memory.call_with_retries(
+                    iqtree.run_iqtree,
+                    [
+                        filename, prefix, partition, tree_builder,
+                        model, preset.iqtree_bootstrap, None,
+                        None if constrain else start_tree, start_tree if constrain else None,
+                        threads
+                    ],
+                    iqtree.reduce_iqtree_memory
+                    )
+            new_tree = prefix + '.treefile'
         else:
             raise GetphyloError(method + ' is not a phylogenetic tool.')
+        if previous_tree is not None:
+            report_tree_update(
+                previous_tree, new_tree, os.path.join(tree_directory, 'tree_update.txt')
+                )
     logging.info("CHECKPOINT: TREES_BUILT")
@@ -1 +1,10 @@
-'''Utility modules used by serveral modules'''
+'''
+Utility modules used by serveral modules
+
+The settings of executor, store, cache, cpupool, profiler and timeline are stored in
+environment variables (GETPHYLO_*) by their configure functions, so that pool processes
+and work queue workers started afterwards inherit them. Those of executor, store and cache
+are read through utils.settings, where a thread can override them for its own calls (see
+api.Pipeline). BioPython and NumPy are imported
+inside the functions that use them to keep startup fast.
+'''
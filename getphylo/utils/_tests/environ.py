@@ -0,0 +1,12 @@
+import os
+import unittest
+from unittest.mock import patch
+
+class EnvironTestCase(unittest.TestCase):
+    '''Restore the environment variables that configure the utils after each test'''
+    def setUp(self):
+        self.environ = patch.dict(os.environ)
+        self.environ.start()
+
+    def tearDown(self):
+        self.environ.stop()
@@ -0,0 +1,53 @@
+import os
+import sys
+import unittest
+from tempfile import TemporaryDirectory
+
+from getphylo.utils.cache import ToolCache
+
+def write(filename, contents):
+    with open(filename, 'w') as _file:
+        _file.write(contents)
+
+def read(filename):
+    with open(filename) as _file:
+        return _file.read()
+
+class TestToolCache(unittest.TestCase):
+    def test_get_key(self):
+        with TemporaryDirectory() as folder:
+            tool_cache = ToolCache(os.path.join(folder, 'cache'))
+            first = os.path.join(folder, 'first.fasta')
+            second = os.path.join(folder, 'second.fasta')
+            write(first, '>a\nAAA\n')
+            write(second, '>a\nAAA\n')
+            key = tool_cache.get_key(
+                [sys.executable, '-in', first, '-out', 'one/out.fasta'],
+                [first], ['one/out.fasta']
+                )
+            # the same contents with different paths give the same key
+            assert key == tool_cache.get_key(
+                [sys.executable, '-in', second, '-out', 'two/out.fasta'],
+                [second], ['two/out.fasta']
+                )
+            write(second, '>a\nCCC\n')
+            assert key != tool_cache.get_key(
+                [sys.executable, '-in', second, '-out', 'two/out.fasta'],
+                [second], ['two/out.fasta']
+                )
+            assert tool_cache.get_key(['not-a-real-tool', first], [first], ['out']) is None
+
+    def test_store_restore_and_evict(self):
+        with TemporaryDirectory() as folder:
+            tool_cache = ToolCache(os.path.join(folder, 'cache'), session='test')
+            output = os.path.join(folder, 'out.tree')
+            assert not tool_cache.restore('key', [output])
+            write(output, '(a,b,c);\n')
+            tool_cache.store('key', [output, os.path.join(folder, 'missing.log')])
+            os.remove(output)
+            assert tool_cache.restore('key', [output, os.path.join(folder, 'missing.log')])
+            assert read(output) == '(a,b,c);\n'
+            assert tool_cache.get_stats() == (1, 1)
+            tool_cache.max_size = 0
+            tool_cache.evict()
+            assert not os.listdir(os.path.join(folder, 'cache', 'entries'))
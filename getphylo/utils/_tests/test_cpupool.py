@@ -0,0 +1,80 @@
+import os
+import subprocess
+import sys
+from tempfile import TemporaryDirectory
+
+from getphylo.utils import cpupool, executor
+from getphylo.utils._tests.environ import EnvironTestCase
+
+def double(value):
+    return value * 2
+
+class TestCpuPool(EnvironTestCase):
+    def test_parse_makeflags(self):
+        assert cpupool.parse_makeflags('') is None
+        assert cpupool.parse_makeflags(' -j4 --jobserver-fds=3,4 -j') == '3,4'
+        assert cpupool.parse_makeflags(
+            '-j --jobserver-auth=fifo:/tmp/gmfifo1'
+            ) == 'fifo:/tmp/gmfifo1'
+        assert cpupool.parse_makeflags('-j --jobserver-auth=-2,-2') is None
+
+    def test_lock_file_pool(self):
+        with TemporaryDirectory() as folder:
+            pool = cpupool.LockFilePool(folder, 2)
+            token = pool.try_acquire()
+            assert token is not None
+            # another run only finds the other token
+            script = (
+                'from getphylo.utils.cpupool import LockFilePool;'
+                f'pool = LockFilePool({folder!r}, 2);'
+                'print(pool.try_acquire() is not None, pool.try_acquire() is not None)'
+                )
+            check = lambda: subprocess.run(
+                [sys.executable, '-c', script], capture_output=True, text=True, check=True
+                ).stdout.split()
+            assert check() == ['True', 'False']
+            assert pool.try_acquire() is not None
+            assert check() == ['False', 'False']
+            pool.release(token)
+            assert check() == ['True', 'False']
+
+    def test_jobserver(self):
+        read_fd, write_fd = os.pipe()
+        try:
+            os.write(write_fd, b'+')
+            pool = cpupool.JobserverPool(f'{read_fd},{write_fd}')
+            token = pool.try_acquire()
+            assert token == b'+'
+            assert pool.try_acquire() is None
+            pool.release(token)
+            assert pool.try_acquire() == b'+'
+            # without free tokens tasks run one at a time on the token of the run
+            os.environ['MAKEFLAGS'] = f'-j --jobserver-auth={read_fd},{write_fd}'
+            assert executor.run_tasks(double, [[1], [2], [3]], 2) == [2, 4, 6]
+        finally:
+            os.close(read_fd)
+            os.close(write_fd)
+
+    def test_take_tokens(self):
+        os.environ.pop('MAKEFLAGS', None)
+        with cpupool.take_tokens(4) as threads:
+            assert threads == 4
+        with TemporaryDirectory() as folder:
+            pool = cpupool.configure(folder, 3)
+            # the token of the run and the two free ones
+            with cpupool.take_tokens(8) as threads:
+                assert threads == 3
+                assert pool.try_acquire() is None
+            with cpupool.take_tokens(2) as threads:
+                assert threads == 2
+                assert pool.try_acquire() is not None
+
+    def test_get_tool_threads(self):
+        os.environ.pop('MAKEFLAGS', None)
+        os.environ.pop(cpupool.POOL_ENV, None)
+        # without a pool each tool keeps its own default
+        assert cpupool.get_tool_threads() is None
+        assert cpupool.get_tool_threads(4) is None
+        os.environ['MAKEFLAGS'] = '-j --jobserver-auth=3,4'
+        assert cpupool.get_tool_threads() == 1
+        assert cpupool.get_tool_threads(4) == 4
@@ -0,0 +1,85 @@
+import json
+import os
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from getphylo.utils import executor, io
+from getphylo.utils.errors import TaskTimeoutError
+from getphylo.utils._tests.environ import EnvironTestCase
+
+def fail_on_odd(value):
+    '''Fail like an external tool for odd values'''
+    if value % 2:
+        raise RuntimeError(f'failed on {value}')
+    return value
+
+def append_line(filename, line):
+    '''Append a line to a file and return the lines written so far'''
+    with open(filename, 'a') as _file:
+        _file.write(line + '\n')
+    with open(filename) as _file:
+        return _file.read().split()
+
+def append_cpus(filename, line, cpus):
+    '''Append a line with the cpus an exclusive task was given'''
+    return append_line(filename, f'{line}{cpus}')
+
+class TestExecutor(EnvironTestCase):
+    def test_tolerate_failures(self):
+        with TemporaryDirectory() as folder, patch.object(executor, 'BACKOFF', 0):
+            report = os.path.join(folder, 'failures.jsonl')
+            executor.configure(retries=1, report=report)
+            for cpus in [1, 2]:
+                assert executor.run_tasks(
+                    fail_on_odd, [[0], [1], [2], [3]], cpus, tolerate_failures=True
+                    ) == [0, None, 2, None]
+            with open(report) as _file:
+                failures = [json.loads(line) for line in _file]
+            assert len(failures) == 4
+            assert {failure['attempts'] for failure in failures} == {2}
+            assert {failure['error'] for failure in failures} == {'RuntimeError'}
+            with self.assertRaisesRegex(RuntimeError, 'failed on'):
+                executor.run_tasks(fail_on_odd, [[0], [1], [2]], 2)
+
+    def test_task_timeout(self):
+        with TemporaryDirectory() as folder:
+            output = os.path.join(folder, 'out.txt')
+            executor.configure(timeout=0.5)
+            with self.assertRaises(TaskTimeoutError):
+                io.run_in_command_line(
+                    ['sh', '-c', f'echo partial > {output}; sleep 30'], outputs=[output]
+                    )
+            # partial outputs of a stopped tool are removed
+            assert not os.path.exists(output)
+
+    def test_task_graph(self):
+        with TemporaryDirectory() as folder, patch.object(executor, 'BACKOFF', 0):
+            for cpus in [1, 2]:
+                filename = os.path.join(folder, f'{cpus}.txt')
+                with executor.TaskGraph(cpus) as graph:
+                    first = graph.add(append_line, [filename, 'first'])
+                    failed = graph.add(fail_on_odd, [1], tolerate_failure=True)
+                    second = graph.add(append_line, [filename, 'second'], [first])
+                    skipped = graph.add(fail_on_odd, [2], [failed], tolerate_failure=True)
+                    # results are in the order asked for and dependencies finish first
+                    assert graph.wait([second, skipped, first]) == [
+                        ['first', 'second'], None, ['first']
+                        ]
+                    assert graph.failures[skipped].attempts == 0
+                    with self.assertRaises(ValueError):
+                        graph.add(append_line, [filename, 'third'], [first, 10])
+
+    def test_exclusive_task(self):
+        with TemporaryDirectory() as folder:
+            for cpus in [1, 2]:
+                filename = os.path.join(folder, f'{cpus}.txt')
+                with executor.TaskGraph(cpus) as graph:
+                    first = graph.add(append_line, [filename, 'first'])
+                    second = graph.add(append_line, [filename, 'second'], [first])
+                    exclusive = graph.add(
+                        append_cpus, [filename, 'exclusive'], [first], exclusive=True
+                        )
+                    # the exclusive task starts before the task added earlier, on every cpu
+                    assert graph.wait([second, exclusive]) == [
+                        ['first', f'exclusive{cpus}', 'second'], ['first', f'exclusive{cpus}']
+                        ]
@@ -0,0 +1,50 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+from getphylo.utils.errors import BadInputError
+from getphylo.utils.manifest import Genome, Manifest
+
+class TestManifest(unittest.TestCase):
+    def test_build_and_read(self):
+        with TemporaryDirectory() as folder:
+            for name in ['c.gbk', 'a.gbk', 'b.gbk']:
+                with open(os.path.join(folder, name), 'w') as _file:
+                    _file.write(name)
+            manifest = Manifest.build(os.path.join(folder, '*.gbk'))
+            assert manifest.keys == ['g0', 'g1', 'g2']
+            assert [genome.name for genome in manifest.genomes] == ['a', 'b', 'c']
+            assert manifest.get_genome(os.path.join(folder, 'b.gbk')).key == 'g1'
+            manifest_path = os.path.join(folder, 'manifest.tsv')
+            manifest.write(manifest_path)
+            assert Manifest.read(manifest_path).genomes == manifest.genomes
+            with self.assertRaisesRegex(BadInputError, 'not one of the input files'):
+                manifest.get_genome('d.gbk')
+
+    def test_find_paths(self):
+        with TemporaryDirectory() as folder:
+            for name in ['x.gff', 'x.fna', 'y.gbk']:
+                with open(os.path.join(folder, name), 'w') as _file:
+                    _file.write(name)
+            # the genome fasta of a GFF3 file is not a genome of its own
+            assert Manifest.find_paths(os.path.join(folder, '*')) == [
+                os.path.join(folder, 'x.gff'), os.path.join(folder, 'y.gbk')
+                ]
+
+    def test_duplicate_names(self):
+        genomes = [
+            Genome(0, 'a', '/one/a.gbk', 1, 0.0, ''),
+            Genome(1, 'a', '/two/a.gbk', 1, 0.0, '')
+            ]
+        with self.assertRaisesRegex(BadInputError, 'share the same name'):
+            Manifest(genomes)
+
+    def test_rename_tree(self):
+        genomes = [Genome(index, name, name, 1, 0.0, '') for index, name in enumerate('ab')]
+        with TemporaryDirectory() as folder:
+            tree_path = os.path.join(folder, 'locus.tree')
+            with open(tree_path, 'w') as _file:
+                _file.write('(g0:0.1,g1:0.2,g10:0.3);\n')
+            Manifest(genomes).rename_tree(tree_path)
+            with open(tree_path) as _file:
+                assert _file.read() == '(a:0.1,b:0.2,g10:0.3);\n'
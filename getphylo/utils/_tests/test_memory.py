@@ -0,0 +1,42 @@
+import unittest
+from unittest.mock import patch
+
+from getphylo.utils import memory
+from getphylo.utils.errors import OutOfMemoryError
+from getphylo.utils.memory import (
+    call_with_retries,
+    get_memory_budget,
+    run_with_memory_budget
+    )
+
+def needs_low_memory(value, low_memory):
+    '''Fail with OutOfMemoryError unless low_memory is set'''
+    if not low_memory:
+        raise OutOfMemoryError('killed')
+    return value
+
+def reduce(args):
+    return [args[0], True]
+
+class TestMemory(unittest.TestCase):
+    def test_get_memory_budget(self):
+        assert get_memory_budget(2) == 2 * 2**30
+        with patch.object(memory, 'get_cgroup_limit', return_value=2**20):
+            assert get_memory_budget() == 2**20
+        with patch.object(memory, 'get_cgroup_limit', return_value=None):
+            assert get_memory_budget() > 2**20
+
+    def test_call_with_retries(self):
+        assert call_with_retries(needs_low_memory, [1, False], reduce) == 1
+        with self.assertRaises(OutOfMemoryError):
+            call_with_retries(needs_low_memory, [1, False])
+
+    def test_run_with_memory_budget(self):
+        args_list = [[1, False], [2, True], [3, False]]
+        estimates = [10, 100, 10]
+        for cpus in [1, 2]:
+            assert run_with_memory_budget(
+                needs_low_memory, args_list, cpus, estimates, 50, reduce
+                ) == [1, 2, 3]
+        with self.assertRaises(OutOfMemoryError):
+            run_with_memory_budget(needs_low_memory, args_list, 2, estimates, 50)
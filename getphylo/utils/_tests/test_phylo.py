@@ -0,0 +1,70 @@
+import math
+import unittest
+from io import StringIO
+
+from Bio import Phylo
+
+from getphylo.utils import phylo
+
+def parse(newick):
+    return Phylo.read(StringIO(newick), 'newick')
+
+class TestPhylo(unittest.TestCase):
+    def test_get_splits(self):
+        tree = parse('((a,b),(c,(d,e)));')
+        assert phylo.get_splits(tree) == {frozenset('de'), frozenset('cde')}
+        # rerooting does not change the splits
+        assert phylo.get_splits(parse('(a,b,(c,(d,e)));')) == phylo.get_splits(tree)
+
+    def test_robinson_foulds(self):
+        assert phylo.robinson_foulds(parse('((a,b),(c,d));'), parse('((a,c),(b,d));')) == (2, 2)
+        # only the shared taxa are compared
+        assert phylo.robinson_foulds(
+            parse('((a,b),(c,(d,e)));'), parse('((a,b),(c,d),f);')
+            ) == (0, 2)
+
+    def test_place_taxa(self):
+        tree = parse('((a,b),(c,d));')
+        alignment = {'a': 'AAAA', 'b': 'AAAC', 'c': 'CCCC', 'd': 'CCCA', 'x': 'CC-C'}
+        assert phylo.place_taxa(tree, alignment) == ['x']
+        assert phylo.get_taxa(tree) == set('abcdx')
+        assert frozenset('cx') in phylo.get_splits(tree)
+        # names are matched literally and sequences regardless of case
+        tree = parse("((a,'GCF_1.1'),('c+1',d));")
+        alignment = {
+            'a': 'AAAA', 'GCF_1.1': 'AAAC', 'c+1': 'CCCC', 'd': 'CCCA', 'x': 'cccc', 'y': 'aaac'
+            }
+        assert phylo.place_taxa(tree, alignment) == ['x', 'y']
+        assert frozenset(['c+1', 'x']) in phylo.get_splits(tree)
+        # the side without GCF_1.1, which sorts first, of the split of GCF_1.1 and y
+        assert frozenset(['a', 'c+1', 'd', 'x']) in phylo.get_splits(tree)
+
+    def test_prune_tree(self):
+        tree = phylo.prune_tree(parse('((a,b),(c,(d,e)));'), set('abcd'))
+        assert phylo.get_taxa(tree) == set('abcd')
+
+    def test_get_distance_matrix(self):
+        alignment = {'a': 'MKTA', 'b': 'MKTR', 'c': 'M-?R', 'd': '----'}
+        names, distances = phylo.get_distance_matrix(alignment, cpus=2)
+        assert names == list('abcd')
+        # sites with gaps or missing data in either sequence are not compared
+        assert distances[0, 1] == 0.25
+        assert distances[0, 2] == 0.5
+        assert distances[1, 2] == 0.0
+        assert distances[0, 3] == phylo.MAX_DISTANCE
+        _, corrected = phylo.get_distance_matrix(alignment, 'poisson')
+        self.assertAlmostEqual(corrected[0, 1], -math.log(0.75))
+
+    def test_neighbour_joining(self):
+        # distances along the tree ((a:1,b:2):1,c:3,(d:1,e:1):2)
+        distances = [
+            [0, 3, 5, 5, 5],
+            [3, 0, 6, 6, 6],
+            [5, 6, 0, 6, 6],
+            [5, 6, 6, 0, 2],
+            [5, 6, 6, 2, 0],
+            ]
+        tree = phylo.neighbour_joining(list('abcde'), distances)
+        assert phylo.get_splits(tree) == {frozenset('cde'), frozenset('de')}
+        self.assertAlmostEqual(tree.distance('a', 'e'), 5)
+        self.assertAlmostEqual(tree.distance('b', 'c'), 6)
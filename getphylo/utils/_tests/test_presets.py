@@ -0,0 +1,54 @@
+import unittest
+from unittest.mock import patch
+
+from getphylo.utils import presets
+from getphylo.utils.errors import BadInputError
+from getphylo.utils.presets import PresetSchedule, downgrade_preset, get_preset
+
+class TestPresets(unittest.TestCase):
+    def test_get_preset(self):
+        assert get_preset('fast').diamond_sensitivity == '--fast'
+        assert get_preset('balanced').iqtree_model == 'MFP'
+        with self.assertRaisesRegex(BadInputError, 'not a valid preset'):
+            get_preset('ludicrous')
+
+    def test_downgrade_preset(self):
+        assert downgrade_preset(get_preset('thorough')).name == 'balanced'
+        assert downgrade_preset(get_preset('thorough'), 5).name == 'fast'
+        assert downgrade_preset(get_preset('fast')).name == 'fast'
+
+class TestPresetSchedule(unittest.TestCase):
+    def run_stage(self, schedule, stage, now, duration):
+        '''Start and end a stage at the given mocked times'''
+        with patch.object(presets.time, 'monotonic', return_value=now):
+            preset = schedule.start_stage(stage)
+        with patch.object(presets.time, 'monotonic', return_value=now + duration):
+            schedule.end_stage(stage)
+        return preset
+
+    def test_no_deadline(self):
+        schedule = PresetSchedule('thorough')
+        assert schedule.start_stage('extract').name == 'thorough'
+
+    def test_on_schedule(self):
+        with patch.object(presets.time, 'monotonic', return_value=0):
+            schedule = PresetSchedule('thorough', deadline=1)
+        assert self.run_stage(schedule, 'extract', 0, 60).name == 'thorough'
+        assert self.run_stage(schedule, 'screen', 60, 60).name == 'thorough'
+
+    def test_behind_schedule(self):
+        with patch.object(presets.time, 'monotonic', return_value=0):
+            schedule = PresetSchedule('thorough', deadline=1)
+        # 10% of the work took 10 minutes, so 90 minutes are projected for 50 remaining
+        assert self.run_stage(schedule, 'extract', 0, 600).name == 'thorough'
+        assert self.run_stage(schedule, 'screen', 600, 600).name == 'balanced'
+        # the deadline has already passed
+        assert self.run_stage(schedule, 'align', 3600, 60).name == 'fast'
+
+    def test_skipped_stages(self):
+        with patch.object(presets.time, 'monotonic', return_value=0):
+            schedule = PresetSchedule('balanced', deadline=1)
+        schedule.skip_stage('extract')
+        schedule.skip_stage('screen')
+        assert self.run_stage(schedule, 'align', 0, 1200).name == 'balanced'
+        assert self.run_stage(schedule, 'trees', 1200, 60).name == 'balanced'
@@ -0,0 +1,32 @@
+import json
+import os
+import pstats
+from contextlib import redirect_stdout
+from io import StringIO
+from tempfile import TemporaryDirectory
+
+from getphylo.utils import executor, io, profiler
+from getphylo.utils._tests.environ import EnvironTestCase
+
+def count_and_run(value):
+    '''Spend some Python time, then run an external tool'''
+    total = sum(range(value))
+    io.run_command(['true'])
+    return total
+
+class TestProfiler(EnvironTestCase):
+    def test_merge_stage(self):
+        with TemporaryDirectory() as folder:
+            profiler.configure(folder, top=5)
+            for cpus in [1, 2]:
+                profiler.start_stage('extract')
+                assert executor.run_tasks(count_and_run, [[10], [20]], cpus) == [45, 190]
+                with redirect_stdout(StringIO()) as summary:
+                    profiler.end_stage('extract')
+                assert 'Profile of extract' in summary.getvalue()
+                # the pool processes are merged into the stats of the stage
+                functions = pstats.Stats(os.path.join(folder, 'extract.pstats')).stats
+                assert any(name == 'count_and_run' for _, _, name in functions)
+                assert not os.listdir(os.path.join(folder, profiler.WORKER_FOLDER))
+                with open(os.path.join(folder, 'extract.tools.json')) as _file:
+                    assert json.load(_file)['true']['runs'] == 2
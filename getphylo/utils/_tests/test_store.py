@@ -0,0 +1,46 @@
+import os
+from tempfile import TemporaryDirectory
+
+from getphylo.utils import io, store
+from getphylo.utils._tests.environ import EnvironTestCase
+
+class TestStore(EnvironTestCase):
+    def setUp(self):
+        super().setUp()
+        self.folder = TemporaryDirectory()
+        self.output = self.folder.name
+        store.configure(os.path.join(self.output, store.STORE_NAME), self.output)
+
+    def tearDown(self):
+        self.folder.cleanup()
+        super().tearDown()
+
+    def test_read_and_write(self):
+        fasta = os.path.join(self.output, 'fasta', 'g0.fasta')
+        io.make_folder(os.path.join(self.output, 'fasta'))
+        io.write_to_file(fasta, ['>g0_0', 'MKT'])
+        io.write_to_file(fasta, ['>g0_1', 'MAA'])
+        # appended in the store without creating the file
+        assert not os.path.exists(fasta)
+        assert io.file_exists(fasta)
+        assert io.read_fasta(fasta) == {'g0_0': 'MKT', 'g0_1': 'MAA'}
+        assert io.list_files(os.path.join(self.output, 'fasta'), 'fasta') == [fasta]
+        # files outside the stored folders are written as usual
+        final_loci = os.path.join(self.output, 'final_loci.txt')
+        io.write_to_file(final_loci, ['g0_0'])
+        assert os.path.exists(final_loci)
+        io.remove_files([fasta])
+        assert not io.file_exists(fasta)
+
+    def test_run_in_command_line(self):
+        io.make_folder(os.path.join(self.output, 'aligned_fasta'))
+        unaligned = os.path.join(self.output, 'aligned_fasta', 'a.in.fasta')
+        aligned = os.path.join(self.output, 'aligned_fasta', 'a.fasta')
+        io.write_to_file(unaligned, ['>g0', 'MKT'])
+        io.run_in_command_line(['cp', unaligned, aligned], inputs=[unaligned], outputs=[aligned])
+        assert io.read_file(aligned) == ['>g0\n', 'MKT\n']
+        assert os.listdir(os.path.join(self.output, 'aligned_fasta')) == []
+        # a new folder starts empty
+        os.rmdir(os.path.join(self.output, 'aligned_fasta'))
+        io.make_folder(os.path.join(self.output, 'aligned_fasta'))
+        assert not io.file_exists(aligned)
@@ -0,0 +1,43 @@
+import json
+import os
+from tempfile import TemporaryDirectory
+
+from getphylo.utils import executor, io, timeline
+from getphylo.utils._tests.environ import EnvironTestCase
+
+def run_tool(value):
+    '''Run an external tool'''
+    io.run_command(['true'])
+    return value
+
+class TestTimeline(EnvironTestCase):
+    def test_write_trace(self):
+        with TemporaryDirectory() as folder:
+            filename = os.path.join(folder, timeline.TRACE_NAME)
+            timeline.configure(os.path.join(folder, timeline.TRACE_FOLDER))
+            timeline.begin_stage('align')
+            assert executor.run_tasks(run_tool, [[0], [1], [2]], 2) == [0, 1, 2]
+            timeline.end_stage('align')
+            timeline.write_trace(filename)
+            assert timeline.get_folder() is None
+            assert not os.path.exists(os.path.join(folder, timeline.TRACE_FOLDER))
+            with open(filename) as _file:
+                events = json.load(_file)['traceEvents']
+            spans = [event for event in events if event['ph'] == 'X']
+            tasks = [event for event in spans if event['cat'] == 'task']
+            tools = [event for event in spans if event['cat'] == 'tool']
+            assert [task['name'] for task in tasks] == ['run_tool'] * 3
+            assert [tool['args']['command'] for tool in tools] == ['true'] * 3
+            # each tool runs within its task, in the lane of its pool process
+            for tool in tools:
+                assert any(
+                    task['tid'] == tool['tid'] and task['ts'] <= tool['ts']
+                    and tool['ts'] + tool['dur'] <= task['ts'] + task['dur']
+                    for task in tasks
+                    )
+            assert {task['tid'] for task in tasks} != {os.getpid()}
+            jobs = [
+                event['args']['active jobs'] for event in events if event['name'] == 'active jobs'
+                ]
+            assert max(jobs) == 2 and jobs[-1] == 0
+            assert [event['ph'] for event in events if event.get('cat') == 'stage'] == ['B', 'E']
@@ -0,0 +1,26 @@
+import unittest
+
+from Bio.Seq import Seq
+from Bio.SeqFeature import BeforePosition, CompoundLocation, FeatureLocation, SeqFeature
+from Bio.SeqRecord import SeqRecord
+
+from getphylo.utils import translate
+
+class TestTranslate(unittest.TestCase):
+    def test_translate_features(self):
+        # GTG start, an intron between 9 and 15, an AGA codon and a TAA stop
+        record = SeqRecord(Seq('GTGAAACCCnnnnnnGGGAGANAATAAccc'))
+        forward = SeqFeature(CompoundLocation([
+            FeatureLocation(0, 9, strand=1), FeatureLocation(15, 27, strand=1)
+            ]), type='CDS')
+        partial = SeqFeature(
+            FeatureLocation(BeforePosition(2), 9, strand=1), type='CDS',
+            qualifiers={'codon_start': ['2']}
+            )
+        assert translate.translate_features(record, [forward, partial]) == ['MKPGRX', 'KP']
+        # the same gene on the other strand in the vertebrate mitochondrial code
+        reverse_record = SeqRecord(record.seq.reverse_complement())
+        reverse = SeqFeature(CompoundLocation([
+            FeatureLocation(21, 30, strand=-1), FeatureLocation(3, 15, strand=-1)
+            ]), type='CDS', qualifiers={'transl_table': ['2']})
+        assert translate.translate_features(reverse_record, [reverse]) == ['MKPG*X']
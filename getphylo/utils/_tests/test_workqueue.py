@@ -0,0 +1,95 @@
+import os
+import time
+import unittest
+from tempfile import TemporaryDirectory
+
+from getphylo.utils.errors import GetphyloError
+from getphylo.utils.io import change_extension
+from getphylo.utils.workqueue import (
+    CLAIMED,
+    DONE,
+    PENDING,
+    WORKERS,
+    WorkQueue,
+    get_function,
+    run_worker,
+    write_json
+    )
+
+class TestWorkQueue(unittest.TestCase):
+    def test_get_function(self):
+        assert get_function('getphylo.utils.io:change_extension') is change_extension
+        with self.assertRaisesRegex(GetphyloError, 'Refusing'):
+            get_function('os:remove')
+
+    def test_submit_and_process(self):
+        with TemporaryDirectory() as queue_dir:
+            work_queue = WorkQueue(queue_dir, poll=0.01)
+            args_list = [['a.gbk', 'fasta'], ['b.gbk', 'tsv']]
+            tasks = work_queue.submit(change_extension, args_list)
+            assert len(os.listdir(work_queue.path(PENDING))) == 2
+            while True:
+                task = work_queue.claim()
+                if task is None:
+                    break
+                work_queue.process(task)
+            assert work_queue.wait(tasks) == ['a.fasta', 'b.tsv']
+            assert not os.listdir(work_queue.path(CLAIMED))
+
+    def test_failed_task(self):
+        with TemporaryDirectory() as queue_dir:
+            work_queue = WorkQueue(queue_dir, poll=0.01)
+            tasks = work_queue.submit(change_extension, [[1, 'fasta']])
+            work_queue.process(work_queue.claim())
+            with self.assertRaisesRegex(GetphyloError, 'failed on a worker'):
+                work_queue.wait(tasks)
+
+    def test_requeue_stale(self):
+        with TemporaryDirectory() as queue_dir:
+            work_queue = WorkQueue(queue_dir, poll=0.01, timeout=60)
+            work_queue.submit(change_extension, [['a.gbk', 'fasta']])
+            os.utime(work_queue.path(PENDING, os.listdir(work_queue.path(PENDING))[0]), (0, 0))
+            # a task is fresh as soon as it is claimed, even if it was pending for long
+            task = work_queue.claim()
+            work_queue.requeue_stale()
+            assert os.listdir(work_queue.path(PENDING)) == []
+            os.utime(work_queue.path(CLAIMED, task), (0, 0))
+            work_queue.requeue_stale()
+            assert os.listdir(work_queue.path(PENDING)) == [task]
+
+    def test_no_workers(self):
+        with TemporaryDirectory() as queue_dir:
+            work_queue = WorkQueue(queue_dir, poll=0.01, worker_timeout=0.05)
+            tasks = work_queue.submit(change_extension, [['a.gbk', 'fasta']])
+            with self.assertRaisesRegex(GetphyloError, 'No worker'):
+                work_queue.wait(tasks)
+
+    def test_reset(self):
+        with TemporaryDirectory() as queue_dir:
+            work_queue = WorkQueue(queue_dir, poll=0.01)
+            tasks = work_queue.submit(change_extension, [['a.gbk', 'fasta'], ['b.gbk', 'tsv']])
+            work_queue.process(work_queue.claim())
+            work_queue.claim()
+            work_queue.shutdown()
+            # a worker started before the next run waits for its coordinator
+            run_worker(queue_dir, poll=0.01, idle_exit=0.05)
+            assert os.listdir(work_queue.path(DONE)) == [tasks[0]]
+            work_queue.reset()
+            assert not work_queue.is_shutdown()
+            for folder in [PENDING, CLAIMED, DONE]:
+                assert not os.listdir(work_queue.path(folder))
+
+    def test_get_timeout(self):
+        with TemporaryDirectory() as queue_dir:
+            work_queue = WorkQueue(queue_dir, poll=0.01, timeout=60)
+            assert work_queue.get_timeout() == 60
+            write_json(work_queue.path(WORKERS, 'node-1'), {'timeout': 600})
+            with open(work_queue.path(WORKERS, 'node-2'), 'w'):
+                pass
+            assert work_queue.get_timeout() == 600
+            work_queue.submit(change_extension, [['a.gbk', 'fasta']])
+            task = work_queue.claim()
+            # stale for the coordinator's own timeout, not for the worker's heartbeats
+            os.utime(work_queue.path(CLAIMED, task), (time.time() - 120,) * 2)
+            work_queue.requeue_stale()
+            assert os.listdir(work_queue.path(CLAIMED)) == [task]
@@ -0,0 +1,285 @@
+'''
+A content-addressed cache for the outputs of external tools.
+
+Classes:
+    ToolCache
+
+Functions:
+    get_file_hash(filename: str) -> str
+    get_tool_version(executable: str) -> Optional[str]
+    get_environment(folder: str = None, max_size: float = DEFAULT_CACHE_SIZE) -> Dict[str, str]
+    configure(folder: str, max_size: float = DEFAULT_CACHE_SIZE) -> ToolCache
+    get_cache() -> Optional[ToolCache]
+'''
+import functools
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from getphylo.utils import settings
+
+CACHE_ENV = 'GETPHYLO_CACHE'
+CACHE_SIZE_ENV = 'GETPHYLO_CACHE_SIZE'
+SESSION_ENV = 'GETPHYLO_CACHE_SESSION'
+# in GB
+DEFAULT_CACHE_SIZE = 10.0
+HIT = 'h'
+MISS = 'm'
+
+def get_file_hash(filename: str) -> str:
+    '''
+    Calculate the sha1 hash of a file's contents.
+        Arguments:
+            filename: path to the file
+        Returns:
+            digest: the hex digest of the file
+    '''
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as _file:
+        for chunk in iter(lambda: _file.read(2**20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+@functools.lru_cache(maxsize=None)
+def get_tool_version(executable: str) -> Optional[str]:
+    '''
+    Identify the version of a tool by the contents of its executable.
+        Arguments:
+            executable: the name or path of the executable
+        Returns:
+            version: the hash of the executable, or None if it cannot be found
+    '''
+    path = shutil.which(executable)
+    if path is None:
+        return None
+    return get_file_hash(path)
+
+def get_size(path: str) -> int:
+    '''Return the total size of the files in a folder'''
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path) for name in names
+        )
+
+class ToolCache:
+    '''
+    Outputs of external tools stored in a shared folder, keyed on the contents of the
+    input files, the command and the executable. The least recently used outputs are
+    evicted when the cache grows beyond its size limit.
+    '''
+    def __init__(self, folder: str, max_size: float = DEFAULT_CACHE_SIZE, session: str = None):
+        '''
+        Arguments:
+            folder: path to the cache folder, which can be shared between runs
+            max_size: the size limit of the cache in GB
+            session: name of the file used to count hits and misses of this run
+        '''
+        self.folder = folder
+        self.max_size = int(max_size * 2**30)
+        self.session = session
+        for name in ['entries', 'tmp', 'sessions']:
+            os.makedirs(os.path.join(folder, name), exist_ok=True)
+
+    def get_key(
+            self, command: Sequence[str], inputs: Sequence[str], outputs: Sequence[str]
+        ) -> Optional[str]:
+        '''
+        Calculate the cache key of a command.
+            Arguments:
+                command: the command to be run
+                inputs: paths to the files read by the command
+                outputs: paths to the files written by the command
+            Returns:
+                key: the cache key, or None if the command cannot be cached
+        '''
+        version = get_tool_version(command[0])
+        if version is None:
+            return None
+        arguments = []
+        for argument in command[1:]:
+            argument = str(argument)
+            if argument in inputs:
+                argument = f'<input{inputs.index(argument)}>'
+            else:
+                # output paths and prefixes (e.g. iqtree -pre) change between runs
+                for index, output in enumerate(outputs):
+                    if argument == output or output.startswith(argument + '.'):
+                        argument = f'<output{index}:{output[len(argument):]}>'
+                        break
+            arguments.append(argument)
+        data = {
+            'version': version,
+            'arguments': arguments,
+            'inputs': [get_file_hash(filename) for filename in inputs],
+            'outputs': len(outputs)
+            }
+        return hashlib.sha256(json.dumps(data).encode()).hexdigest()
+
+    def entry(self, key: str) -> str:
+        '''Return the folder holding the outputs for a key'''
+        return os.path.join(self.folder, 'entries', key)
+
+    def restore(self, key: str, outputs: Sequence[str]) -> bool:
+        '''
+        Copy cached outputs to their destinations.
+            Arguments:
+                key: the cache key
+                outputs: paths to the files written by the command
+            Returns:
+                hit: True if the outputs were restored
+        '''
+        entry = self.entry(key)
+        try:
+            with open(os.path.join(entry, 'outputs.json')) as _file:
+                stored = json.load(_file)
+            for index in stored:
+                shutil.copyfile(os.path.join(entry, str(index)), outputs[index])
+            # the modification time of an entry marks when it was last used
+            os.utime(entry)
+        except (FileNotFoundError, IndexError, ValueError):
+            self.record(MISS)
+            return False
+        self.record(HIT)
+        return True
+
+    def store(self, key: str, outputs: Sequence[str]) -> None:
+        '''
+        Copy the outputs of a command into the cache.
+            Arguments:
+                key: the cache key
+                outputs: paths to the files written by the command
+            Returns:
+                None
+        '''
+        temporary = os.path.join(self.folder, 'tmp', uuid.uuid4().hex)
+        os.makedirs(temporary)
+        stored = []
+        for index, output in enumerate(outputs):
+            if os.path.exists(output):
+                shutil.copyfile(output, os.path.join(temporary, str(index)))
+                stored.append(index)
+        with open(os.path.join(temporary, 'outputs.json'), 'w') as _file:
+            json.dump(stored, _file)
+        try:
+            os.rename(temporary, self.entry(key))
+        except OSError:
+            # another process stored the same result first
+            shutil.rmtree(temporary, ignore_errors=True)
+
+    def record(self, event: str) -> None:
+        '''Count a hit or a miss for this run'''
+        if self.session is None:
+            return
+        with open(os.path.join(self.folder, 'sessions', self.session), 'a') as _file:
+            _file.write(event)
+
+    def get_stats(self) -> Tuple[int, int]:
+        '''
+        Count the hits and misses of this run.
+            Arguments:
+                None
+            Returns:
+                hits: the number of results restored from the cache
+                misses: the number of results that had to be computed
+        '''
+        try:
+            with open(os.path.join(self.folder, 'sessions', self.session)) as _file:
+                events = _file.read()
+        except (FileNotFoundError, TypeError):
+            return 0, 0
+        return events.count(HIT), events.count(MISS)
+
+    def evict(self) -> None:
+        '''
+        Remove the least recently used entries until the cache fits its size limit.
+            Arguments:
+                None
+            Returns:
+                None
+        '''
+        entries: List[Tuple[float, int, str]] = []
+        for name in os.listdir(os.path.join(self.folder, 'entries')):
+            entry = self.entry(name)
+            try:
+                entries.append((os.path.getmtime(entry), get_size(entry), entry))
+            except FileNotFoundError:
+                continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+        # temporary folders left behind by interrupted runs
+        tmp_folder = os.path.join(self.folder, 'tmp')
+        for name in os.listdir(tmp_folder):
+            path = os.path.join(tmp_folder, name)
+            try:
+                if time.time() - os.path.getmtime(path) > 24 * 60 * 60:
+                    shutil.rmtree(path, ignore_errors=True)
+            except FileNotFoundError:
+                continue
+
+    def report(self) -> None:
+        '''Log the hits and misses of this run and apply the size limit'''
+        hits, misses = self.get_stats()
+        logging.info('Tool cache: %s hits, %s misses (%s).', hits, misses, self.folder)
+        if self.session is not None:
+            try:
+                os.remove(os.path.join(self.folder, 'sessions', self.session))
+            except FileNotFoundError:
+                pass
+        self.evict()
+
+def get_environment(folder: str = None, max_size: float = DEFAULT_CACHE_SIZE) -> Dict[str, str]:
+    '''
+    Get the settings of a cache with a new session (see utils.settings).
+        Arguments:
+            folder: path to the cache folder, or None to disable the cache
+            max_size: the size limit of the cache in GB
+        Returns:
+            environment: the environment variables of the settings
+    '''
+    if folder is None:
+        return {CACHE_ENV: '', CACHE_SIZE_ENV: '', SESSION_ENV: ''}
+    return {
+        CACHE_ENV: os.path.abspath(folder),
+        CACHE_SIZE_ENV: str(max_size),
+        SESSION_ENV: uuid.uuid4().hex
+        }
+
+def configure(folder: str, max_size: float = DEFAULT_CACHE_SIZE) -> ToolCache:
+    '''
+    Enable the cache for this process and the processes it starts.
+        Arguments:
+            folder: path to the cache folder
+            max_size: the size limit of the cache in GB
+        Returns:
+            cache: the configured cache
+    '''
+    settings.apply(get_environment(folder, max_size))
+    tool_cache = get_cache()
+    tool_cache.evict()
+    return tool_cache
+
+def get_cache() -> Optional[ToolCache]:
+    '''
+    Return the cache configured for this process.
+        Arguments:
+            None
+        Returns:
+            cache: the cache, or None if it is not enabled
+    '''
+    folder = settings.get(CACHE_ENV)
+    if not folder:
+        return None
+    return ToolCache(
+        folder,
+        float(settings.get(CACHE_SIZE_ENV) or DEFAULT_CACHE_SIZE),
+        settings.get(SESSION_ENV) or None
+        )
@@ -0,0 +1,263 @@
+'''
+A machine-wide pool of cpu tokens shared by concurrent runs.
+
+Classes:
+    LockFilePool
+    JobserverPool
+
+Functions:
+    configure(path: str, size: int = None) -> Optional[LockFilePool]
+    parse_makeflags(makeflags: str) -> Optional[str]
+    get_pool() -> Optional[Union[LockFilePool, JobserverPool]]
+    take_tokens(cpus: int) -> Iterator[int]
+    get_tool_threads(threads: int = None) -> Optional[int]
+'''
+import contextlib
+import fcntl
+import logging
+import os
+import random
+import select
+import time
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+POOL_ENV = 'GETPHYLO_CPU_POOL'
+SIZE_ENV = 'GETPHYLO_CPU_POOL_SIZE'
+# seconds between attempts to take the token of a run
+POLL = 0.5
+
+class LockFilePool:
+    '''
+    A pool of cpu tokens kept as lock files in a shared folder. The locks are released by
+    the operating system when a run exits, so a crashed run cannot leak tokens.
+    '''
+    def __init__(self, path: str, size: int):
+        '''
+        Arguments:
+            path: path to the folder of lock files, created if it does not exist
+            size: the number of cpus in the pool
+        '''
+        self.path = path
+        self.size = size
+        # record locks belong to the process, so its own tokens are tracked here
+        self.held: Dict[int, int] = {}
+        os.makedirs(path, exist_ok=True)
+
+    def get_slot(self, index: int) -> str:
+        '''Return the path to the lock file of a token'''
+        return os.path.join(self.path, f'cpu_{index}.lock')
+
+    def try_acquire(self) -> Optional[int]:
+        '''
+        Take a free token without waiting.
+            Arguments:
+                None
+            Returns:
+                token: the number of the token, or None if all tokens are taken
+        '''
+        # runs start at different slots so that they rarely compete for the same lock
+        offset = random.randrange(self.size)
+        for index in range(self.size):
+            token = (offset + index) % self.size
+            if token in self.held:
+                continue
+            descriptor = os.open(self.get_slot(token), os.O_RDWR | os.O_CREAT)
+            try:
+                # record locks are not inherited by pool processes and are released on exit
+                fcntl.lockf(descriptor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(descriptor)
+                continue
+            self.held[token] = descriptor
+            return token
+        return None
+
+    def release(self, token: int) -> None:
+        '''Return a token to the pool'''
+        os.close(self.held.pop(token))
+
+    def acquire(self) -> int:
+        '''
+        Take a token, waiting until one is free.
+            Arguments:
+                None
+            Returns:
+                token: the number of the token
+        '''
+        token = self.try_acquire()
+        if token is None:
+            logging.info(
+                'All %s cpus of the pool in %s are in use. Waiting...', self.size, self.path
+                )
+        while token is None:
+            time.sleep(POLL)
+            token = self.try_acquire()
+        return token
+
+class JobserverPool:
+    '''
+    The tokens of a GNU make jobserver, provided in MAKEFLAGS by make -j or a workflow
+    manager
+    '''
+    def __init__(self, auth: str):
+        '''
+        Arguments:
+            auth: the value of --jobserver-auth, either fifo:PATH or the descriptors R,W
+        '''
+        self.auth = auth
+        self.read_fd, self.write_fd, self.nonblocking = self.open(auth)
+
+    @staticmethod
+    def open(auth: str) -> Tuple[int, int, bool]:
+        '''
+        Open the jobserver for reading tokens without blocking.
+            Arguments:
+                auth: the value of --jobserver-auth
+            Returns:
+                read_fd: the descriptor tokens are read from
+                write_fd: the descriptor tokens are returned to
+                nonblocking: False if reads may block and have to be guarded by select
+        '''
+        if auth.startswith('fifo:'):
+            descriptor = os.open(auth[len('fifo:'):], os.O_RDWR | os.O_NONBLOCK)
+            return descriptor, descriptor, True
+        read_fd, write_fd = [int(descriptor) for descriptor in auth.split(',')]
+        # raises OSError if make did not pass the descriptors on
+        os.fstat(read_fd)
+        os.fstat(write_fd)
+        # reopening the pipe gives a nonblocking descriptor without changing the one make shares
+        try:
+            return os.open(f'/proc/self/fd/{read_fd}', os.O_RDONLY | os.O_NONBLOCK), write_fd, True
+        except OSError:
+            return read_fd, write_fd, False
+
+    def try_acquire(self) -> Optional[bytes]:
+        '''
+        Take a free token without waiting.
+            Arguments:
+                None
+            Returns:
+                token: the byte read from the jobserver, or None if all tokens are taken
+        '''
+        if not self.nonblocking and not select.select([self.read_fd], [], [], 0)[0]:
+            return None
+        try:
+            token = os.read(self.read_fd, 1)
+        except (BlockingIOError, InterruptedError):
+            return None
+        return token or None
+
+    def release(self, token: bytes) -> None:
+        '''Return a token to the jobserver'''
+        os.write(self.write_fd, token)
+
+def configure(path: str, size: int = None) -> Optional[LockFilePool]:
+    '''
+    Share the cpus of this process and the processes it starts with other runs, waiting
+    until the pool has a token for this run.
+        Arguments:
+            path: path to the folder of lock files, or None to only use a make jobserver
+            size: the number of cpus in the pool, or None for all cpus of the machine
+        Returns:
+            pool: the configured pool, or None if no folder was given
+    '''
+    if path is None:
+        os.environ.pop(POOL_ENV, None)
+        os.environ.pop(SIZE_ENV, None)
+        return None
+    os.environ[POOL_ENV] = os.path.abspath(path)
+    os.environ[SIZE_ENV] = str(size or os.cpu_count() or 1)
+    return get_pool()
+
+def parse_makeflags(makeflags: str) -> Optional[str]:
+    '''
+    Find the jobserver in the MAKEFLAGS set by make for its recipes.
+        Arguments:
+            makeflags: the value of MAKEFLAGS
+        Returns:
+            auth: the value of the last --jobserver-auth (or --jobserver-fds before make 4.2),
+            or None if make is not running a jobserver
+    '''
+    auth = None
+    for flag in makeflags.split():
+        for option in ['--jobserver-auth=', '--jobserver-fds=']:
+            if flag.startswith(option):
+                auth = flag[len(option):]
+    # negative descriptors mean that the jobserver is disabled
+    if auth is not None and auth.startswith('-'):
+        return None
+    return auth
+
+_pools: dict = {}
+# the tokens held by each run for itself, released when the process exits
+_own_tokens: List = []
+
+def get_pool() -> Optional[Union[LockFilePool, JobserverPool]]:
+    '''
+    Return the pool configured for this process, taking the token of the run the first
+    time a lock file pool is used. Every run holds one token of its own, and the process
+    that starts the tasks takes an extra token for each task it runs beside the first.
+        Arguments:
+            None
+        Returns:
+            pool: the pool, or None if cpus are not shared
+    '''
+    path = os.environ.get(POOL_ENV)
+    auth = None if path else parse_makeflags(os.environ.get('MAKEFLAGS', ''))
+    key = (os.getpid(), path, auth)
+    if key in _pools:
+        return _pools[key]
+    pool = None
+    if path:
+        pool = LockFilePool(path, int(os.environ.get(SIZE_ENV, os.cpu_count() or 1)))
+        _own_tokens.append(pool.acquire())
+    elif auth is not None:
+        try:
+            # make counts one implicit token for each job it starts
+            pool = JobserverPool(auth)
+        except (OSError, ValueError) as error:
+            logging.warning(
+                'The make jobserver in MAKEFLAGS cannot be used (%s). '
+                'Mark the recipe with + to share the cpus of make -j.', error
+                )
+    _pools[key] = pool
+    return pool
+
+@contextlib.contextmanager
+def take_tokens(cpus: int) -> Iterator[int]:
+    '''
+    Take the tokens for a multithreaded tool that runs on its own, outside a parallel stage.
+    The tool runs on the token of the run and as many free tokens as the pool has, up to
+    the cpus of the run.
+        Arguments:
+            cpus: the number of cpus of the run
+        Returns:
+            threads: the number of threads the tool may use
+    '''
+    pool = get_pool()
+    tokens = []
+    try:
+        while pool is not None and 1 + len(tokens) < cpus:
+            token = pool.try_acquire()
+            if token is None:
+                break
+            tokens.append(token)
+        yield cpus if pool is None else 1 + len(tokens)
+    finally:
+        for token in tokens:
+            pool.release(token)
+
+def get_tool_threads(threads: int = None) -> Optional[int]:
+    '''
+    Choose the number of threads passed to an external tool. Without a pool the tool keeps
+    its own default. The pool is read from the environment, as get_pool would take a token
+    in a pool process.
+        Arguments:
+            threads: the tokens held by a tool that runs on its own, or None for a tool run
+                by a parallel task, which holds one token
+        Returns:
+            threads: the number of threads for the tool, or None to leave it to the tool
+    '''
+    if not os.environ.get(POOL_ENV) and parse_makeflags(os.environ.get('MAKEFLAGS', '')) is None:
+        return None
+    return 1 if threads is None else threads
@@ -53,6 +53,14 @@ class BadExecutableError(GetphyloError):
     '''Called when a non-existant executable path is provided'''
     pass
 
+class OutOfMemoryError(GetphyloError):
+    '''Called when an external process is killed for using too much memory'''
+    pass
+
+class TaskTimeoutError(GetphyloError):
+    '''Called when an external process runs for longer than the task timeout'''
+    pass
+
 class BadMethodError(GetphyloError):
     '''
     Called if a phylogentic tool is defined that is not 'fasttree' or 'iqtree'
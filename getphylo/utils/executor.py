@@ -0,0 +1,618 @@
+'''
+Run tasks in parallel without losing finished results when one of them fails.
+
+Classes:
+    TaskFailure
+    GraphTask
+    TaskGraph
+
+Functions:
+    get_environment(
+        timeout: float = None, retries: int = DEFAULT_RETRIES, report: str = None
+        ) -> Dict[str, str]
+    configure(timeout: float = None, retries: int = DEFAULT_RETRIES, report: str = None) -> None
+    get_timeout() -> Optional[float]
+    get_retries() -> int
+    run_task(function: Callable, args: List, reduce_memory: Callable = None)
+    record_failures(failures: List[TaskFailure]) -> None
+    stop_process(process: subprocess.Popen) -> None
+    exit_on_signal(signum: int, frame) -> None
+    init_worker(environment: Dict[str, str] = None) -> None
+    make_pool(cpus: int, environment: Dict[str, str] = None) -> multiprocessing.pool.Pool
+    stop_workers(existing: Set) -> None
+    run_tasks(
+        function: Callable, args_list: List[List], cpus: int, estimates: List[int] = None,
+        budget: int = None, reduce_memory: Callable = None, tolerate_failures: bool = False,
+        pool: multiprocessing.pool.Pool = None
+        ) -> List
+'''
+import bisect
+import json
+import logging
+import multiprocessing
+import multiprocessing.pool
+import os
+import queue
+import signal
+import subprocess
+import time
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Set
+
+from getphylo.utils import cpupool, memory, profiler, settings, timeline
+from getphylo.utils.errors import OutOfMemoryError, TaskTimeoutError
+
+TIMEOUT_ENV = 'GETPHYLO_TASK_TIMEOUT'
+RETRIES_ENV = 'GETPHYLO_TASK_RETRIES'
+REPORT_ENV = 'GETPHYLO_FAILURE_REPORT'
+DEFAULT_RETRIES = 1
+# seconds before the first retry, doubled for each further retry
+BACKOFF = 2.0
+# errors from external tools that may succeed when run again
+RETRYABLE_ERRORS = (RuntimeError, TaskTimeoutError)
+# seconds between checks for a free token of a shared cpu pool
+TOKEN_POLL = 0.2
+
+class TaskFailure(NamedTuple):
+    '''A task that could not be completed'''
+    index: int
+    function: str
+    args: List
+    error: BaseException
+    attempts: int
+    seconds: float
+
+    def to_dict(self) -> Dict:
+        '''Return the failure in a form that can be written as json'''
+        return {
+            'index': self.index,
+            'function': self.function,
+            'args': [str(arg) for arg in self.args],
+            'error': type(self.error).__name__,
+            'message': str(self.error),
+            'attempts': self.attempts,
+            'seconds': round(self.seconds, 3)
+            }
+
+def get_environment(
+        timeout: float = None, retries: int = DEFAULT_RETRIES, report: str = None
+    ) -> Dict[str, str]:
+    '''
+    Get the settings of the timeout, retries and failure report (see utils.settings).
+        Arguments:
+            timeout: the longest an external tool may run in seconds, or None for no limit
+            retries: the number of times a failed task is run again
+            report: path to the file that failures are appended to
+        Returns:
+            environment: the environment variables of the settings
+    '''
+    return {
+        TIMEOUT_ENV: '' if timeout is None else str(timeout),
+        RETRIES_ENV: str(retries),
+        REPORT_ENV: '' if report is None else os.path.abspath(report)
+        }
+
+def configure(timeout: float = None, retries: int = DEFAULT_RETRIES, report: str = None) -> None:
+    '''
+    Set the timeout, retries and failure report for this process and the processes it starts.
+        Arguments:
+            timeout: the longest an external tool may run in seconds, or None for no limit
+            retries: the number of times a failed task is run again
+            report: path to the file that failures are appended to
+        Returns:
+            None
+    '''
+    settings.apply(get_environment(timeout, retries, report))
+
+def get_timeout() -> Optional[float]:
+    '''Return the task timeout in seconds, or None if there is no limit'''
+    timeout = settings.get(TIMEOUT_ENV)
+    return float(timeout) if timeout else None
+
+def get_retries() -> int:
+    '''Return the number of times a failed task is run again'''
+    return int(settings.get(RETRIES_ENV) or DEFAULT_RETRIES)
+
+def run_task(function: Callable, args: List, reduce_memory: Callable = None):
+    '''
+    Call a function, retrying with backoff if an external tool fails or times out, and with
+    lower memory arguments if it runs out of memory.
+        Arguments:
+            function: the function to be called
+            args: the arguments for the function
+            reduce_memory: takes the arguments of a call that ran out of memory
+                and returns lower memory ones
+        Returns:
+            the return value of the function
+    '''
+    retries = get_retries()
+    for attempt in range(retries + 1):
+        try:
+            with timeline.task_span(function, args):
+                return profiler.profile_task(
+                    memory.call_with_retries, [function, args, reduce_memory]
+                    )
+        except RETRYABLE_ERRORS as error:
+            if attempt == retries:
+                # kept when the error is sent back from a pool process
+                error.attempts = attempt + 1
+                raise
+            delay = BACKOFF * 2 ** attempt
+            logging.warning('Task failed, retrying in %s seconds: %s', delay, error)
+            time.sleep(delay)
+
+def record_failures(failures: List[TaskFailure]) -> None:
+    '''
+    Log failed tasks and append them to the failure report.
+        Arguments:
+            failures: the failed tasks
+        Returns:
+            None
+    '''
+    for failure in failures:
+        logging.error(
+            'Task %s of %s failed after %s attempt(s): %s',
+            failure.index, failure.function, failure.attempts, failure.error
+            )
+    report = settings.get(REPORT_ENV)
+    if not report:
+        return
+    with open(report, 'a') as _file:
+        for failure in failures:
+            _file.write(json.dumps(failure.to_dict()) + '\n')
+
+def stop_process(process: subprocess.Popen) -> None:
+    '''
+    Terminate an external tool, killing it if it does not exit.
+        Arguments:
+            process: the running tool
+        Returns:
+            None
+    '''
+    process.terminate()
+    try:
+        process.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+def exit_on_signal(signum: int, frame) -> None:
+    '''Exit through the normal cleanup path so that running tools are terminated'''
+    raise SystemExit(128 + signum)
+
+def init_worker(environment: Dict[str, str] = None) -> None:
+    '''
+    Set up a pool process. Each pool process leads its own process group with the tools it
+    starts, so that interrupts only reach the main process, which stops the whole group.
+        Arguments:
+            environment: optional settings of the pool (see utils.settings)
+        Returns:
+            None
+    '''
+    os.setpgrp()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    profiler.init_worker()
+    if environment is not None:
+        settings.apply(environment)
+
+def make_pool(cpus: int, environment: Dict[str, str] = None) -> multiprocessing.pool.Pool:
+    '''
+    Start a pool of processes for running tasks.
+        Arguments:
+            cpus: the number of processes
+            environment: optional settings of the pool processes (see utils.settings)
+        Returns:
+            pool: the pool
+    '''
+    return multiprocessing.Pool(cpus, initializer=init_worker, initargs=(environment,))
+
+def stop_workers(existing: Set) -> None:
+    '''
+    Terminate the process groups of the pool processes and the tools they are running.
+        Arguments:
+            existing: child processes that were running before the pool was started
+        Returns:
+            None
+    '''
+    for child in multiprocessing.active_children():
+        if child in existing:
+            continue
+        try:
+            os.killpg(child.pid, signal.SIGTERM)
+        except (ProcessLookupError, PermissionError):
+            # not yet in its own group; the pool terminates it directly
+            pass
+
+def get_failure(
+        index: int, function: Callable, args: List, error: BaseException, start: float
+    ) -> TaskFailure:
+    '''Describe a failed task'''
+    return TaskFailure(
+        index, function.__name__, args, error, getattr(error, 'attempts', 1),
+        time.monotonic() - start
+        )
+
+class GraphTask(NamedTuple):
+    '''A task of a TaskGraph'''
+    function: Callable
+    after: List[int]
+    reduce_memory: Optional[Callable]
+    tolerate_failure: bool
+    exclusive: bool = False
+
+class TaskGraph:
+    '''
+    Tasks that start as soon as the tasks they depend on have finished.
+
+    A stage adds the work for each item as soon as the item is ready, instead of waiting
+    for every item of the previous step, and waits only for the results it needs. Ready
+    tasks are started in the order they were added, within the cpus, the memory budget and
+    the tokens of a shared cpu pool, so the order of the results and of the failure report
+    does not depend on which task finished first. A task whose dependency failed is skipped.
+    '''
+    def __init__(
+            self, cpus: int, budget: int = None, runner: Callable = None,
+            pool: multiprocessing.pool.Pool = None
+        ):
+        '''
+        Arguments:
+            cpus: the number of cpus available
+            budget: optional total memory available to the running tasks in bytes
+            runner: optional function that runs the ready tasks of one function elsewhere
+                (e.g. the work queue of a distributed run) as in utils.io.run_in_parallel
+            pool: optional long-lived pool (see make_pool) that the graph uses instead of
+                starting its own, and leaves running when it is closed
+        '''
+        self.cpus = cpus
+        self.budget = budget or 0
+        self.runner = runner
+        self.tasks: List[GraphTask] = []
+        self.args: List[List] = []
+        self.estimates: List[int] = []
+        self.attempts: List[int] = []
+        self.results: Dict[int, Any] = {}
+        self.failures: Dict[int, TaskFailure] = {}
+        # tasks that have not started, in the order they were added
+        self.waiting: List[int] = []
+        self.running: Dict[int, float] = {}
+        self.in_use = 0
+        self.finished = queue.Queue()
+        self.cpu_pool = None
+        self.tokens = {}
+        # the exclusive task that is running and the extra tokens it holds
+        self.alone = None
+        self.alone_tokens: List = []
+        self.pool = pool
+        self.own_pool = pool is None
+        self.started = False
+        self.existing = set()
+        # set when a task that may not fail has failed, after which no tasks are started
+        self.stopped = False
+
+    def __enter__(self) -> 'TaskGraph':
+        return self
+
+    def __exit__(self, error_type, error, traceback) -> None:
+        # tools still running when the run is interrupted are stopped with their workers
+        if error_type is not None and self.running and self.own_pool:
+            stop_workers(self.existing)
+        self.close()
+
+    def add(
+            self, function: Callable, args: List, after: Iterable[int] = (), estimate: int = 0,
+            reduce_memory: Callable = None, tolerate_failure: bool = False,
+            exclusive: bool = False
+        ) -> int:
+        '''
+        Add a task, starting it straight away if it is ready.
+            Arguments:
+                function: the function to be called
+                args: the arguments for the function
+                after: the tasks that have to finish before this one starts
+                estimate: optional estimated memory of the call in bytes
+                reduce_memory: takes the arguments of a call that ran out of memory
+                    and returns lower memory ones
+                tolerate_failure: give None as the result if the task fails instead of
+                    stopping the graph
+                exclusive: run the task on its own once the running tasks have finished,
+                    before the waiting tasks added earlier, with the number of cpus it may
+                    use (those of the graph, or the free tokens of a shared cpu pool) given
+                    as its last argument
+            Returns:
+                index: the index of the task
+        '''
+        index = len(self.tasks)
+        after = list(after)
+        if any(dependency >= index for dependency in after):
+            raise ValueError('Tasks can only depend on tasks added before them.')
+        self.tasks.append(GraphTask(function, after, reduce_memory, tolerate_failure, exclusive))
+        self.args.append(list(args))
+        self.estimates.append(estimate)
+        self.attempts.append(0)
+        if exclusive:
+            self.waiting.insert(0, index)
+        else:
+            self.waiting.append(index)
+        self.poll()
+        return index
+
+    def get_args(self, index: int, cpus: int) -> List:
+        '''Return the arguments of a task, with the cpus it may use if it is exclusive'''
+        if self.tasks[index].exclusive:
+            return self.args[index] + [cpus]
+        return self.args[index]
+
+    def is_finished(self, index: int) -> bool:
+        '''Return True if a task has finished or failed'''
+        return index in self.results or index in self.failures
+
+    def fail(self, index: int, error: BaseException, start: float) -> None:
+        '''Record a failed task'''
+        task = self.tasks[index]
+        failure = get_failure(index, task.function, self.args[index], error, start)
+        self.failures[index] = failure
+        record_failures([failure])
+        if not task.tolerate_failure:
+            self.stopped = True
+
+    def skip_failed_dependencies(self, index: int) -> bool:
+        '''Skip a ready task if one of its dependencies failed, returning True if it was'''
+        failed = [
+            dependency for dependency in self.tasks[index].after if dependency in self.failures
+            ]
+        if not failed:
+            return False
+        self.waiting.remove(index)
+        task = self.tasks[index]
+        logging.warning(
+            'Task %s of %s was skipped because task %s failed.',
+            index, task.function.__name__, failed[0]
+            )
+        self.failures[index] = TaskFailure(
+            index, task.function.__name__, self.args[index], self.failures[failed[0]].error,
+            0, 0.0
+            )
+        if not task.tolerate_failure:
+            self.stopped = True
+        return True
+
+    def start_ready(self) -> bool:
+        '''
+        Start the ready tasks in order while there are cpus, memory and tokens for them.
+            Arguments:
+                None
+            Returns:
+                waiting_for_token: True if a ready task is waiting for a token of the cpu pool
+        '''
+        if not self.started:
+            self.started = True
+            if self.own_pool:
+                self.existing = set(multiprocessing.active_children())
+                self.pool = make_pool(self.cpus)
+            self.cpu_pool = cpupool.get_pool()
+        for index in list(self.waiting):
+            if self.stopped or len(self.running) >= self.cpus or self.alone is not None:
+                break
+            task = self.tasks[index]
+            if not all(self.is_finished(dependency) for dependency in task.after):
+                continue
+            if self.skip_failed_dependencies(index):
+                continue
+            # an exclusive task keeps its place until the running tasks have finished
+            if task.exclusive and self.running:
+                break
+            # a task larger than the budget runs on its own
+            estimate = self.estimates[index]
+            if self.running and self.budget and self.in_use + estimate > self.budget:
+                break
+            cpus = 1
+            if task.exclusive:
+                self.alone = index
+                while self.cpu_pool is not None and len(self.alone_tokens) + 1 < self.cpus:
+                    token = self.cpu_pool.try_acquire()
+                    if token is None:
+                        break
+                    self.alone_tokens.append(token)
+                cpus = self.cpus if self.cpu_pool is None else len(self.alone_tokens) + 1
+            # one task at a time runs on the token of the run itself
+            elif self.cpu_pool is not None and len(self.running) > len(self.tokens):
+                token = self.cpu_pool.try_acquire()
+                if token is None:
+                    return True
+                self.tokens[index] = token
+            self.waiting.remove(index)
+            self.running[index] = time.monotonic()
+            timeline.count('active jobs', len(self.running))
+            self.in_use += estimate
+            self.pool.apply_async(
+                run_task, (task.function, self.get_args(index, cpus)),
+                callback=lambda result, index=index: self.finished.put((index, result, None)),
+                error_callback=lambda error, index=index: self.finished.put((index, None, error))
+                )
+        return False
+
+    def collect(self, timeout: float = None) -> bool:
+        '''
+        Collect a finished task from the pool.
+            Arguments:
+                timeout: seconds to wait for a task to finish, 0 to not wait or None to
+                    wait as long as it takes
+            Returns:
+                collected: False if no task finished in time
+        '''
+        try:
+            # waiting is not counted as Python time of the stage (see utils.profiler)
+            with profiler.paused():
+                index, result, error = self.finished.get(timeout != 0, timeout)
+        except queue.Empty:
+            return False
+        start = self.running.pop(index)
+        timeline.count('active jobs', len(self.running))
+        self.in_use -= self.estimates[index]
+        if index in self.tokens:
+            self.cpu_pool.release(self.tokens.pop(index))
+        if index == self.alone:
+            self.release_alone_tokens()
+        task = self.tasks[index]
+        if error is None:
+            self.results[index] = result
+        elif (
+                isinstance(error, OutOfMemoryError)
+                and task.reduce_memory is not None
+                and self.attempts[index] < memory.MAX_RETRIES
+            ):
+            logging.warning(
+                'Job ran out of memory, retrying with lower memory settings: %s', self.args[index]
+                )
+            self.args[index] = task.reduce_memory(self.args[index])
+            self.estimates[index] //= 2
+            self.attempts[index] += 1
+            bisect.insort(self.waiting, index)
+        else:
+            self.fail(index, error, start)
+        return True
+
+    def poll(self) -> None:
+        '''Start the tasks that have become ready without waiting for any to finish'''
+        if self.runner is not None or self.cpus <= 1:
+            return
+        self.start_ready()
+        while self.collect(0):
+            self.start_ready()
+
+    def run_in_order(self, last: int) -> None:
+        '''
+        Run the waiting tasks up to a given index without a local pool: in this process one
+        at a time, or with the runner in rounds of the tasks that are ready.
+            Arguments:
+                last: the index of the last task to run
+            Returns:
+                None
+        '''
+        while not self.stopped:
+            ready = [
+                index for index in self.waiting if index <= last
+                and all(self.is_finished(dependency) for dependency in self.tasks[index].after)
+                ]
+            ready = [index for index in ready if not self.skip_failed_dependencies(index)]
+            if not ready:
+                return
+            if self.runner is None:
+                index = ready[0]
+                self.waiting.remove(index)
+                task = self.tasks[index]
+                start = time.monotonic()
+                timeline.count('active jobs', 1)
+                try:
+                    self.results[index] = run_task(
+                        task.function, self.get_args(index, self.cpus), task.reduce_memory
+                        )
+                except Exception as error:
+                    self.fail(index, error, start)
+                timeline.count('active jobs', 0)
+                continue
+            # the ready tasks of the first function are run together
+            task = self.tasks[ready[0]]
+            batch = [
+                index for index in ready if self.tasks[index].function is task.function
+                and self.tasks[index].reduce_memory is task.reduce_memory
+                and self.tasks[index].tolerate_failure == task.tolerate_failure
+                ]
+            for index in batch:
+                self.waiting.remove(index)
+            timeline.count('active jobs', len(batch))
+            results = self.runner(
+                task.function, [self.get_args(index, self.cpus) for index in batch],
+                task.reduce_memory, task.tolerate_failure
+                )
+            timeline.count('active jobs', 0)
+            self.results.update(zip(batch, results))
+
+    def wait(self, indices: Iterable[int]) -> List:
+        '''
+        Wait for tasks to finish. If a task that may not fail has failed, the running tasks
+        are left to finish and its error is raised.
+            Arguments:
+                indices: the indices of the tasks
+            Returns:
+                results: the return value of each task, or None for failed tasks
+        '''
+        indices = list(indices)
+        # the main process waiting shows where a stage is held up by its slowest tasks
+        with timeline.span('wait', 'wait', {
+                'tasks': len(indices),
+                'functions': sorted({self.tasks[index].function.__name__ for index in indices})
+            }):
+            if self.runner is not None or self.cpus <= 1:
+                self.run_in_order(max(indices, default=-1))
+            else:
+                while not all(self.is_finished(index) for index in indices):
+                    waiting_for_token = self.start_ready()
+                    if not self.running:
+                        break
+                    self.collect(TOKEN_POLL if waiting_for_token else None)
+        if self.stopped:
+            while self.running:
+                self.collect()
+            raise next(
+                failure.error for failure in self.failures.values()
+                if not self.tasks[failure.index].tolerate_failure
+                )
+        return [self.results.get(index) for index in indices]
+
+    def close(self) -> None:
+        '''Stop the pool unless it is shared and return the tokens of the cpu pool'''
+        if self.pool is not None and self.own_pool:
+            self.pool.terminate()
+        self.pool = None
+        for token in self.tokens.values():
+            self.cpu_pool.release(token)
+        self.tokens = {}
+        self.release_alone_tokens()
+
+    def release_alone_tokens(self) -> None:
+        '''Return the extra tokens of the exclusive task to the cpu pool'''
+        for token in self.alone_tokens:
+            self.cpu_pool.release(token)
+        self.alone_tokens = []
+        self.alone = None
+
+def run_tasks(
+        function: Callable, args_list: List[List], cpus: int, estimates: List[int] = None,
+        budget: int = None, reduce_memory: Callable = None, tolerate_failures: bool = False,
+        pool: multiprocessing.pool.Pool = None
+    ) -> List:
+    '''
+    Run tasks in parallel. When a memory budget is given, a task is only started while the
+    estimated memory of all running tasks fits within it. When cpus are shared with other
+    runs (see utils.cpupool), each task beside the first only starts once it has a token.
+    Tasks that run out of memory are retried with the arguments returned by reduce_memory.
+        Arguments:
+            function: the function to be called
+            args_list: list of lists containing the arguments for each call of the function
+            cpus: the number of cpus available
+            estimates: optional estimated memory of each call in bytes
+            budget: optional total memory available in bytes
+            reduce_memory: takes the arguments of a failed call and returns lower memory ones
+            tolerate_failures:
+                return None for failed tasks instead of raising the first error once the
+                running tasks have finished
+            pool: optional long-lived pool to run the tasks in (see TaskGraph)
+        Returns:
+            return_value: a list of return values for each call of the function
+    '''
+    if estimates is None or budget is None:
+        estimates = [0] * len(args_list)
+        budget = None
+    with TaskGraph(cpus, budget, pool=pool) as graph:
+        indices = [
+            graph.add(function, args, (), estimate, reduce_memory, tolerate_failures)
+            for args, estimate in zip(args_list, estimates)
+            ]
+        return_value = graph.wait(indices)
+    if graph.failures:
+        logging.warning(
+            '%s of %s %s tasks failed and were skipped.',
+            len(graph.failures), len(args_list), function.__name__
+            )
+    return return_value
@@ -0,0 +1,168 @@
+'''
+Read CDS features from GFF3 files with a genome FASTA.
+
+Functions:
+    parse_attributes(column: str) -> Dict[str, str]
+    read_cds_rows(handle: TextIO) -> Iterator[CdsRow]
+    get_cds_features(
+        rows: Iterable[CdsRow]
+        ) -> Dict[str, List[Tuple[Dict[str, str], SeqFeature]]]
+    get_sequence_path(filename: str) -> str
+    get_cds_translations(
+        filename: str, tag_label: str
+        ) -> Iterator[Tuple[str, Optional[str], str]]
+'''
+import itertools
+import os
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, TextIO, Tuple
+from urllib.parse import unquote
+
+from getphylo.utils.translate import translate_features
+
+# extensions of the genome FASTA looked for next to a GFF3 file without a ##FASTA section
+SEQUENCE_EXTENSIONS = ['.fna', '.fasta', '.fa', '.fas']
+FASTA_DIRECTIVE = '##FASTA'
+
+class CdsRow(NamedTuple):
+    '''A row of a GFF3 file describing one segment of a CDS'''
+    seqid: str
+    start: int
+    end: int
+    strand: int
+    phase: int
+    attributes: Dict[str, str]
+
+def parse_attributes(column: str) -> Dict[str, str]:
+    '''
+    Read the attributes column of a GFF3 row.
+        Arguments:
+            column: the ninth column (e.g. 'ID=cds1;locus_tag=ABC_0001')
+        Returns:
+            attributes: {tag: value} with escaped characters decoded
+    '''
+    attributes = {}
+    for attribute in column.strip().split(';'):
+        tag, _, value = attribute.partition('=')
+        if tag:
+            attributes[unquote(tag.strip())] = unquote(value.strip())
+    return attributes
+
+def read_cds_rows(handle: TextIO) -> Iterator[CdsRow]:
+    '''
+    Read the CDS rows of a GFF3 file, stopping at the ##FASTA section.
+        Arguments:
+            handle: the open GFF3 file
+        Returns:
+            rows: the CDS rows in the order of the file, with 0-based half-open coordinates
+    '''
+    for line in handle:
+        if line.startswith(FASTA_DIRECTIVE):
+            return
+        if line.startswith('#') or not line.strip():
+            continue
+        columns = line.rstrip('\n').split('\t')
+        if len(columns) != 9:
+            raise ValueError(f'GFF3 rows need 9 tab separated columns: {line.strip()}')
+        if columns[2] != 'CDS':
+            continue
+        yield CdsRow(
+            unquote(columns[0]), int(columns[3]) - 1, int(columns[4]),
+            -1 if columns[6] == '-' else 1, 0 if columns[7] == '.' else int(columns[7]),
+            parse_attributes(columns[8])
+            )
+
+def get_cds_features(rows: Iterable[CdsRow]):
+    '''
+    Group CDS rows into features.
+        Arguments:
+            rows: the CDS rows of a GFF3 file
+        Returns:
+            features: {seqid: [(attributes, feature)]} in the order the features first appear
+    '''
+    from Bio.SeqFeature import (
+        AfterPosition, BeforePosition, CompoundLocation, FeatureLocation, SeqFeature
+        )
+    groups: Dict[Tuple[str, str], List[CdsRow]] = {}
+    for index, row in enumerate(rows):
+        # rows of one CDS share an ID, a CDS without an ID is a single row
+        key = (row.seqid, row.attributes.get('ID', f'#{index}'))
+        groups.setdefault(key, []).append(row)
+    features: Dict[str, List] = {}
+    for (seqid, _), segments in groups.items():
+        # the segments are joined in the order they are transcribed
+        segments.sort(key=lambda row: row.start, reverse=segments[0].strand == -1)
+        attributes = segments[0].attributes
+        first = min(segments, key=lambda row: row.start)
+        last = max(segments, key=lambda row: row.end)
+        parts = []
+        for row in segments:
+            # start_range and end_range mark CDSs that continue beyond the annotated ends
+            start = row.start
+            if row is first and 'start_range' in attributes:
+                start = BeforePosition(start)
+            end = row.end
+            if row is last and 'end_range' in attributes:
+                end = AfterPosition(end)
+            parts.append(FeatureLocation(start, end, row.strand))
+        qualifiers = {
+            'codon_start': [str(segments[0].phase + 1)],
+            'transl_table': [attributes.get('transl_table', '11')]
+            }
+        location = parts[0] if len(parts) == 1 else CompoundLocation(parts)
+        features.setdefault(seqid, []).append(
+            (attributes, SeqFeature(location, type='CDS', qualifiers=qualifiers))
+            )
+    return features
+
+def get_sequence_path(filename: str) -> str:
+    '''
+    Find the genome FASTA of a GFF3 file without a ##FASTA section.
+        Arguments:
+            filename: path to the GFF3 file
+        Returns:
+            path: path to the FASTA file with the same name
+    '''
+    prefix = os.path.splitext(filename)[0]
+    for extension in SEQUENCE_EXTENSIONS:
+        if os.path.exists(prefix + extension):
+            return prefix + extension
+    raise ValueError(
+        f'{filename} has no ##FASTA section and no genome FASTA was found next to it '
+        f'(expected one of {", ".join(prefix + extension for extension in SEQUENCE_EXTENSIONS)}).'
+        )
+
+def get_cds_translations(
+        filename: str, tag_label: str
+    ) -> Iterator[Tuple[str, Optional[str], str]]:
+    '''
+    Translate the CDS features of a GFF3 file from its genome sequence.
+        Arguments:
+            filename: path to the GFF3 file
+            tag_label: the attribute naming each CDS (e.g. 'locus_tag')
+        Returns:
+            cdses: (seqid, name or None if the attribute is missing, translation) for each
+            CDS, contig by contig in the order of the genome sequence. Features on contigs
+            without a sequence have an empty translation.
+    '''
+    from Bio import SeqIO
+    with open(filename) as _file:
+        features = get_cds_features(read_cds_rows(_file))
+        # the handle is left at the ##FASTA section if the file has one
+        records = SeqIO.parse(_file, 'fasta')
+        first = next(records, None)
+        if first is None:
+            records = SeqIO.parse(get_sequence_path(filename), 'fasta')
+        else:
+            records = itertools.chain([first], records)
+        for record in records:
+            if not features:
+                break
+            contig = features.pop(record.id, [])
+            if not contig:
+                continue
+            attributes, cdses = zip(*contig)
+            for cds_attributes, translation in zip(attributes, translate_features(record, cdses)):
+                yield record.id, cds_attributes.get(tag_label), translation
+    for seqid, contig in features.items():
+        for attributes, _ in contig:
+            yield seqid, attributes.get(tag_label), ''
@@ -5,24 +5,54 @@ Functions:
     get_locus(file:str, locus:str) -> str
     count_files(directory: str) -> int
     change_extension(filename: str, new_extension: str) -> str
+    get_input_format(filename: str) -> str
     get_records_from_genbank(filename: str) -> List
     make_folder(name: str) -> None
+    read_fasta(filename: str) -> Dict[str, str]
     read_file(filename: str) -> List[str]
     read_tsv(filename: str) -> List[str]
-    run_in_command_line(List[str])
-    run_in_parallel(function: Callable, args_list: Iterable[List], cpus: int) -> List
+    file_exists(filename: str) -> bool
+    get_file_size(filename: str) -> int
+    list_files(folder: str, extension: str) -> List[str]
+    run_in_command_line(
+        command: List[str], inputs: List[str] = (), outputs: List[str] = (), stdout: str = None,
+        env: Dict[str, str] = None
+        )
+    run_command(
+        command: List[str], inputs: List[str] = (), outputs: List[str] = (), stdout: str = None,
+        env: Dict[str, str] = None
+        )
+    remove_files(filenames: Iterable[str]) -> None
+    set_work_queue(work_queue: WorkQueue) -> None
+    run_in_parallel(
+        function: Callable, args_list: Iterable[List], cpus: int,
+        memory_estimates: List[int] = None, memory_budget: int = None,
+        reduce_memory: Callable = None, tolerate_failures: bool = False
+        ) -> List
+    make_task_graph(cpus: int, memory_budget: int = None) -> TaskGraph
+    write_fasta(filename: str, sequences: Dict[str, str]) -> None
     write_to_file(filename: str, write_lines: List[str]) -> None
 '''
 import csv
 import glob
-import multiprocessing
 import os
+import shutil
+import signal
 import subprocess
 import logging
-from typing import Callable, Iterable, List
-from Bio import SeqIO
+from typing import Callable, Dict, Iterable, List
 
-from getphylo.utils.errors import GetphyloError, FolderExistsError, BadExecutableError
+from getphylo.utils import cache, executor, profiler, store, timeline
+from getphylo.utils.errors import (
+    GetphyloError, FolderExistsError, BadExecutableError, OutOfMemoryError, TaskTimeoutError
+    )
+
+# inputs are read as genbank files unless their extension names another format
+PROTEIN_EXTENSIONS = ['.faa']
+GFF_EXTENSIONS = ['.gff', '.gff3']
+
+# when set, parallel jobs are sent to workers on other nodes instead of a local pool
+_work_queue = None
 
 def get_locus(fasta: List[str], locus: str) -> str:
     '''
@@ -66,6 +96,21 @@ def change_extension(filename: str, new_extension: str) -> str:
     new_filename = os.path.splitext(filename)[0] + '.' + new_extension
     return new_filename
 
+def get_input_format(filename: str) -> str:
+    '''
+    Get the format of an input genome from its extension.
+        Arguments:
+            filename: path to the input file
+        Returns:
+            input_format: 'protein' for protein fasta, 'gff' for GFF3 or 'genbank'
+    '''
+    extension = os.path.splitext(filename)[1].lower()
+    if extension in PROTEIN_EXTENSIONS:
+        return 'protein'
+    if extension in GFF_EXTENSIONS:
+        return 'gff'
+    return 'genbank'
+
 def get_records_from_genbank(filename: str) -> List:
     '''
     Use BioPython to get genbank records from a given file.
@@ -74,6 +119,8 @@ def get_records_from_genbank(filename: str) -> List:
         Returns:
             records: a list genbank records
     '''
+    # BioPython is slow to import, so only load it once genbank files are read
+    from Bio import SeqIO
     records = SeqIO.parse(filename, "genbank")
     return records
 
@@ -91,6 +138,30 @@ def make_folder(name: str) -> None:
             'For saftey, please remove the folder before continuing.'
             )
     os.mkdir(name)
+    artifact_store = store.get_store()
+    if artifact_store is not None and artifact_store.get_key(os.path.join(name, '_')):
+        # files left in the store by an earlier attempt at this stage
+        artifact_store.clear(name)
+
+def read_fasta(filename: str) -> Dict[str, str]:
+    '''
+    Read a fasta file into a dictionary.
+        Arguments:
+            filename: The file to be read
+        Returns:
+            sequences: dictionary of sequences keyed by the first word of each header
+    '''
+    sequences = {}
+    name = None
+    with store.open_file(filename) as _file:
+        for line in _file:
+            line = line.strip()
+            if line.startswith('>'):
+                name = line[1:].split()[0]
+                sequences[name] = []
+            elif line and name is not None:
+                sequences[name].append(line)
+    return {name: ''.join(lines) for name, lines in sequences.items()}
 
 def read_file(filename: str) -> List[str]:
     '''
@@ -100,7 +171,7 @@ def read_file(filename: str) -> List[str]:
         Returns:
             _file.readlines(): list of strings for each line of the file
     '''
-    with open(filename) as _file:
+    with store.open_file(filename) as _file:
         return _file.readlines()
 
 def read_tsv(filename: str) -> List[str]:
@@ -112,72 +183,271 @@ def read_tsv(filename: str) -> List[str]:
             list containing the lines of the .tsv file
     '''
     contents = []
-    with open(filename) as file:
+    with store.open_file(filename) as file:
         tsv_file = csv.reader(file, delimiter="\t")
         for line in tsv_file:
             contents.append(line)
     return contents
 
-def run_in_command_line(command: List[str]) -> None:
+def file_exists(filename: str) -> bool:
+    '''
+    Check whether a file exists on disk or in the artifact store.
+        Arguments:
+            filename: path to the file
+        Returns:
+            exists: True if the file exists
+    '''
+    if os.path.exists(filename):
+        return True
+    artifact_store = store.get_store()
+    return (
+        artifact_store is not None and artifact_store.get_key(filename) is not None
+        and artifact_store.exists(filename)
+        )
+
+def get_file_size(filename: str) -> int:
+    '''
+    Get the size of a file on disk or in the artifact store.
+        Arguments:
+            filename: path to the file
+        Returns:
+            size: the size of the file in bytes
+    '''
+    artifact_store = store.get_store()
+    if (
+            not os.path.exists(filename) and artifact_store is not None
+            and artifact_store.get_key(filename) is not None
+        ):
+        data = artifact_store.read(filename)
+        if data is not None:
+            return len(data)
+    return os.path.getsize(filename)
+
+def list_files(folder: str, extension: str) -> List[str]:
+    '''
+    List the files with an extension in a folder, including those in the artifact store.
+        Arguments:
+            folder: path to the folder
+            extension: the extension of the files (e.g. 'fasta')
+        Returns:
+            filenames: the sorted paths of the files
+    '''
+    filenames = set(glob.glob(os.path.join(folder, '*.' + extension)))
+    artifact_store = store.get_store()
+    if artifact_store is not None:
+        filenames.update(
+            filename for filename in artifact_store.list(folder)
+            if filename.endswith('.' + extension)
+            )
+    return sorted(filenames)
+
+def run_in_command_line(
+        command: List[str], inputs: List[str] = (), outputs: List[str] = (), stdout: str = None,
+        env: Dict[str, str] = None
+    ) -> None:
+    '''
+    Run a command, writing inputs kept in the artifact store to disk while it runs
+    and moving its outputs into the store afterwards.
+        Aruments:
+            command: list of strings containing the command for the terminal
+            inputs: paths to the files read by the command
+            outputs: paths to the files written by the command
+            stdout: optional path to write the standard output to, also listed in outputs
+            env: optional environment variables set for the command
+        Returns:
+            process: the process being run, or None if the outputs came from the cache
+    '''
+    artifact_store = store.get_store()
+    if artifact_store is None:
+        return run_command(command, inputs, outputs, stdout, env)
+    command, inputs, temporary = artifact_store.materialize(command, inputs)
+    try:
+        process = run_command(command, inputs, outputs, stdout, env)
+    finally:
+        if temporary is not None:
+            shutil.rmtree(temporary, ignore_errors=True)
+    artifact_store.ingest(outputs)
+    return process
+
+def run_command(
+        command: List[str], inputs: List[str] = (), outputs: List[str] = (), stdout: str = None,
+        env: Dict[str, str] = None
+    ) -> None:
     '''
     Convert a string into a command and run in the terminal.
+    If the tool cache is enabled and the outputs are given, the outputs of an identical
+    earlier command are restored from the cache instead. The command is stopped if it runs
+    for longer than the task timeout.
         Aruments:
             command: list of strings containing the command for the terminal
+            inputs: paths to the files read by the command
+            outputs: paths to the files written by the command
+            stdout: optional path to write the standard output to, also listed in outputs
+            env: optional environment variables set for the command
         Returns:
-            process: the process being run
+            process: the process being run, or None if the outputs came from the cache
     '''
     logging.debug(command)
+    tool_cache = cache.get_cache() if outputs else None
+    key = None
+    if tool_cache is not None:
+        key = tool_cache.get_key(command, list(inputs), list(outputs))
+        if key is not None and tool_cache.restore(key, list(outputs)):
+            logging.debug('Restored %s from the tool cache.', outputs)
+            return None
+    timeout = executor.get_timeout()
+    stdout_file = None if stdout is None else open(stdout, 'w')
     try:
-        with subprocess.Popen(
-            command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
-            ) as process:
-            _, stderr =process.communicate()
-            if process.returncode != 0:
-                raise RuntimeError(
-                    'Failed to run: ' + str(command)
-                    + 'with the following error ' + str(stderr))
-            return process
+        # the time of the tool is kept apart from the Python profile (see utils.profiler)
+        with timeline.tool_span(command, inputs), profiler.pause_for_tool(command[0]):
+            with subprocess.Popen(
+                command, stdout=subprocess.DEVNULL if stdout_file is None else stdout_file,
+                stderr=subprocess.PIPE, env=None if env is None else {**os.environ, **env}
+                ) as process:
+                try:
+                    _, stderr = process.communicate(timeout=timeout)
+                except subprocess.TimeoutExpired as error:
+                    executor.stop_process(process)
+                    remove_files(outputs)
+                    raise TaskTimeoutError(
+                        f'Stopped after {timeout} seconds while running: {command}'
+                        ) from error
+                except BaseException:
+                    # interrupted or terminated; do not leave the tool running
+                    executor.stop_process(process)
+                    raise
+                if process.returncode != 0:
+                    # partial outputs would be mistaken for results
+                    remove_files(outputs)
+                # the OOM killer sends SIGKILL; shells report this as 128 + 9
+                if process.returncode in (-signal.SIGKILL, 128 + signal.SIGKILL):
+                    raise OutOfMemoryError(
+                        'Killed while running: ' + str(command)
+                        + ' the process most likely ran out of memory.')
+                if process.returncode != 0:
+                    raise RuntimeError(
+                        'Failed to run: ' + str(command)
+                        + 'with the following error ' + str(stderr))
     except FileNotFoundError as error:
+        remove_files(outputs)
         raise BadExecutableError(
             'getphylo could not find an executable, ' +
             'please ensure the correct paths to all executables are provided'
             ) from error
+    finally:
+        if stdout_file is not None:
+            stdout_file.close()
+    if key is not None:
+        tool_cache.store(key, list(outputs))
+    return process
+
+def remove_files(filenames: Iterable[str]) -> None:
+    '''
+    Remove files if they exist.
+        Arguments:
+            filenames: paths to the files
+        Returns:
+            None
+    '''
+    artifact_store = store.get_store()
+    for filename in filenames:
+        try:
+            os.remove(filename)
+        except FileNotFoundError:
+            pass
+        if artifact_store is not None and artifact_store.get_key(filename) is not None:
+            artifact_store.remove(filename)
 
-def run_in_parallel(function: Callable, args_list: Iterable[List], cpus: int) -> List:
+def set_work_queue(work_queue) -> None:
+    '''
+    Send all subsequent parallel jobs to a shared filesystem work queue.
+        Arguments:
+            work_queue: a getphylo.utils.workqueue.WorkQueue, or None to run locally
+        Returns:
+            None
+    '''
+    global _work_queue
+    _work_queue = work_queue
+
+def run_in_parallel(
+        function: Callable, args_list: Iterable[List], cpus: int,
+        memory_estimates: List[int] = None, memory_budget: int = None,
+        reduce_memory: Callable = None, tolerate_failures: bool = False
+    ) -> List:
     '''
     Run a given function on avaliable cpus. If only 1 cpu is available, run as normal.
+    A failed call does not discard the results of the others (see utils.executor).
         Arguments:
             function: the function to be called
             args_list: Iterable of lists containing the arguments for each call of the function
             cpus: the number of cpus available
+            memory_estimates: optional estimated memory of each call in bytes
+            memory_budget: optional total memory available in bytes
+            reduce_memory:
+                optional function taking the arguments of a call that ran out of memory
+                and returning arguments that use less memory
+            tolerate_failures: return None for failed calls instead of raising an error
         Returns:
             return_value: a list of return values for each call of the function
     '''
-    if cpus <= 1:
-        return_value = [function(*args) for args in args_list]
-    else:
-        for item in args_list:
-            try:
-                iter(item)
-            except TypeError as error:
-                raise GetphyloError from error
+    args_list = list(args_list)
+    for item in args_list:
         try:
-            with multiprocessing.Pool(cpus) as pool:
-                results = pool.starmap_async(function, args_list)
-                return_value = results.get()
-        except Exception:
-            raise
-    return return_value
+            iter(item)
+        except TypeError as error:
+            raise GetphyloError from error
+    if _work_queue is not None:
+        return _work_queue.run(function, args_list, reduce_memory, tolerate_failures)
+    if memory_budget is None or memory_estimates is None:
+        memory_estimates, memory_budget = None, None
+    return executor.run_tasks(
+        function, args_list, cpus, memory_estimates, memory_budget, reduce_memory,
+        tolerate_failures
+        )
+
+def make_task_graph(cpus: int, memory_budget: int = None) -> executor.TaskGraph:
+    '''
+    Create a task graph whose tasks start as soon as the tasks they depend on have finished.
+    In a distributed run the tasks that are ready are sent to the work queue together.
+        Arguments:
+            cpus: the number of cpus available
+            memory_budget: optional total memory available to the tasks in bytes
+        Returns:
+            graph: the task graph, to be used as a context manager
+    '''
+    runner = None if _work_queue is None else _work_queue.run
+    return executor.TaskGraph(cpus, memory_budget, runner)
+
+def write_fasta(filename: str, sequences: Dict[str, str]) -> None:
+    '''
+    Write a dictionary of sequences to a new fasta file.
+        Arguments:
+            filename: path to the new file being written
+            sequences: dictionary of sequences keyed by name
+        Returns:
+            None
+    '''
+    lines = []
+    for name, sequence in sequences.items():
+        lines.append('>' + name)
+        lines.append(sequence)
+    write_to_file(filename, lines)
 
 def write_to_file(filename: str, write_lines: List[str]) -> None:
     '''
-    Write a list line by line into a new file.
+    Write a list line by line into a new file, or the artifact store if it is kept there.
         Arguments:
             filename: path to the new file being written
             write_lines: list of strings to be written to the file
         Returns:
             None
     '''
+    artifact_store = store.get_store()
+    if artifact_store is not None and artifact_store.get_key(filename) is not None:
+        artifact_store.write(
+            filename, ''.join(line + '\n' for line in write_lines).encode(), append=True
+            )
+        return
     with open(filename, "a") as _file:
         for line in write_lines:
             _file.write(line + '\n')
@@ -0,0 +1,212 @@
+'''
+A manifest of the input genomes with stable integer ids.
+
+Classes:
+    Genome
+    Manifest
+'''
+import glob
+import logging
+import os
+import re
+from typing import Dict, List, NamedTuple
+
+from getphylo.utils import io
+from getphylo.utils.cache import get_file_hash
+from getphylo.utils.errors import BadInputError
+from getphylo.utils.gff import SEQUENCE_EXTENSIONS
+
+MANIFEST_COLUMNS = ['id', 'name', 'path', 'size', 'mtime', 'sha1']
+
+class Genome(NamedTuple):
+    '''An input genome'''
+    index: int
+    name: str
+    path: str
+    size: int
+    mtime: float
+    sha1: str
+
+    @property
+    def key(self) -> str:
+        '''The id used for intermediate files (e.g. g0)'''
+        return f'g{self.index}'
+
+class Manifest:
+    '''
+    The input genomes in a stable order. Intermediate files and external tools use compact
+    ids: genomes are g0, g1, ... and proteins are g0_0, g0_1, ...
+    '''
+    def __init__(self, genomes: List[Genome]):
+        '''
+        Arguments:
+            genomes: the input genomes ordered by index
+        '''
+        self.genomes = genomes
+        self.by_key = {genome.key: genome for genome in genomes}
+        self.by_path = {genome.path: genome for genome in genomes}
+        self.by_name = {genome.name: genome for genome in genomes}
+        if len(self.by_name) != len(genomes):
+            raise BadInputError(
+                'Some input files share the same name in different folders. '
+                'Please rename them so that each genome has a unique name.'
+                )
+
+    @staticmethod
+    def find_paths(gbks: str) -> List[str]:
+        '''
+        Find the input genomes matching a search string. The genome FASTA of a GFF3 file is
+        read with it and not listed as a genome of its own.
+            Arguments:
+                gbks: search string for the input files
+            Returns:
+                paths: the absolute paths of the input genomes in manifest order
+        '''
+        paths = sorted(os.path.abspath(path) for path in glob.glob(gbks))
+        annotated = {
+            os.path.splitext(path)[0] for path in paths if io.get_input_format(path) == 'gff'
+            }
+        return [
+            path for path in paths
+            if os.path.splitext(path)[0] not in annotated
+            or os.path.splitext(path)[1] not in SEQUENCE_EXTENSIONS
+            ]
+
+    @classmethod
+    def build(cls, gbks: str, cpus: int = 1) -> 'Manifest':
+        '''
+        Build a manifest from the files matching a search string.
+            Arguments:
+                gbks: search string for the input files
+                cpus: number of cpus used to hash the files
+            Returns:
+                manifest: the new manifest
+        '''
+        paths = cls.find_paths(gbks)
+        hashes = io.run_in_parallel(get_file_hash, [[path] for path in paths], cpus)
+        genomes = []
+        for index, (path, sha1) in enumerate(zip(paths, hashes)):
+            stat = os.stat(path)
+            name = os.path.splitext(os.path.basename(path))[0]
+            genomes.append(Genome(index, name, path, stat.st_size, stat.st_mtime, sha1))
+        return cls(genomes)
+
+    @classmethod
+    def read(cls, filename: str) -> 'Manifest':
+        '''
+        Read a manifest written by a previous run.
+            Arguments:
+                filename: path to manifest.tsv
+            Returns:
+                manifest: the manifest
+        '''
+        genomes = []
+        with open(filename) as _file:
+            next(_file)
+            for line in _file:
+                key, name, path, size, mtime, sha1 = line.rstrip('\n').split('\t')
+                genomes.append(Genome(int(key[1:]), name, path, int(size), float(mtime), sha1))
+        return cls(genomes)
+
+    def write(self, filename: str) -> None:
+        '''
+        Write the manifest as a tab separated table.
+            Arguments:
+                filename: path to manifest.tsv
+            Returns:
+                None
+        '''
+        with open(filename, 'w') as _file:
+            _file.write('\t'.join(MANIFEST_COLUMNS) + '\n')
+            for genome in self.genomes:
+                _file.write('\t'.join([
+                    genome.key, genome.name, genome.path, str(genome.size),
+                    str(genome.mtime), genome.sha1
+                    ]) + '\n')
+
+    def __len__(self) -> int:
+        return len(self.genomes)
+
+    @property
+    def keys(self) -> List[str]:
+        '''The ids of all genomes in order'''
+        return [genome.key for genome in self.genomes]
+
+    @property
+    def paths(self) -> List[str]:
+        '''The paths of all genomes in order'''
+        return [genome.path for genome in self.genomes]
+
+    def get_genome(self, path: str) -> Genome:
+        '''
+        Find a genome by path or name.
+            Arguments:
+                path: the path to the genbank file or the name of the genome
+            Returns:
+                genome: the matching genome
+        '''
+        genome = self.by_path.get(os.path.abspath(path))
+        if genome is None:
+            genome = self.by_name.get(os.path.splitext(os.path.basename(path))[0])
+        if genome is None:
+            raise BadInputError(f'{path} is not one of the input files.')
+        return genome
+
+    def get_extracted_keys(self, output: str) -> List[str]:
+        '''
+        Get the ids of genomes that produced a fasta file (bad records may be skipped).
+            Arguments:
+                output: path to the output folder
+            Returns:
+                keys: list of genome ids
+        '''
+        return [
+            key for key in self.keys
+            if io.file_exists(os.path.join(output, 'fasta', key + '.fasta'))
+            ]
+
+    def check_unchanged(self) -> None:
+        '''Warn if input files have changed since the manifest was written'''
+        for genome in self.genomes:
+            try:
+                stat = os.stat(genome.path)
+            except FileNotFoundError:
+                logging.warning('%s is listed in the manifest but no longer exists.', genome.path)
+                continue
+            if stat.st_size != genome.size or stat.st_mtime != genome.mtime:
+                logging.warning('%s has changed since the manifest was written.', genome.path)
+
+    @staticmethod
+    def read_protein_names(output: str, key: str) -> Dict[str, str]:
+        '''
+        Read the original names of the proteins of a genome.
+            Arguments:
+                output: path to the output folder
+                key: the genome id
+            Returns:
+                names: {protein id: original name}
+        '''
+        names = {}
+        for line in io.read_file(os.path.join(output, 'fasta', key + '.names')):
+            protein, name = line.rstrip('\n').split('\t')
+            names[protein] = name
+        return names
+
+    def rename_tree(self, filename: str) -> None:
+        '''
+        Replace genome ids with genome names in a newick file.
+            Arguments:
+                filename: path to the tree
+            Returns:
+                None
+        '''
+        with open(filename) as _file:
+            tree = _file.read()
+        tree = re.sub(
+            r'(?<=[(,])(g\d+)(?=[:,);])',
+            lambda match: self.by_key[match.group(1)].name if match.group(1) in self.by_key
+            else match.group(1),
+            tree
+            )
+        with open(filename, 'w') as _file:
+            _file.write(tree)
@@ -0,0 +1,125 @@
+'''
+Memory budgeting for jobs run in parallel.
+
+Functions:
+    get_memory_budget(memory: float = None) -> int
+    get_fasta_dimensions(filename: str) -> Tuple[int, int]
+    call_with_retries(function: Callable, args: List, reduce_memory: Callable = None)
+    run_with_memory_budget(
+        function: Callable, args_list: List[List], cpus: int, estimates: List[int],
+        budget: int, reduce_memory: Callable = None
+        ) -> List
+'''
+import logging
+import os
+from typing import Callable, List, Optional, Tuple
+
+from getphylo.utils import store
+from getphylo.utils.errors import OutOfMemoryError
+
+CGROUP_LIMITS = [
+    '/sys/fs/cgroup/memory.max',
+    '/sys/fs/cgroup/memory/memory.limit_in_bytes',
+]
+MAX_RETRIES = 2
+
+def get_cgroup_limit() -> Optional[int]:
+    '''
+    Read the memory limit of the current cgroup (v2 or v1).
+        Arguments:
+            None
+        Returns:
+            limit: the limit in bytes or None if there is no limit
+    '''
+    for path in CGROUP_LIMITS:
+        try:
+            with open(path) as _file:
+                value = _file.read().strip()
+        except OSError:
+            continue
+        if value.isdigit():
+            return int(value)
+    return None
+
+def get_memory_budget(memory: float = None) -> int:
+    '''
+    Get the memory available to getphylo.
+        Arguments:
+            memory: the budget requested by the user in GB, or None to detect it
+        Returns:
+            budget: the budget in bytes
+    '''
+    if memory is not None:
+        return int(memory * 2**30)
+    physical = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    limit = get_cgroup_limit()
+    # cgroup v1 reports an enormous number when unlimited
+    if limit is None or limit > physical:
+        return physical
+    return limit
+
+def get_fasta_dimensions(filename: str) -> Tuple[int, int]:
+    '''
+    Count the sequences in a fasta file and find the longest.
+        Arguments:
+            filename: path to the fasta file
+        Returns:
+            sequences: the number of sequences
+            max_length: the length of the longest sequence
+    '''
+    sequences = 0
+    max_length = 0
+    length = 0
+    with store.open_file(filename) as _file:
+        for line in _file:
+            if line.startswith('>'):
+                sequences += 1
+                max_length = max(max_length, length)
+                length = 0
+            else:
+                length += len(line.strip())
+    max_length = max(max_length, length)
+    return sequences, max_length
+
+def call_with_retries(function: Callable, args: List, reduce_memory: Callable = None):
+    '''
+    Call a function, retrying with lower memory arguments if it runs out of memory.
+        Arguments:
+            function: the function to be called
+            args: the arguments for the function
+            reduce_memory: takes the arguments of a failed call and returns lower memory ones
+        Returns:
+            the return value of the function
+    '''
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return function(*args)
+        except OutOfMemoryError:
+            if reduce_memory is None or attempt == MAX_RETRIES:
+                raise
+            logging.warning(
+                'Job ran out of memory, retrying with lower memory settings: %s', args
+                )
+            args = reduce_memory(args)
+
+def run_with_memory_budget(
+        function: Callable, args_list: List[List], cpus: int, estimates: List[int],
+        budget: int, reduce_memory: Callable = None
+    ) -> List:
+    '''
+    Run jobs in parallel, only admitting a job while the estimated memory of all
+    running jobs fits within the budget. Jobs that run out of memory are retried
+    with the arguments returned by reduce_memory.
+        Arguments:
+            function: the function to be called
+            args_list: list of lists containing the arguments for each call of the function
+            cpus: the number of cpus available
+            estimates: the estimated memory of each call in bytes
+            budget: the total memory available in bytes
+            reduce_memory: takes the arguments of a failed call and returns lower memory ones
+        Returns:
+            return_value: a list of return values for each call of the function
+    '''
+    # imported here as the executor builds on the retries in this module
+    from getphylo.utils import executor
+    return executor.run_tasks(function, args_list, cpus, estimates, budget, reduce_memory)
@@ -0,0 +1,313 @@
+'''
+Read, edit and compare phylogenetic trees.
+
+Functions:
+    read_tree(filename: str) -> Tree
+    write_tree(tree: Tree, filename: str) -> None
+    get_taxa(tree: Tree) -> Set[str]
+    prune_tree(tree: Tree, taxa: Set[str]) -> Tree
+    get_nearest_taxa(
+        alignment: Dict[str, str], references: List[str], queries: List[str]
+        ) -> List[Tuple[str, float]]
+    place_taxa(tree: Tree, alignment: Dict[str, str]) -> List[str]
+    get_splits(tree: Tree) -> Set[FrozenSet[str]]
+    robinson_foulds(first: Tree, second: Tree) -> Tuple[int, int]
+    encode_alignment(alignment: Dict[str, str]) -> Tuple[List[str], ndarray]
+    correct_distances(distances: ndarray, correction: str = None) -> ndarray
+    get_distance_matrix(
+        alignment: Dict[str, str], correction: str = None, cpus: int = 1
+        ) -> Tuple[List[str], ndarray]
+    get_distance_memory(sequences: int, sites: int) -> int
+    neighbour_joining(names: List[str], distances: ndarray) -> Tree
+'''
+import copy
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, FrozenSet, List, Set, Tuple
+
+# characters that carry no information when comparing sequences
+MISSING = b'-?X'
+# rows of the reference alignment compared at a time
+CHUNK_SIZE = 1000
+# alignment columns counted at a time when building a distance matrix
+SITE_CHUNK_SIZE = 4096
+DISTANCE_CORRECTIONS = ['none', 'poisson', 'kimura']
+# distance given to pairs that share no sites or are too divergent to correct
+MAX_DISTANCE = 10.0
+
+def read_tree(filename: str):
+    '''
+    Read a newick tree.
+        Arguments:
+            filename: path to the tree
+        Returns:
+            tree: the tree as a Bio.Phylo tree
+    '''
+    from Bio import Phylo
+    return Phylo.read(filename, 'newick')
+
+def write_tree(tree, filename: str) -> None:
+    '''
+    Write a tree in newick format.
+        Arguments:
+            tree: the tree as a Bio.Phylo tree
+            filename: path to the new file
+        Returns:
+            None
+    '''
+    from Bio import Phylo
+    Phylo.write(tree, filename, 'newick')
+
+def get_taxa(tree) -> Set[str]:
+    '''
+    Get the names of the leaves of a tree.
+        Arguments:
+            tree: the tree as a Bio.Phylo tree
+        Returns:
+            taxa: the names of the leaves
+    '''
+    return {leaf.name for leaf in tree.get_terminals()}
+
+def prune_tree(tree, taxa: Set[str]):
+    '''
+    Remove the leaves that are not in a set of taxa.
+        Arguments:
+            tree: the tree as a Bio.Phylo tree, which is modified
+            taxa: the names of the leaves to keep
+        Returns:
+            tree: the pruned tree
+    '''
+    for name in get_taxa(tree) - set(taxa):
+        tree.prune(name)
+    return tree
+
+def get_nearest_taxa(
+        alignment: Dict[str, str], references: List[str], queries: List[str]
+    ) -> List[Tuple[str, float]]:
+    '''
+    Find the closest reference sequence to each query by p-distance.
+    Sites with a gap or missing data in either sequence are ignored, and case is ignored
+    as in encode_alignment.
+        Arguments:
+            alignment: the aligned sequences keyed by name
+            references: names of the sequences to compare against
+            queries: names of the sequences to place
+        Returns:
+            nearest: the closest reference and its distance for each query
+    '''
+    import numpy as np
+    _, matrix = encode_alignment({name: alignment[name] for name in references})
+    missing = np.isin(matrix, np.frombuffer(MISSING, dtype=np.uint8))
+    nearest = []
+    for query in queries:
+        sequence = np.frombuffer(alignment[query].upper().encode(), dtype=np.uint8)
+        sequence_missing = np.isin(sequence, np.frombuffer(MISSING, dtype=np.uint8))
+        distances = []
+        for start in range(0, len(references), CHUNK_SIZE):
+            chunk = matrix[start:start + CHUNK_SIZE]
+            compared = ~(missing[start:start + CHUNK_SIZE] | sequence_missing)
+            mismatches = ((chunk != sequence) & compared).sum(axis=1)
+            sites = compared.sum(axis=1)
+            distances.append(np.where(sites > 0, mismatches / np.maximum(sites, 1), 1.0))
+        distances = np.concatenate(distances)
+        best = int(np.argmin(distances))
+        nearest.append((references[best], float(distances[best])))
+    return nearest
+
+def place_taxa(tree, alignment: Dict[str, str]) -> List[str]:
+    '''
+    Add the sequences missing from a tree as sisters of their closest leaf.
+        Arguments:
+            tree: the tree as a Bio.Phylo tree, which is modified
+            alignment: the aligned sequences keyed by name
+        Returns:
+            new_taxa: the names of the added leaves
+    '''
+    from Bio.Phylo.BaseTree import Clade
+    references = sorted(get_taxa(tree) & set(alignment))
+    new_taxa = sorted(set(alignment) - get_taxa(tree))
+    if not new_taxa or not references:
+        return new_taxa
+    for taxon, (nearest, distance) in zip(
+            new_taxa, get_nearest_taxa(alignment, references, new_taxa)
+        ):
+        # find_clades would match the name as a regular expression
+        leaf = next(clade for clade in tree.get_terminals() if clade.name == nearest)
+        leaf.clades = [
+            Clade(branch_length=distance / 2, name=nearest),
+            Clade(branch_length=distance / 2, name=taxon)
+            ]
+        leaf.name = None
+    return new_taxa
+
+def get_splits(tree) -> Set[FrozenSet[str]]:
+    '''
+    Get the non-trivial bipartitions of a tree, ignoring where it is rooted.
+        Arguments:
+            tree: the tree as a Bio.Phylo tree
+        Returns:
+            splits: each split as the side that does not contain the first taxon
+    '''
+    taxa = get_taxa(tree)
+    reference = min(taxa)
+    splits = set()
+    for clade in tree.get_nonterminals():
+        side = frozenset(leaf.name for leaf in clade.get_terminals())
+        if reference in side:
+            side = frozenset(taxa - side)
+        if 1 < len(side) < len(taxa) - 1:
+            splits.add(side)
+    return splits
+
+def robinson_foulds(first, second) -> Tuple[int, int]:
+    '''
+    Calculate the Robinson-Foulds distance between two trees on their shared taxa.
+        Arguments:
+            first: a Bio.Phylo tree
+            second: a Bio.Phylo tree
+        Returns:
+            distance: the number of splits found in only one of the trees
+            maximum: the largest possible distance for these trees
+    '''
+    shared = get_taxa(first) & get_taxa(second)
+    first_splits = get_splits(prune_tree(copy.deepcopy(first), shared))
+    second_splits = get_splits(prune_tree(copy.deepcopy(second), shared))
+    return len(first_splits ^ second_splits), len(first_splits) + len(second_splits)
+
+def encode_alignment(alignment: Dict[str, str]):
+    '''
+    Encode an alignment as a matrix of bytes.
+        Arguments:
+            alignment: the aligned sequences keyed by name
+        Returns:
+            names: the names of the sequences in the order of the rows
+            matrix: a uint8 matrix with a row for each sequence
+    '''
+    import numpy as np
+    names = list(alignment)
+    matrix = np.array(
+        [np.frombuffer(alignment[name].upper().encode(), dtype=np.uint8) for name in names]
+        )
+    return names, matrix
+
+def correct_distances(distances, correction: str = None):
+    '''
+    Correct p-distances for multiple substitutions at the same site.
+        Arguments:
+            distances: a matrix of p-distances
+            correction: 'poisson', 'kimura' (Kimura 1983) or None for p-distances
+        Returns:
+            distances: the corrected distances, saturated pairs set to MAX_DISTANCE
+    '''
+    import numpy as np
+    if correction in (None, 'none'):
+        return distances
+    if correction == 'poisson':
+        identity = 1 - distances
+    elif correction == 'kimura':
+        identity = 1 - distances - 0.2 * distances ** 2
+    else:
+        raise ValueError(f'{correction} is not a distance correction.')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corrected = -np.log(identity)
+    corrected[~(identity > 0)] = MAX_DISTANCE
+    return np.clip(corrected, 0, MAX_DISTANCE)
+
+def get_distance_matrix(alignment: Dict[str, str], correction: str = None, cpus: int = 1):
+    '''
+    Calculate the distance between every pair of sequences in an alignment.
+    Sites with a gap or missing data in either sequence are ignored. Identical residues are
+    counted with a matrix product for each residue over chunks of sites, which are shared
+    between threads.
+        Arguments:
+            alignment: the aligned sequences keyed by name
+            correction: 'poisson', 'kimura' or None for p-distances
+            cpus: the number of threads used
+        Returns:
+            names: the names of the sequences in the order of the matrix
+            distances: a square matrix of distances
+    '''
+    import numpy as np
+    names, matrix = encode_alignment(alignment)
+    missing = np.frombuffer(MISSING, dtype=np.uint8)
+    residues = np.setdiff1d(np.unique(matrix), missing)
+
+    def count_sites(start: int):
+        '''Count the compared and identical sites of every pair in a chunk of sites'''
+        chunk = matrix[:, start:start + SITE_CHUNK_SIZE]
+        compared = (~np.isin(chunk, missing)).astype(np.float32)
+        identical = np.zeros((len(names), len(names)), dtype=np.float64)
+        for residue in residues:
+            present = (chunk == residue).astype(np.float32)
+            identical += present @ present.T
+        return compared @ compared.T, identical
+
+    compared = np.zeros((len(names), len(names)), dtype=np.float64)
+    identical = np.zeros((len(names), len(names)), dtype=np.float64)
+    # NumPy releases the GIL during the matrix products, so threads share the matrix
+    with ThreadPoolExecutor(max(cpus, 1)) as pool:
+        for chunk_compared, chunk_identical in pool.map(
+                count_sites, range(0, matrix.shape[1], SITE_CHUNK_SIZE)
+            ):
+            compared += chunk_compared
+            identical += chunk_identical
+    with np.errstate(divide='ignore', invalid='ignore'):
+        distances = 1 - identical / compared
+    distances = correct_distances(distances, correction)
+    distances[compared == 0] = MAX_DISTANCE
+    np.fill_diagonal(distances, 0)
+    return names, distances
+
+def get_distance_memory(sequences: int, sites: int) -> int:
+    '''
+    Estimate the memory used by get_distance_matrix and neighbour_joining.
+        Arguments:
+            sequences: the number of sequences
+            sites: the length of the alignment
+        Returns:
+            estimate: the estimated memory in bytes
+    '''
+    # the encoded alignment, a chunk of sites as floats and a few square matrices
+    return sequences * sites + 8 * sequences * SITE_CHUNK_SIZE + 6 * 8 * sequences ** 2
+
+def neighbour_joining(names: List[str], distances):
+    '''
+    Build an unrooted tree by neighbour joining (Saitou and Nei 1987).
+        Arguments:
+            names: the names of the sequences
+            distances: a square matrix of distances between the sequences
+        Returns:
+            tree: the tree as a Bio.Phylo tree
+    '''
+    import numpy as np
+    from Bio.Phylo.BaseTree import Clade, Tree
+    if len(names) < 3:
+        raise ValueError('Neighbour joining requires at least 3 sequences.')
+    distances = np.array(distances, dtype=np.float64)
+    clades = [Clade(name=name) for name in names]
+    while len(clades) > 3:
+        size = len(clades)
+        totals = distances.sum(axis=1)
+        criterion = (size - 2) * distances - totals[:, None] - totals[None, :]
+        np.fill_diagonal(criterion, np.inf)
+        first, second = sorted(np.unravel_index(np.argmin(criterion), criterion.shape))
+        distance = distances[first, second]
+        first_length = distance / 2 + (totals[first] - totals[second]) / (2 * (size - 2))
+        clades[first].branch_length = max(first_length, 0.0)
+        clades[second].branch_length = max(distance - first_length, 0.0)
+        node = Clade(clades=[clades[first], clades[second]])
+        # the distances to the new node replace those of the first clade
+        joined = (distances[first] + distances[second] - distance) / 2
+        joined[first] = 0
+        distances[first, :] = joined
+        distances[:, first] = joined
+        distances = np.delete(np.delete(distances, second, axis=0), second, axis=1)
+        clades[first] = node
+        del clades[second]
+    for index, clade in enumerate(clades):
+        others = [other for other in range(3) if other != index]
+        clade.branch_length = max(
+            (distances[index, others[0]] + distances[index, others[1]]
+             - distances[others[0], others[1]]) / 2,
+            0.0
+            )
+    return Tree(root=Clade(clades=clades), rooted=False)
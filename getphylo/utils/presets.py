@@ -0,0 +1,175 @@
+'''
+Speed presets for the external tools and deadline based preset selection.
+
+Classes:
+    Preset
+    PresetSchedule
+
+Functions:
+    get_preset(name: str) -> Preset
+    downgrade_preset(preset: Preset, steps: int = 1) -> Preset
+'''
+import logging
+import time
+from typing import NamedTuple, Optional, Tuple
+
+from getphylo.utils.errors import BadInputError
+
+class Preset(NamedTuple):
+    '''Coordinated options for each external tool'''
+    name: str
+    diamond_sensitivity: Optional[str]
+    muscle_maxiters: Optional[int]
+    muscle_super5: bool
+    fasttree_options: Tuple[str, ...]
+    iqtree_model: Optional[str]
+    iqtree_bootstrap: Optional[int]
+
+# ordered from fastest to slowest; 'balanced' reproduces the original behaviour
+PRESETS = {
+    'fast': Preset(
+        name='fast',
+        diamond_sensitivity='--fast',
+        muscle_maxiters=2,
+        muscle_super5=True,
+        fasttree_options=('-fastest', '-nosupport'),
+        iqtree_model=None,
+        iqtree_bootstrap=None
+        ),
+    'balanced': Preset(
+        name='balanced',
+        diamond_sensitivity=None,
+        muscle_maxiters=None,
+        muscle_super5=False,
+        fasttree_options=(),
+        iqtree_model='MFP',
+        iqtree_bootstrap=1000
+        ),
+    'thorough': Preset(
+        name='thorough',
+        diamond_sensitivity='--sensitive',
+        muscle_maxiters=None,
+        muscle_super5=False,
+        fasttree_options=('-spr', '4', '-mlacc', '2', '-slownni'),
+        iqtree_model='MFP',
+        iqtree_bootstrap=1000
+        ),
+}
+PRESET_ORDER = list(PRESETS)
+DEFAULT_PRESET = 'balanced'
+
+# rough share of the total run time spent in each stage
+STAGE_WEIGHTS = {
+    'extract': 0.1,
+    'screen': 0.3,
+    'align': 0.3,
+    'trees': 0.3,
+}
+
+def get_preset(name: str) -> Preset:
+    '''
+    Get a preset by name.
+        Arguments:
+            name: the name of the preset (e.g. 'fast')
+        Returns:
+            preset: the matching Preset
+    '''
+    try:
+        return PRESETS[name]
+    except KeyError as error:
+        raise BadInputError(
+            f'{name} is not a valid preset. Choose from: {", ".join(PRESET_ORDER)}.'
+            ) from error
+
+def downgrade_preset(preset: Preset, steps: int = 1) -> Preset:
+    '''
+    Get the preset a number of steps faster than the one provided.
+        Arguments:
+            preset: the current preset
+            steps: how many levels to move towards 'fast'
+        Returns:
+            preset: the downgraded preset
+    '''
+    index = max(PRESET_ORDER.index(preset.name) - steps, 0)
+    return PRESETS[PRESET_ORDER[index]]
+
+class PresetSchedule:
+    '''
+    Select a preset for each stage, downgrading when a deadline is at risk.
+    Without a deadline the requested preset is always returned.
+    '''
+    def __init__(self, preset_name: str = DEFAULT_PRESET, deadline: Optional[float] = None):
+        '''
+        Arguments:
+            preset_name: the preset requested by the user
+            deadline: the wall-clock budget for the whole run in hours
+        '''
+        self.requested = get_preset(preset_name)
+        self.budget = None if deadline is None else deadline * 3600
+        self.start_time = time.monotonic()
+        self.stage_start = None
+        self.pending = dict(STAGE_WEIGHTS)
+        self.completed_weight = 0.0
+        self.completed_time = 0.0
+        # seconds taken by each stage that was run
+        self.stage_times = {}
+
+    def elapsed(self) -> float:
+        '''Return the seconds elapsed since the schedule was created'''
+        return time.monotonic() - self.start_time
+
+    def skip_stage(self, stage: str) -> None:
+        '''
+        Remove a stage that will not run (e.g. when restarting from a checkpoint).
+            Arguments:
+                stage: the name of the stage
+            Returns:
+                None
+        '''
+        self.pending.pop(stage, None)
+
+    def start_stage(self, stage: str) -> Preset:
+        '''
+        Choose the preset for the next stage.
+            Arguments:
+                stage: the name of the stage about to run
+            Returns:
+                preset: the preset to use for this stage
+        '''
+        self.stage_start = time.monotonic()
+        preset = self.requested
+        if self.budget is None:
+            return preset
+        remaining_time = self.budget - self.elapsed()
+        if remaining_time <= 0:
+            preset = downgrade_preset(preset, len(PRESET_ORDER))
+        elif self.completed_weight > 0:
+            # project the time left from the pace of the stages already run
+            remaining_weight = sum(self.pending.values())
+            projected = self.completed_time / self.completed_weight * remaining_weight
+            if projected > 2 * remaining_time:
+                preset = downgrade_preset(preset, len(PRESET_ORDER))
+            elif projected > remaining_time:
+                preset = downgrade_preset(preset)
+        if preset != self.requested:
+            logging.warning(
+                'Deadline at risk: using the %s preset for the %s stage (%.0f seconds left).',
+                preset.name, stage, max(remaining_time, 0)
+                )
+        return preset
+
+    def end_stage(self, stage: str) -> None:
+        '''
+        Record that a stage has finished.
+            Arguments:
+                stage: the name of the stage that finished
+            Returns:
+                None
+        '''
+        weight = self.pending.pop(stage, 0.0)
+        if self.stage_start is not None:
+            duration = time.monotonic() - self.stage_start
+            self.stage_times[stage] = duration
+            self.completed_time += duration
+            self.completed_weight += weight
+        self.stage_start = None
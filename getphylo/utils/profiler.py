@@ -0,0 +1,247 @@
+'''
+Profile the Python side of each stage across the main process and its pool processes.
+
+Functions:
+    configure(folder: str = None, top: int = DEFAULT_TOP) -> None
+    get_folder() -> Optional[str]
+    init_worker() -> None
+    start_stage(stage: str) -> None
+    end_stage(stage: str) -> None
+    profile_task(function: Callable, args: List)
+    paused() -> Iterator[None]
+    pause_for_tool(tool: str) -> Iterator[None]
+    write_worker_stats() -> None
+    merge_tool_times(tool_times: Dict[str, List], other: Dict[str, List]) -> None
+    get_summary(
+        stage: str, stats: pstats.Stats, tool_times: Dict[str, List], processes: int,
+        seconds: float, top: int
+        ) -> List[str]
+'''
+import contextlib
+import cProfile
+import glob
+import json
+import os
+import pstats
+import time
+from typing import Callable, Dict, Iterator, List, Optional
+
+PROFILE_ENV = 'GETPHYLO_PROFILE'
+TOP_ENV = 'GETPHYLO_PROFILE_TOP'
+STAGE_ENV = 'GETPHYLO_PROFILE_STAGE'
+PROFILE_FOLDER = 'profile'
+WORKER_FOLDER = 'workers'
+DEFAULT_TOP = 20
+
+# the profile collecting in this process: of the stage in the main process, or of the
+# running task in a pool process
+_profile = None
+# the profile of a pool process, kept across the tasks it runs
+_worker_profile = None
+_worker = False
+# {tool: [runs, seconds]} of the tools run by this process during the stage
+_tool_times: Dict[str, List] = {}
+_stage_start = None
+
+def configure(folder: str = None, top: int = DEFAULT_TOP) -> None:
+    '''
+    Profile the stages run by this process and the pool processes it starts.
+        Arguments:
+            folder: path to the folder the profiles are written to, or None to stop profiling
+            top: the number of functions printed for each stage
+        Returns:
+            None
+    '''
+    if folder is None:
+        os.environ.pop(PROFILE_ENV, None)
+        return
+    folder = os.path.abspath(folder)
+    os.makedirs(os.path.join(folder, WORKER_FOLDER), exist_ok=True)
+    # stats left by the workers of an interrupted run would be merged into the next one
+    for filename in glob.glob(os.path.join(folder, WORKER_FOLDER, '*')):
+        os.remove(filename)
+    os.environ[PROFILE_ENV] = folder
+    os.environ[TOP_ENV] = str(top)
+
+def get_folder() -> Optional[str]:
+    '''Return the folder the profiles are written to, or None if profiling is off'''
+    return os.environ.get(PROFILE_ENV)
+
+def init_worker() -> None:
+    '''Set up a pool process, which profiles its tasks instead of the inherited stage'''
+    global _profile, _worker
+    if _profile is not None:
+        _profile.disable()
+        _profile = None
+    _tool_times.clear()
+    _worker = True
+
+def start_stage(stage: str) -> None:
+    '''
+    Start profiling a stage in this process.
+        Arguments:
+            stage: the name of the stage
+        Returns:
+            None
+    '''
+    global _profile, _stage_start
+    if get_folder() is None:
+        return
+    os.environ[STAGE_ENV] = stage
+    _tool_times.clear()
+    _stage_start = time.monotonic()
+    _profile = cProfile.Profile()
+    _profile.enable()
+
+def end_stage(stage: str) -> None:
+    '''
+    Stop profiling a stage, merge the stats of the pool processes into
+    profile/<stage>.pstats and print the summary.
+        Arguments:
+            stage: the name of the stage
+        Returns:
+            None
+    '''
+    global _profile
+    folder = get_folder()
+    if folder is None or _profile is None:
+        return
+    _profile.disable()
+    stats = pstats.Stats(_profile)
+    _profile = None
+    seconds = time.monotonic() - _stage_start
+    tool_times = dict(_tool_times)
+    processes = 1
+    prefix = os.path.join(folder, WORKER_FOLDER, stage + '.')
+    for filename in sorted(glob.glob(prefix + '*.pstats')):
+        stats.add(filename)
+        processes += 1
+        tools_name = filename[:-len('.pstats')] + '.tools.json'
+        with open(tools_name) as _file:
+            merge_tool_times(tool_times, json.load(_file))
+        os.remove(filename)
+        os.remove(tools_name)
+    stats.dump_stats(os.path.join(folder, stage + '.pstats'))
+    with open(os.path.join(folder, stage + '.tools.json'), 'w') as _file:
+        json.dump({
+            tool: {'runs': runs, 'seconds': round(total, 3)}
+            for tool, (runs, total) in sorted(tool_times.items())
+            }, _file, indent=2)
+    print('\n'.join(get_summary(
+        stage, stats, tool_times, processes, seconds, int(os.environ.get(TOP_ENV, DEFAULT_TOP))
+        )))
+    _tool_times.clear()
+    os.environ.pop(STAGE_ENV, None)
+
+def profile_task(function: Callable, args: List):
+    '''
+    Call a function, profiling it if this is a pool process of a profiled stage.
+        Arguments:
+            function: the function to be called
+            args: the arguments for the function
+        Returns:
+            the return value of the function
+    '''
+    global _profile, _worker_profile
+    # pools started outside a stage are not profiled
+    if not _worker or get_folder() is None or STAGE_ENV not in os.environ:
+        return function(*args)
+    if _worker_profile is None:
+        _worker_profile = cProfile.Profile()
+    _profile = _worker_profile
+    _profile.enable()
+    try:
+        return function(*args)
+    finally:
+        _profile.disable()
+        _profile = None
+        write_worker_stats()
+
+@contextlib.contextmanager
+def paused() -> Iterator[None]:
+    '''Pause the profile collecting in this process, if there is one'''
+    profile = _profile
+    if profile is not None:
+        profile.disable()
+    try:
+        yield
+    finally:
+        if profile is not None:
+            profile.enable()
+
+@contextlib.contextmanager
+def pause_for_tool(tool: str) -> Iterator[None]:
+    '''
+    Pause the profiler while an external tool runs and record its run time. Pausing ends
+    the calls that were running, so the cumulative time of a function that runs a tool
+    only covers the time before the tool was started.
+        Arguments:
+            tool: the name or path of the tool
+        Returns:
+            None
+    '''
+    if get_folder() is None:
+        yield
+        return
+    start = time.monotonic()
+    try:
+        with paused():
+            yield
+    finally:
+        times = _tool_times.setdefault(os.path.basename(tool), [0, 0.0])
+        times[0] += 1
+        times[1] += time.monotonic() - start
+
+def write_worker_stats() -> None:
+    '''Write the stats of this pool process so far for the main process to merge'''
+    prefix = os.path.join(get_folder(), WORKER_FOLDER, f'{os.environ[STAGE_ENV]}.{os.getpid()}')
+    # written under a temporary name so that a terminated process leaves no partial file
+    _worker_profile.dump_stats(prefix + '.tmp')
+    with open(prefix + '.tools.json', 'w') as _file:
+        json.dump(_tool_times, _file)
+    os.replace(prefix + '.tmp', prefix + '.pstats')
+
+def merge_tool_times(tool_times: Dict[str, List], other: Dict[str, List]) -> None:
+    '''
+    Add the tool run times of another process.
+        Arguments:
+            tool_times: {tool: [runs, seconds]} that is added to
+            other: {tool: [runs, seconds]} of the other process
+        Returns:
+            None
+    '''
+    for tool, (runs, seconds) in other.items():
+        runs_so_far, seconds_so_far = tool_times.get(tool, [0, 0.0])
+        tool_times[tool] = [runs_so_far + runs, seconds_so_far + seconds]
+
+def get_summary(
+        stage: str, stats: pstats.Stats, tool_times: Dict[str, List], processes: int,
+        seconds: float, top: int
+    ) -> List[str]:
+    '''
+    Describe where the time of a stage went.
+        Arguments:
+            stage: the name of the stage
+            stats: the merged stats of the stage
+            tool_times: {tool: [runs, seconds]} of the stage
+            processes: the number of processes the stats were merged from
+            seconds: the wall-clock time of the stage
+            top: the number of functions listed
+        Returns:
+            lines: the lines of the summary
+    '''
+    lines = [
+        f'Profile of {stage}: {seconds:.1f} s wall-clock',
+        f'  Python: {stats.total_tt:.1f} s in {processes} process(es)',
+        f'  External tools: {sum(total for _, total in tool_times.values()):.1f} s'
+        ]
+    for tool, (runs, total) in sorted(tool_times.items(), key=lambda item: -item[1][1]):
+        lines.append(f'    {tool}: {runs} run(s), {total:.1f} s')
+    lines.append(f'  Top {top} functions by own Python time:')
+    lines.append(f'    {"calls":>9} {"own s":>9} {"total s":>9}  function')
+    functions = sorted(stats.stats.items(), key=lambda item: -item[1][2])[:top]
+    for function, (_, calls, own, total, _) in functions:
+        lines.append(
+            f'    {calls:>9} {own:>9.3f} {total:>9.3f}  {pstats.func_std_string(function)}'
+            )
+    return lines
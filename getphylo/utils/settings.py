@@ -0,0 +1,65 @@
+'''
+Read the GETPHYLO_* settings of this process, which a thread can override for its own calls.
+
+Functions:
+    get(name: str, default: str = None) -> Optional[str]
+    get_overrides() -> Dict[str, str]
+    override(environment: Dict[str, str]) -> Iterator[None]
+    apply(environment: Dict[str, str]) -> None
+'''
+import contextlib
+import os
+import threading
+from typing import Dict, Iterator, Optional
+
+_local = threading.local()
+
+def get_overrides() -> Dict[str, str]:
+    '''Return the settings overridden in this thread'''
+    return getattr(_local, 'environment', {})
+
+def get(name: str, default: str = None) -> Optional[str]:
+    '''
+    Read a setting, from the overrides of this thread if it is overridden there.
+        Arguments:
+            name: the name of the environment variable
+            default: the value if the setting is not set
+        Returns:
+            value: the value of the setting
+    '''
+    overrides = get_overrides()
+    if name in overrides:
+        return overrides[name]
+    return os.environ.get(name, default)
+
+@contextlib.contextmanager
+def override(environment: Dict[str, str]) -> Iterator[None]:
+    '''
+    Override settings for the calls made by this thread, so that several pipelines can run
+    in one process with their own settings. An empty value turns a setting off.
+        Arguments:
+            environment: the environment variables of the settings
+        Returns:
+            None
+    '''
+    previous = get_overrides()
+    _local.environment = {**previous, **environment}
+    try:
+        yield
+    finally:
+        _local.environment = previous
+
+def apply(environment: Dict[str, str]) -> None:
+    '''
+    Set settings for this process and the processes it starts, e.g. in a pool process
+    started for a pipeline. An empty value turns a setting off.
+        Arguments:
+            environment: the environment variables of the settings
+        Returns:
+            None
+    '''
+    for name, value in environment.items():
+        if value:
+            os.environ[name] = value
+        else:
+            os.environ.pop(name, None)
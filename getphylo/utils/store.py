@@ -0,0 +1,257 @@
+'''
+An optional single-file store for the intermediate files of a run.
+
+Classes:
+    ArtifactStore
+
+Functions:
+    get_environment(filename: str = None, root: str = None) -> Dict[str, str]
+    configure(filename: str, root: str) -> ArtifactStore
+    get_store() -> Optional[ArtifactStore]
+    open_file(filename: str) -> TextIO
+'''
+import functools
+import os
+import sqlite3
+import tempfile
+from io import StringIO
+from typing import Dict, List, Optional, Sequence, TextIO, Tuple
+
+from getphylo.utils import settings
+
+STORE_ENV = 'GETPHYLO_STORE'
+ROOT_ENV = 'GETPHYLO_STORE_ROOT'
+STORE_NAME = 'artifacts.sqlite'
+# folders of the output whose files are kept in the store
+STORED_FOLDERS = ['fasta', 'dmnd', 'tsv', 'tsvs', 'unaligned_fasta', 'aligned_fasta']
+# results that users read are always written as files
+KEPT_FILES = [os.path.join('aligned_fasta', 'combined_alignment.fasta')]
+# seconds to wait while another process is writing
+LOCK_TIMEOUT = 600
+
+class ArtifactStore:
+    '''
+    Intermediate files kept as blobs in an SQLite database, which spares shared filesystems
+    the file creations and directory listings. utils.io reads and writes stored paths, and
+    a stored file is only written to disk while an external tool reads it.
+    '''
+    def __init__(self, filename: str, root: str):
+        '''
+        Arguments:
+            filename: path to the database
+            root: path to the output folder whose intermediate files are stored
+        '''
+        self.filename = filename
+        self.root = root
+        # connections cannot be shared with forked processes, so each process opens its own
+        self.connections: Dict[int, sqlite3.Connection] = {}
+
+    def connect(self) -> sqlite3.Connection:
+        '''Return the connection of the current process'''
+        pid = os.getpid()
+        if pid not in self.connections:
+            self.connections[pid] = sqlite3.connect(
+                self.filename, timeout=LOCK_TIMEOUT, isolation_level=None
+                )
+        return self.connections[pid]
+
+    def create(self) -> None:
+        '''Create the tables of a new store'''
+        # files are stored in chunks so that appending does not rewrite them
+        self.connect().executescript(
+            '''
+            CREATE TABLE IF NOT EXISTS chunks (path TEXT NOT NULL, data BLOB NOT NULL);
+            CREATE INDEX IF NOT EXISTS chunks_path ON chunks (path);
+            '''
+            )
+
+    def get_key(self, filename: str) -> Optional[str]:
+        '''
+        Get the name of a file in the store.
+            Arguments:
+                filename: path to the file
+            Returns:
+                key: the path relative to the output folder, or None if it is not stored
+        '''
+        key = os.path.relpath(os.path.abspath(filename), self.root)
+        folder, _, name = key.partition(os.sep)
+        if folder not in STORED_FOLDERS or not name or key in KEPT_FILES:
+            return None
+        return key
+
+    def read(self, filename: str) -> Optional[bytes]:
+        '''
+        Read a stored file.
+            Arguments:
+                filename: path to the file
+            Returns:
+                data: the contents of the file, or None if it is not in the store
+        '''
+        rows = self.connect().execute(
+            'SELECT data FROM chunks WHERE path = ? ORDER BY rowid', (self.get_key(filename),)
+            ).fetchall()
+        if not rows:
+            return None
+        return b''.join(row[0] for row in rows)
+
+    def write(self, filename: str, data: bytes, append: bool = False) -> None:
+        '''
+        Write a file to the store.
+            Arguments:
+                filename: path to the file
+                data: the contents to write
+                append: add to the end of the file instead of replacing it
+            Returns:
+                None
+        '''
+        key = self.get_key(filename)
+        connection = self.connect()
+        if append:
+            connection.execute('INSERT INTO chunks VALUES (?, ?)', (key, data))
+            return
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute('DELETE FROM chunks WHERE path = ?', (key,))
+            connection.execute('INSERT INTO chunks VALUES (?, ?)', (key, data))
+
+    def exists(self, filename: str) -> bool:
+        '''Return True if a file is in the store'''
+        return self.connect().execute(
+            'SELECT 1 FROM chunks WHERE path = ? LIMIT 1', (self.get_key(filename),)
+            ).fetchone() is not None
+
+    def remove(self, filename: str) -> None:
+        '''Remove a file from the store'''
+        self.connect().execute('DELETE FROM chunks WHERE path = ?', (self.get_key(filename),))
+
+    def list(self, folder: str) -> List[str]:
+        '''
+        List the stored files in a folder.
+            Arguments:
+                folder: path to the folder
+            Returns:
+                filenames: the paths of the files
+        '''
+        prefix = os.path.relpath(os.path.abspath(folder), self.root) + os.sep
+        # the keys between the folder and the next character after the separator
+        rows = self.connect().execute(
+            'SELECT DISTINCT path FROM chunks WHERE path >= ? AND path < ? ORDER BY path',
+            (prefix, prefix[:-1] + chr(ord(os.sep) + 1))
+            ).fetchall()
+        return [os.path.join(self.root, row[0]) for row in rows]
+
+    def clear(self, folder: str) -> None:
+        '''Remove the stored files in a folder'''
+        for filename in self.list(folder):
+            self.remove(filename)
+
+    def materialize(
+            self, command: Sequence[str], inputs: Sequence[str]
+        ) -> Tuple[List[str], List[str], Optional[str]]:
+        '''
+        Write the stored inputs of a command to a temporary folder.
+            Arguments:
+                command: the command to be run
+                inputs: paths to the files read by the command
+            Returns:
+                command: the command reading the temporary files
+                inputs: the paths of the inputs on disk
+                temporary: the temporary folder to remove afterwards, or None if not needed
+        '''
+        stored = [
+            filename for filename in inputs
+            if self.get_key(filename) is not None and not os.path.exists(filename)
+            ]
+        if not stored:
+            return list(command), list(inputs), None
+        temporary = tempfile.mkdtemp(prefix='getphylo-')
+        paths = {}
+        for index, filename in enumerate(stored):
+            data = self.read(filename)
+            if data is None:
+                continue
+            # names are kept because tools may rely on their extensions
+            path = os.path.join(temporary, f'{index}_{os.path.basename(filename)}')
+            with open(path, 'wb') as _file:
+                _file.write(data)
+            paths[filename] = path
+        return (
+            [paths.get(str(argument), argument) for argument in command],
+            [paths.get(filename, filename) for filename in inputs],
+            temporary
+            )
+
+    def ingest(self, outputs: Sequence[str]) -> None:
+        '''
+        Move the outputs of a command into the store.
+            Arguments:
+                outputs: paths to the files written by the command
+            Returns:
+                None
+        '''
+        for filename in outputs:
+            if self.get_key(filename) is None or not os.path.exists(filename):
+                continue
+            with open(filename, 'rb') as _file:
+                self.write(filename, _file.read())
+            os.remove(filename)
+
+def get_environment(filename: str = None, root: str = None) -> Dict[str, str]:
+    '''
+    Get the settings of a store (see utils.settings).
+        Arguments:
+            filename: path to the database, or None to disable the store
+            root: path to the output folder
+        Returns:
+            environment: the environment variables of the settings
+    '''
+    if filename is None:
+        return {STORE_ENV: '', ROOT_ENV: ''}
+    return {STORE_ENV: os.path.abspath(filename), ROOT_ENV: os.path.abspath(root)}
+
+def configure(filename: str, root: str) -> ArtifactStore:
+    '''
+    Enable the store for this process and the processes it starts.
+        Arguments:
+            filename: path to the database, created if it does not exist
+            root: path to the output folder
+        Returns:
+            store: the configured store
+    '''
+    settings.apply(get_environment(filename, root))
+    artifact_store = get_store()
+    artifact_store.create()
+    return artifact_store
+
+@functools.lru_cache(maxsize=None)
+def open_store(filename: str, root: str) -> ArtifactStore:
+    '''Return the store for a database, keeping its connections open'''
+    return ArtifactStore(filename, root)
+
+def get_store() -> Optional[ArtifactStore]:
+    '''
+    Return the store configured for this process.
+        Arguments:
+            None
+        Returns:
+            store: the store, or None if it is not enabled
+    '''
+    filename = settings.get(STORE_ENV)
+    if not filename:
+        return None
+    return open_store(filename, settings.get(ROOT_ENV))
+
+def open_file(filename: str) -> TextIO:
+    '''
+    Open a text file for reading, from the store if it is kept there.
+        Arguments:
+            filename: path to the file
+        Returns:
+            file: the open file
+    '''
+    artifact_store = get_store()
+    if artifact_store is not None and artifact_store.get_key(filename) is not None:
+        data = artifact_store.read(filename)
+        if data is not None:
+            return StringIO(data.decode())
+    return open(filename)
@@ -0,0 +1,291 @@
+'''
+Record a timeline of the run that opens in Perfetto (ui.perfetto.dev) or chrome://tracing.
+
+Functions:
+    configure(folder: str = None) -> None
+    get_folder() -> Optional[str]
+    get_timestamp(seconds: float) -> float
+    get_cpu() -> Optional[int]
+    get_input_size(paths: Iterable) -> int
+    get_busy_cpus(previous: List[int]) -> Tuple[Optional[float], List[int]]
+    write_event(event: Dict) -> None
+    count(name: str, value: float) -> None
+    begin_stage(stage: str) -> None
+    end_stage(stage: str) -> None
+    span(name: str, category: str, args: Dict = None) -> Iterator[None]
+    task_span(function: Callable, args: List) -> Iterator[None]
+    tool_span(command: List[str], inputs: Iterable[str] = ()) -> Iterator[None]
+    sample_load(stop: threading.Event) -> None
+    write_trace(filename: str) -> None
+'''
+import contextlib
+import glob
+import json
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+TRACE_ENV = 'GETPHYLO_TRACE'
+START_ENV = 'GETPHYLO_TRACE_START'
+PID_ENV = 'GETPHYLO_TRACE_PID'
+TRACE_FOLDER = 'trace_events'
+TRACE_NAME = 'trace.json'
+# seconds between samples of the load of the machine
+SAMPLE_INTERVAL = 1.0
+# longest argument or command kept in a span
+MAX_ARG_LENGTH = 500
+
+# the process whose lane has been named in its event file
+_named_pid = None
+_sampler = None
+_stop_sampler = None
+
+def configure(folder: str = None) -> None:
+    '''
+    Record the timeline of this process and the pool processes it starts, and sample
+    the load of the machine until write_trace is called.
+        Arguments:
+            folder: path to the folder the events are written to, or None to stop recording
+        Returns:
+            None
+    '''
+    global _sampler, _stop_sampler
+    if folder is None:
+        os.environ.pop(TRACE_ENV, None)
+        return
+    folder = os.path.abspath(folder)
+    # events left by an interrupted run would be merged into this one
+    shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(folder)
+    os.environ[TRACE_ENV] = folder
+    os.environ[START_ENV] = str(time.time())
+    os.environ[PID_ENV] = str(os.getpid())
+    _stop_sampler = threading.Event()
+    _sampler = threading.Thread(target=sample_load, args=(_stop_sampler,), daemon=True)
+    _sampler.start()
+
+def get_folder() -> Optional[str]:
+    '''Return the folder the events are written to, or None if no timeline is recorded'''
+    return os.environ.get(TRACE_ENV)
+
+def get_timestamp(seconds: float) -> float:
+    '''Return the microseconds between the start of the run and a time.time() value'''
+    return round((seconds - float(os.environ[START_ENV])) * 1e6, 1)
+
+def get_cpu() -> Optional[int]:
+    '''Return the cpu this process last ran on, or None where /proc is not available'''
+    try:
+        with open('/proc/self/stat') as _file:
+            # the name of the process may contain spaces, the fields after it do not
+            return int(_file.read().rsplit(')', 1)[1].split()[36])
+    except (OSError, IndexError, ValueError):
+        return None
+
+def get_input_size(paths: Iterable) -> int:
+    '''
+    Add up the size of the arguments that are files.
+        Arguments:
+            paths: the arguments of a task or the inputs of a tool
+        Returns:
+            size: the total size of the files in bytes
+    '''
+    size = 0
+    for path in paths:
+        if isinstance(path, str) and os.path.isfile(path):
+            size += os.path.getsize(path)
+    return size
+
+def get_busy_cpus(previous: List[int]) -> Tuple[Optional[float], List[int]]:
+    '''
+    Measure how many cpus of the machine were busy since the previous sample.
+        Arguments:
+            previous: the cpu times of the previous sample, or an empty list
+        Returns:
+            busy: the number of busy cpus, or None for the first sample or without /proc
+            times: the cpu times of this sample
+    '''
+    try:
+        with open('/proc/stat') as _file:
+            times = [int(value) for value in _file.readline().split()[1:9]]
+    except (OSError, ValueError):
+        return None, []
+    if len(previous) != len(times):
+        return None, times
+    # idle and waiting for input or output
+    total = sum(times) - sum(previous)
+    idle = times[3] + times[4] - previous[3] - previous[4]
+    if total <= 0:
+        return None, times
+    return round((total - idle) / total * (os.cpu_count() or 1), 2), times
+
+def write_event(event: Dict) -> None:
+    '''
+    Append an event to the file of this process, which write_trace merges with the files
+    of the other processes.
+        Arguments:
+            event: the trace event, without its process and lane
+        Returns:
+            None
+    '''
+    global _named_pid
+    folder = get_folder()
+    if folder is None:
+        return
+    pid = os.getpid()
+    event = {'pid': int(os.environ[PID_ENV]), 'tid': pid, **event}
+    lines = []
+    if _named_pid != pid:
+        # a pool process inherits the variable and names its own lane
+        _named_pid = pid
+        lines.append(json.dumps({
+            'name': 'thread_name', 'ph': 'M', 'pid': event['pid'], 'tid': pid,
+            'args': {'name': multiprocessing.current_process().name}
+            }))
+    lines.append(json.dumps(event))
+    with open(os.path.join(folder, f'{pid}.jsonl'), 'a') as _file:
+        _file.write('\n'.join(lines) + '\n')
+
+def count(name: str, value: float) -> None:
+    '''
+    Record the value of a counter track.
+        Arguments:
+            name: the name of the track (e.g. 'active jobs')
+            value: the new value
+        Returns:
+            None
+    '''
+    if get_folder() is not None:
+        write_event({
+            'name': name, 'ph': 'C', 'ts': get_timestamp(time.time()), 'args': {name: value}
+            })
+
+def begin_stage(stage: str) -> None:
+    '''Open the span of a stage in the lane of the main process'''
+    if get_folder() is not None:
+        write_event({
+            'name': stage, 'cat': 'stage', 'ph': 'B', 'ts': get_timestamp(time.time())
+            })
+
+def end_stage(stage: str) -> None:
+    '''Close the span of a stage in the lane of the main process'''
+    if get_folder() is not None:
+        write_event({
+            'name': stage, 'cat': 'stage', 'ph': 'E', 'ts': get_timestamp(time.time())
+            })
+
+@contextlib.contextmanager
+def span(name: str, category: str, args: Dict = None) -> Iterator[None]:
+    '''
+    Record a span in the lane of this process. The error type is added to the arguments
+    of a span that raises.
+        Arguments:
+            name: the name of the span
+            category: the kind of span (e.g. 'task' or 'tool')
+            args: optional details shown when the span is selected
+        Returns:
+            None
+    '''
+    if get_folder() is None:
+        yield
+        return
+    args = dict(args or {})
+    start = time.time()
+    try:
+        yield
+    except BaseException as error:
+        args['error'] = type(error).__name__
+        raise
+    finally:
+        write_event({
+            'name': name, 'cat': category, 'ph': 'X', 'ts': get_timestamp(start),
+            'dur': round((time.time() - start) * 1e6, 1), 'args': args
+            })
+
+@contextlib.contextmanager
+def task_span(function: Callable, args: List) -> Iterator[None]:
+    '''
+    Record the span of a task of a parallel stage.
+        Arguments:
+            function: the function of the task
+            args: the arguments of the task
+        Returns:
+            None
+    '''
+    if get_folder() is None:
+        yield
+        return
+    with span(function.__name__, 'task', {
+            'args': [str(arg)[:MAX_ARG_LENGTH] for arg in args],
+            'input_bytes': get_input_size(args), 'cpu': get_cpu()
+        }):
+        yield
+
+@contextlib.contextmanager
+def tool_span(command: List[str], inputs: Iterable[str] = ()) -> Iterator[None]:
+    '''
+    Record the span of an external process.
+        Arguments:
+            command: the command being run
+            inputs: paths to the files read by the command
+        Returns:
+            None
+    '''
+    if get_folder() is None:
+        yield
+        return
+    with span(os.path.basename(str(command[0])), 'tool', {
+            'command': ' '.join(str(part) for part in command)[:MAX_ARG_LENGTH],
+            'input_bytes': get_input_size(inputs), 'cpu': get_cpu()
+        }):
+        yield
+
+def sample_load(stop: threading.Event) -> None:
+    '''
+    Record the load average and the busy cpus of the machine until stopped.
+        Arguments:
+            stop: set to stop sampling
+        Returns:
+            None
+    '''
+    previous: List[int] = []
+    while True:
+        count('load average', round(os.getloadavg()[0], 2))
+        busy, previous = get_busy_cpus(previous)
+        if busy is not None:
+            count('busy cpus', busy)
+        if stop.wait(SAMPLE_INTERVAL):
+            return
+
+def write_trace(filename: str) -> None:
+    '''
+    Stop sampling and merge the events of every process into a trace file.
+        Arguments:
+            filename: path to the trace file
+        Returns:
+            None
+    '''
+    folder = get_folder()
+    if folder is None:
+        return
+    if _sampler is not None:
+        _stop_sampler.set()
+        _sampler.join()
+    events = [{
+        'name': 'process_name', 'ph': 'M', 'pid': int(os.environ[PID_ENV]),
+        'args': {'name': 'getphylo'}
+        }]
+    for events_name in sorted(glob.glob(os.path.join(folder, '*.jsonl'))):
+        with open(events_name) as _file:
+            for line in _file:
+                try:
+                    events.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # the last line of a process that was terminated while writing
+                    continue
+    with open(filename, 'w') as _file:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, _file)
+    shutil.rmtree(folder, ignore_errors=True)
+    configure(None)
@@ -0,0 +1,137 @@
+'''
+Translate CDS features from the nucleotide sequence of their record.
+
+Functions:
+    get_codon_table(table_id: int) -> Tuple[ndarray, ndarray]
+    encode_sequence(sequence: str) -> Tuple[ndarray, ndarray]
+    get_feature_codons(
+        feature: SeqFeature, forward: ndarray, reverse: ndarray
+        ) -> Tuple[ndarray, bool]
+    translate_features(record: SeqRecord, features: List[SeqFeature]) -> List[str]
+'''
+import functools
+from typing import List
+
+# nucleotides with a code of their own, any other character is an unknown base
+BASES = 'TCAG'
+UNKNOWN = len(BASES)
+# the codon index of each position is base * RADIX ** (2 - position)
+RADIX = UNKNOWN + 1
+DEFAULT_TABLE = 11
+
+@functools.lru_cache(maxsize=None)
+def get_codon_table(table_id: int):
+    '''
+    Build the lookup tables of an NCBI genetic code.
+        Arguments:
+            table_id: the number of the genetic code (as in /transl_table)
+        Returns:
+            residues: the amino acid of each codon index, X for codons with unknown bases
+            starts: True for the codon indices of start codons
+    '''
+    import numpy as np
+    from Bio.Data.CodonTable import unambiguous_dna_by_id
+    table = unambiguous_dna_by_id[table_id]
+    residues = np.full(RADIX ** 3, ord('X'), dtype=np.uint8)
+    starts = np.zeros(RADIX ** 3, dtype=bool)
+    index = lambda codon: sum(
+        BASES.index(base) * RADIX ** (2 - position) for position, base in enumerate(codon)
+        )
+    for codon, residue in table.forward_table.items():
+        residues[index(codon)] = ord(residue)
+    for codon in table.stop_codons:
+        residues[index(codon)] = ord('*')
+    for codon in table.start_codons:
+        starts[index(codon)] = True
+    return residues, starts
+
+def encode_sequence(sequence: str):
+    '''
+    Encode both strands of a nucleotide sequence.
+        Arguments:
+            sequence: the sequence of the record
+        Returns:
+            forward: the code of each base of the sequence
+            reverse: the code of the complement of each base
+    '''
+    import numpy as np
+    codes = np.full(256, UNKNOWN, dtype=np.uint8)
+    complements = np.full(256, UNKNOWN, dtype=np.uint8)
+    for code, (base, complement) in enumerate(zip(BASES, 'AGTC')):
+        for case in [str.upper, str.lower]:
+            codes[ord(case(base))] = code
+            complements[ord(case(base))] = BASES.index(complement)
+    # U is read as T in RNA records
+    codes[[ord('U'), ord('u')]] = BASES.index('T')
+    complements[[ord('U'), ord('u')]] = BASES.index('A')
+    raw = np.frombuffer(sequence.encode('ascii', 'replace'), dtype=np.uint8)
+    return codes[raw], complements[raw]
+
+def get_feature_codons(feature, forward, reverse):
+    '''
+    Collect the codons of a CDS feature.
+        Arguments:
+            feature: the CDS feature
+            forward: the encoded sequence of the record
+            reverse: the encoded complement of the sequence
+        Returns:
+            codons: the codons of the feature as an array of shape (codons, 3)
+            complete: False if the 5' end of the feature is partial
+    '''
+    import numpy as np
+    from Bio.SeqFeature import AfterPosition, BeforePosition
+    # the parts of a location are in the order they are transcribed
+    parts = feature.location.parts
+    segments = [
+        reverse[int(part.start):int(part.end)][::-1] if part.strand == -1
+        else forward[int(part.start):int(part.end)]
+        for part in parts
+        ]
+    bases = np.concatenate(segments) if segments else np.zeros(0, dtype=np.uint8)
+    codon_start = int(feature.qualifiers.get('codon_start', ['1'])[0])
+    bases = bases[codon_start - 1:]
+    bases = bases[:len(bases) - len(bases) % 3]
+    first = parts[0]
+    if first.strand == -1:
+        complete = not isinstance(first.end, AfterPosition)
+    else:
+        complete = not isinstance(first.start, BeforePosition)
+    return bases.reshape(-1, 3), complete and codon_start == 1
+
+def translate_features(record, features) -> List[str]:
+    '''
+    Translate CDS features from the sequence of their record. As in the /translation
+    qualifiers written by NCBI, the first codon of a complete CDS is read as methionine and
+    a terminal stop codon is removed. /transl_except qualifiers are not applied.
+        Arguments:
+            record: the genbank record holding the features
+            features: the CDS features to translate
+        Returns:
+            translations: the protein sequence of each feature
+    '''
+    import numpy as np
+    forward, reverse = encode_sequence(str(record.seq))
+    # features are translated in one batch for each genetic code
+    batches = {}
+    for position, feature in enumerate(features):
+        table_id = int(feature.qualifiers.get('transl_table', [DEFAULT_TABLE])[0])
+        batches.setdefault(table_id, []).append(position)
+    translations = [''] * len(features)
+    for table_id, positions in batches.items():
+        residues, starts = get_codon_table(table_id)
+        codons, complete = zip(
+            *[get_feature_codons(features[position], forward, reverse) for position in positions]
+            )
+        lengths = [len(feature_codons) for feature_codons in codons]
+        stacked = np.concatenate(codons).astype(np.intp)
+        indices = stacked[:, 0] * RADIX ** 2 + stacked[:, 1] * RADIX + stacked[:, 2]
+        proteins = residues[indices]
+        offsets = np.cumsum([0] + lengths[:-1])
+        # complete CDSs begin with methionine whichever start codon is used
+        first = offsets[np.array(complete) & (np.array(lengths) > 0)]
+        proteins[first[starts[indices[first]]]] = ord('M')
+        text = proteins.tobytes().decode()
+        for position, offset, length in zip(positions, offsets, lengths):
+            protein = text[offset:offset + length]
+            translations[position] = protein[:-1] if protein.endswith('*') else protein
+    return translations
@@ -0,0 +1,427 @@
+'''
+A work queue on a shared filesystem so that one analysis can run across many nodes.
+
+Classes:
+    WorkQueue
+
+Functions:
+    get_function_name(function: Callable) -> str
+    get_function(name: str) -> Callable
+    run_worker(
+        queue_dir: str, poll: float = 1.0, timeout: float = DEFAULT_TIMEOUT,
+        idle_exit: float = None
+        ) -> None
+'''
+import importlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Callable, List, Optional
+
+from getphylo.utils import executor
+from getphylo.utils.errors import GetphyloError
+
+PENDING = 'pending'
+CLAIMED = 'claimed'
+DONE = 'done'
+FAILED = 'failed'
+SHUTDOWN = 'shutdown'
+WORKERS = 'workers'
+# seconds without a heartbeat before a claimed task is requeued
+DEFAULT_TIMEOUT = 120.0
+# seconds the coordinator waits for tasks while no worker is attached to the queue
+DEFAULT_WORKER_TIMEOUT = 600.0
+
+def get_function_name(function: Callable) -> str:
+    '''
+    Get the importable name of a function (e.g. 'getphylo.ext.muscle:run_muscle').
+        Arguments:
+            function: the function
+        Returns:
+            name: the module and name of the function separated by a colon
+    '''
+    return f'{function.__module__}:{function.__name__}'
+
+def get_function(name: str) -> Callable:
+    '''
+    Import a function from its importable name. Only getphylo functions are allowed.
+        Arguments:
+            name: the module and name of the function separated by a colon
+        Returns:
+            function: the function
+    '''
+    module_name, function_name = name.split(':')
+    if module_name.split('.')[0] != 'getphylo':
+        raise GetphyloError(f'Refusing to run {name} from the work queue.')
+    return getattr(importlib.import_module(module_name), function_name)
+
+def write_json(filename: str, data) -> None:
+    '''
+    Write json so that other nodes never see a partially written file.
+        Arguments:
+            filename: path to the json file
+            data: the data to be written
+        Returns:
+            None
+    '''
+    temporary = f'{filename}.{uuid.uuid4().hex}.tmp'
+    with open(temporary, 'w') as _file:
+        json.dump(data, _file)
+    os.rename(temporary, filename)
+
+def read_json(filename: str):
+    '''
+    Read a json file.
+        Arguments:
+            filename: path to the json file
+        Returns:
+            the contents of the file
+    '''
+    with open(filename) as _file:
+        return json.load(_file)
+
+class WorkQueue:
+    '''
+    A task queue stored in a folder on a shared filesystem. Tasks are json files that move
+    from pending/ to claimed/ and then done/ or failed/ with atomic renames.
+    '''
+    def __init__(
+            self, queue_dir: str, poll: float = 1.0, timeout: float = DEFAULT_TIMEOUT,
+            worker_timeout: float = DEFAULT_WORKER_TIMEOUT
+        ):
+        '''
+        Arguments:
+            queue_dir: path to the queue folder
+            poll: seconds between checks of the queue
+            timeout: seconds without a heartbeat before a claimed task is requeued, unless
+                an attached worker uses a longer one
+            worker_timeout: seconds without any worker before waiting for tasks fails
+        '''
+        self.queue_dir = queue_dir
+        self.poll = poll
+        self.timeout = timeout
+        self.worker_timeout = worker_timeout
+        for folder in [PENDING, CLAIMED, DONE, FAILED, WORKERS]:
+            os.makedirs(self.path(folder), exist_ok=True)
+
+    def path(self, *parts: str) -> str:
+        '''Return a path inside the queue folder'''
+        return os.path.join(self.queue_dir, *parts)
+
+    def reset(self) -> None:
+        '''
+        Remove the tasks and the shutdown marker left by an earlier run in the same folder,
+        so that the coordinator of a restarted run starts from an empty queue.
+            Arguments:
+                None
+            Returns:
+                None
+        '''
+        # the tasks go first so that waiting workers never claim one of them
+        for folder in [PENDING, CLAIMED, DONE, FAILED]:
+            for name in os.listdir(self.path(folder)):
+                try:
+                    os.remove(self.path(folder, name))
+                except FileNotFoundError:
+                    continue
+        try:
+            os.remove(self.path(SHUTDOWN))
+        except FileNotFoundError:
+            pass
+
+    def get_timeout(self) -> float:
+        '''
+        Get the seconds without a heartbeat before a claimed task is requeued, which is
+        the longest timeout of the workers that have attached to the queue.
+            Arguments:
+                None
+            Returns:
+                timeout: the timeout in seconds
+        '''
+        timeout = self.timeout
+        for name in os.listdir(self.path(WORKERS)):
+            try:
+                timeout = max(timeout, read_json(self.path(WORKERS, name))['timeout'])
+            except (OSError, ValueError, KeyError, TypeError):
+                # written by an older worker or being replaced
+                continue
+        return timeout
+
+    def submit(
+            self, function: Callable, args_list: List[List], reduce_memory: Callable = None
+        ) -> List[str]:
+        '''
+        Add a task for each set of arguments to the queue.
+            Arguments:
+                function: the function to be called
+                args_list: list of lists containing the arguments for each call
+                reduce_memory: optional function returning lower memory arguments
+            Returns:
+                tasks: the names of the task files in the same order as args_list
+        '''
+        batch = f'{function.__name__}-{uuid.uuid4().hex[:8]}'
+        tasks = []
+        for index, args in enumerate(args_list):
+            task = f'{batch}-{index:06d}.json'
+            write_json(self.path(PENDING, task), {
+                'function': get_function_name(function),
+                'args': list(args),
+                'reduce_memory': None if reduce_memory is None else get_function_name(
+                    reduce_memory
+                    )
+                })
+            tasks.append(task)
+        return tasks
+
+    def wait(
+            self, tasks: List[str], function: Callable = None, args_list: List[List] = None,
+            tolerate_failures: bool = False
+        ) -> List:
+        '''
+        Wait for tasks to finish and return their results.
+            Arguments:
+                tasks: the names of the task files
+                function: the function run by the tasks, used to report failures
+                args_list: the arguments of each task, used to report failures
+                tolerate_failures: return None for failed tasks instead of raising an error
+            Returns:
+                results: the return value of each task
+        '''
+        remaining = set(tasks)
+        results = {}
+        failures = []
+        worker_seen = time.monotonic()
+        while remaining:
+            for task in list(remaining):
+                if os.path.exists(self.path(FAILED, task)):
+                    data = read_json(self.path(FAILED, task))
+                    error = GetphyloError(f'Task {task} failed on a worker: {data["error"]}')
+                    if not tolerate_failures:
+                        raise error
+                    index = tasks.index(task)
+                    failures.append(executor.TaskFailure(
+                        index, getattr(function, '__name__', str(function)),
+                        args_list[index] if args_list is not None else [], error,
+                        data.get('attempts', 1), data.get('seconds', 0.0)
+                        ))
+                    results[task] = None
+                    remaining.remove(task)
+                    continue
+                if os.path.exists(self.path(DONE, task)):
+                    results[task] = read_json(self.path(DONE, task))['result']
+                    remaining.remove(task)
+            if remaining:
+                self.requeue_stale()
+                if self.has_live_workers():
+                    worker_seen = time.monotonic()
+                elif time.monotonic() - worker_seen > self.worker_timeout:
+                    raise GetphyloError(
+                        f'No worker has been attached to {self.queue_dir} for '
+                        f'{self.worker_timeout} seconds. Start workers with: '
+                        'getphylo worker -o OUTPUT'
+                        )
+                time.sleep(self.poll)
+        if failures:
+            executor.record_failures(failures)
+        return [results[task] for task in tasks]
+
+    def run(
+            self, function: Callable, args_list: List[List], reduce_memory: Callable = None,
+            tolerate_failures: bool = False
+        ) -> List:
+        '''
+        Run a function on the workers attached to the queue.
+            Arguments:
+                function: the function to be called
+                args_list: list of lists containing the arguments for each call
+                reduce_memory: optional function returning lower memory arguments
+                tolerate_failures: return None for failed calls instead of raising an error
+            Returns:
+                results: a list of return values for each call of the function
+        '''
+        tasks = self.submit(function, args_list, reduce_memory)
+        logging.info(
+            '%s tasks submitted to %s. Waiting for workers (getphylo worker -o ...).',
+            len(tasks), self.queue_dir
+            )
+        return self.wait(tasks, function, args_list, tolerate_failures)
+
+    def requeue_stale(self) -> None:
+        '''
+        Move tasks whose worker has stopped sending heartbeats back to pending.
+            Arguments:
+                None
+            Returns:
+                None
+        '''
+        now = time.time()
+        timeout = self.get_timeout()
+        for task in os.listdir(self.path(CLAIMED)):
+            try:
+                if now - os.path.getmtime(self.path(CLAIMED, task)) > timeout:
+                    os.rename(self.path(CLAIMED, task), self.path(PENDING, task))
+                    logging.warning('Requeued %s from an unresponsive worker.', task)
+            except FileNotFoundError:
+                continue
+
+    def has_live_workers(self) -> bool:
+        '''
+        Check whether an idle worker or a running task has sent a heartbeat recently.
+            Arguments:
+                None
+            Returns:
+                alive: True if a worker is attached to the queue
+        '''
+        now = time.time()
+        timeout = self.get_timeout()
+        for folder in [WORKERS, CLAIMED]:
+            for name in os.listdir(self.path(folder)):
+                try:
+                    if now - os.path.getmtime(self.path(folder, name)) <= timeout:
+                        return True
+                except FileNotFoundError:
+                    continue
+        return False
+
+    def claim(self) -> Optional[str]:
+        '''
+        Claim the next pending task.
+            Arguments:
+                None
+            Returns:
+                task: the name of the claimed task, or None if there are none
+        '''
+        for task in sorted(os.listdir(self.path(PENDING))):
+            if not task.endswith('.json'):
+                continue
+            try:
+                # touched first so that the claimed task is never stale
+                os.utime(self.path(PENDING, task))
+                os.rename(self.path(PENDING, task), self.path(CLAIMED, task))
+            except FileNotFoundError:
+                # another worker was faster
+                continue
+            return task
+        return None
+
+    def heartbeat(self, task: str, stop: threading.Event) -> None:
+        '''
+        Refresh the modification time of a claimed task until stop is set.
+            Arguments:
+                task: the name of the claimed task
+                stop: event set when the task has finished
+            Returns:
+                None
+        '''
+        while not stop.wait(self.timeout / 4):
+            try:
+                os.utime(self.path(CLAIMED, task))
+            except FileNotFoundError:
+                return
+
+    def process(self, task: str) -> None:
+        '''
+        Run a claimed task and record the result.
+            Arguments:
+                task: the name of the claimed task
+            Returns:
+                None
+        '''
+        stop = threading.Event()
+        beat = threading.Thread(target=self.heartbeat, args=(task, stop), daemon=True)
+        beat.start()
+        start = time.monotonic()
+        try:
+            data = read_json(self.path(CLAIMED, task))
+            reduce_memory = data['reduce_memory']
+            if reduce_memory is not None:
+                reduce_memory = get_function(reduce_memory)
+            result = executor.run_task(
+                get_function(data['function']), data['args'], reduce_memory
+                )
+            write_json(self.path(DONE, task), {'result': result, 'host': socket.gethostname()})
+        except Exception as error:
+            logging.error('Task %s failed: %s', task, error)
+            write_json(self.path(FAILED, task), {
+                'error': repr(error),
+                'attempts': getattr(error, 'attempts', 1),
+                'seconds': time.monotonic() - start
+                })
+        finally:
+            stop.set()
+            beat.join()
+            try:
+                os.remove(self.path(CLAIMED, task))
+            except FileNotFoundError:
+                pass
+
+    def shutdown(self) -> None:
+        '''Tell all workers attached to the queue to exit'''
+        with open(self.path(SHUTDOWN), 'w'):
+            pass
+
+    def is_shutdown(self) -> bool:
+        '''Return True once the coordinator has finished'''
+        return os.path.exists(self.path(SHUTDOWN))
+
+def run_worker(
+        queue_dir: str, poll: float = 1.0, timeout: float = DEFAULT_TIMEOUT, idle_exit: float = None
+    ) -> None:
+    '''
+    Process tasks from a work queue until the coordinator shuts it down. A shutdown marker
+    found when the worker starts is left by an earlier run, so the worker waits for the
+    coordinator of the next run to remove it.
+        Arguments:
+            queue_dir: path to the queue folder
+            poll: seconds between checks of the queue
+            timeout: seconds without a heartbeat before a claimed task is requeued
+            idle_exit: optionally exit after this many seconds without a task
+        Returns:
+            None
+    '''
+    idle_since = time.monotonic()
+    waiting = False
+    while (
+            not os.path.isdir(os.path.join(queue_dir, PENDING))
+            or os.path.exists(os.path.join(queue_dir, SHUTDOWN))
+        ):
+        if not waiting:
+            logging.info('Waiting for a coordinator to open %s...', queue_dir)
+            waiting = True
+        if idle_exit is not None and time.monotonic() - idle_since > idle_exit:
+            logging.info('No coordinator for %s seconds. Exiting...', idle_exit)
+            return
+        time.sleep(poll)
+    work_queue = WorkQueue(queue_dir, poll, timeout)
+    logging.info('Worker %s attached to %s', socket.gethostname(), queue_dir)
+    worker_file = work_queue.path(WORKERS, f'{socket.gethostname()}-{os.getpid()}')
+    idle_since = time.monotonic()
+    try:
+        while not work_queue.is_shutdown():
+            # tells the coordinator that a worker is attached and how long its heartbeats
+            # may take
+            try:
+                os.utime(worker_file)
+            except FileNotFoundError:
+                write_json(worker_file, {'timeout': timeout})
+            task = work_queue.claim()
+            if task is None:
+                if idle_exit is not None and time.monotonic() - idle_since > idle_exit:
+                    logging.info('No tasks for %s seconds. Exiting...', idle_exit)
+                    return
+                work_queue.requeue_stale()
+                time.sleep(poll)
+                continue
+            logging.info('Running %s', task)
+            work_queue.process(task)
+            idle_since = time.monotonic()
+        logging.info('The analysis is complete. Exiting...')
+    finally:
+        try:
+            os.remove(worker_file)
+        except FileNotFoundError:
+            pass